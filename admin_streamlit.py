@@ -4,7 +4,6 @@
 """
 import streamlit as st
 import sqlite3
-import pandas as pd
 import os
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
@@ -60,6 +59,9 @@ class VetBotAdmin:
     
     def get_recent_users(self, limit=10):
         """Получить последних пользователей"""
+        # Тяжелый pandas нужен только разделам с таблицами: стартовая
+        # страница со статистикой открывается без него
+        import pandas as pd
         try:
             conn = self.get_db_connection()
             if not conn:
@@ -81,6 +83,7 @@ class VetBotAdmin:
     
     def get_recent_consultations(self, limit=10):
         """Получить последние консультации"""
+        import pandas as pd
         try:
             conn = self.get_db_connection()
             if not conn:
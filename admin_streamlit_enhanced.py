@@ -9,6 +9,10 @@ import os
 import requests
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
+from media_store import MediaStore
+from event_bus import EventBus
+from vetbot_improved.utils.metrics import metrics_endpoints, parse_metrics, summarize_histograms
+from vetbot_improved.utils import profiler
 
 # Загрузка переменных окружения
 load_dotenv()
@@ -17,6 +21,8 @@ class VetBotAdmin:
     def __init__(self, db_path='vetbot.db'):
         self.db_path = db_path
         self.bot_token = os.getenv('TELEGRAM_BOT_TOKEN')
+        self.media = MediaStore(db_path=db_path)
+        self.events = EventBus(db_path)
     
     def get_db_connection(self):
         """Получить соединение с базой данных"""
@@ -51,9 +57,11 @@ class VetBotAdmin:
             cursor = conn.execute("SELECT COUNT(*) FROM vet_calls")
             stats['vet_requests'] = cursor.fetchone()[0]
             
-            # Консультации за сегодня
+            # Консультации за сегодня (диапазоном - по индексу created_at)
             today = datetime.now().strftime('%Y-%m-%d')
-            cursor = conn.execute("SELECT COUNT(*) FROM consultations WHERE DATE(created_at) = ?", (today,))
+            tomorrow = (datetime.now() + timedelta(days=1)).strftime('%Y-%m-%d')
+            cursor = conn.execute("SELECT COUNT(*) FROM consultations WHERE created_at >= ? AND created_at < ?",
+                                  (today, tomorrow))
             stats['today_consultations'] = cursor.fetchone()[0]
             
             conn.close()
@@ -84,12 +92,16 @@ class VetBotAdmin:
                 END as assigned_doctor,
                 ac.doctor_id,
                 CASE 
-                    WHEN ac.consultation_id IS NOT NULL THEN 1
+                    WHEN ac.id IS NOT NULL THEN 1
                     ELSE 0
                 END as has_active_consultation
             FROM users u
-            LEFT JOIN active_consultations ac ON u.user_id = ac.user_id
-            LEFT JOIN doctors d ON ac.doctor_id = d.user_id
+            -- Только последняя незавершенная консультация клиента
+            LEFT JOIN active_consultations ac ON ac.id = (
+                SELECT MAX(id) FROM active_consultations
+                WHERE client_id = u.user_id AND status IN ('waiting', 'assigned', 'active')
+            )
+            LEFT JOIN doctors d ON ac.doctor_id = d.id
             ORDER BY u.created_at DESC 
             LIMIT ?
             """
@@ -187,29 +199,35 @@ class VetBotAdmin:
             st.error(f"Ошибка получения диалога: {e}")
             return pd.DataFrame()
     
-    def send_telegram_message(self, user_id, message):
-        """Отправить сообщение пользователю в Telegram"""
+    def send_telegram_message(self, user_id, message, parse_mode='HTML'):
+        """Поставить сообщение пользователю в очередь Telegram
+        
+        Сообщение ставится в очередь основного бота, и он сразу отправляет
+        его по событию admin.message.queued с разметкой parse_mode. True
+        означает, что сообщение в очереди, а не что оно доставлено.
+        """
         try:
-            if not self.bot_token:
-                st.error("Токен бота не найден в переменных окружения")
+            conn = self.get_db_connection()
+            if not conn:
                 return False
             
-            url = f"https://api.telegram.org/bot{self.bot_token}/sendMessage"
-            data = {
-                'chat_id': user_id,
-                'text': message,
-                'parse_mode': 'HTML'
-            }
+            cursor = conn.cursor()
+            cursor.execute("""
+                INSERT INTO admin_message_queue (user_id, message, parse_mode)
+                VALUES (?, ?, ?)
+            """, (user_id, message, parse_mode))
             
-            response = requests.post(url, data=data)
+            self.events.publish('admin.message.queued', {
+                'user_id': user_id,
+                'queue_id': cursor.lastrowid
+            }, conn=conn)
             
-            if response.status_code == 200:
-                # Сохраняем сообщение в БД
-                self.save_admin_message(user_id, message)
-                return True
-            else:
-                st.error(f"Ошибка отправки: {response.text}")
-                return False
+            conn.commit()
+            conn.close()
+            
+            # Сохраняем сообщение в БД
+            self.save_admin_message(user_id, message)
+            return True
                 
         except Exception as e:
             st.error(f"Ошибка отправки сообщения: {e}")
@@ -280,23 +298,24 @@ class VetBotAdmin:
             st.error(f"Ошибка обновления активности врача: {e}")
             return False
     
-    def get_doctor_consultations(self, doctor_id):
-        """Получить консультации врача"""
+    def get_doctor_consultations(self, doctor_id, limit=50):
+        """Получить последние консультации врача"""
         try:
             conn = self.get_db_connection()
             if not conn:
                 return pd.DataFrame()
             
+            # Счетчик сообщений - подзапросом по индексу, только для выводимых строк
             query = """
             SELECT ac.id, ac.client_id, ac.client_name, ac.status, ac.started_at,
-                   COUNT(cm.id) as message_count
+                   (SELECT COUNT(*) FROM consultation_messages cm
+                    WHERE cm.consultation_id = ac.id) as message_count
             FROM active_consultations ac
-            LEFT JOIN consultation_messages cm ON ac.id = cm.consultation_id
             WHERE ac.doctor_id = ?
-            GROUP BY ac.id
             ORDER BY ac.started_at DESC
+            LIMIT ?
             """
-            df = pd.read_sql_query(query, conn, params=(doctor_id,))
+            df = pd.read_sql_query(query, conn, params=(doctor_id, limit))
             conn.close()
             return df
             
@@ -314,14 +333,14 @@ class VetBotAdmin:
             query = """
             SELECT 
                 ac.id,
-                ac.user_id as client_id,
+                ac.client_id,
                 COALESCE(u.first_name || ' ' || u.last_name, u.username, 'ID: ' || u.user_id) as client_name,
                 COALESCE(d.full_name, 'ID: ' || ac.doctor_id) as doctor_name,
                 ac.status,
                 ac.started_at,
                 ac.doctor_id
             FROM active_consultations ac
-            LEFT JOIN users u ON ac.user_id = u.user_id
+            LEFT JOIN users u ON ac.client_id = u.user_id
             LEFT JOIN doctors d ON ac.doctor_id = d.id
             WHERE ac.status = 'active'
             ORDER BY ac.started_at DESC
@@ -370,16 +389,30 @@ class VetBotAdmin:
                 SET doctor_id = ? 
                 WHERE id = ?
             """, (new_doctor_id, consultation_id))
+            updated = cursor.rowcount > 0
             
             # Добавляем системное сообщение о переназначении
             cursor.execute("""
-                INSERT INTO consultation_messages (consultation_id, sender_type, message, sent_at)
+                INSERT INTO consultation_messages (consultation_id, sender_type, message_text, sent_at)
                 VALUES (?, 'system', 'Консультация переназначена новому врачу', ?)
             """, (consultation_id, datetime.now().isoformat()))
             
+            # Бот врачей сразу сообщит новому врачу о консультации
+            doctor = cursor.execute(
+                "SELECT telegram_id, full_name FROM doctors WHERE id = ?", (new_doctor_id,)
+            ).fetchone()
+            if updated and doctor:
+                self.events.publish('consultation.assigned', {
+                    'consultation_id': consultation_id,
+                    'doctor_id': new_doctor_id,
+                    'doctor_telegram_id': doctor[0],
+                    'doctor_name': doctor[1],
+                    'reassigned': True
+                }, conn=conn)
+            
             conn.commit()
             conn.close()
-            return cursor.rowcount > 0
+            return updated
             
         except Exception as e:
             st.error(f"Ошибка переназначения врача: {e}")
@@ -464,6 +497,28 @@ class VetBotAdmin:
         except Exception as e:
             st.error(f"Ошибка отправки сообщения врачу: {e}")
             return False
+    
+    def get_metrics(self):
+        """Снять /metrics со всех процессов ботов"""
+        result = {}
+        for process, url in metrics_endpoints().items():
+            try:
+                response = requests.get(url, timeout=2)
+                response.raise_for_status()
+                result[process] = parse_metrics(response.text)
+            except Exception as e:
+                result[process] = e
+        return result
+    
+    def debug_request(self, process, path, **params):
+        """Служебный запрос к эндпоинту метрик процесса бота (/debug/...)"""
+        url = metrics_endpoints()[process].rsplit('/metrics', 1)[0] + path
+        try:
+            response = requests.get(url, params=params, timeout=15)
+            response.raise_for_status()
+            return response.json()
+        except Exception as e:
+            return {'error': str(e)}
 
 def main():
     st.set_page_config(
@@ -493,6 +548,9 @@ def main():
             "🚑 Вызовы врача",
             "👨‍⚕️ Врачи",
             "💬 Диалоги",
+            "📡 События",
+            "📈 Метрики",
+            "🔬 Профилирование",
             "ℹ️ Информация"
         ]
     )
@@ -604,12 +662,12 @@ def main():
                             full_message = f"👨‍💼 **{admin_name}:**\n\n{quick_message}"
                             
                             if admin.send_telegram_message(user_id, full_message):
-                                st.success("✅ Сообщение отправлено!")
+                                st.success("📨 Сообщение поставлено в очередь отправки")
                                 del st.session_state['quick_message_user_id']
                                 del st.session_state['quick_message_username']
                                 st.rerun()
                             else:
-                                st.error("❌ Ошибка отправки сообщения")
+                                st.error("❌ Не удалось поставить сообщение в очередь")
                         else:
                             st.warning("⚠️ Введите текст сообщения")
                 
@@ -724,6 +782,10 @@ def main():
                         col1, col2, col3, col4 = st.columns(4)
                         
                         with col1:
+                            # Показываем миниатюру, а не полноразмерное фото
+                            thumb_path = admin.media.thumbnail_path(doctor['photo_path'])
+                            if thumb_path:
+                                st.image(thumb_path, width=96)
                             st.write(f"**Username:** @{doctor['username']}")
                             st.write(f"**Telegram ID:** {doctor['telegram_id']}")
                         
@@ -763,7 +825,7 @@ def main():
                         # Просмотр консультаций врача
                         doctor_consultations = admin.get_doctor_consultations(doctor['id'])
                         if not doctor_consultations.empty:
-                            st.write("**Консультации врача:**")
+                            st.write("**Последние консультации врача:**")
                             st.dataframe(doctor_consultations, use_container_width=True)
                         else:
                             st.info("У врача пока нет консультаций")
@@ -797,7 +859,7 @@ def main():
                                 del st.session_state['message_doctor_name']
                                 st.rerun()
                             else:
-                                st.error("❌ Ошибка отправки сообщения")
+                                st.error("❌ Не удалось поставить сообщение в очередь")
                         else:
                             st.warning("⚠️ Введите текст сообщения")
                 
@@ -925,10 +987,10 @@ def main():
                             full_message = f"👨‍💼 **{admin_name}:**\n\n{message_text}"
                             
                             if admin.send_telegram_message(user_id, full_message):
-                                st.success("✅ Сообщение отправлено!")
+                                st.success("📨 Сообщение поставлено в очередь отправки")
                                 st.rerun()
                             else:
-                                st.error("❌ Ошибка отправки сообщения")
+                                st.error("❌ Не удалось поставить сообщение в очередь")
                         else:
                             st.warning("⚠️ Введите текст сообщения")
             
@@ -959,6 +1021,99 @@ def main():
                                 st.session_state['selected_username'] = f"{display_name} (ID: {user['user_id']})"
                                 st.rerun()
     
+    # События
+    elif page == "📡 События":
+        st.header("📡 События системы")
+        st.caption("Журнал шины событий между основным ботом, ботом врачей и админ-панелью")
+        
+        def render_events():
+            events = admin.events.recent(limit=100)
+            if events:
+                st.dataframe(pd.DataFrame([{
+                    'ID': event['id'],
+                    'Время': event['created_at'],
+                    'Событие': event['topic'],
+                    'Источник': event['source'] or '—',
+                    'Данные': str(event['payload'])
+                } for event in events]), use_container_width=True)
+            else:
+                st.info("📭 Событий пока нет")
+        
+        # В новых версиях Streamlit журнал обновляется сам, без перезагрузки страницы
+        if hasattr(st, 'fragment'):
+            st.fragment(render_events, run_every=2)()
+        else:
+            render_events()
+    
+    # Метрики
+    elif page == "📈 Метрики":
+        st.header("📈 Метрики ботов")
+        st.caption("Локальные эндпоинты /metrics процессов ботов (формат Prometheus)")
+        
+        for process, samples in admin.get_metrics().items():
+            st.subheader(f"🤖 {process}")
+            if isinstance(samples, Exception):
+                st.warning(f"Эндпоинт недоступен: {samples}")
+                continue
+            
+            histograms = summarize_histograms(samples)
+            if histograms:
+                st.dataframe(pd.DataFrame([{
+                    'Метрика': row['metric'],
+                    'Метки': ', '.join(f"{k}={v}" for k, v in row['labels'].items()),
+                    'Число': row['count'],
+                    'Среднее, мс': round(row['avg'] * 1000, 1),
+                    'p50, мс': round(row['p50'] * 1000, 1),
+                    'p99, мс': round(row['p99'] * 1000, 1),
+                } for row in histograms]), use_container_width=True)
+            
+            values = [{
+                'Метрика': name,
+                'Метки': ', '.join(f"{k}={v}" for k, v in labels.items()),
+                'Значение': value,
+            } for name, series in samples.items()
+                if not name.endswith(('_bucket', '_sum', '_count'))
+                for labels, value in series]
+            if values:
+                st.dataframe(pd.DataFrame(values), use_container_width=True)
+            elif not histograms:
+                st.info("📭 Метрик пока нет")
+    
+    # Профилирование
+    elif page == "🔬 Профилирование":
+        st.header("🔬 Профилирование")
+        st.caption(
+            "Сэмплирующий профилировщик пишет в каталог logs стеки для flamegraph (*.folded) "
+            "и лаг цикла событий (*.csv); дамп задач - стеки задач asyncio и потоков. "
+            "То же делают сигналы: kill -USR1 <pid> - вкл/выкл, kill -USR2 <pid> - дамп задач."
+        )
+        
+        seconds = st.number_input("Длительность, секунд:", min_value=5, max_value=300, value=30, step=5)
+        
+        for process in metrics_endpoints():
+            st.subheader(f"🤖 {process}")
+            col1, col2, col3 = st.columns(3)
+            with col1:
+                if st.button("▶️ Запустить", key=f"profile_start_{process}"):
+                    st.json(admin.debug_request(process, '/debug/profile/start', seconds=seconds))
+            with col2:
+                if st.button("⏹ Остановить", key=f"profile_stop_{process}"):
+                    st.json(admin.debug_request(process, '/debug/profile/stop'))
+            with col3:
+                if st.button("🧵 Дамп задач", key=f"tasks_{process}"):
+                    st.json(admin.debug_request(process, '/debug/tasks'))
+        
+        st.subheader("🖥 Админ-панель")
+        own = profiler.get_profiler('admin')
+        col1, col2 = st.columns(2)
+        with col1:
+            if st.button("▶️ Запустить", key="profile_start_admin", disabled=own.running):
+                own.start(seconds)
+                st.success("Профилировщик запущен")
+        with col2:
+            if st.button("⏹ Остановить", key="profile_stop_admin", disabled=not own.running):
+                st.json(own.stop())
+    
     # Информация
     elif page == "ℹ️ Информация":
         st.header("ℹ️ Информация о системе")
@@ -0,0 +1,98 @@
+"""
+Склейка сообщений клиента в один AI-запрос и ограничение параллельных запросов
+"""
+
+import os
+import asyncio
+import logging
+from contextlib import nullcontext
+
+logger = logging.getLogger(__name__)
+
+# Конфигурация
+AI_COALESCE_WINDOW = float(os.getenv('AI_COALESCE_WINDOW', '1.0'))
+AI_PER_USER_LIMIT = int(os.getenv('AI_PER_USER_LIMIT', '1'))
+AI_GLOBAL_LIMIT = int(os.getenv('AI_GLOBAL_LIMIT', '8'))
+
+class _UserState:
+    """Состояние AI-запросов одного пользователя"""
+
+    def __init__(self, per_user_limit):
+        self.messages = []
+        self.generation = 0
+        self.task = None
+        self.semaphore = asyncio.Semaphore(per_user_limit)
+
+class RequestCoalescer:
+    """Объединяет сообщения, пришедшие в коротком окне, в один AI-запрос
+
+    Каждое новое сообщение пользователя продлевает окно ожидания и отменяет
+    его запрос, который уже выполняется: текст отмененного запроса не теряется,
+    а попадает в следующий. Число одновременных запросов ограничено как для
+    одного пользователя, так и для всего бота.
+    """
+
+    def __init__(self, window=AI_COALESCE_WINDOW, per_user_limit=AI_PER_USER_LIMIT,
+                 global_limit=AI_GLOBAL_LIMIT):
+        self.window = window
+        self.per_user_limit = per_user_limit
+        # global_limit=None - общий лимит задается снаружи (например, планировщиком)
+        self._global_semaphore = asyncio.Semaphore(global_limit) if global_limit else nullcontext()
+        self._states = {}
+        self.merged_count = 0
+        self.cancelled_count = 0
+
+    def in_flight(self):
+        """Количество выполняющихся AI-запросов"""
+        return sum(1 for state in self._states.values() if state.task and not state.task.done())
+
+    async def run(self, user_id, message, request):
+        """Выполнить request(текст) для сообщения пользователя
+
+        Возвращает результат request или None, если сообщение было
+        присоединено к более позднему запросу того же пользователя.
+        """
+        state = self._states.get(user_id)
+        if state is None:
+            state = self._states[user_id] = _UserState(self.per_user_limit)
+
+        state.messages.append(message)
+        state.generation += 1
+        generation = state.generation
+
+        # Выполняющийся запрос устарел - его текст уйдет в новый запрос
+        if state.task and not state.task.done():
+            state.task.cancel()
+            self.cancelled_count += 1
+
+        try:
+            await asyncio.sleep(self.window)
+            if state.generation != generation:
+                self.merged_count += 1
+                return None
+
+            async with state.semaphore, self._global_semaphore:
+                if state.generation != generation:
+                    self.merged_count += 1
+                    return None
+
+                consumed = len(state.messages)
+                text = "\n".join(state.messages)
+                state.task = asyncio.ensure_future(request(text))
+
+                try:
+                    result = await state.task
+                except asyncio.CancelledError:
+                    if state.generation != generation:
+                        # Отменен более новым сообщением пользователя
+                        return None
+                    raise
+
+                del state.messages[:consumed]
+                return result
+        finally:
+            if state.generation == generation:
+                # Последний запрос пользователя завершен (успешно или нет)
+                state.messages.clear()
+                state.task = None
+                self._states.pop(user_id, None)
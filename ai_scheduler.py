@@ -0,0 +1,184 @@
+"""
+Приоритетный планировщик AI-запросов: срочные вопросы обслуживаются первыми
+"""
+
+import os
+import time
+import asyncio
+import logging
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+# Конфигурация
+AI_GLOBAL_LIMIT = int(os.getenv('AI_GLOBAL_LIMIT', '8'))
+
+# Полосы приоритета: вес в честной очереди и срок, после которого
+# клиенту отдается резервный ответ вместо ожидания AI
+EMERGENCY = 'emergency'
+URGENT = 'urgent'
+ROUTINE = 'routine'
+
+LANES = {
+    EMERGENCY: {'weight': 8, 'deadline': 20.0},
+    URGENT: {'weight': 4, 'deadline': 30.0},
+    ROUTINE: {'weight': 1, 'deadline': 50.0},
+}
+
+EMERGENCY_KEYWORDS = (
+    'отравлен', 'отравил', 'не дышит', 'задыха', 'кровь', 'кровотеч', 'судорог',
+    'без сознания', 'потеря сознания', 'упала с', 'выпала', 'сбила машина',
+    'не может встать', 'парализ', 'антифриз', 'крысин',
+)
+
+URGENT_KEYWORDS = (
+    'рвота', 'рвет', 'понос', 'диарея', 'температур', 'не ест', 'не пьет',
+    'не писает', 'не мочится', 'травм', 'хромает', 'опух', 'вялая', 'вялый',
+    'роды', 'рожает', 'глаз',
+)
+
+# Значения поля urgency заявок на вызов врача
+URGENT_CALL_LEVELS = {'high', 'urgent', 'срочно', 'высокая'}
+EMERGENCY_CALL_LEVELS = {'emergency', 'critical', 'экстренно', 'критическая'}
+
+def classify_urgency(text, call_urgency=None):
+    """Определить полосу приоритета по тексту вопроса и срочности заявки"""
+    level = (call_urgency or '').strip().lower()
+    if level in EMERGENCY_CALL_LEVELS:
+        return EMERGENCY
+
+    lowered = (text or '').lower()
+    if any(keyword in lowered for keyword in EMERGENCY_KEYWORDS):
+        return EMERGENCY
+
+    if level in URGENT_CALL_LEVELS or any(keyword in lowered for keyword in URGENT_KEYWORDS):
+        return URGENT
+
+    return ROUTINE
+
+class _QueuedRequest:
+    """Запрос, ожидающий свободного слота"""
+
+    def __init__(self, factory, lane, deadline):
+        self.factory = factory
+        self.lane = lane
+        self.deadline = deadline
+        self.enqueued_at = time.monotonic()
+        self.future = asyncio.get_running_loop().create_future()
+        self.task = None
+
+class AIScheduler:
+    """Планировщик AI-запросов со взвешенной честной очередью
+
+    Полоса с большим весом получает пропорционально больше слотов, но
+    обычные вопросы не голодают. Время ожидания в очереди учитывается по
+    полосам; запрос, который не успевает начаться до своего срока, сразу
+    получает резервный ответ.
+    """
+
+    def __init__(self, max_concurrency=AI_GLOBAL_LIMIT, lanes=LANES, history=500):
+        self.max_concurrency = max_concurrency
+        self.lanes = lanes
+        self._queues = {lane: deque() for lane in lanes}
+        self._virtual_time = {lane: 0.0 for lane in lanes}
+        self._clock = 0.0
+        self._running = 0
+        self._wait_times = {lane: deque(maxlen=history) for lane in lanes}
+        self._served = {lane: 0 for lane in lanes}
+        self._expired = {lane: 0 for lane in lanes}
+
+    async def submit(self, factory, lane=ROUTINE, fallback=None, deadline=None):
+        """Поставить factory() в очередь и дождаться результата
+
+        При истечении срока возвращает fallback() (или пробрасывает
+        asyncio.TimeoutError, если fallback не задан).
+        """
+        if lane not in self.lanes:
+            lane = ROUTINE
+        if deadline is None:
+            deadline = self.lanes[lane]['deadline']
+
+        item = _QueuedRequest(factory, lane, time.monotonic() + deadline)
+        queue = self._queues[lane]
+        if not queue:
+            # Полоса возвращается из простоя - не даем ей накопленного кредита
+            self._virtual_time[lane] = max(self._virtual_time[lane], self._clock)
+        queue.append(item)
+        self._dispatch()
+
+        try:
+            return await asyncio.wait_for(asyncio.shield(item.future), timeout=deadline)
+        except asyncio.TimeoutError:
+            self._expire(item)
+            if fallback is None:
+                raise
+            logger.warning(f"AI request in lane {lane} missed its {deadline:.0f}s deadline")
+            return fallback()
+        except asyncio.CancelledError:
+            self._expire(item, missed_deadline=False)
+            raise
+
+    def _expire(self, item, missed_deadline=True):
+        """Убрать запрос из очереди или отменить его выполнение"""
+        if missed_deadline:
+            self._expired[item.lane] += 1
+        if item.task is not None:
+            item.task.cancel()
+        elif item in self._queues[item.lane]:
+            self._queues[item.lane].remove(item)
+        if not item.future.done():
+            item.future.cancel()
+
+    def _next_lane(self):
+        """Непустая полоса с наименьшим виртуальным временем"""
+        candidates = [lane for lane, queue in self._queues.items() if queue]
+        if not candidates:
+            return None
+        return min(candidates, key=lambda lane: self._virtual_time[lane])
+
+    def _dispatch(self):
+        """Запустить запросы из очереди, пока есть свободные слоты"""
+        while self._running < self.max_concurrency:
+            lane = self._next_lane()
+            if lane is None:
+                return
+
+            item = self._queues[lane].popleft()
+            self._clock = self._virtual_time[lane]
+            self._virtual_time[lane] += 1.0 / self.lanes[lane]['weight']
+
+            now = time.monotonic()
+            if now >= item.deadline or item.future.done():
+                continue
+
+            self._wait_times[lane].append(now - item.enqueued_at)
+            self._served[lane] += 1
+            self._running += 1
+            item.task = asyncio.ensure_future(item.factory())
+            item.task.add_done_callback(lambda task, item=item: self._on_done(item, task))
+
+    def _on_done(self, item, task):
+        """Передать результат ожидающему и освободить слот"""
+        self._running -= 1
+        if not item.future.done():
+            if task.cancelled():
+                item.future.cancel()
+            elif task.exception() is not None:
+                item.future.set_exception(task.exception())
+            else:
+                item.future.set_result(task.result())
+        self._dispatch()
+
+    def stats(self):
+        """Глубина очередей и время ожидания по полосам (в секундах)"""
+        result = {'running': self._running}
+        for lane, waits in self._wait_times.items():
+            ordered = sorted(waits)
+            result[lane] = {
+                'queued': len(self._queues[lane]),
+                'served': self._served[lane],
+                'expired': self._expired[lane],
+                'wait_avg': sum(ordered) / len(ordered) if ordered else 0.0,
+                'wait_p95': ordered[int(len(ordered) * 0.95)] if ordered else 0.0,
+            }
+        return result
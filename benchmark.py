@@ -0,0 +1,497 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Сквозной бенчмарк ботов на заглушках Telegram Bot API и DeepSeek
+
+Запускает настоящие процессы enhanced_bot.py, vet_doctor_bot.py и
+webapp_server.py (NotificationSystem работает внутри ботов) против
+локальных заглушек и прогоняет сценарий:
+
+    1. консультации - N клиентов: /start и несколько вопросов AI;
+    2. захват - M врачей разбирают уведомления о клиентах (гонка за
+       кнопку "Взять клиента");
+    3. диалог - реплики врача клиенту и клиента врачу через ботов;
+    4. вызовы врача - всплеск заявок из веб-приложения в бота и POST
+       /submit_request в webapp_server.
+
+Задержка шага - от постановки обновления в очередь заглушки до ответа
+бота в этот чат. Длительность обработчиков, ожидание блокировок SQLite и
+блокировки цикла событий снимаются с /metrics процессов. Результат
+сравнивается с базовым прогоном (benchmark_baseline.json): рост задержек
+или падение пропускной способности сверх --tolerance дает код выхода 1.
+
+Пример:
+    python benchmark.py --clients 30 --doctors 5 --compare
+    python benchmark.py --save-baseline
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import signal
+import socket
+import sqlite3
+import asyncio
+import argparse
+import tempfile
+import subprocess
+import urllib.request
+
+import httpx
+
+from load_test import QUESTIONS, percentile
+from vetbot_improved.services import llm_stub, telegram_stub
+from vetbot_improved.services.telegram_stub import text_message, callback_query, web_app_message, callback_data
+from vetbot_improved.utils.metrics import parse_metrics, summarize_histograms
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+BASELINE_PATH = os.path.join(ROOT, 'benchmark_baseline.json')
+
+MAIN_TOKEN = '1001:bench-main'
+VET_TOKEN = '1002:bench-vet'
+CLIENT_ID_BASE = 100000
+DOCTOR_ID_BASE = 900000
+
+# Разница задержек меньше этой (секунды) не считается регрессией
+LATENCY_FLOOR = 0.01
+
+DOCTOR_REPLIES = [
+    "Дайте коту воды и понаблюдайте за ним до вечера",
+    "Пришлите, пожалуйста, температуру и вес кошки",
+    "Уберите корм на 8 часов, воду оставьте",
+]
+CLIENT_REPLIES = [
+    "Спасибо, воду пьет, но есть отказывается",
+    "Температура 39.2, вес 4 кг",
+    "Хорошо, сделаю",
+]
+
+def free_port():
+    """Свободный локальный порт"""
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def sent_to(token, chat_id, method='sendMessage', contains=None, exclude=()):
+    """Условие на запись журнала заглушки: вызов бота token в чат chat_id"""
+    def predicate(record):
+        return (record['token'] == token and record['chat_id'] == chat_id and record['method'] == method
+                and (contains is None or contains in record['text'])
+                and not record['text'].startswith(tuple(exclude)))
+    return predicate
+
+class Replies:
+    """Ожидание ответов ботов из журнала заглушки внутри цикла asyncio"""
+
+    def __init__(self, stub, loop):
+        self.stub = stub
+        self.loop = loop
+        self._waiters = []
+        stub.on_sent = lambda record: loop.call_soon_threadsafe(self._dispatch, record)
+
+    def _dispatch(self, record):
+        for waiter in self._waiters[:]:
+            predicate, since, future = waiter
+            if record['at'] >= since and not future.done() and predicate(record):
+                future.set_result(record)
+                self._waiters.remove(waiter)
+
+    async def wait(self, predicate, since, timeout):
+        """Первая запись после since, подходящая под predicate; None - не дождались"""
+        with self.stub.cond:
+            records = list(self.stub.sent)
+        for record in records:
+            if record['at'] >= since and predicate(record):
+                return record
+
+        waiter = (predicate, since, self.loop.create_future())
+        self._waiters.append(waiter)
+        try:
+            return await asyncio.wait_for(waiter[2], timeout)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+
+class Scenario:
+    """Сценарий клиентов и врачей поверх заглушки Telegram"""
+
+    def __init__(self, args, stub, db_path, webapp_url):
+        self.args = args
+        self.stub = stub
+        self.db_path = db_path
+        self.webapp_url = webapp_url
+        self.rng = random.Random(args.seed)
+        self.samples = {}
+        self.timeouts = {}
+        self.updates = 0
+        self.phases = {}
+        self.assignments = {}
+        self.claims_lost = 0
+        self.replies = None
+
+    async def step(self, name, token, update, predicate):
+        """Отправить обновление и дождаться ответа бота; задержка идет в samples[name]"""
+        since = self.stub.push(token, update)
+        self.updates += 1
+        record = await self.replies.wait(predicate, since, self.args.timeout)
+        if record is None:
+            self.timeouts[name] = self.timeouts.get(name, 0) + 1
+        else:
+            self.samples.setdefault(name, []).append(record['at'] - since)
+        return record
+
+    async def pause(self):
+        if self.args.think:
+            await asyncio.sleep(self.rng.expovariate(1 / self.args.think))
+
+    async def run(self):
+        self.replies = Replies(self.stub, asyncio.get_running_loop())
+        started = time.monotonic()
+
+        await self.phase('consultations', *(self.client(CLIENT_ID_BASE + i) for i in range(self.args.clients)))
+        await self.phase('claims', *(self.doctor(DOCTOR_ID_BASE + i) for i in range(self.args.doctors)))
+        await self.phase('dialogs', *(self.dialog(doctor_id, consultation_id)
+                                      for doctor_id, consultation_id in self.assignments.items()))
+        await self.phase('vet_calls', *(self.vet_call(i) for i in range(self.args.vet_calls)),
+                         *(self.webapp_request(i) for i in range(self.args.vet_calls)))
+        return time.monotonic() - started
+
+    async def phase(self, name, *coros):
+        started = time.monotonic()
+        updates = self.updates
+        await asyncio.gather(*coros)
+        self.phases[name] = {'seconds': time.monotonic() - started, 'updates': self.updates - updates}
+
+    async def client(self, user_id):
+        """Клиент: /start и вопросы AI по одному, дожидаясь ответа"""
+        await self.pause()
+        await self.step('start', MAIN_TOKEN, text_message(user_id, '/start'), sent_to(MAIN_TOKEN, user_id))
+        for _ in range(self.args.questions):
+            # Ответ AI - первое сообщение после "Анализирую ваш вопрос..."
+            await self.step('ai_answer', MAIN_TOKEN, text_message(user_id, self.rng.choice(QUESTIONS)),
+                            sent_to(MAIN_TOKEN, user_id, exclude=('🤔', '👨‍⚕️')))
+            await self.pause()
+
+    async def doctor(self, doctor_id):
+        """Врач: жмет "Взять клиента" в уведомлениях, пока не получит клиента"""
+        seen = set()
+
+        def notification(record):
+            return (record['token'] == VET_TOKEN and record['chat_id'] == doctor_id
+                    and record['message_id'] not in seen
+                    and any(data.startswith('take_client_') for data in callback_data(record)))
+
+        while doctor_id not in self.assignments:
+            record = await self.replies.wait(notification, 0, self.args.settle)
+            if record is None:
+                return
+            seen.add(record['message_id'])
+            data = next(data for data in callback_data(record) if data.startswith('take_client_'))
+            await self.pause()
+
+            answer = await self.step(
+                'take_client', VET_TOKEN, callback_query(doctor_id, data, record['message_id']),
+                lambda reply, message_id=record['message_id']: (
+                    sent_to(VET_TOKEN, doctor_id, 'editMessageText', exclude=('❌ **Клиент уже взят',))(reply)
+                    and reply['message_id'] == message_id
+                )
+            )
+            if answer is not None and answer['text'].startswith('✅'):
+                self.assignments[doctor_id] = int(data.rsplit('_', 1)[1])
+            else:
+                self.claims_lost += 1
+
+    async def dialog(self, doctor_id, consultation_id):
+        """Переписка врача и клиента через ботов"""
+        conn = sqlite3.connect(self.db_path)
+        client_id = conn.execute('SELECT client_id FROM active_consultations WHERE id = ?',
+                                 (consultation_id,)).fetchone()[0]
+        conn.close()
+
+        for i in range(self.args.replies):
+            text = f"{DOCTOR_REPLIES[i % len(DOCTOR_REPLIES)]} (#{consultation_id}.{i})"
+            await self.step('relay_to_client', VET_TOKEN, text_message(doctor_id, text),
+                            sent_to(MAIN_TOKEN, client_id, contains=text))
+            await self.pause()
+            text = f"{CLIENT_REPLIES[i % len(CLIENT_REPLIES)]} (#{consultation_id}.{i})"
+            await self.step('relay_to_doctor', MAIN_TOKEN, text_message(client_id, text),
+                            sent_to(VET_TOKEN, doctor_id, contains=text))
+
+    def vet_call_form(self, i):
+        return {
+            'name': f'Клиент {i}', 'phone': f'+7-900-000-{i:04d}', 'address': f'ул. Тестовая, {i}',
+            'pet_name': 'Мурка', 'pet_type': 'кошка', 'pet_age': '3 года',
+            'urgency': self.rng.choice(['обычная', 'срочная']), 'problem': self.rng.choice(QUESTIONS),
+            'preferred_time': 'сегодня', 'comments': '',
+        }
+
+    async def vet_call(self, i):
+        """Заявка на вызов врача из веб-приложения в боте (всплеск без пауз)"""
+        user_id = CLIENT_ID_BASE + self.args.clients + i
+        await self.step('vet_call', MAIN_TOKEN, web_app_message(user_id, self.vet_call_form(i)),
+                        sent_to(MAIN_TOKEN, user_id, contains='Заявка на вызов врача принята'))
+
+    async def webapp_request(self, i):
+        """Та же заявка через POST /submit_request"""
+        async with httpx.AsyncClient(timeout=self.args.timeout) as client:
+            started = time.monotonic()
+            try:
+                response = await client.post(f'{self.webapp_url}/submit_request', json=self.vet_call_form(i))
+                response.raise_for_status()
+            except httpx.HTTPError:
+                self.timeouts['webapp_submit'] = self.timeouts.get('webapp_submit', 0) + 1
+                return
+            self.samples.setdefault('webapp_submit', []).append(time.monotonic() - started)
+
+def scrape(url):
+    """Снять /metrics процесса"""
+    with urllib.request.urlopen(url, timeout=5) as response:
+        return parse_metrics(response.read().decode('utf-8'))
+
+def summarize(scenario, elapsed, metrics, locked_errors):
+    """Свести результаты прогона в словарь для отчета и сравнения"""
+    steps = {}
+    for name in sorted(set(scenario.samples) | set(scenario.timeouts)):
+        values = scenario.samples.get(name, [])
+        steps[name] = {
+            'count': len(values),
+            'timeouts': scenario.timeouts.get(name, 0),
+            'p50': percentile(values, 0.5),
+            'p99': percentile(values, 0.99),
+        }
+
+    results = {
+        'scenario': {key: getattr(scenario.args, key) for key in
+                     ('clients', 'doctors', 'questions', 'replies', 'vet_calls', 'latency', 'think', 'seed')},
+        'elapsed': elapsed,
+        'updates': scenario.updates,
+        'updates_per_second': scenario.updates / elapsed if elapsed else 0.0,
+        'burst_updates_per_second': (scenario.phases['vet_calls']['updates'] / scenario.phases['vet_calls']['seconds']
+                                     if scenario.phases.get('vet_calls', {}).get('seconds') else 0.0),
+        'phases': scenario.phases,
+        'steps': steps,
+        'claims': {'assigned': len(scenario.assignments), 'lost': scenario.claims_lost},
+        'handlers': {},
+        'db': {'lock_wait': {}, 'lock_timeouts': 0, 'locked_errors': locked_errors, 'queries': {}},
+        'loop_blocks': {},
+    }
+
+    for process, samples in metrics.items():
+        for row in summarize_histograms(samples):
+            stats = {'count': row['count'], 'p50': row['p50'], 'p99': row['p99']}
+            if row['metric'] == 'vetbot_handler_seconds':
+                results['handlers'][f"{process}.{row['labels']['handler']}"] = stats
+            elif row['metric'] == 'vetbot_db_lock_wait_seconds':
+                results['db']['lock_wait'][f"{process}.{row['labels']['query']}"] = stats
+            elif row['metric'] == 'vetbot_db_query_seconds':
+                results['db']['queries'][f"{process}.{row['labels']['query']}"] = stats
+        for labels, value in samples.get('vetbot_db_lock_timeouts_total', []):
+            results['db']['lock_timeouts'] += int(value)
+        for labels, value in samples.get('vetbot_loop_blocks_total', []):
+            results['loop_blocks'][labels['process']] = int(value)
+    return results
+
+def comparable(results):
+    """Показатели для сравнения с базовым прогоном: имя -> (значение, вид)"""
+    values = {'updates_per_second': (results['updates_per_second'], 'rate')}
+    for name, stats in results['steps'].items():
+        values[f'steps.{name}.p50'] = (stats['p50'], 'latency')
+        values[f'steps.{name}.p99'] = (stats['p99'], 'latency')
+        values[f'steps.{name}.timeouts'] = (stats['timeouts'], 'count')
+    for name, stats in results['handlers'].items():
+        values[f'handlers.{name}.p99'] = (stats['p99'], 'latency')
+    for name, stats in results['db']['lock_wait'].items():
+        values[f'db.lock_wait.{name}.p99'] = (stats['p99'], 'latency')
+    values['db.lock_timeouts'] = (results['db']['lock_timeouts'], 'count')
+    values['db.locked_errors'] = (results['db']['locked_errors'], 'count')
+    for process, blocks in results['loop_blocks'].items():
+        values[f'loop_blocks.{process}'] = (blocks, 'count')
+    return values
+
+def compare(results, baseline, tolerance):
+    """
+    Сравнить прогон с базовым
+
+    Задержки и счетчики (таймауты, блокировки) не должны вырасти больше
+    чем в 1 + tolerance раз, пропускная способность - упасть больше чем
+    в 1 - tolerance раз. Показатели, которых нет в базовом прогоне,
+    пропускаются. Возвращает список описаний регрессий.
+    """
+    regressions = []
+    base = comparable(baseline)
+    for name, (value, kind) in sorted(comparable(results).items()):
+        if name not in base:
+            continue
+        expected = base[name][0]
+        if kind == 'rate':
+            failed = value < expected * (1 - tolerance)
+        elif kind == 'latency':
+            failed = value > expected * (1 + tolerance) and value - expected > LATENCY_FLOOR
+        else:
+            failed = value > expected * (1 + tolerance)
+        if failed:
+            regressions.append(f"{name}: {value:.3f} (база {expected:.3f})")
+    return regressions
+
+def count_locked_errors(workdir):
+    """Записи логов процессов с 'database is locked'"""
+    count = 0
+    for name in os.listdir(workdir):
+        if name.endswith(('.log', '.out')):
+            with open(os.path.join(workdir, name), encoding='utf-8', errors='replace') as f:
+                count += sum(1 for line in f if 'database is locked' in line)
+    return count
+
+def start_services(workdir, env):
+    """Запустить ботов и webapp_server; вывод каждого - в <имя>.out"""
+    processes = {}
+    for name, script in (('main_bot', 'enhanced_bot.py'), ('doctor_bot', 'vet_doctor_bot.py'),
+                         ('webapp', 'webapp_server.py')):
+        out = open(os.path.join(workdir, f'{name}.out'), 'wb')
+        processes[name] = subprocess.Popen([sys.executable, os.path.join(ROOT, script)],
+                                           cwd=workdir, env=env, stdout=out, stderr=subprocess.STDOUT)
+    return processes
+
+def wait_ready(stub, processes, webapp_url, timeout=60):
+    """Дождаться long polling обоих ботов и /health веб-приложения"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        for name, process in processes.items():
+            if process.poll() is not None:
+                raise RuntimeError(f"{name} exited with code {process.returncode}")
+        if MAIN_TOKEN in stub.polling and VET_TOKEN in stub.polling:
+            try:
+                with urllib.request.urlopen(f'{webapp_url}/health', timeout=1):
+                    return
+            except OSError:
+                pass
+        time.sleep(0.1)
+    raise RuntimeError("services did not become ready")
+
+def stop_services(processes):
+    """Штатная остановка (SIGINT), как Ctrl+C у run_polling"""
+    for process in processes.values():
+        if process.poll() is None:
+            process.send_signal(signal.SIGINT)
+    for process in processes.values():
+        try:
+            process.wait(timeout=20)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+def seed_doctors(db_path, count):
+    """Одобренные врачи для сценария"""
+    conn = sqlite3.connect(db_path)
+    conn.executemany('''
+        INSERT OR REPLACE INTO doctors (telegram_id, username, full_name, is_approved)
+        VALUES (?, ?, ?, 1)
+    ''', [(DOCTOR_ID_BASE + i, f'doctor{i}', f'Врач {i}') for i in range(count)])
+    conn.commit()
+    conn.close()
+
+def print_report(results):
+    """Вывести сводку прогона"""
+    scenario = results['scenario']
+    print(f"📊 Сценарий: {scenario['clients']} клиентов, {scenario['doctors']} врачей, "
+          f"{scenario['vet_calls']} вызовов врача")
+    print(f"⏱️ Время прогона: {results['elapsed']:.2f} с, обновлений: {results['updates']}")
+    print(f"🚀 Пропускная способность: {results['updates_per_second']:.1f} обновлений/с "
+          f"(всплеск: {results['burst_updates_per_second']:.1f}/с)")
+    print("📈 Задержка ответа p50 / p99, с:")
+    for name, stats in results['steps'].items():
+        timeouts = f", без ответа {stats['timeouts']}" if stats['timeouts'] else ''
+        print(f"   {name:16} {stats['p50']:.3f} / {stats['p99']:.3f} ({stats['count']}{timeouts})")
+    print("🧩 Обработчики p50 / p99, с:")
+    for name, stats in results['handlers'].items():
+        print(f"   {name:30} {stats['p50']:.3f} / {stats['p99']:.3f} ({stats['count']})")
+    print(f"🤝 Захват клиентов: назначено {results['claims']['assigned']}, проиграно {results['claims']['lost']}")
+    lock_wait = ', '.join(f"{name} p99 {stats['p99'] * 1000:.1f} мс ({stats['count']})"
+                          for name, stats in results['db']['lock_wait'].items()) or 'нет'
+    print(f"🔒 Ожидание блокировок SQLite: {lock_wait}; таймаутов {results['db']['lock_timeouts']}, "
+          f"'database is locked' в логах: {results['db']['locked_errors']}")
+    slowest = sorted(results['db']['queries'].items(), key=lambda item: item[1]['p99'], reverse=True)[:5]
+    for name, stats in slowest:
+        print(f"   {name:30} p99 {stats['p99'] * 1000:.1f} мс ({stats['count']})")
+    print(f"🐢 Блокировки цикла событий: {results['loop_blocks']}")
+
+def main():
+    """Основная функция"""
+    parser = argparse.ArgumentParser(description='Сквозной бенчмарк ботов на заглушках Telegram и DeepSeek')
+    parser.add_argument('--clients', type=int, default=20)
+    parser.add_argument('--doctors', type=int, default=5)
+    parser.add_argument('--questions', type=int, default=2, help='Вопросов AI от каждого клиента')
+    parser.add_argument('--replies', type=int, default=2, help='Реплик врача и клиента в диалоге')
+    parser.add_argument('--vet-calls', type=int, default=20, help='Заявок во всплеске вызовов врача')
+    parser.add_argument('--latency', default='lognormal:0.3,0.3', help='Распределение задержки заглушки LLM')
+    parser.add_argument('--think', type=float, default=0.2, help='Средняя пауза пользователя, с')
+    parser.add_argument('--settle', type=float, default=3.0, help='Сколько врач ждет новых уведомлений, с')
+    parser.add_argument('--timeout', type=float, default=30.0, help='Ожидание ответа бота, с')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='Записать результаты в JSON')
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--save-baseline', action='store_true', help='Сохранить прогон как базовый')
+    parser.add_argument('--compare', action='store_true', help='Сравнить с базовым; регрессия - код 1')
+    parser.add_argument('--tolerance', type=float, default=0.3, help='Допустимое ухудшение (доля)')
+    parser.add_argument('--keep', action='store_true', help='Не удалять рабочий каталог')
+    args = parser.parse_args()
+
+    llm, _ = llm_stub.start_stub_server(latency=args.latency, seed=args.seed)
+    stub, _ = telegram_stub.start_stub_server()
+    workdir = tempfile.mkdtemp(prefix='vetbot-bench-')
+    webapp_url = f'http://127.0.0.1:{free_port()}'
+    ports = {process: free_port() for process in ('main_bot', 'doctor_bot', 'webapp')}
+
+    env = dict(
+        os.environ,
+        TELEGRAM_BOT_TOKEN=MAIN_TOKEN, VET_BOT_TOKEN=VET_TOKEN, TELEGRAM_API_URL=stub.url,
+        LLM_BACKENDS='stub', LLM_STUB_URL=llm.url, ADMIN_CHAT_ID='',
+        METRICS_PORTS=','.join(f'{process}:{port}' for process, port in ports.items()),
+        PORT=webapp_url.rsplit(':', 1)[1], WEBAPP_DB_PATH=os.path.join(workdir, 'vetbot.db'),
+        PYTHONUNBUFFERED='1',
+    )
+    processes = start_services(workdir, env)
+    try:
+        wait_ready(stub, processes, webapp_url)
+        seed_doctors(os.path.join(workdir, 'vetbot.db'), args.doctors)
+        scenario = Scenario(args, stub, os.path.join(workdir, 'vetbot.db'), webapp_url)
+        elapsed = asyncio.run(scenario.run())
+        metrics = {process: scrape(f'http://127.0.0.1:{ports[process]}/metrics')
+                   for process in ('main_bot', 'doctor_bot')}
+    except RuntimeError as e:
+        print(f"❌ {e}; логи в {workdir}")
+        stop_services(processes)
+        sys.exit(2)
+    stop_services(processes)
+    llm.shutdown()
+    stub.shutdown()
+
+    results = summarize(scenario, elapsed, metrics, count_locked_errors(workdir))
+    print_report(results)
+    if args.keep:
+        print(f"📁 Рабочий каталог: {workdir}")
+    else:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"💾 Базовый прогон сохранен: {args.baseline}")
+    if args.compare:
+        with open(args.baseline, encoding='utf-8') as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"⚠️ Регрессия {regression}")
+        if regressions:
+            sys.exit(1)
+        print("✅ Регрессий относительно базового прогона нет")
+
+if __name__ == '__main__':
+    main()
@@ -12,9 +12,8 @@ import atexit
 from telegram import Update
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes
 from dotenv import load_dotenv
-import requests
-import json
 from typing import Optional
+from vetbot_improved.services.llm_gateway import get_gateway, LLMError
 
 # Загружаем переменные окружения
 load_dotenv()
@@ -34,18 +33,15 @@ class VeterinaryBot:
     """Профессиональный ветеринарный консультант с улучшенной обработкой процессов"""
     
     def __init__(self):
-        # API ключи
+        # API ключи; ключ DeepSeek шлюз LLM берет из конфигурации сам
+        # (а бэкенду-заглушке он не нужен)
         self.telegram_token = os.getenv('TELEGRAM_BOT_TOKEN')
-        self.ai_key = os.getenv('DEEPSEEK_API_KEY')
         
         if not self.telegram_token:
             raise ValueError("❌ TELEGRAM_BOT_TOKEN не найден в .env файле")
-        if not self.ai_key:
-            raise ValueError("❌ API ключ не найден в .env файле")
         
-        # Настройки AI API
-        self.ai_url = "https://api.deepseek.com/v1/chat/completions"
-        self.model = os.getenv('DEEPSEEK_MODEL', 'deepseek-chat')
+        # Настройки AI API (адрес и модель задает шлюз LLM)
+        self.llm = get_gateway()
         self.max_tokens = int(os.getenv('MAX_TOKENS', '1500'))
         self.temperature = float(os.getenv('TEMPERATURE', '0.7'))
         
@@ -112,42 +108,20 @@ class VeterinaryBot:
 
     async def get_ai_response(self, user_message: str, user_id: int) -> str:
         """Получение ответа от AI с обработкой ошибок"""
+        messages = self.llm.build_messages(user_message, system_prompt=self.system_prompt)
+        
         try:
-            headers = {
-                'Authorization': f'Bearer {self.ai_key}',
-                'Content-Type': 'application/json'
-            }
-            
-            data = {
-                "model": self.model,
-                "messages": [
-                    {"role": "system", "content": self.system_prompt},
-                    {"role": "user", "content": user_message}
-                ],
-                "max_tokens": self.max_tokens,
-                "temperature": self.temperature,
-                "stream": False
-            }
-            
-            response = requests.post(
-                self.ai_url, 
-                headers=headers, 
-                json=data, 
-                timeout=30
+            response = await self.llm.complete(
+                messages,
+                max_tokens=self.max_tokens,
+                temperature=self.temperature
             )
-            
-            if response.status_code == 200:
-                result = response.json()
-                ai_response = result['choices'][0]['message']['content']
-                logger.info(f"AI ответ получен для пользователя {user_id}")
-                return ai_response
-            else:
-                logger.error(f"Ошибка AI API: {response.status_code} - {response.text}")
-                return "😔 Извините, сейчас у меня технические проблемы. Попробуйте позже или обратитесь к ветеринару напрямую."
+            logger.info(f"AI ответ получен для пользователя {user_id} ({response.backend}, {response.latency:.1f}с)")
+            return response.text
                 
-        except requests.exceptions.Timeout:
-            logger.error("Таймаут запроса к AI API")
-            return "⏰ Запрос занял слишком много времени. Попробуйте переформулировать вопрос."
+        except LLMError as e:
+            logger.error(f"Ошибка AI API: {e}")
+            return "😔 Извините, сейчас у меня технические проблемы. Попробуйте позже или обратитесь к ветеринару напрямую."
         except Exception as e:
             logger.error(f"Ошибка при обращении к AI: {e}")
             return "😔 Произошла ошибка при обработке вашего запроса. Попробуйте позже."
@@ -0,0 +1,163 @@
+"""
+Предохранитель (circuit breaker) и дублирующие запросы для внешних зависимостей
+"""
+
+import os
+import time
+import asyncio
+import logging
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+# Конфигурация
+AI_FAILURE_THRESHOLD = int(os.getenv('AI_FAILURE_THRESHOLD', '3'))
+AI_SLOW_THRESHOLD = int(os.getenv('AI_SLOW_THRESHOLD', '3'))
+AI_LATENCY_SLO = float(os.getenv('AI_LATENCY_SLO', '20'))
+AI_RESET_TIMEOUT = float(os.getenv('AI_RESET_TIMEOUT', '30'))
+# Меньше срока самой срочной полосы планировщика (20 с), иначе зависший
+# DeepSeek отменяется по сроку полосы раньше, чем предохранитель это заметит
+AI_CALL_TIMEOUT = float(os.getenv('AI_CALL_TIMEOUT', '15'))
+AI_HEDGE_ENABLED = os.getenv('AI_HEDGE_ENABLED', 'False').lower() in ('true', '1', 't')
+AI_HEDGE_MIN_DELAY = float(os.getenv('AI_HEDGE_MIN_DELAY', '3'))
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+class CircuitBreaker:
+    """Предохранитель вокруг нестабильной зависимости
+
+    Размыкается после failure_threshold ошибок подряд или slow_threshold
+    ответов подряд медленнее latency_slo. Ошибкой считается и вызов дольше
+    timeout. В разомкнутом состоянии сразу возвращает резервный ответ, а через
+    reset_timeout пропускает один пробный запрос. При hedge=True, если
+    ответ не пришел за p95 задержки, параллельно отправляется дубликат и
+    берется первый успешный ответ.
+    """
+
+    def __init__(self, name, failure_threshold=AI_FAILURE_THRESHOLD, slow_threshold=AI_SLOW_THRESHOLD,
+                 latency_slo=AI_LATENCY_SLO, reset_timeout=AI_RESET_TIMEOUT, timeout=AI_CALL_TIMEOUT,
+                 hedge=AI_HEDGE_ENABLED, hedge_min_delay=AI_HEDGE_MIN_DELAY, history=200):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.slow_threshold = slow_threshold
+        self.latency_slo = latency_slo
+        self.reset_timeout = reset_timeout
+        self.timeout = timeout
+        self.hedge = hedge
+        self.hedge_min_delay = hedge_min_delay
+
+        self.state = CLOSED
+        self._failures = 0
+        self._slow = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._latencies = deque(maxlen=history)
+
+        self.short_circuited = 0
+        self.hedged = 0
+
+    def _open(self, reason):
+        """Разомкнуть цепь"""
+        if self.state != OPEN:
+            logger.warning(f"Circuit '{self.name}' opened: {reason}")
+        self.state = OPEN
+        self._opened_at = time.monotonic()
+
+    def allow_request(self):
+        """Можно ли сейчас обращаться к зависимости"""
+        if self.state == CLOSED:
+            return True
+
+        if self.state == OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+            self.state = HALF_OPEN
+            self._probe_in_flight = False
+
+        if self.state == HALF_OPEN and not self._probe_in_flight:
+            self._probe_in_flight = True
+            return True
+
+        return False
+
+    def record_success(self, latency):
+        """Учесть успешный ответ и его задержку"""
+        self._latencies.append(latency)
+        self._failures = 0
+
+        if latency > self.latency_slo:
+            self._slow += 1
+            if self.state == HALF_OPEN or self._slow >= self.slow_threshold:
+                self._open(f"{self._slow} responses slower than {self.latency_slo:.0f}s")
+                return
+        else:
+            self._slow = 0
+
+        if self.state == HALF_OPEN:
+            logger.info(f"Circuit '{self.name}' closed after successful probe")
+        self.state = CLOSED
+
+    def record_failure(self):
+        """Учесть ошибку зависимости"""
+        self._failures += 1
+        if self.state == HALF_OPEN or self._failures >= self.failure_threshold:
+            self._open(f"{self._failures} consecutive failures")
+
+    def hedge_delay(self):
+        """Через сколько секунд отправлять дублирующий запрос"""
+        if len(self._latencies) < 20:
+            return max(self.hedge_min_delay, self.latency_slo / 2)
+        ordered = sorted(self._latencies)
+        return max(self.hedge_min_delay, ordered[int(len(ordered) * 0.95)])
+
+    async def call(self, factory, fallback):
+        """Выполнить factory() через предохранитель
+
+        При разомкнутой цепи или ошибке возвращает fallback().
+        """
+        if not self.allow_request():
+            self.short_circuited += 1
+            return fallback()
+
+        # Флаг пробного запроса сбрасывает только тот вызов, который его занял.
+        # Отмена снаружи (склейка сообщений, срок полосы) ошибкой не считается:
+        # более новое сообщение клиента отменяет запрос штатно
+        probe = self.state == HALF_OPEN
+        start = time.monotonic()
+        try:
+            result = await asyncio.wait_for(self._hedged(factory) if self.hedge else factory(), self.timeout)
+        except Exception as e:
+            logger.error(f"Circuit '{self.name}' call failed: {e!r}")
+            self.record_failure()
+            return fallback()
+        finally:
+            if probe:
+                self._probe_in_flight = False
+
+        self.record_success(time.monotonic() - start)
+        return result
+
+    async def _hedged(self, factory):
+        """Запрос с дубликатом после порога задержки"""
+        first = asyncio.ensure_future(factory())
+        pending = {first}
+
+        try:
+            done, pending = await asyncio.wait(pending, timeout=self.hedge_delay())
+            if done:
+                return first.result()
+
+            self.hedged += 1
+            pending.add(asyncio.ensure_future(factory()))
+
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
@@ -0,0 +1,131 @@
+"""
+История консультации для врача постранично
+
+Сообщения читаются курсором по id (индекс consultation_messages
+(consultation_id, id)) страницами по HISTORY_PAGE_SIZE, раскладываются в
+сообщения Telegram не длиннее лимита и отправляются по одному с учетом
+RetryAfter. Под последним сообщением страницы - кнопка "показать ещё",
+которая присылает следующую страницу.
+"""
+
+import os
+import html
+import asyncio
+import sqlite3
+import logging
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import RetryAfter
+from vetbot_improved.utils.telegram_format import TELEGRAM_MESSAGE_LIMIT, format_message, utf16_length
+from vetbot_improved.utils.metrics import DB_QUERY_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Конфигурация
+HISTORY_PAGE_SIZE = int(os.getenv('HISTORY_PAGE_SIZE', '30'))
+HISTORY_SEND_RETRIES = int(os.getenv('HISTORY_SEND_RETRIES', '3'))
+
+SENDER_ICONS = {'client': '👤', 'doctor': '👨‍⚕️', 'ai': '🤖', 'admin': '👨‍💼'}
+
+class ConsultationHistory:
+    """Постраничное чтение и отправка истории консультации
+
+    message_log - журнал MessageLog; перед чтением его буфер сбрасывается,
+    чтобы в истории были и только что переданные сообщения.
+    """
+
+    def __init__(self, db_path='vetbot.db', page_size=HISTORY_PAGE_SIZE, message_log=None,
+                 limit=TELEGRAM_MESSAGE_LIMIT):
+        self.db_path = db_path
+        self.page_size = page_size
+        self.message_log = message_log
+        self.limit = limit
+
+    def page(self, consultation_id, after_id=0):
+        """Страница сообщений после after_id
+
+        Возвращает (rows, next_cursor): rows - кортежи (id, sender_type,
+        sender_name, message_text, sent_at), next_cursor - id для следующей
+        страницы или None, если это последняя.
+        """
+        if self.message_log is not None:
+            self.message_log.flush()
+
+        conn = sqlite3.connect(self.db_path)
+        with DB_QUERY_SECONDS.time(query='history_page'):
+            rows = conn.execute('''
+                SELECT id, sender_type, sender_name, message_text, sent_at
+                FROM consultation_messages
+                WHERE consultation_id = ? AND id > ?
+                ORDER BY id ASC LIMIT ?
+            ''', (consultation_id, after_id, self.page_size + 1)).fetchall()
+        conn.close()
+
+        if len(rows) > self.page_size:
+            rows = rows[:self.page_size]
+            return rows, rows[-1][0]
+        return rows, None
+
+    def render(self, rows, header=''):
+        """Разложить сообщения в тексты (HTML) не длиннее лимита Telegram
+
+        Сообщения не разрываются между частями; слишком длинное сообщение
+        само делится по границам предложений.
+        """
+        chunks = []
+        current = header
+
+        for _, sender_type, sender_name, message_text, _ in rows:
+            icon = SENDER_ICONS.get(sender_type, '❓')
+            title = f"{icon} <b>{html.escape(sender_name or sender_type)}:</b> "
+            entry = title + html.escape(message_text) + "\n\n"
+
+            if utf16_length(entry) > self.limit:
+                if current.strip():
+                    chunks.append(current.strip())
+                parts = format_message(message_text, parse_mode='HTML', limit=self.limit - utf16_length(title))
+                chunks.extend(title + part for part in parts)
+                current = ''
+                continue
+
+            if utf16_length(current + entry) > self.limit:
+                chunks.append(current.strip())
+                current = ''
+            current += entry
+
+        if current.strip():
+            chunks.append(current.strip())
+        return chunks
+
+    async def send_page(self, bot, chat_id, consultation_id, after_id=0):
+        """Отправить страницу истории врачу; возвращает курсор следующей страницы"""
+        rows, next_cursor = self.page(consultation_id, after_id)
+        if not rows:
+            return None
+
+        header = "📖 <b>История диалога с клиентом:</b>\n\n" if not after_id else "📖 <b>История (продолжение):</b>\n\n"
+        chunks = self.render(rows, header)
+
+        for i, chunk in enumerate(chunks):
+            reply_markup = None
+            if next_cursor and i == len(chunks) - 1:
+                reply_markup = InlineKeyboardMarkup([[InlineKeyboardButton(
+                    "📜 Показать ещё", callback_data=f"history_{consultation_id}_{next_cursor}"
+                )]])
+            # Части отправляются строго по очереди: следующая - только после
+            # того, как Telegram принял предыдущую
+            await self._send(bot, chat_id, chunk, reply_markup)
+
+        return next_cursor
+
+    async def _send(self, bot, chat_id, text, reply_markup=None):
+        for attempt in range(HISTORY_SEND_RETRIES):
+            try:
+                return await bot.send_message(chat_id=chat_id, text=text, parse_mode='HTML',
+                                              reply_markup=reply_markup)
+            except RetryAfter as e:
+                delay = e.retry_after
+                delay = delay.total_seconds() if hasattr(delay, 'total_seconds') else float(delay)
+                logger.warning(f"History delivery to {chat_id} throttled for {delay}s")
+                if attempt == HISTORY_SEND_RETRIES - 1:
+                    raise
+                await asyncio.sleep(delay)
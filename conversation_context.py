@@ -0,0 +1,246 @@
+"""
+Контекст диалога для AI: последние обращения клиента в пределах бюджета токенов
+и накопительное краткое содержание более старой истории
+"""
+
+import os
+import re
+import sqlite3
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Конфигурация
+AI_CONTEXT_TOKENS = int(os.getenv('AI_CONTEXT_TOKENS', '1500'))
+AI_CONTEXT_TURNS = int(os.getenv('AI_CONTEXT_TURNS', '20'))
+AI_SUMMARY_TOKENS = int(os.getenv('AI_SUMMARY_TOKENS', '300'))
+
+# Служебные приписки к ответам AI, которые не нужно повторно отправлять модели
+SERVICE_NOTES = (
+    '\n\n⚠️ Для точного диагноза',
+    '\n\n👨‍⚕️ К диалогу подключен ветеринар',
+    '\n\n🔔 Врачи уведомлены',
+)
+
+_TOKEN_RE = re.compile(r'\w+|[^\w\s]', re.UNICODE)
+
+def estimate_tokens(text):
+    """Оценка числа токенов без обращения к токенизатору модели
+
+    Слова длиннее четырех символов считаются за несколько токенов: так
+    BPE-токенизаторы режут кириллицу, оценка получается с небольшим запасом.
+    """
+    if not text:
+        return 0
+    return sum(1 + (len(piece) - 1) // 4 for piece in _TOKEN_RE.findall(text))
+
+def strip_service_notes(text):
+    """Убрать из ответа AI приписки бота"""
+    for note in SERVICE_NOTES:
+        position = text.find(note)
+        if position != -1:
+            text = text[:position]
+    return text.strip()
+
+def _first_sentence(text, limit=160):
+    """Первое предложение текста, обрезанное до limit символов"""
+    text = ' '.join((text or '').split())
+    match = re.search(r'[.!?…](\s|$)', text)
+    if match:
+        text = text[:match.start() + 1]
+    return text if len(text) <= limit else text[:limit - 1].rstrip() + '…'
+
+def summarize_turns(summary, turns, max_tokens=AI_SUMMARY_TOKENS):
+    """Дописать к краткому содержанию выжимку из вытесненных реплик
+
+    Каждая реплика сокращается до первого предложения; если содержание не
+    помещается в max_tokens, отбрасываются самые старые строки.
+    """
+    labels = {'user': 'Клиент', 'assistant': 'Ответ'}
+    lines = summary.split('\n') if summary else []
+    for turn in turns:
+        label = turn.get('label') or labels[turn['role']]
+        lines.append(f"{label}: {_first_sentence(turn['content'])}")
+
+    while len(lines) > 1 and estimate_tokens('\n'.join(lines)) > max_tokens:
+        lines.pop(0)
+    return '\n'.join(lines)
+
+class ConversationContext:
+    """Собирает историю клиента для запроса к AI
+
+    Реплики берутся из consultations (вопросы и ответы AI) и
+    consultation_messages (переписка с врачом). Самые свежие реплики идут в
+    запрос целиком, пока помещаются в бюджет токенов и в max_turns;
+    вытесненные один раз сворачиваются в краткое содержание, которое
+    хранится по пользователю и только дополняется.
+    """
+
+    def __init__(self, db_path='vetbot.db', token_budget=AI_CONTEXT_TOKENS,
+                 max_turns=AI_CONTEXT_TURNS, summary_tokens=AI_SUMMARY_TOKENS,
+                 summarizer=summarize_turns):
+        self.db_path = db_path
+        self.token_budget = token_budget
+        self.max_turns = max_turns
+        self.summary_tokens = summary_tokens
+        self.summarizer = summarizer
+        self._summaries = {}
+        self.init_database()
+
+    def init_database(self):
+        """Индексы для выборки истории и таблица кратких содержаний"""
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_consultations_user
+            ON consultations (user_id, id)
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_active_consultations_client
+            ON active_consultations (client_id)
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_consultation_messages_consultation
+            ON consultation_messages (consultation_id, id)
+        ''')
+
+        # Краткое содержание и позиция, до которой история уже свернута
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS conversation_summaries (
+                user_id INTEGER PRIMARY KEY,
+                summary TEXT NOT NULL DEFAULT '',
+                last_consultation_id INTEGER DEFAULT 0,
+                last_message_id INTEGER DEFAULT 0,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+
+        conn.commit()
+        conn.close()
+
+    def recent_turns(self, user_id, limit=None):
+        """Последние реплики клиента в хронологическом порядке"""
+        limit = limit or self.max_turns
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+
+        # Каждая консультация с AI - это две реплики
+        cursor.execute('''
+            SELECT id, question, response, created_at FROM consultations
+            WHERE user_id = ?
+            ORDER BY id DESC LIMIT ?
+        ''', (user_id, (limit + 1) // 2))
+        consultations = cursor.fetchall()
+
+        cursor.execute('''
+            SELECT cm.id, cm.sender_type, cm.message_text, cm.sent_at
+            FROM consultation_messages cm
+            JOIN active_consultations ac ON ac.id = cm.consultation_id
+            WHERE ac.client_id = ?
+            ORDER BY cm.id DESC LIMIT ?
+        ''', (user_id, limit))
+        messages = cursor.fetchall()
+        conn.close()
+
+        turns = []
+        for consultation_id, question, response, created_at in consultations:
+            key = ('consultation', consultation_id)
+            if question:
+                turns.append({'role': 'user', 'content': question, 'at': created_at, 'key': key})
+            if response:
+                turns.append({'role': 'assistant', 'content': strip_service_notes(response),
+                              'at': created_at, 'key': key})
+
+        for message_id, sender_type, text, sent_at in messages:
+            if sender_type == 'client':
+                turns.append({'role': 'user', 'content': text, 'at': sent_at,
+                              'key': ('message', message_id)})
+            else:
+                turns.append({'role': 'assistant', 'content': f"Врач: {text}", 'label': 'Врач',
+                              'at': sent_at, 'key': ('message', message_id)})
+
+        # Время хранится с точностью до секунды: при совпадении порядок задает
+        # id строки, а вопрос и ответ одной консультации сохраняют порядок
+        # добавления - сортировка устойчивая
+        turns.sort(key=lambda turn: (turn['at'] or '', *turn['key']))
+        return turns[-limit:]
+
+    def get_summary(self, user_id):
+        """Краткое содержание и позиции свернутой истории (из кэша или БД)"""
+        if user_id in self._summaries:
+            return self._summaries[user_id]
+
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT summary, last_consultation_id, last_message_id
+            FROM conversation_summaries WHERE user_id = ?
+        ''', (user_id,))
+        result = cursor.fetchone()
+        conn.close()
+
+        state = result if result else ('', 0, 0)
+        self._summaries[user_id] = state
+        return state
+
+    def _save_summary(self, user_id, state):
+        """Сохранить краткое содержание в кэш и БД"""
+        self._summaries[user_id] = state
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        cursor.execute('''
+            INSERT INTO conversation_summaries (user_id, summary, last_consultation_id, last_message_id)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(user_id) DO UPDATE SET
+                summary = excluded.summary,
+                last_consultation_id = excluded.last_consultation_id,
+                last_message_id = excluded.last_message_id,
+                updated_at = CURRENT_TIMESTAMP
+        ''', (user_id, *state))
+        conn.commit()
+        conn.close()
+
+    def build(self, user_id, user_message=''):
+        """История для запроса к AI
+
+        Возвращает (history, summary): history - реплики в формате chat
+        completions, summary - краткое содержание более ранних обращений
+        (пустая строка, если его нет).
+        """
+        # Реплики сверх max_turns тоже сворачиваются в краткое содержание;
+        # еще более старые не поместились бы в него по summary_tokens
+        turns = self.recent_turns(user_id, 2 * self.max_turns)
+        window = turns[-self.max_turns:]
+        summary, last_consultation_id, last_message_id = self.get_summary(user_id)
+
+        # Место под краткое содержание резервируется заранее: иначе после
+        # дополнения оно вытесняло бы новые реплики при каждой сборке
+        budget = self.token_budget - estimate_tokens(user_message) - self.summary_tokens
+        kept = []
+        for turn in reversed(window):
+            cost = estimate_tokens(turn['content'])
+            if cost > budget:
+                break
+            budget -= cost
+            kept.append(turn)
+        kept.reverse()
+        # Ответ без своего вопроса модели не нужен - сворачиваем их вместе
+        if kept and len(kept) < len(turns) and kept[0]['key'] == turns[len(turns) - len(kept) - 1]['key']:
+            kept.pop(0)
+
+        # Вытесненные из бюджета или окна реплики, еще не вошедшие в краткое
+        # содержание
+        evicted = turns[:len(turns) - len(kept)]
+        positions = {'consultation': last_consultation_id, 'message': last_message_id}
+        fresh = [turn for turn in evicted if turn['key'][1] > positions[turn['key'][0]]]
+        if fresh:
+            summary = self.summarizer(summary, fresh, self.summary_tokens)
+            for turn in fresh:
+                source, row_id = turn['key']
+                positions[source] = max(positions[source], row_id)
+            self._save_summary(user_id, (summary, positions['consultation'], positions['message']))
+            logger.info(f"Folded {len(fresh)} turns of user {user_id} into the conversation summary")
+
+        history = [{'role': turn['role'], 'content': turn['content']} for turn in kept]
+        return history, summary
@@ -0,0 +1,34 @@
+"""
+Версии схем компонентов в общей базе
+
+Главный бот и бот врачей создают свои таблицы и индексы в vetbot.db сами
+(init_database). Версия схемы компонента хранится в schema_versions: если
+она совпадает с текущей, DDL при запуске не выполняется и init_database
+обходится одним SELECT. При изменении таблиц или индексов компонента его
+версия увеличивается - и при следующем запуске DDL выполняется снова.
+"""
+
+import sqlite3
+
+def schema_current(conn, component, version):
+    """Схема компонента в базе уже версии version"""
+    try:
+        row = conn.execute('SELECT version FROM schema_versions WHERE component = ?', (component,)).fetchone()
+    except sqlite3.OperationalError:
+        # Таблицы версий еще нет - база новая или создана до нее
+        return False
+    return row is not None and row[0] == version
+
+def mark_schema(conn, component, version):
+    """Записать версию схемы компонента; коммит - за вызывающим"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS schema_versions (
+            component TEXT PRIMARY KEY,
+            version INTEGER NOT NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.execute('''
+        INSERT INTO schema_versions (component, version) VALUES (?, ?)
+        ON CONFLICT(component) DO UPDATE SET version = excluded.version, updated_at = CURRENT_TIMESTAMP
+    ''', (component, version))
@@ -0,0 +1,157 @@
+"""
+Маршрутизация новых клиентов по загрузке врачей
+
+Вместо рассылки всем врачам уведомление сначала получают несколько наименее
+загруженных: меньше активных консультаций, быстрее обычно берут клиента
+(EWMA времени отклика), недавно были активны. Если за
+ROUTING_ESCALATION_TIMEOUT секунд клиента никто не взял, уведомление
+получают следующие врачи рейтинга, пока не будут оповещены все.
+"""
+
+import os
+import json
+import time
+import sqlite3
+import logging
+from vetbot_improved.utils.metrics import DB_QUERY_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Конфигурация
+ROUTING_INITIAL_DOCTORS = int(os.getenv('ROUTING_INITIAL_DOCTORS', '3'))
+ROUTING_ESCALATION_STEP = int(os.getenv('ROUTING_ESCALATION_STEP', '3'))
+ROUTING_ESCALATION_TIMEOUT = float(os.getenv('ROUTING_ESCALATION_TIMEOUT', '60'))
+ROUTING_EWMA_ALPHA = float(os.getenv('ROUTING_EWMA_ALPHA', '0.3'))
+# Оценка времени отклика врача, который еще ни разу не брал клиента
+ROUTING_DEFAULT_RESPONSE = float(os.getenv('ROUTING_DEFAULT_RESPONSE', '120'))
+
+class DoctorRouter:
+    """Рейтинг врачей и волны уведомлений по консультациям
+
+    Загрузка считается по active_consultations при каждом запросе рейтинга,
+    поэтому всегда актуальна; EWMA времени отклика хранится в doctor_stats и
+    обновляется в транзакции захвата клиента.
+    """
+
+    def __init__(self, db_path='vetbot.db', initial=ROUTING_INITIAL_DOCTORS, step=ROUTING_ESCALATION_STEP,
+                 timeout=ROUTING_ESCALATION_TIMEOUT, alpha=ROUTING_EWMA_ALPHA):
+        self.db_path = db_path
+        self.initial = initial
+        self.step = step
+        self.timeout = timeout
+        self.alpha = alpha
+        self._initialized = False
+
+    def init_database(self, conn=None):
+        """Таблицы статистики врачей и волн уведомлений"""
+        own_conn = conn is None
+        if own_conn:
+            conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS doctor_stats (
+                doctor_id INTEGER PRIMARY KEY,
+                response_ewma REAL,
+                responses INTEGER DEFAULT 0,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS consultation_routing (
+                consultation_id INTEGER PRIMARY KEY,
+                notified TEXT NOT NULL DEFAULT '[]', -- telegram_id оповещенных врачей
+                started_at REAL NOT NULL
+            )
+        ''')
+        # Волны запускает SLA-таймер consultation.escalate; индекс для
+        # прежнего опроса эскалаций больше не нужен
+        cursor.execute('DROP INDEX IF EXISTS idx_consultation_routing_due')
+
+        if own_conn:
+            conn.commit()
+            conn.close()
+        self._initialized = True
+
+    def _ensure_database(self, conn=None):
+        if not self._initialized:
+            self.init_database(conn)
+
+    def rank(self, conn=None):
+        """Одобренные врачи от лучшего кандидата к худшему
+
+        Возвращает список словарей с ключами id, telegram_id, full_name,
+        load (число консультаций в работе) и response_ewma (секунды).
+        """
+        own_conn = conn is None
+        if own_conn:
+            conn = sqlite3.connect(self.db_path)
+
+        try:
+            self._ensure_database(conn)
+            with DB_QUERY_SECONDS.time(query='router_rank'):
+                rows = conn.execute('''
+                    SELECT d.id, d.telegram_id, d.full_name,
+                           (SELECT COUNT(*) FROM active_consultations ac
+                            WHERE ac.doctor_id = d.id AND ac.status IN ('assigned', 'active')) AS load,
+                           COALESCE(s.response_ewma, ?) AS response_ewma
+                    FROM doctors d
+                    LEFT JOIN doctor_stats s ON s.doctor_id = d.id
+                    WHERE d.is_approved = 1 AND d.is_active = 1
+                    ORDER BY load ASC, response_ewma ASC, d.last_activity DESC, d.id ASC
+                ''', (ROUTING_DEFAULT_RESPONSE,)).fetchall()
+        finally:
+            if own_conn:
+                conn.close()
+
+        columns = ['id', 'telegram_id', 'full_name', 'load', 'response_ewma']
+        return [dict(zip(columns, row)) for row in rows]
+
+    def select(self, conn, consultation_id):
+        """Следующая волна врачей для консультации
+
+        Первая волна - self.initial лучших врачей, каждая следующая -
+        self.step еще не оповещенных. Выбор запоминается в той же транзакции
+        conn; возвращает список врачей (пустой, если оповещены все).
+        """
+        self._ensure_database(conn)
+        row = conn.execute('''
+            SELECT notified, started_at FROM consultation_routing WHERE consultation_id = ?
+        ''', (consultation_id,)).fetchone()
+        notified = json.loads(row[0]) if row else []
+        started_at = row[1] if row else time.time()
+
+        candidates = [doctor for doctor in self.rank(conn) if doctor['telegram_id'] not in notified]
+        selected = candidates[:self.step if notified else self.initial]
+        notified += [doctor['telegram_id'] for doctor in selected]
+
+        conn.execute('''
+            INSERT OR REPLACE INTO consultation_routing (consultation_id, notified, started_at)
+            VALUES (?, ?, ?)
+        ''', (consultation_id, json.dumps(notified), started_at))
+        return selected
+
+    def record_claim(self, conn, consultation_id, doctor_id):
+        """Учесть, что врач взял клиента: обновить EWMA и закрыть маршрут
+
+        Вызывается в транзакции захвата консультации.
+        """
+        self._ensure_database(conn)
+        row = conn.execute('''
+            SELECT started_at FROM consultation_routing WHERE consultation_id = ?
+        ''', (consultation_id,)).fetchone()
+        if not row:
+            return None
+
+        conn.execute('DELETE FROM consultation_routing WHERE consultation_id = ?', (consultation_id,))
+        response_time = max(0.0, time.time() - row[0])
+        conn.execute('''
+            INSERT INTO doctor_stats (doctor_id, response_ewma, responses)
+            VALUES (?, ?, 1)
+            ON CONFLICT(doctor_id) DO UPDATE SET
+                response_ewma = ? * excluded.response_ewma + (1 - ?) * response_ewma,
+                responses = responses + 1,
+                updated_at = CURRENT_TIMESTAMP
+        ''', (doctor_id, response_time, self.alpha, self.alpha))
+        return response_time
@@ -6,41 +6,52 @@
 import os
 import json
 import logging
+import signal
 import sqlite3
-import requests
 import asyncio
 from datetime import datetime
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, WebAppInfo
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes, CallbackQueryHandler
 from dotenv import load_dotenv
 from notification_system import notification_system
+from ai_coalescer import RequestCoalescer
+from ai_scheduler import AIScheduler, classify_urgency
+from circuit_breaker import CircuitBreaker
+from conversation_context import ConversationContext
+from event_bus import EventBus
+from db_schema import schema_current, mark_schema
+from update_dispatcher import WorkerServer, partition, worker_name
+from vetbot_improved.services.llm_gateway import get_gateway
+from vetbot_improved.utils.telegram_format import format_message
+from vetbot_improved.utils.metrics import QUEUE_DEPTH, timed, start_metrics_server
+from vetbot_improved.utils import tracing, profiler
+from vetbot_improved.utils.loop_watchdog import LoopWatchdog
+from vetbot_improved.utils.logging_setup import setup_logging
 
 # Загрузка переменных окружения
 load_dotenv()
 
 # Версия бота
 VERSION = "2.1.0"
+# Версия схемы init_database: увеличить при изменении таблиц или индексов
+SCHEMA_VERSION = 2
 
-# Настройка логирования
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO,
-    handlers=[
-        logging.FileHandler('./enhanced_bot.log'),
-        logging.StreamHandler()
-    ]
-)
 logger = logging.getLogger(__name__)
 
 # Конфигурация
 BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN', 'YOUR_BOT_TOKEN_HERE')
+# Адрес Bot API (в бенчмарке - локальная заглушка)
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL', 'https://api.telegram.org/bot')
 WEBAPP_URL = os.getenv('WEBAPP_URL', 'https://your-webapp-url.com')
 ADMIN_CHAT_ID = os.getenv('ADMIN_CHAT_ID')
 VET_SERVICE_PHONE = os.getenv('VET_SERVICE_PHONE', '+7-999-123-45-67')
-
-# DeepSeek API конфигурация
-DEEPSEEK_API_KEY = os.getenv('DEEPSEEK_API_KEY', 'sk-your-api-key-here')
-DEEPSEEK_API_URL = "https://api.deepseek.com/v1/chat/completions"
+# Админская сессия закрывается через ADMIN_SESSION_TTL секунд после начала
+ADMIN_SESSION_TTL = int(os.getenv('ADMIN_SESSION_TTL', '14400'))
+ADMIN_SESSION_SWEEP_INTERVAL = float(os.getenv('ADMIN_SESSION_SWEEP_INTERVAL', '300'))
+# При BOT_WORKERS > 1 обновления раздает update_dispatcher.py, а этот процесс -
+# воркер с номером BOT_WORKER_INDEX
+BOT_WORKERS = int(os.getenv('BOT_WORKERS', '1'))
+BOT_WORKER_INDEX = int(os.getenv('BOT_WORKER_INDEX', '0'))
 
 class VetBotDatabase:
     """Класс для работы с базой данных"""
@@ -52,6 +63,10 @@ class VetBotDatabase:
     def init_database(self):
         """Инициализация базы данных"""
         conn = sqlite3.connect(self.db_path)
+        # Схема уже актуальна: при перезапуске DDL не выполняется
+        if schema_current(conn, 'main_bot', SCHEMA_VERSION):
+            conn.close()
+            return
         cursor = conn.cursor()
         
         # Таблица пользователей
@@ -146,6 +161,7 @@ class VetBotDatabase:
                 message_text TEXT NOT NULL,
                 sent_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                 telegram_message_id INTEGER,
+                trace_id TEXT, -- трасса обработчика, передавшего сообщение
                 FOREIGN KEY (consultation_id) REFERENCES active_consultations (id)
             )
         ''')
@@ -175,6 +191,10 @@ class VetBotDatabase:
                 is_active BOOLEAN DEFAULT 1
             )
         ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_admin_sessions_active
+            ON admin_sessions (is_active, started_at)
+        ''')
         
         # Таблица для сообщений админов
         cursor.execute('''
@@ -195,10 +215,65 @@ class VetBotDatabase:
                 user_id INTEGER NOT NULL,
                 message TEXT NOT NULL,
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                sent BOOLEAN DEFAULT 0
+                sent BOOLEAN DEFAULT 0,
+                parse_mode TEXT
             )
         ''')
+        # Очереди, созданные до parse_mode, получают колонку
+        columns = {row[1] for row in cursor.execute('PRAGMA table_info(admin_message_queue)')}
+        if 'parse_mode' not in columns:
+            cursor.execute('ALTER TABLE admin_message_queue ADD COLUMN parse_mode TEXT')
         
+        # Таблица учета токенов AI-запросов
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS ai_usage (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER,
+                consultation_id INTEGER,
+                backend TEXT,
+                prompt_tokens INTEGER DEFAULT 0,
+                completion_tokens INTEGER DEFAULT 0,
+                cache_hit_tokens INTEGER DEFAULT 0,
+                cost REAL DEFAULT 0,
+                latency REAL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (consultation_id) REFERENCES consultations (id)
+            )
+        ''')
+        
+        # Заявки клиента читаются при каждом вопросе AI (срочность), а
+        # админ-панель листает пользователей, консультации, заявки и
+        # консультации врачей по дате
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_vet_calls_user
+            ON vet_calls (user_id, created_at)
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_vet_calls_created
+            ON vet_calls (created_at)
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_users_created
+            ON users (created_at)
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_consultations_created
+            ON consultations (created_at)
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_admin_messages_user
+            ON admin_messages (user_id, sent_at)
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_active_consultations_status
+            ON active_consultations (status, started_at)
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_active_consultations_doctor_started
+            ON active_consultations (doctor_id, started_at)
+        ''')
+        
+        mark_schema(conn, 'main_bot', SCHEMA_VERSION)
         conn.commit()
         conn.close()
     
@@ -216,13 +291,28 @@ class VetBotDatabase:
         conn.close()
         return result[0] if result else None
     
+    def expire_admin_sessions(self, ttl=ADMIN_SESSION_TTL):
+        """Закрыть админские сессии старше ttl секунд"""
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        
+        cursor.execute('''
+            UPDATE admin_sessions SET is_active = 0, ended_at = CURRENT_TIMESTAMP
+            WHERE is_active = 1 AND started_at < datetime('now', ?)
+        ''', (f'-{ttl} seconds',))
+        
+        expired = cursor.rowcount
+        conn.commit()
+        conn.close()
+        return expired
+    
     def get_pending_admin_messages(self, user_id):
         """Получить неотправленные сообщения от админов"""
         conn = sqlite3.connect(self.db_path)
         cursor = conn.cursor()
         
         cursor.execute('''
-            SELECT id, message FROM admin_message_queue 
+            SELECT id, message, parse_mode FROM admin_message_queue 
             WHERE user_id = ? AND sent = 0
             ORDER BY created_at ASC
         ''', (user_id,))
@@ -245,15 +335,15 @@ class VetBotDatabase:
         conn.commit()
         conn.close()
     
-    def add_admin_message_to_queue(self, user_id, message):
+    def add_admin_message_to_queue(self, user_id, message, parse_mode=None):
         """Добавить сообщение админа в очередь"""
         conn = sqlite3.connect(self.db_path)
         cursor = conn.cursor()
         
         cursor.execute('''
-            INSERT INTO admin_message_queue (user_id, message)
-            VALUES (?, ?)
-        ''', (user_id, message))
+            INSERT INTO admin_message_queue (user_id, message, parse_mode)
+            VALUES (?, ?, ?)
+        ''', (user_id, message, parse_mode))
         
         conn.commit()
         conn.close()
@@ -305,6 +395,21 @@ class VetBotDatabase:
         conn.close()
         return calls
     
+    def get_latest_call_urgency(self, user_id):
+        """Срочность последней заявки пользователя на вызов врача"""
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        
+        cursor.execute('''
+            SELECT urgency FROM vet_calls 
+            WHERE user_id = ? AND status = 'pending'
+            ORDER BY created_at DESC LIMIT 1
+        ''', (user_id,))
+        
+        result = cursor.fetchone()
+        conn.close()
+        return result[0] if result else None
+    
     def save_consultation(self, user_id, question, response):
         """Сохранение консультации"""
         conn = sqlite3.connect(self.db_path)
@@ -320,6 +425,35 @@ class VetBotDatabase:
         conn.close()
         return consultation_id
     
+    def save_ai_usage(self, user_id, response):
+        """Сохранение расхода токенов на AI-запрос"""
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        
+        cursor.execute('''
+            INSERT INTO ai_usage (user_id, backend, prompt_tokens, completion_tokens,
+                                  cache_hit_tokens, cost, latency)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', (user_id, response.backend, response.prompt_tokens, response.completion_tokens,
+              response.cache_hit_tokens, response.cost, response.latency))
+        
+        conn.commit()
+        conn.close()
+    
+    def attach_ai_usage(self, user_id, consultation_id):
+        """Привязать еще не учтенные AI-запросы пользователя к консультации"""
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        
+        # Расход записывается сразу после ответа AI, а консультация - позже
+        cursor.execute('''
+            UPDATE ai_usage SET consultation_id = ?
+            WHERE user_id = ? AND consultation_id IS NULL
+        ''', (consultation_id, user_id))
+        
+        conn.commit()
+        conn.close()
+    
     def get_active_consultation_by_client(self, client_id):
         """Получить активную консультацию клиента"""
         conn = sqlite3.connect(self.db_path)
@@ -335,8 +469,9 @@ class VetBotDatabase:
         conn.close()
         
         if result:
-            columns = ['id', 'client_id', 'doctor_id', 'consultation_id', 'started_at', 
-                      'status', 'client_username', 'client_name', 'initial_message']
+            # Схема таблицы зависит от того, какой бот создал ее первым
+            # (у основного бота есть consultation_id), поэтому имена - из курсора
+            columns = [column[0] for column in cursor.description]
             return dict(zip(columns, result))
         return None
     
@@ -359,9 +494,42 @@ class VetBotDatabase:
         return None
 
 class EnhancedVetBot:
-    def __init__(self):
-        self.application = Application.builder().token(BOT_TOKEN).build()
+    def __init__(self, workers=BOT_WORKERS, worker_index=BOT_WORKER_INDEX):
+        self.workers = workers
+        self.worker_index = worker_index
+        self.process_name = 'main_bot' if workers == 1 else worker_name(worker_index)
+        # Обновления обрабатываются параллельно, чтобы сообщения, отправленные
+        # подряд, попадали в одно окно склейки AI-запросов
+        builder = (
+            Application.builder().token(BOT_TOKEN).base_url(TELEGRAM_API_URL).concurrent_updates(True)
+            .request(tracing.TracedRequest(connection_pool_size=256, bot_name='main'))
+            .get_updates_request(tracing.TracedRequest(bot_name='main'))
+            .post_init(self.start_event_bus).post_shutdown(self.stop_event_bus)
+        )
+        # Воркер получает обновления от диспетчера, а не от Telegram
+        if workers > 1:
+            builder.updater(None)
+        self.application = builder.build()
         self.db = VetBotDatabase()
+        # События от админ-панели и бота врачей доставляются сразу, а не при
+        # следующем сообщении клиента
+        self.events = EventBus(self.db.db_path, consumer=self.process_name)
+        self.events.subscribe('admin.message.queued', self.on_admin_message_queued)
+        self.outbox_relay = notification_system.create_outbox_relay()
+        self.sla_timers = notification_system.create_sla_scheduler()
+        self.sla_timers.on('admin_sessions.expire', self.expire_admin_sessions)
+        self._admin_delivery_lock = asyncio.Lock()
+        self.context = ConversationContext(self.db.db_path)
+        # Общий лимит AI-запросов держит планировщик, чтобы срочные вопросы
+        # обгоняли обычные в его очереди
+        self.coalescer = RequestCoalescer(global_limit=None)
+        self.scheduler = AIScheduler()
+        for lane in self.scheduler.lanes:
+            QUEUE_DEPTH.set_function(lambda lane=lane: self.scheduler.stats()[lane]['queued'], queue=f'ai_{lane}')
+        self.metrics_server = None
+        self.watchdog = LoopWatchdog(self.process_name)
+        self.ai_breaker = CircuitBreaker('deepseek')
+        self.llm = get_gateway()
         self.setup_handlers()
     
     def setup_handlers(self):
@@ -379,70 +547,40 @@ class EnhancedVetBot:
         # Обработчик текстовых сообщений
         self.application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, self.handle_message))
     
-    async def get_ai_consultation(self, user_message, user_name):
+    async def get_ai_consultation(self, user_message, user_name, user_id=None):
         """Получение AI-консультации от DeepSeek"""
-        try:
-            system_prompt = """Ты опытный ветеринар-фелинолог с 15+ летним стажем, специализирующийся исключительно на лечении кошек.
-
-Важные правила ответа:
-- НЕ используй символы ### в ответах
-- НЕ используй форматирование **текст**
-- Используй простой текст с эмодзи
-- Структурируй ответ с помощью номеров и эмодзи
-
-Дай профессиональную консультацию по здоровью кошки, включая:
-1. Анализ симптомов
-2. Возможные причины
-3. Рекомендации по первой помощи
-4. Когда обязательно нужен осмотр врача
-
-Помни: ты консультируешь только по кошкам!"""
-            
-            headers = {
-                'Authorization': f'Bearer {DEEPSEEK_API_KEY}',
-                'Content-Type': 'application/json'
-            }
-            
-            data = {
-                "model": "deepseek-chat",
-                "messages": [
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": f"Пользователь {user_name} спрашивает: {user_message}"}
-                ],
-                "max_tokens": 1500,
-                "temperature": 0.7
-            }
-            
-            # Асинхронный запрос с таймаутом
-            response = await asyncio.wait_for(
-                asyncio.to_thread(
-                    requests.post, 
-                    DEEPSEEK_API_URL, 
-                    headers=headers, 
-                    json=data, 
-                    timeout=30
-                ),
-                timeout=35.0
+        # Пока DeepSeek недоступен, предохранитель сразу отдает резервный ответ
+        return await self.ai_breaker.call(
+            lambda: self.request_ai(user_message, user_name, user_id),
+            fallback=self.get_fallback_response
+        )
+    
+    async def request_ai(self, user_message, user_name, user_id=None):
+        """Запрос к AI через шлюз LLM; при ошибке выбрасывает исключение"""
+        # Уточняющие вопросы ("а сколько давать?") понятны модели только с историей
+        history, summary = self.context.build(user_id, user_message) if user_id else ([], '')
+        response = await self.llm.consult(user_message, user_name, history=history, summary=summary)
+        if user_id:
+            self.db.save_ai_usage(user_id, response)
+        # Разметку модели убирает format_message при отправке - одним проходом
+        return response.text + "\n\n⚠️ Для точного диагноза рекомендуется очный осмотр"
+    
+    async def consult(self, user_id, user_message, user_name):
+        """AI-консультация с учетом склейки сообщений и приоритета
+        
+        Возвращает (вопрос, ответ) или None, если сообщение вошло в более
+        поздний запрос этого пользователя.
+        """
+        async def ask_ai(question):
+            lane = classify_urgency(question, self.db.get_latest_call_urgency(user_id))
+            ai_response = await self.scheduler.submit(
+                lambda: self.get_ai_consultation(question, user_name, user_id),
+                lane,
+                fallback=self.get_fallback_response
             )
-            
-            if response.status_code == 200:
-                result = response.json()
-                ai_response = result['choices'][0]['message']['content']
-                
-                # Очистка форматирования
-                ai_response = ai_response.replace('###', '').replace('**', '')
-                
-                # Добавляем предупреждение
-                ai_response += "\n\n⚠️ Для точного диагноза рекомендуется очный осмотр"
-                
-                return ai_response
-            else:
-                logger.error(f"DeepSeek API error: {response.status_code}")
-                return self.get_fallback_response()
-                
-        except Exception as e:
-            logger.error(f"Error getting AI consultation: {e}")
-            return self.get_fallback_response()
+            return question, ai_response
+        
+        return await self.coalescer.run(user_id, user_message, ask_ai)
     
     def get_fallback_response(self):
         """Резервный ответ при недоступности AI"""
@@ -535,6 +673,7 @@ class EnhancedVetBot:
         
         await query.edit_message_text(emergency_text, reply_markup=reply_markup)
     
+    @timed('handle_message')
     async def handle_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработчик текстовых сообщений с AI-консультацией"""
         user_id = update.effective_user.id
@@ -556,6 +695,7 @@ class EnhancedVetBot:
             if active_consultation and active_consultation['status'] == 'active':
                 # Клиент уже в диалоге с врачом - пересылаем сообщение врачу
                 doctor_info = self.db.get_doctor_by_id(active_consultation['doctor_id'])
+                tracing.annotate(**{'vetbot.consultation_id': active_consultation['id']})
                 if doctor_info:
                     processing_msg = await update.message.reply_text(f"👨‍⚕️ Сообщение передано врачу {doctor_info['full_name']}...")
                     
@@ -588,18 +728,30 @@ class EnhancedVetBot:
             return
         
         try:
-            # Получаем AI-консультацию с таймаутом
-            ai_response = await asyncio.wait_for(
-                self.get_ai_consultation(user_message, user_name),
+            # Получаем AI-консультацию с таймаутом; сообщения, пришедшие подряд,
+            # объединяются в один запрос
+            result = await asyncio.wait_for(
+                self.consult(user_id, user_message, user_name),
                 timeout=60.0  # 45 секунд таймаут
             )
             
+            if result is None:
+                # Сообщение вошло в более поздний запрос этого пользователя
+                try:
+                    await processing_msg.delete()
+                except:
+                    pass
+                return
+            
+            user_message, ai_response = result
+            
             # Если активна админская сессия, добавляем уведомление
             if active_admin:
                 ai_response += f"\n\n👨‍⚕️ К диалогу подключен ветеринар {active_admin}. Вы можете получить дополнительную персональную консультацию!"
             
             # Сохраняем консультацию в базу данных
             consultation_id = self.db.save_consultation(user_id, user_message, ai_response)
+            self.db.attach_ai_usage(user_id, consultation_id)
             
             # Создаем запрос на консультацию с врачом (если нет активной консультации)
             if not active_consultation and consultation_id:
@@ -623,15 +775,10 @@ class EnhancedVetBot:
             except:
                 pass  # Игнорируем ошибки удаления
             
-            # Отправляем ответ без кнопок
-            # Разбиваем длинные сообщения
-            if len(ai_response) > 4000:
-                # Отправляем по частям
-                parts = [ai_response[i:i+4000] for i in range(0, len(ai_response), 4000)]
-                for part in parts:
-                    await update.message.reply_text(part)
-            else:
-                await update.message.reply_text(ai_response)
+            # Отправляем ответ без кнопок; длинный ответ делится на сообщения
+            # по границам абзацев и предложений
+            for part in format_message(ai_response):
+                await update.message.reply_text(part)
             
         except asyncio.TimeoutError:
             logger.error("AI consultation timeout")
@@ -655,16 +802,67 @@ class EnhancedVetBot:
     
     async def check_and_send_admin_messages(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Проверить и отправить сообщения от админов"""
-        user_id = update.effective_user.id
-        pending_messages = self.db.get_pending_admin_messages(user_id)
-        
-        for message_id, message in pending_messages:
-            try:
-                await update.message.reply_text(f"👨‍⚕️ Сообщение от ветеринара:\n\n{message}")
-                self.db.mark_admin_message_sent(message_id)
-            except Exception as e:
-                logger.error(f"Error sending admin message: {e}")
+        await self.send_pending_admin_messages(update.effective_user.id)
     
+    async def send_pending_admin_messages(self, user_id):
+        """Отправить клиенту неотправленные сообщения от админов"""
+        # Очередь разбирается и по событию, и по сообщению клиента - без
+        # блокировки одно сообщение могло бы уйти дважды
+        async with self._admin_delivery_lock:
+            pending_messages = self.db.get_pending_admin_messages(user_id)
+            
+            for message_id, message, parse_mode in pending_messages:
+                try:
+                    # Разметка - та, с которой админ-панель поставила сообщение
+                    await self.application.bot.send_message(
+                        chat_id=user_id,
+                        text=f"👨‍⚕️ Сообщение от ветеринара:\n\n{message}",
+                        parse_mode=parse_mode
+                    )
+                    self.db.mark_admin_message_sent(message_id)
+                except Exception as e:
+                    logger.error(f"Error sending admin message: {e}")
+    
+    async def on_admin_message_queued(self, event):
+        """Событие шины: админ поставил сообщение клиенту в очередь"""
+        # Событие получают все воркеры, доставляет - владелец чата клиента
+        if partition(event['payload']['user_id'], self.workers) != self.worker_index:
+            return
+        await self.send_pending_admin_messages(event['payload']['user_id'])
+    
+    async def start_event_bus(self, application):
+        """Запустить доставку событий, outbox, SLA-таймеры и /metrics вместе с ботом"""
+        self.metrics_server = start_metrics_server(self.process_name)
+        tracing.configure(self.process_name)
+        profiler.install(self.process_name, asyncio.get_running_loop())
+        self.watchdog.start()
+        application.create_task(self.events.run())
+        # Outbox забирается атомарно, relay может работать в каждом воркере
+        application.create_task(self.outbox_relay.run())
+        # Таймеры консультаций обрабатывает только этот бот (и только воркер 0)
+        if self.worker_index == 0:
+            self.sla_timers.schedule('admin_sessions.expire', 0, 0, keep_existing=True)
+            application.create_task(self.sla_timers.run())
+    
+    async def stop_event_bus(self, application):
+        """Остановить доставку событий, outbox и SLA-таймеры, дописать журнал сообщений"""
+        self.events.stop()
+        self.outbox_relay.stop()
+        self.sla_timers.stop()
+        notification_system.messages.close()
+        profiler.stop()
+        self.watchdog.stop()
+        if self.metrics_server is not None:
+            self.metrics_server.shutdown()
+    
+    def expire_admin_sessions(self, ref_id, fired):
+        """Таймер: закрыть устаревшие админские сессии"""
+        expired = self.db.expire_admin_sessions()
+        if expired:
+            logger.info(f"Expired {expired} admin sessions")
+        return ADMIN_SESSION_SWEEP_INTERVAL
+    
+    @timed('web_app_data')
     async def web_app_data(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработчик данных из веб-приложения"""
         try:
@@ -727,9 +925,40 @@ class EnhancedVetBot:
 📱 WebApp URL: {WEBAPP_URL}
         """)
         
-        self.application.run_polling(drop_pending_updates=True)
+        if self.workers > 1:
+            asyncio.run(self.run_worker())
+        else:
+            self.application.run_polling(drop_pending_updates=True)
+    
+    async def run_worker(self):
+        """Воркер: обновления своих чатов приходят от update_dispatcher.py"""
+        stopping = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, stopping.set)
+        
+        # Тот же порядок запуска и остановки, что у run_polling
+        await self.application.initialize()
+        await self.start_event_bus(self.application)
+        await self.application.start()
+        server = WorkerServer(self.application, self.worker_index)
+        await server.start()
+        try:
+            await stopping.wait()
+        finally:
+            # Принятые обновления обрабатываются до остановки приложения
+            await server.close()
+            await self.application.stop()
+            await self.application.shutdown()
+            await self.stop_event_bus(self.application)
 
 if __name__ == '__main__':
+    # JSON-лог с ротацией, запись в файл - в отдельном потоке; у воркеров
+    # файлы свои, иначе процессы мешали бы друг другу при ротации
+    if BOT_WORKERS > 1:
+        setup_logging(worker_name(BOT_WORKER_INDEX), f'./enhanced_bot.{BOT_WORKER_INDEX}.log')
+    else:
+        setup_logging('main_bot', './enhanced_bot.log')
     bot = EnhancedVetBot()
     bot.run()
 
@@ -0,0 +1,276 @@
+"""
+Шина событий между основным ботом, ботом врачей и админ-панелью
+
+События пишутся в таблицу events общей базы SQLite (при необходимости - в
+той же транзакции, что и изменение состояния). Каждый процесс-подписчик
+хранит свой курсор (id последнего обработанного события) в event_cursors и
+узнает о новых записях по PRAGMA data_version, не перечитывая таблицу впустую.
+
+Основные темы:
+    consultation.created   - клиент ждет врача
+    consultation.assigned  - врач взял клиента или админ переназначил
+    consultation.completed - консультация завершена (например, по SLA)
+    message.relayed        - сообщение передано между клиентом и врачом
+    admin.message.queued   - админ поставил сообщение клиенту в очередь
+"""
+
+import os
+import json
+import time
+import asyncio
+import fnmatch
+import sqlite3
+import logging
+import inspect
+from vetbot_improved.utils.metrics import DB_QUERY_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Конфигурация
+EVENT_POLL_INTERVAL = float(os.getenv('EVENT_POLL_INTERVAL', '0.1'))
+EVENT_RETENTION_DAYS = int(os.getenv('EVENT_RETENTION_DAYS', '7'))
+
+class EventBus:
+    """Шина событий поверх общей базы SQLite
+
+    publish() доступен любому процессу; подписчик (consumer) регистрирует
+    обработчики через subscribe() и запускает run() в своем цикле событий.
+    Новый подписчик начинает с текущего конца журнала, а после перезапуска
+    продолжает с сохраненного курсора и получает пропущенные события.
+    """
+
+    def __init__(self, db_path='vetbot.db', consumer=None, poll_interval=EVENT_POLL_INTERVAL):
+        self.db_path = db_path
+        self.consumer = consumer
+        self.poll_interval = poll_interval
+        self._handlers = []
+        self._initialized = False
+        self._running = False
+        self._wakeup = None
+
+    def init_database(self, conn=None):
+        """Таблицы журнала событий и курсоров подписчиков"""
+        own_conn = conn is None
+        if own_conn:
+            conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS events (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                topic TEXT NOT NULL,
+                payload TEXT NOT NULL DEFAULT '{}',
+                source TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS event_cursors (
+                consumer TEXT PRIMARY KEY,
+                last_event_id INTEGER NOT NULL DEFAULT 0,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+
+        if own_conn:
+            conn.commit()
+            conn.close()
+        self._initialized = True
+
+    def _ensure_database(self, conn=None):
+        # Таблицы создаются при первом обращении, а не при импорте модуля;
+        # внутри чужой транзакции - через ее же соединение, чтобы не ждать блокировку
+        if not self._initialized:
+            self.init_database(conn)
+
+    def publish(self, topic, payload=None, conn=None):
+        """Опубликовать событие
+
+        Если передано соединение conn, событие записывается в его текущую
+        транзакцию и станет видно подписчикам только вместе с ней.
+        """
+        own_conn = conn is None
+        if own_conn:
+            conn = sqlite3.connect(self.db_path)
+
+        try:
+            self._ensure_database(conn)
+            cursor = conn.execute('''
+                INSERT INTO events (topic, payload, source)
+                VALUES (?, ?, ?)
+            ''', (topic, json.dumps(payload or {}, ensure_ascii=False), self.consumer))
+            event_id = cursor.lastrowid
+            if own_conn:
+                conn.commit()
+        finally:
+            if own_conn:
+                conn.close()
+
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return event_id
+
+    def subscribe(self, pattern, handler):
+        """Подписать обработчик на темы по шаблону (например, consultation.*)
+
+        handler(event) может быть обычной функцией или корутиной; event -
+        словарь с ключами id, topic, payload, source, created_at.
+        """
+        self._handlers.append((pattern, handler))
+
+    def fetch(self, after_id=0, limit=100):
+        """События с id больше after_id в порядке публикации"""
+        self._ensure_database()
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+
+        with DB_QUERY_SECONDS.time(query='event_fetch'):
+            cursor.execute('''
+                SELECT id, topic, payload, source, created_at FROM events
+                WHERE id > ?
+                ORDER BY id ASC LIMIT ?
+            ''', (after_id, limit))
+            rows = cursor.fetchall()
+        conn.close()
+        return [self._to_event(row) for row in rows]
+
+    def recent(self, limit=50):
+        """Последние события (сначала новые) - для админ-панели"""
+        self._ensure_database()
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+
+        cursor.execute('''
+            SELECT id, topic, payload, source, created_at FROM events
+            ORDER BY id DESC LIMIT ?
+        ''', (limit,))
+
+        rows = cursor.fetchall()
+        conn.close()
+        return [self._to_event(row) for row in rows]
+
+    @staticmethod
+    def _to_event(row):
+        event_id, topic, payload, source, created_at = row
+        return {
+            'id': event_id,
+            'topic': topic,
+            'payload': json.loads(payload) if payload else {},
+            'source': source,
+            'created_at': created_at,
+        }
+
+    def get_cursor(self):
+        """Курсор подписчика; новый подписчик начинает с конца журнала"""
+        self._ensure_database()
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+
+        cursor.execute('SELECT last_event_id FROM event_cursors WHERE consumer = ?', (self.consumer,))
+        result = cursor.fetchone()
+        if result is None:
+            cursor.execute('SELECT COALESCE(MAX(id), 0) FROM events')
+            last_event_id = cursor.fetchone()[0]
+            cursor.execute('''
+                INSERT INTO event_cursors (consumer, last_event_id) VALUES (?, ?)
+            ''', (self.consumer, last_event_id))
+            conn.commit()
+        else:
+            last_event_id = result[0]
+
+        conn.close()
+        return last_event_id
+
+    def _save_cursor(self, last_event_id):
+        conn = sqlite3.connect(self.db_path)
+        conn.execute('''
+            UPDATE event_cursors SET last_event_id = ?, updated_at = CURRENT_TIMESTAMP
+            WHERE consumer = ?
+        ''', (last_event_id, self.consumer))
+        conn.commit()
+        conn.close()
+
+    async def dispatch_pending(self):
+        """Передать обработчикам все события после курсора
+
+        Возвращает число обработанных событий. Ошибка обработчика
+        логируется и не останавливает доставку остальных событий.
+        """
+        last_event_id = self.get_cursor()
+        handled = 0
+
+        while True:
+            events = self.fetch(last_event_id)
+            if not events:
+                break
+
+            for event in events:
+                for pattern, handler in self._handlers:
+                    if not fnmatch.fnmatchcase(event['topic'], pattern):
+                        continue
+                    try:
+                        result = handler(event)
+                        if inspect.isawaitable(result):
+                            await result
+                    except Exception as e:
+                        logger.error(f"Event handler for {event['topic']} #{event['id']} failed: {e}")
+                last_event_id = event['id']
+                handled += 1
+
+            self._save_cursor(last_event_id)
+
+        return handled
+
+    def prune(self, older_than_days=EVENT_RETENTION_DAYS):
+        """Удалить события старше older_than_days дней"""
+        self._ensure_database()
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        cursor.execute('''
+            DELETE FROM events WHERE created_at < datetime('now', ?)
+        ''', (f'-{older_than_days} days',))
+        deleted = cursor.rowcount
+        conn.commit()
+        conn.close()
+        return deleted
+
+    async def run(self):
+        """Цикл доставки событий подписчику до вызова stop()"""
+        if self.consumer is None:
+            raise ValueError("EventBus.run() requires a consumer name")
+
+        self._ensure_database()
+        self._running = True
+        self._wakeup = asyncio.Event()
+        # data_version меняется, когда другое соединение фиксирует транзакцию,
+        # поэтому проверка на каждом шаге почти ничего не стоит
+        watch = sqlite3.connect(self.db_path)
+        last_version = None
+        last_prune = 0.0
+
+        try:
+            while self._running:
+                version = watch.execute('PRAGMA data_version').fetchone()[0]
+                if version != last_version or self._wakeup.is_set():
+                    self._wakeup.clear()
+                    last_version = version
+                    await self.dispatch_pending()
+
+                if time.monotonic() - last_prune > 3600:
+                    last_prune = time.monotonic()
+                    self.prune()
+
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            watch.close()
+            self._wakeup = None
+
+    def stop(self):
+        """Остановить цикл run()"""
+        self._running = False
+        if self._wakeup is not None:
+            self._wakeup.set()
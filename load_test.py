@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Нагрузочный тест AI-конвейера ботов на офлайн-заглушке LLM
+
+Запускает заглушку DeepSeek с заданным распределением задержки и прогоняет
+через EnhancedVetBot (склейка сообщений, приоритеты, предохранитель, шлюз)
+или через AIService из vetbot_improved сценарий из N клиентов.
+
+Пример:
+    python load_test.py --clients 100 --messages 3 --latency lognormal:0.8,0.5
+"""
+
+import os
+import sys
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+
+from vetbot_improved.services.llm_stub import start_stub_server
+from vetbot_improved.utils.loop_watchdog import LoopWatchdog
+from vetbot_improved.utils.metrics import LOOP_BLOCKS
+
+QUESTIONS = [
+    "Кошка второй день не ест и много спит",
+    "Чем лучше кормить котенка 3 месяцев?",
+    "У кота рвота после еды, что делать?",
+    "Похоже на отравление, кошка шатается",
+    "Когда делать прививки британцу?",
+    "Кошка чихает и слезятся глаза",
+]
+
+def percentile(values, q):
+    """Перцентиль q (0..1) по отсортированному списку"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+async def run_enhanced_client(bot, user_id, args, rng, results):
+    """Клиент EnhancedVetBot: серия сообщений с паузами"""
+    tasks = []
+    for i in range(args.messages):
+        question = rng.choice(QUESTIONS)
+        tasks.append(asyncio.create_task(timed(bot.consult(user_id, question, f"Клиент {user_id}"), results)))
+        await asyncio.sleep(rng.expovariate(1 / args.gap) if args.gap else 0)
+    await asyncio.gather(*tasks)
+
+async def run_improved_client(service, user_id, args, rng, results):
+    """Клиент AIService: каждый вопрос - отдельный запрос"""
+    for i in range(args.messages):
+        question = rng.choice(QUESTIONS)
+        await timed(service.get_consultation(question, f"Клиент {user_id}"), results)
+        await asyncio.sleep(rng.expovariate(1 / args.gap) if args.gap else 0)
+
+async def timed(coro, results):
+    """Замерить время обработки одного сообщения"""
+    start = time.monotonic()
+    result = await coro
+    results.append((time.monotonic() - start, result))
+
+async def run(args):
+    """Прогнать сценарий и вернуть собранные результаты"""
+    rng = random.Random(args.seed)
+    results = []
+
+    if args.target == 'enhanced':
+        # Импорт после настройки окружения: шлюз читает LLM_BACKENDS при создании
+        from enhanced_bot import EnhancedVetBot
+        bot = EnhancedVetBot()
+        bot.coalescer.window = args.window
+        fallback = bot.get_fallback_response()
+        clients = [run_enhanced_client(bot, 1000 + i, args, rng, results) for i in range(args.clients)]
+    else:
+        from vetbot_improved.services.ai_service import AIService
+        bot = None
+        fallback = AIService.get_fallback_response()
+        clients = [run_improved_client(AIService, 1000 + i, args, rng, results) for i in range(args.clients)]
+
+    # Блокирующие вызовы в конвейере видны как остановки цикла
+    watchdog = LoopWatchdog('load_test')
+    watchdog.start()
+    start = time.monotonic()
+    await asyncio.gather(*clients)
+    elapsed = time.monotonic() - start
+    watchdog.stop()
+    return results, elapsed, fallback, bot, watchdog
+
+def main():
+    """Основная функция"""
+    parser = argparse.ArgumentParser(description='Нагрузочный тест AI-конвейера на заглушке LLM')
+    parser.add_argument('--target', choices=['enhanced', 'improved'], default='enhanced')
+    parser.add_argument('--clients', type=int, default=50)
+    parser.add_argument('--messages', type=int, default=3, help='Сообщений от каждого клиента')
+    parser.add_argument('--gap', type=float, default=0.3, help='Средняя пауза между сообщениями, с')
+    parser.add_argument('--window', type=float, default=0.5, help='Окно склейки сообщений, с')
+    parser.add_argument('--latency', default='lognormal:0.8,0.5', help='Распределение задержки заглушки')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Доля ответов 503')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--max-loop-blocks', type=int, default=None,
+                        help='Завершиться с ошибкой, если цикл блокировался чаще')
+    args = parser.parse_args()
+
+    server, _ = start_stub_server(latency=args.latency, error_rate=args.error_rate, seed=args.seed)
+    os.environ['LLM_BACKENDS'] = 'stub'
+    os.environ['LLM_STUB_URL'] = server.url
+
+    # Базу данных и логи бота создаем во временном каталоге
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    os.chdir(tempfile.mkdtemp(prefix='vetbot-load-'))
+
+    results, elapsed, fallback, bot, watchdog = asyncio.run(run(args))
+    server.shutdown()
+
+    answered = [(latency, result) for latency, result in results if result is not None]
+    latencies = [latency for latency, _ in answered]
+    fallbacks = sum(1 for _, result in answered if (result[1] if isinstance(result, tuple) else result) == fallback)
+
+    print(f"📊 Сценарий: {args.clients} клиентов × {args.messages} сообщений ({args.target})")
+    print(f"⏱️ Время прогона: {elapsed:.2f} с")
+    print(f"📨 Сообщений: {len(results)}, ответов: {len(answered)}, склеено: {len(results) - len(answered)}")
+    print(f"🤖 Запросов к LLM: {server.requests_served}")
+    print(f"🆘 Резервных ответов: {fallbacks}")
+    print(f"🚀 Пропускная способность: {len(results) / elapsed:.1f} сообщений/с")
+    print(f"📈 Задержка p50/p95/p99: {percentile(latencies, 0.5):.2f} / "
+          f"{percentile(latencies, 0.95):.2f} / {percentile(latencies, 0.99):.2f} с")
+
+    from vetbot_improved.services.llm_gateway import get_gateway
+    usage = get_gateway().usage
+    print(f"🧮 Токены: промпт {usage['prompt_tokens']}, ответ {usage['completion_tokens']}, "
+          f"из кэша {usage['cache_hit_tokens']}")
+
+    if bot is not None:
+        print(f"🚦 Планировщик: {bot.scheduler.stats()}")
+        print(f"🔌 Предохранитель: {bot.ai_breaker.state}, отсечено {bot.ai_breaker.short_circuited}")
+
+    blocks = LOOP_BLOCKS.value(process='load_test')
+    print(f"🐢 Цикл событий: макс. лаг {watchdog.max_lag * 1000:.0f} мс, блокировок {blocks:.0f}")
+    for block in watchdog.blocks[-3:]:
+        where = ''.join(block['stack'].splitlines(keepends=True)[-2:])
+        print(f"   {block['duration'] * 1000:.0f} мс:\n{where.rstrip()}")
+    if args.max_loop_blocks is not None and blocks > args.max_loop_blocks:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,192 @@
+"""
+Хранилище фотографий врачей с дедупликацией по содержимому и миниатюрами
+"""
+
+import os
+import io
+import hashlib
+import logging
+import sqlite3
+import threading
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow не обязателен: миниатюру присылает сам Telegram
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+# Конфигурация
+MEDIA_DIR = os.getenv('MEDIA_DIR', 'doctor_photos')
+THUMBNAIL_SIZE = (160, 160)
+
+class MediaStore:
+    """Хранилище медиафайлов, адресуемых по SHA-256 содержимого"""
+
+    def __init__(self, base_dir=MEDIA_DIR, db_path='vetbot.db'):
+        self.base_dir = base_dir
+        self.db_path = db_path
+        # Кэш telegram file_id по пути файла, чтобы не ходить в БД на каждый просмотр
+        self._file_ids = {}
+        self._lock = threading.Lock()
+        self.init_database()
+
+    def init_database(self):
+        """Инициализация таблицы медиафайлов"""
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+
+        # content_hash пустой у файлов, сохраненных до появления хранилища
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS media_files (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                content_hash TEXT UNIQUE,
+                path TEXT UNIQUE NOT NULL,
+                thumb_path TEXT,
+                size INTEGER,
+                telegram_file_id TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+
+        conn.commit()
+        conn.close()
+
+    @staticmethod
+    def content_hash(data):
+        """SHA-256 содержимого файла"""
+        return hashlib.sha256(data).hexdigest()
+
+    def _path_for(self, content_hash, suffix=''):
+        """Путь файла внутри хранилища: два уровня каталогов по префиксу хэша"""
+        return os.path.join(self.base_dir, content_hash[:2], f"{content_hash}{suffix}.jpg")
+
+    @staticmethod
+    def _write_atomic(path, data):
+        """Записать файл атомарно, чтобы читатели не видели недописанный файл"""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp.{os.getpid()}.{threading.get_ident()}"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def make_thumbnail(data, size=THUMBNAIL_SIZE):
+        """Сделать JPEG-миниатюру (None, если Pillow не установлен)"""
+        if Image is None:
+            return None
+
+        try:
+            with Image.open(io.BytesIO(data)) as image:
+                image = image.convert('RGB')
+                image.thumbnail(size)
+                output = io.BytesIO()
+                image.save(output, format='JPEG', quality=80)
+                return output.getvalue()
+        except Exception as e:
+            logger.error(f"Error creating thumbnail: {e}")
+            return None
+
+    def save_photo(self, data, thumbnail=None, file_id=None):
+        """Сохранить фото и вернуть путь к нему
+
+        Одинаковые фото хранятся в одном файле. thumbnail - готовая миниатюра
+        (например, наименьший PhotoSize из Telegram), file_id - идентификатор,
+        по которому бот уже может отправить это фото без повторной загрузки.
+        """
+        data = bytes(data)
+        content_hash = self.content_hash(data)
+        path = self._path_for(content_hash)
+
+        if not os.path.exists(path):
+            self._write_atomic(path, data)
+
+        thumb_path = self._path_for(content_hash, '_thumb')
+        if not os.path.exists(thumb_path):
+            thumb_data = bytes(thumbnail) if thumbnail else self.make_thumbnail(data)
+            if thumb_data:
+                self._write_atomic(thumb_path, thumb_data)
+            else:
+                thumb_path = path
+
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+
+        try:
+            cursor.execute('''
+                INSERT INTO media_files (content_hash, path, thumb_path, size)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT(path) DO UPDATE SET thumb_path = excluded.thumb_path
+            ''', (content_hash, path, thumb_path, len(data)))
+
+            conn.commit()
+        except Exception as e:
+            logger.error(f"Error saving media file record: {e}")
+        finally:
+            conn.close()
+
+        if file_id:
+            self.remember_file_id(path, file_id)
+
+        return path
+
+    def get_file_id(self, path):
+        """Получить закэшированный telegram file_id для файла"""
+        with self._lock:
+            if path in self._file_ids:
+                return self._file_ids[path]
+
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+
+        cursor.execute('''
+            SELECT telegram_file_id FROM media_files WHERE path = ?
+        ''', (path,))
+
+        result = cursor.fetchone()
+        conn.close()
+
+        file_id = result[0] if result else None
+        if file_id:
+            with self._lock:
+                self._file_ids[path] = file_id
+        return file_id
+
+    def remember_file_id(self, path, file_id):
+        """Запомнить file_id после первой загрузки файла в Telegram"""
+        with self._lock:
+            self._file_ids[path] = file_id
+
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+
+        try:
+            cursor.execute('''
+                INSERT INTO media_files (path, telegram_file_id)
+                VALUES (?, ?)
+                ON CONFLICT(path) DO UPDATE SET telegram_file_id = excluded.telegram_file_id
+            ''', (path, file_id))
+
+            conn.commit()
+        except Exception as e:
+            logger.error(f"Error saving telegram file_id: {e}")
+        finally:
+            conn.close()
+
+    def thumbnail_path(self, path):
+        """Путь к миниатюре фото (или к самому фото, если миниатюры нет)"""
+        if not path:
+            return None
+
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+
+        cursor.execute('''
+            SELECT thumb_path FROM media_files WHERE path = ?
+        ''', (path,))
+
+        result = cursor.fetchone()
+        conn.close()
+
+        thumb_path = result[0] if result and result[0] else path
+        return thumb_path if os.path.exists(thumb_path) else None
@@ -0,0 +1,168 @@
+"""
+Журнал сообщений консультаций с отложенной пакетной записью
+
+Сообщения, пересылаемые между клиентом и врачом, не пишутся в
+consultation_messages по одному: они копятся в памяти и сбрасываются
+фоновым потоком одной транзакцией - когда набралось MESSAGE_LOG_BATCH
+сообщений или прошло MESSAGE_LOG_FLUSH_MS миллисекунд с первого из них.
+База переводится в режим WAL с synchronous=NORMAL, поэтому групповая
+фиксация не ждет fsync на каждое сообщение, а при падении процесса база
+остается целостной. При остановке бота буфер сбрасывается (close() и atexit);
+при жестком падении теряется не более последних MESSAGE_LOG_FLUSH_MS мс.
+"""
+
+import os
+import time
+import atexit
+import sqlite3
+import logging
+import threading
+from vetbot_improved.utils.metrics import DB_QUERY_SECONDS, QUEUE_DEPTH
+from vetbot_improved.utils.tracing import current_trace_id
+
+logger = logging.getLogger(__name__)
+
+# Конфигурация
+MESSAGE_LOG_BATCH = int(os.getenv('MESSAGE_LOG_BATCH', '100'))
+MESSAGE_LOG_FLUSH_MS = float(os.getenv('MESSAGE_LOG_FLUSH_MS', '5'))
+
+class MessageLog:
+    """Буфер записи consultation_messages
+
+    append() только кладет сообщение в буфер и не блокирует обработчик
+    Telegram. Обработчики on_flush(conn, rows) выполняются в транзакции
+    сброса - так вместе с сообщениями фиксируется связанный учет. Вместе с
+    сообщением сохраняется trace_id трассы обработчика, который его передал.
+    """
+
+    def __init__(self, db_path='vetbot.db', batch_size=MESSAGE_LOG_BATCH, flush_ms=MESSAGE_LOG_FLUSH_MS):
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.flush_interval = flush_ms / 1000
+        self._buffer = []
+        self._hooks = []
+        self._condition = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._closed = False
+        self._wal = False
+        self._schema_checked = False
+
+    def on_flush(self, hook):
+        """Учет в транзакции сброса: hook(conn, rows), rows - словари сообщений"""
+        self._hooks.append(hook)
+
+    def append(self, consultation_id, sender_type, sender_id, sender_name, message_text, telegram_message_id=None):
+        """Добавить сообщение в буфер"""
+        row = {
+            'consultation_id': consultation_id,
+            'sender_type': sender_type,
+            'sender_id': sender_id,
+            'sender_name': sender_name,
+            'message_text': message_text,
+            'sent_at': time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime()),
+            'telegram_message_id': telegram_message_id,
+            'trace_id': current_trace_id(),
+        }
+
+        with self._condition:
+            if self._closed:
+                # После остановки пишем сразу, чтобы не потерять сообщение
+                self._buffer.append(row)
+            else:
+                self._start()
+                self._buffer.append(row)
+                self._condition.notify()
+                return
+
+        self.flush()
+
+    def _start(self):
+        if self._thread is None:
+            QUEUE_DEPTH.set_function(self.pending, queue='message_log')
+            self._thread = threading.Thread(target=self._run, name='message-log', daemon=True)
+            self._thread.start()
+            atexit.register(self.close)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._buffer and not self._closed:
+                    self._condition.wait()
+                if self._closed:
+                    break
+                # Ждем добора пачки не дольше flush_interval с первого сообщения
+                deadline = time.monotonic() + self.flush_interval
+                while len(self._buffer) < self.batch_size and not self._closed:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Message log flush failed: {e}")
+                time.sleep(self.flush_interval)
+
+    def flush(self):
+        """Записать буфер одной транзакцией; возвращает число записанных сообщений"""
+        with self._flush_lock:
+            with self._condition:
+                rows, self._buffer = self._buffer, []
+            if not rows:
+                return 0
+
+            started = time.perf_counter()
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            try:
+                if not self._wal:
+                    # Режим WAL сохраняется в файле базы и действует для всех процессов
+                    conn.execute('PRAGMA journal_mode=WAL')
+                    self._wal = True
+                conn.execute('PRAGMA synchronous=NORMAL')
+                self._ensure_schema(conn)
+                for row in rows:
+                    cursor = conn.execute('''
+                        INSERT INTO consultation_messages
+                        (consultation_id, sender_type, sender_id, sender_name, message_text, sent_at, telegram_message_id, trace_id)
+                        VALUES (:consultation_id, :sender_type, :sender_id, :sender_name, :message_text, :sent_at, :telegram_message_id, :trace_id)
+                    ''', row)
+                    row['id'] = cursor.lastrowid
+                for hook in self._hooks:
+                    hook(conn, rows)
+                conn.commit()
+                DB_QUERY_SECONDS.observe(time.perf_counter() - started, query='message_log_flush')
+            except Exception:
+                conn.rollback()
+                # Сообщения возвращаются в начало буфера до следующей попытки
+                with self._condition:
+                    self._buffer[:0] = rows
+                raise
+            finally:
+                conn.close()
+
+            return len(rows)
+
+    def _ensure_schema(self, conn):
+        # Базы, созданные до трассировки, получают колонку trace_id
+        if self._schema_checked:
+            return
+        columns = {row[1] for row in conn.execute('PRAGMA table_info(consultation_messages)')}
+        if 'trace_id' not in columns:
+            conn.execute('ALTER TABLE consultation_messages ADD COLUMN trace_id TEXT')
+        self._schema_checked = True
+
+    def pending(self):
+        """Число сообщений, еще не записанных в базу"""
+        with self._condition:
+            return len(self._buffer)
+
+    def close(self):
+        """Остановить фоновый поток и сбросить остаток буфера"""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout=5)
+        self.flush()
@@ -4,35 +4,103 @@
 
 import os
 import json
+import time
 import logging
 import sqlite3
 import asyncio
-import requests
 from datetime import datetime
+from collections.abc import Mapping
 from telegram import Bot, InlineKeyboardButton, InlineKeyboardMarkup
 from dotenv import load_dotenv
+from event_bus import EventBus
+from telegram_outbox import TelegramOutbox, OutboxRelay
+from doctor_routing import DoctorRouter
+from sla_scheduler import SLAScheduler
+from message_log import MessageLog
+from vetbot_improved.utils.metrics import DB_QUERY_SECONDS, DB_LOCK_WAIT_SECONDS, DB_LOCK_TIMEOUTS
+from vetbot_improved.utils.tracing import TracedRequest
 
 # Загрузка переменных окружения
 load_dotenv()
 
-# Настройка логирования
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
 logger = logging.getLogger(__name__)
 
 # Конфигурация
 MAIN_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
 VET_BOT_TOKEN = os.getenv('VET_BOT_TOKEN')
+# Адрес Bot API (в бенчмарке - локальная заглушка)
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL', 'https://api.telegram.org/bot')
+# Сколько секунд захват консультации ждет блокировку базы
+CLAIM_BUSY_TIMEOUT = float(os.getenv('CLAIM_BUSY_TIMEOUT', '2'))
+# SLA консультаций (секунды): ожидание врача и тишина в начатой консультации
+SLA_CLAIM_TIMEOUT = float(os.getenv('SLA_CLAIM_TIMEOUT', '900'))
+SLA_MAX_RENOTIFY = int(os.getenv('SLA_MAX_RENOTIFY', '3'))
+SLA_IDLE_TIMEOUT = float(os.getenv('SLA_IDLE_TIMEOUT', '7200'))
+
+class BotClients(Mapping):
+    """Клиенты Bot API по имени ('main', 'vet'); None - токен не задан
+    
+    Bot создается при первом обращении: модуль импортируется при каждом
+    запуске ботов, а HTTP-клиенты нужны только для первой отправки.
+    """
+    
+    def __init__(self, tokens):
+        self._tokens = tokens
+        self._bots = {}
+    
+    def __getitem__(self, name):
+        if name not in self._bots:
+            token = self._tokens[name]
+            self._bots[name] = Bot(
+                token=token, base_url=TELEGRAM_API_URL,
+                request=TracedRequest(bot_name=name), get_updates_request=TracedRequest(bot_name=name)
+            ) if token else None
+        return self._bots[name]
+    
+    def __setitem__(self, name, bot):
+        """Подставить готовый клиент вместо создаваемого по токену"""
+        self._bots[name] = bot
+    
+    def __iter__(self):
+        return iter(self._tokens)
+    
+    def __len__(self):
+        return len(self._tokens)
 
 class NotificationSystem:
     """Система уведомлений между ботами"""
     
     def __init__(self, db_path='vetbot.db'):
         self.db_path = db_path
-        self.main_bot = Bot(token=MAIN_BOT_TOKEN) if MAIN_BOT_TOKEN else None
-        self.vet_bot = Bot(token=VET_BOT_TOKEN) if VET_BOT_TOKEN else None
+        self.bots = BotClients({'main': MAIN_BOT_TOKEN, 'vet': VET_BOT_TOKEN})
+        self.events = EventBus(db_path)
+        self.outbox = TelegramOutbox(db_path)
+        self.router = DoctorRouter(db_path)
+        self.timers = SLAScheduler(db_path)
+        self.messages = MessageLog(db_path)
+        self.messages.on_flush(self.record_relayed_messages)
+    
+    @property
+    def main_bot(self):
+        return self.bots['main']
+    
+    @main_bot.setter
+    def main_bot(self, bot):
+        self.bots['main'] = bot
+    
+    @property
+    def vet_bot(self):
+        return self.bots['vet']
+    
+    @vet_bot.setter
+    def vet_bot(self, bot):
+        self.bots['vet'] = bot
+    
+    def create_outbox_relay(self):
+        """Relay для доставки outbox через ботов системы"""
+        relay = OutboxRelay(self.outbox, self.bots)
+        relay.on_sent('doctor_notification', self.record_doctor_notification)
+        return relay
     
     def get_approved_doctors(self):
         """Получить список одобренных врачей"""
@@ -62,6 +130,12 @@ class NotificationSystem:
             ''', (client_id, client_username, client_name, initial_message))
             
             consultation_id = cursor.lastrowid
+            self.timers.schedule('consultation.unclaimed', consultation_id, SLA_CLAIM_TIMEOUT, conn=conn)
+            self.events.publish('consultation.created', {
+                'consultation_id': consultation_id,
+                'client_id': client_id,
+                'client_name': client_name,
+            }, conn=conn)
             conn.commit()
             return consultation_id
         except Exception as e:
@@ -71,16 +145,166 @@ class NotificationSystem:
             conn.close()
     
     async def notify_doctors_about_client(self, consultation_id, client_name, initial_message):
-        """Уведомить всех врачей о новом клиенте"""
+        """Уведомить врачей о новом клиенте
+        
+        Уведомление получают наименее загруженные врачи (см. DoctorRouter);
+        если клиента не возьмут, таймер consultation.escalate оповестит
+        следующих. Уведомления ставятся в outbox и отправляются relay-циклом;
+        message_id сохраняется в doctor_notifications при отправке.
+        """
         if not self.vet_bot:
             logger.error("VET_BOT_TOKEN not configured")
             return False
         
-        doctors = self.get_approved_doctors()
-        if not doctors:
-            logger.warning("No approved doctors found")
+        conn = sqlite3.connect(self.db_path)
+        
+        try:
+            doctors = self.router.select(conn, consultation_id)
+            if not doctors:
+                logger.warning("No approved doctors found")
+                conn.rollback()
+                return False
+            
+            self.queue_doctor_notifications(conn, consultation_id, client_name, initial_message, doctors)
+            self.timers.schedule('consultation.escalate', consultation_id, self.router.timeout, conn=conn)
+            conn.commit()
+            logger.info(f"Notifications about consultation {consultation_id} queued for {len(doctors)} doctors",
+                        extra={'consultation_id': consultation_id})
+            return True
+        except Exception as e:
+            logger.error(f"Failed to queue doctor notifications: {e}")
             return False
+        finally:
+            conn.close()
+    
+    def escalate_consultation(self, consultation_id):
+        """Оповестить следующую волну врачей о клиенте, которого еще не взяли
+        
+        Возвращает число оповещенных врачей (0 - клиента взяли или
+        оповещены все).
+        """
+        conn = sqlite3.connect(self.db_path)
+        
+        try:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT client_name, initial_message FROM active_consultations
+                WHERE id = ? AND status = 'waiting'
+            ''', (consultation_id,))
+            
+            consultation_row = cursor.fetchone()
+            if not consultation_row:
+                return 0
+            
+            doctors = self.router.select(conn, consultation_id)
+            self.queue_doctor_notifications(conn, consultation_id, *consultation_row, doctors)
+            conn.commit()
+            
+            if doctors:
+                logger.info(f"Consultation {consultation_id} escalated to {len(doctors)} more doctors",
+                            extra={'consultation_id': consultation_id})
+            return len(doctors)
+        finally:
+            conn.close()
+    
+    def renotify_unclaimed(self, consultation_id, fired=0):
+        """SLA ожидания врача нарушено: повторно оповестить всех врачей
+        
+        При первом нарушении клиенту сообщается, что врачи заняты.
+        Возвращает задержку до следующего повтора или None.
+        """
+        conn = sqlite3.connect(self.db_path)
+        
+        try:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT client_id, client_name, initial_message FROM active_consultations
+                WHERE id = ? AND status = 'waiting'
+            ''', (consultation_id,))
+            
+            consultation_row = cursor.fetchone()
+            if not consultation_row:
+                return None
+            
+            client_id, client_name, initial_message = consultation_row
+            doctors = self.router.rank(conn)
+            self.queue_doctor_notifications(conn, consultation_id, client_name, initial_message, doctors,
+                                            repeat=fired + 1)
+            
+            self.outbox.enqueue(conn, 'main', 'send_message', {
+                'chat_id': client_id,
+                'text': "⏳ Все врачи сейчас заняты. Ваш вопрос остается в очереди - "
+                        "врач подключится, как только освободится."
+            }, dedup_key=f"unclaimed:{consultation_id}")
+            conn.commit()
+            
+            logger.warning(f"Consultation {consultation_id} unclaimed for too long, {len(doctors)} doctors re-notified")
+        finally:
+            conn.close()
+        
+        return SLA_CLAIM_TIMEOUT if fired + 1 < SLA_MAX_RENOTIFY else None
+    
+    def complete_idle_consultation(self, consultation_id, fired=0):
+        """Завершить консультацию, в которой давно нет сообщений"""
+        conn = sqlite3.connect(self.db_path)
+        
+        try:
+            cursor = conn.cursor()
+            cursor.execute('''
+                UPDATE active_consultations SET status = 'completed'
+                WHERE id = ? AND status IN ('assigned', 'active')
+                RETURNING client_id, doctor_id
+            ''', (consultation_id,))
+            
+            completed = cursor.fetchone()
+            if not completed:
+                conn.rollback()
+                return None
+            
+            client_id, doctor_id = completed
+            hours = round(SLA_IDLE_TIMEOUT / 3600, 1)
+            
+            self.outbox.enqueue(conn, 'main', 'send_message', {
+                'chat_id': client_id,
+                'text': "✅ Консультация с врачом завершена: давно не было сообщений.\n\n"
+                        "Если остались вопросы - просто напишите, и мы продолжим."
+            }, dedup_key=f"idle_completed:{consultation_id}:client")
+            
+            cursor.execute('SELECT telegram_id FROM doctors WHERE id = ?', (doctor_id,))
+            doctor_row = cursor.fetchone()
+            if doctor_row:
+                self.outbox.enqueue(conn, 'vet', 'send_message', {
+                    'chat_id': doctor_row[0],
+                    'text': f"📋 Консультация #{consultation_id} завершена автоматически: "
+                            f"нет сообщений {hours:g} ч."
+                }, dedup_key=f"idle_completed:{consultation_id}:doctor")
+            
+            self.events.publish('consultation.completed', {
+                'consultation_id': consultation_id,
+                'reason': 'idle',
+            }, conn=conn)
+            conn.commit()
+            
+            logger.info(f"Consultation {consultation_id} completed after {hours:g} h of inactivity",
+                        extra={'consultation_id': consultation_id})
+        finally:
+            conn.close()
+        
+        return None
+    
+    def create_sla_scheduler(self):
+        """Планировщик SLA-таймеров консультаций с обработчиками системы"""
+        self.timers.on('consultation.escalate',
+                       lambda consultation_id, fired: self.router.timeout if self.escalate_consultation(consultation_id) else None)
+        self.timers.on('consultation.unclaimed', self.renotify_unclaimed)
+        self.timers.on('consultation.idle', self.complete_idle_consultation)
+        return self.timers
+    
+    def queue_doctor_notifications(self, conn, consultation_id, client_name, initial_message, doctors, repeat=0):
+        """Поставить в outbox уведомления о клиенте для врачей doctors
         
+        repeat - номер повторного оповещения (0 - первое).
+        """
         # Создаем кнопку для взятия клиента
         keyboard = [
             [InlineKeyboardButton("👨‍⚕️ Взять клиента", callback_data=f"take_client_{consultation_id}")]
@@ -88,7 +312,7 @@ class NotificationSystem:
         reply_markup = InlineKeyboardMarkup(keyboard)
         
         notification_text = f"""
-🔔 **Новый клиент ждет консультации!**
+🔔 **{'Клиент все еще ждет консультации!' if repeat else 'Новый клиент ждет консультации!'}**
 
 👤 **Клиент:** {client_name}
 💬 **Вопрос:** {initial_message[:200]}{'...' if len(initial_message) > 200 else ''}
@@ -97,61 +321,58 @@ class NotificationSystem:
 Кто первый нажмет кнопку - за тем закрепится клиент.
         """
         
-        successful_notifications = 0
-        
-        # Отправляем уведомления всем врачам
-        for doctor_telegram_id, doctor_name in doctors:
-            try:
-                message = await self.vet_bot.send_message(
-                    chat_id=doctor_telegram_id,
-                    text=notification_text,
-                    reply_markup=reply_markup,
-                    parse_mode='Markdown'
-                )
-                
-                # Сохраняем уведомление в базу данных
-                self.save_doctor_notification(consultation_id, doctor_telegram_id, message.message_id)
-                successful_notifications += 1
-                
-                logger.info(f"Notification sent to doctor {doctor_name} ({doctor_telegram_id})")
-                
-            except Exception as e:
-                logger.error(f"Failed to send notification to doctor {doctor_name}: {e}")
-        
-        return successful_notifications > 0
+        for doctor in doctors:
+            self.outbox.enqueue(conn, 'vet', 'send_message', {
+                'chat_id': doctor['telegram_id'],
+                'text': notification_text,
+                'reply_markup': reply_markup.to_dict(),
+                'parse_mode': 'Markdown'
+            }, dedup_key=f"notify:{consultation_id}:{doctor['telegram_id']}" + (f":{repeat}" if repeat else ''),
+               kind='doctor_notification',
+               ref={'consultation_id': consultation_id, 'doctor_telegram_id': doctor['telegram_id']})
     
-    def save_doctor_notification(self, consultation_id, doctor_telegram_id, message_id):
-        """Сохранить уведомление врача в базу данных"""
-        conn = sqlite3.connect(self.db_path)
+    def record_doctor_notification(self, conn, ref, message_id):
+        """Учет отправленного уведомления врачу (в транзакции отметки outbox)"""
         cursor = conn.cursor()
+        cursor.execute('''
+            INSERT INTO doctor_notifications (consultation_id, doctor_id, message_id)
+            SELECT ?, id, ? FROM doctors WHERE telegram_id = ?
+        ''', (ref['consultation_id'], message_id, ref['doctor_telegram_id']))
         
-        try:
-            # Получаем ID врача по telegram_id
-            cursor.execute('SELECT id FROM doctors WHERE telegram_id = ?', (doctor_telegram_id,))
-            doctor_row = cursor.fetchone()
-            
-            if doctor_row:
-                doctor_id = doctor_row[0]
-                cursor.execute('''
-                    INSERT INTO doctor_notifications 
-                    (consultation_id, doctor_id, message_id)
-                    VALUES (?, ?, ?)
-                ''', (consultation_id, doctor_id, message_id))
-                
-                conn.commit()
-        except Exception as e:
-            logger.error(f"Error saving doctor notification: {e}")
-        finally:
-            conn.close()
+        # Клиента взяли, пока уведомление было в пути - сразу правим и его
+        cursor.execute('''
+            SELECT ac.status, d.full_name, d.telegram_id
+            FROM active_consultations ac
+            LEFT JOIN doctors d ON ac.doctor_id = d.id
+            WHERE ac.id = ?
+        ''', (ref['consultation_id'],))
+        
+        row = cursor.fetchone()
+        if row and row[0] != 'waiting' and row[2] is not None:
+            self.queue_client_taken_edits(conn, ref['consultation_id'], row[1], row[2])
     
     async def assign_doctor_to_consultation(self, consultation_id, doctor_telegram_id):
         """Назначить врача на консультацию"""
-        conn = sqlite3.connect(self.db_path)
+        # Захват ждет блокировку SQLite до CLAIM_BUSY_TIMEOUT - не в цикле событий бота
+        return await asyncio.to_thread(self.claim_consultation, consultation_id, doctor_telegram_id)
+    
+    def claim_consultation(self, consultation_id, doctor_telegram_id):
+        """Атомарно закрепить консультацию за врачом
+        
+        Захват - одна инструкция UPDATE ... RETURNING в транзакции
+        BEGIN IMMEDIATE: блокировка на запись берется сразу, поэтому из
+        одновременных нажатий "Взять клиента" побеждает ровно одно, а
+        остальные ждут не дольше CLAIM_BUSY_TIMEOUT. В той же транзакции
+        правки уведомлений других врачей и сообщение клиенту ставятся в outbox.
+        """
+        conn = sqlite3.connect(self.db_path, timeout=CLAIM_BUSY_TIMEOUT, isolation_level=None)
         cursor = conn.cursor()
         
         try:
-            # Получаем ID врача
-            cursor.execute('SELECT id, full_name FROM doctors WHERE telegram_id = ?', (doctor_telegram_id,))
+            # Данные врача читаем до захвата блокировки
+            cursor.execute('''
+                SELECT id, full_name FROM doctors WHERE telegram_id = ? AND is_approved = 1
+            ''', (doctor_telegram_id,))
             doctor_row = cursor.fetchone()
             
             if not doctor_row:
@@ -159,95 +380,104 @@ class NotificationSystem:
             
             doctor_id, doctor_name = doctor_row
             
-            # Проверяем, что консультация еще не назначена
+            # Время захвата включает ожидание блокировки на запись
+            started = time.perf_counter()
+            cursor.execute('BEGIN IMMEDIATE')
+            DB_LOCK_WAIT_SECONDS.observe(time.perf_counter() - started, query='consultation_claim')
             cursor.execute('''
-                SELECT status FROM active_consultations WHERE id = ?
-            ''', (consultation_id,))
-            
-            consultation_row = cursor.fetchone()
-            if not consultation_row:
-                return False, "Консультация не найдена"
+                UPDATE active_consultations
+                SET doctor_id = ?, status = 'assigned'
+                WHERE id = ? AND status = 'waiting'
+                RETURNING client_id
+            ''', (doctor_id, consultation_id))
+            claimed = cursor.fetchone()
             
-            if consultation_row[0] != 'waiting':
+            if not claimed:
+                cursor.execute('ROLLBACK')
+                cursor.execute('SELECT 1 FROM active_consultations WHERE id = ?', (consultation_id,))
+                if not cursor.fetchone():
+                    return False, "Консультация не найдена"
                 return False, "Консультация уже назначена другому врачу"
             
-            # Назначаем врача
+            client_id = claimed[0]
+            self.router.record_claim(conn, consultation_id, doctor_id)
+            self.timers.cancel('consultation.unclaimed', consultation_id, conn=conn)
+            self.timers.cancel('consultation.escalate', consultation_id, conn=conn)
+            self.timers.schedule('consultation.idle', consultation_id, SLA_IDLE_TIMEOUT, conn=conn)
+            
+            # Отмечаем уведомление как отвеченное
             cursor.execute('''
-                UPDATE active_consultations 
-                SET doctor_id = ?, status = 'assigned'
-                WHERE id = ? AND status = 'waiting'
-            ''', (doctor_id, consultation_id))
+                UPDATE doctor_notifications
+                SET is_responded = 1
+                WHERE consultation_id = ? AND doctor_id = ?
+            ''', (consultation_id, doctor_id))
             
-            if cursor.rowcount > 0:
-                conn.commit()
-                
-                # Отмечаем уведомление как отвеченное
-                cursor.execute('''
-                    UPDATE doctor_notifications 
-                    SET is_responded = 1
-                    WHERE consultation_id = ? AND doctor_id = ?
-                ''', (consultation_id, doctor_id))
-                
-                conn.commit()
-                
-                # Уведомляем других врачей, что клиент занят
-                await self.notify_other_doctors_client_taken(consultation_id, doctor_name, doctor_telegram_id)
-                
-                return True, f"Консультация назначена врачу {doctor_name}"
-            else:
-                return False, "Не удалось назначить консультацию"
-                
+            # Уведомляем других врачей, что клиент занят
+            self.queue_client_taken_edits(conn, consultation_id, doctor_name, doctor_telegram_id)
+            
+            # Уведомляем клиента о подключении врача
+            self.outbox.enqueue(conn, 'main', 'send_message', {
+                'chat_id': client_id,
+                'text': f"👨‍⚕️ **Врач {doctor_name}:**\n\n"
+                        f"👨‍⚕️ К диалогу подключился врач **{doctor_name}**!\n\n"
+                        "Теперь вы можете задавать вопросы напрямую врачу. "
+                        "Все ваши сообщения будут переданы врачу, а ответы врача - вам.",
+                'parse_mode': 'Markdown'
+            }, dedup_key=f"doctor_joined:{consultation_id}")
+            
+            self.events.publish('consultation.assigned', {
+                'consultation_id': consultation_id,
+                'doctor_id': doctor_id,
+                'doctor_telegram_id': doctor_telegram_id,
+                'doctor_name': doctor_name,
+            }, conn=conn)
+            cursor.execute('COMMIT')
+            DB_QUERY_SECONDS.observe(time.perf_counter() - started, query='consultation_claim')
+            
+            return True, f"Консультация назначена врачу {doctor_name}"
+        
+        except sqlite3.OperationalError as e:
+            if conn.in_transaction:
+                conn.rollback()
+            if 'locked' in str(e):
+                DB_LOCK_TIMEOUTS.inc(query='consultation_claim')
+            logger.warning(f"Consultation {consultation_id} claim by {doctor_telegram_id} failed: {e}")
+            return False, "База данных занята, попробуйте еще раз"
         except Exception as e:
+            if conn.in_transaction:
+                conn.rollback()
             logger.error(f"Error assigning doctor to consultation: {e}")
             return False, f"Ошибка: {e}"
         finally:
             conn.close()
     
-    async def notify_other_doctors_client_taken(self, consultation_id, assigned_doctor_name, assigned_doctor_telegram_id):
-        """Уведомить других врачей, что клиент уже взят"""
-        if not self.vet_bot:
-            return
-        
-        conn = sqlite3.connect(self.db_path)
+    def queue_client_taken_edits(self, conn, consultation_id, assigned_doctor_name, assigned_doctor_telegram_id):
+        """Поставить в outbox правки уведомлений других врачей: клиент уже взят"""
         cursor = conn.cursor()
         
-        try:
-            # Получаем всех врачей, которым было отправлено уведомление
-            cursor.execute('''
-                SELECT dn.doctor_id, dn.message_id, d.telegram_id, d.full_name
-                FROM doctor_notifications dn
-                JOIN doctors d ON dn.doctor_id = d.id
-                WHERE dn.consultation_id = ? AND dn.is_responded = 0 AND d.telegram_id != ?
-            ''', (consultation_id, assigned_doctor_telegram_id))
-            
-            notifications = cursor.fetchall()
-            
-            for doctor_id, message_id, doctor_telegram_id, doctor_name in notifications:
-                try:
-                    # Редактируем сообщение
-                    await self.vet_bot.edit_message_text(
-                        chat_id=doctor_telegram_id,
-                        message_id=message_id,
-                        text=f"❌ **Клиент уже взят**\n\n👨‍⚕️ Врач: {assigned_doctor_name}\n⏰ Время: {datetime.now().strftime('%H:%M')}",
-                        parse_mode='Markdown'
-                    )
-                    
-                    # Отмечаем уведомление как отвеченное
-                    cursor.execute('''
-                        UPDATE doctor_notifications 
-                        SET is_responded = 1
-                        WHERE id = (SELECT id FROM doctor_notifications WHERE consultation_id = ? AND doctor_id = ? LIMIT 1)
-                    ''', (consultation_id, doctor_id))
-                    
-                except Exception as e:
-                    logger.error(f"Failed to update notification for doctor {doctor_name}: {e}")
-            
-            conn.commit()
+        # Еще не отправленные уведомления отменяем
+        self.outbox.cancel(conn, f"notify:{consultation_id}:")
+        
+        # Получаем всех врачей, которым было отправлено уведомление
+        cursor.execute('''
+            SELECT dn.id, dn.message_id, d.telegram_id
+            FROM doctor_notifications dn
+            JOIN doctors d ON dn.doctor_id = d.id
+            WHERE dn.consultation_id = ? AND dn.is_responded = 0 AND d.telegram_id != ?
+        ''', (consultation_id, assigned_doctor_telegram_id))
+        
+        for notification_id, message_id, doctor_telegram_id in cursor.fetchall():
+            self.outbox.enqueue(conn, 'vet', 'edit_message_text', {
+                'chat_id': doctor_telegram_id,
+                'message_id': message_id,
+                'text': f"❌ **Клиент уже взят**\n\n👨‍⚕️ Врач: {assigned_doctor_name}\n⏰ Время: {datetime.now().strftime('%H:%M')}",
+                'parse_mode': 'Markdown'
+            }, dedup_key=f"client_taken:{consultation_id}:{doctor_telegram_id}")
             
-        except Exception as e:
-            logger.error(f"Error notifying other doctors: {e}")
-        finally:
-            conn.close()
+            # Отмечаем уведомление как отвеченное
+            cursor.execute('''
+                UPDATE doctor_notifications SET is_responded = 1 WHERE id = ?
+            ''', (notification_id,))
     
     async def send_message_to_client(self, client_id, message_text, from_doctor=None):
         """Отправить сообщение клиенту от врача"""
@@ -303,30 +533,64 @@ class NotificationSystem:
         
         result = cursor.fetchone()
         conn.close()
-        return result
+        
+        if result:
+            # Схема active_consultations зависит от того, какой бот создал
+            # таблицу первым, поэтому имена колонок - из курсора
+            columns = [column[0] for column in cursor.description]
+            return dict(zip(columns, result))
+        return None
     
     def add_consultation_message(self, consultation_id, sender_type, sender_id, sender_name, message_text, telegram_message_id=None):
-        """Добавить сообщение в консультацию"""
-        conn = sqlite3.connect(self.db_path)
+        """Добавить сообщение в консультацию
+        
+        Сообщение попадает в буфер журнала и записывается групповой
+        фиксацией через несколько миллисекунд (см. MessageLog).
+        """
+        self.messages.append(consultation_id, sender_type, sender_id, sender_name, message_text, telegram_message_id)
+    
+    def record_relayed_messages(self, conn, rows):
+        """Учет записанных сообщений (в транзакции сброса журнала)"""
         cursor = conn.cursor()
         
-        try:
-            cursor.execute('''
-                INSERT INTO consultation_messages 
-                (consultation_id, sender_type, sender_id, sender_name, message_text, telegram_message_id)
-                VALUES (?, ?, ?, ?, ?, ?)
-            ''', (consultation_id, sender_type, sender_id, sender_name, message_text, telegram_message_id))
+        for row in rows:
+            if row['sender_type'] == 'doctor':
+                # Активность врача учитывается при выборе, кого оповещать
+                cursor.execute('''
+                    UPDATE doctors SET last_activity = CURRENT_TIMESTAMP WHERE telegram_id = ?
+                ''', (row['sender_id'],))
             
-            conn.commit()
-            return cursor.lastrowid
-        except Exception as e:
-            logger.error(f"Error adding consultation message: {e}")
-            return None
-        finally:
-            conn.close()
+            self.events.publish('message.relayed', {
+                'consultation_id': row['consultation_id'],
+                'message_id': row['id'],
+                'sender_type': row['sender_type'],
+                'sender_id': row['sender_id'],
+            }, conn=conn)
+        
+        # Новые сообщения отодвигают автозавершение консультации
+        for consultation_id in {row['consultation_id'] for row in rows}:
+            self.timers.schedule('consultation.idle', consultation_id, SLA_IDLE_TIMEOUT, conn=conn)
+    
+    def last_client_trace(self, consultation_id):
+        """trace_id последнего сообщения клиента в консультации"""
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        
+        cursor.execute('''
+            SELECT trace_id FROM consultation_messages
+            WHERE consultation_id = ? AND sender_type = 'client' AND trace_id IS NOT NULL
+            ORDER BY id DESC LIMIT 1
+        ''', (consultation_id,))
+        
+        result = cursor.fetchone()
+        conn.close()
+        return result[0] if result else None
     
     def get_consultation_history(self, consultation_id):
         """Получить историю сообщений консультации"""
+        # История должна включать сообщения, еще лежащие в буфере
+        self.messages.flush()
+        
         conn = sqlite3.connect(self.db_path)
         cursor = conn.cursor()
         
@@ -334,7 +598,7 @@ class NotificationSystem:
             SELECT sender_type, sender_name, message_text, sent_at
             FROM consultation_messages
             WHERE consultation_id = ?
-            ORDER BY sent_at ASC
+            ORDER BY sent_at ASC, id ASC
         ''', (consultation_id,))
         
         result = cursor.fetchall()
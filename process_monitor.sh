@@ -107,6 +107,11 @@ check_and_cleanup() {
 
 # Функция проверки основных сервисов
 check_services() {
+    # Под супервизором (start_all.py / start_with_admin.py) сервисы перезапускает он сам
+    if pgrep -f "start_all.py|start_with_admin.py" > /dev/null; then
+        return 0
+    fi
+
     # Проверка бота
     bot_running=$(ps aux | grep "bot\.py" | grep -v grep | wc -l)
     if [ "$bot_running" -eq 0 ]; then
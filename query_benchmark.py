@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Микробенчмарк SQL-запросов ботов и админ-панели на большой базе
+
+Вызывает настоящие методы VetBotDatabase, VetDoctorDatabase, VetDoctorBot,
+NotificationSystem, DoctorRouter, ConversationContext, ConsultationHistory
+и VetBotAdmin (если установлены streamlit и pandas) с аргументами из базы:
+обычные клиенты, врачи и консультации вперемешку с самыми "тяжелыми".
+Для каждого запроса - p50/p99/max и число строк результата (пустой
+результат на заполненной базе - признак ошибки в SQL).
+
+Один дополнительный вызов каждого метода проходит с трассировкой
+соединений SQLite: для всех его SELECT снимается EXPLAIN QUERY PLAN, и
+полный просмотр (без индекса) таблицы больше --scan-rows строк попадает
+в предупреждения.
+
+Пример:
+    python synthetic_data.py --db /tmp/big.db
+    python query_benchmark.py --db /tmp/big.db --repeat 50 --fail-on-scan
+"""
+
+import re
+import sys
+import json
+import time
+import random
+import sqlite3
+import argparse
+from contextlib import contextmanager
+
+from load_test import percentile
+
+# Доля вызовов с самыми нагруженными клиентами, врачами и консультациями
+HEAVY_SHARE = 0.2
+HEAVY_POOL = 100
+
+class Samples:
+    """Аргументы запросов: случайные и самые "тяжелые" объекты базы"""
+
+    def __init__(self, db_path, rng):
+        self.rng = rng
+        conn = sqlite3.connect(db_path)
+        self.users = [row[0] for row in conn.execute('SELECT user_id FROM users')]
+        self.heavy_users = [row[0] for row in conn.execute('''
+            SELECT user_id FROM consultations GROUP BY user_id ORDER BY COUNT(*) DESC LIMIT ?
+        ''', (HEAVY_POOL,))]
+        self.doctors = [row for row in conn.execute('SELECT id, telegram_id FROM doctors WHERE is_approved = 1')]
+        self.heavy_doctors = [row for row in conn.execute('''
+            SELECT d.id, d.telegram_id FROM active_consultations ac JOIN doctors d ON d.id = ac.doctor_id
+            GROUP BY d.id ORDER BY COUNT(*) DESC LIMIT ?
+        ''', (HEAVY_POOL,))]
+        self.dialogs = [row[0] for row in conn.execute('SELECT id FROM active_consultations')]
+        self.heavy_dialogs = [row[0] for row in conn.execute('''
+            SELECT consultation_id FROM consultation_messages GROUP BY consultation_id ORDER BY COUNT(*) DESC LIMIT ?
+        ''', (HEAVY_POOL,))]
+        conn.close()
+        if not (self.users and self.doctors and self.dialogs):
+            raise ValueError(f"{db_path}: нет клиентов, врачей или консультаций - сначала synthetic_data.py")
+
+    def _pick(self, common, heavy):
+        return self.rng.choice(heavy if heavy and self.rng.random() < HEAVY_SHARE else common)
+
+    def user(self):
+        return self._pick(self.users, self.heavy_users)
+
+    def doctor(self):
+        """(id, telegram_id) одобренного врача"""
+        return self._pick(self.doctors, self.heavy_doctors)
+
+    def dialog(self):
+        return self._pick(self.dialogs, self.heavy_dialogs)
+
+def bot_queries(db_path):
+    """Запросы основного бота, бота врачей и системы уведомлений"""
+    from enhanced_bot import VetBotDatabase
+    from vet_doctor_bot import VetDoctorDatabase, VetDoctorBot
+    from notification_system import NotificationSystem
+    from conversation_context import ConversationContext
+    from consultation_history import ConsultationHistory
+
+    db = VetBotDatabase(db_path)
+    doctor_db = VetDoctorDatabase(db_path)
+    # Методы бота врачей читают только self.db - Application не нужен
+    doctor_bot = VetDoctorBot.__new__(VetDoctorBot)
+    doctor_bot.db = doctor_db
+    notifications = NotificationSystem(db_path)
+    context = ConversationContext(db_path)
+    history = ConsultationHistory(db_path)
+
+    return {
+        'main_bot.is_admin_session_active': lambda s: db.is_admin_session_active(s.user()),
+        'main_bot.get_pending_admin_messages': lambda s: db.get_pending_admin_messages(s.user()),
+        'main_bot.get_user_calls': lambda s: db.get_user_calls(s.user()),
+        'main_bot.get_latest_call_urgency': lambda s: db.get_latest_call_urgency(s.user()),
+        'main_bot.get_active_consultation_by_client': lambda s: db.get_active_consultation_by_client(s.user()),
+        'main_bot.get_doctor_by_id': lambda s: db.get_doctor_by_id(s.doctor()[0]),
+        'context.recent_turns': lambda s: context.recent_turns(s.user()),
+        'doctor_bot.get_doctor': lambda s: doctor_db.get_doctor(s.doctor()[1]),
+        'doctor_bot.get_approved_doctors': lambda s: doctor_db.get_approved_doctors(),
+        'doctor_bot.get_doctor_active_consultation':
+            lambda s: doctor_bot.get_doctor_active_consultation(s.doctor()[0]),
+        'history.page': lambda s: history.page(s.dialog())[0],
+        'notifications.get_approved_doctors': lambda s: notifications.get_approved_doctors(),
+        'notifications.get_consultation_info': lambda s: notifications.get_consultation_info(s.dialog()),
+        'notifications.get_consultation_history': lambda s: notifications.get_consultation_history(s.dialog()),
+        'notifications.last_client_trace': lambda s: notifications.last_client_trace(s.dialog()),
+        'router.rank': lambda s: notifications.router.rank(),
+    }
+
+def admin_queries(db_path):
+    """Запросы админ-панели; None - если нет streamlit или pandas"""
+    try:
+        from admin_streamlit_enhanced import VetBotAdmin
+    except ImportError as e:
+        print(f"⚠️ Запросы админ-панели пропущены: {e}")
+        return None
+
+    admin = VetBotAdmin(db_path)
+    return {
+        'admin.get_statistics': lambda s: admin.get_statistics(),
+        'admin.get_recent_users': lambda s: admin.get_recent_users(10),
+        'admin.get_recent_consultations': lambda s: admin.get_recent_consultations(10),
+        'admin.get_vet_requests': lambda s: admin.get_vet_requests(20),
+        'admin.get_user_dialog': lambda s: admin.get_user_dialog(s.user()),
+        'admin.get_doctors': lambda s: admin.get_doctors(),
+        'admin.get_doctor_consultations': lambda s: admin.get_doctor_consultations(s.doctor()[0]),
+        'admin.get_active_consultations': lambda s: admin.get_active_consultations(),
+        'admin.get_available_doctors': lambda s: admin.get_available_doctors(),
+    }
+
+@contextmanager
+def traced_statements():
+    """Собрать SQL (с подставленными параметрами) всех соединений внутри блока"""
+    statements = []
+    connect = sqlite3.connect
+
+    def traced_connect(*args, **kwargs):
+        conn = connect(*args, **kwargs)
+        conn.set_trace_callback(statements.append)
+        return conn
+
+    sqlite3.connect = traced_connect
+    try:
+        yield statements
+    finally:
+        sqlite3.connect = connect
+
+def table_sizes(db_path):
+    """Число строк в каждой таблице"""
+    conn = sqlite3.connect(db_path)
+    tables = [row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+    sizes = {table: conn.execute(f'SELECT COUNT(*) FROM "{table}"').fetchone()[0] for table in tables}
+    conn.close()
+    return sizes
+
+def plan_warnings(db_path, statements, sizes, scan_rows):
+    """Полные просмотры больших таблиц без индекса в планах запросов"""
+    warnings = []
+    conn = sqlite3.connect(db_path)
+    for sql in statements:
+        if not sql.lstrip().upper().startswith(('SELECT', 'WITH')):
+            continue
+        plan = [row[3] for row in conn.execute(f'EXPLAIN QUERY PLAN {sql}')]
+        for detail in plan:
+            # SCAN ... USING INDEX - обход индекса, обычно до LIMIT
+            scan = re.fullmatch(r'SCAN (\w+)', detail)
+            if scan:
+                # В плане - псевдоним таблицы, если он задан в запросе
+                name = scan.group(1)
+                alias = re.search(rf'\b(\w+)\s+(?:AS\s+)?{name}\b', sql, re.IGNORECASE)
+                table = name if name in sizes else (alias.group(1) if alias else name)
+                if sizes.get(table, 0) > scan_rows:
+                    warnings.append(f"{detail} ({sizes[table]} строк)")
+    conn.close()
+    return sorted(set(warnings))
+
+def result_rows(result):
+    """Число строк результата метода"""
+    if result is None or result is False:
+        return 0
+    if hasattr(result, '__len__') and not isinstance(result, (str, tuple, dict)):
+        return len(result)
+    return 1
+
+def run(db_path, repeat=50, seed=0, scan_rows=10000, include_admin=True):
+    """Прогнать все запросы; возвращает {имя: статистика} по имени запроса"""
+    samples = Samples(db_path, random.Random(seed))
+    sizes = table_sizes(db_path)
+    queries = bot_queries(db_path)
+    admin = admin_queries(db_path) if include_admin else None
+    queries.update(admin or {})
+
+    results = {}
+    for name, query in queries.items():
+        # Первый вызов прогревает кэш страниц и заодно дает SQL для планов
+        with traced_statements() as statements:
+            rows = result_rows(query(samples))
+
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            query(samples)
+            timings.append(time.perf_counter() - started)
+
+        results[name] = {
+            'p50_ms': round(percentile(timings, 0.5) * 1000, 3),
+            'p99_ms': round(percentile(timings, 0.99) * 1000, 3),
+            'max_ms': round(max(timings) * 1000, 3) if timings else 0.0,
+            'rows': rows,
+            'warnings': plan_warnings(db_path, statements, sizes, scan_rows),
+        }
+    return results
+
+def print_report(results):
+    """Таблица результатов"""
+    print(f"{'Запрос':<48} {'p50, мс':>9} {'p99, мс':>9} {'max, мс':>9} {'строк':>7}")
+    for name, stats in sorted(results.items(), key=lambda item: -item[1]['p99_ms']):
+        print(f"{name:<48} {stats['p50_ms']:>9.2f} {stats['p99_ms']:>9.2f} {stats['max_ms']:>9.2f} {stats['rows']:>7}")
+        for warning in stats['warnings']:
+            print(f"    ⚠️ {warning}")
+
+def main():
+    """Точка входа"""
+    parser = argparse.ArgumentParser(description='Микробенчмарк SQL-запросов ботов и админ-панели')
+    parser.add_argument('--db', default='vetbot_synthetic.db', help='База из synthetic_data.py')
+    parser.add_argument('--repeat', type=int, default=50, help='Вызовов каждого запроса')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--scan-rows', type=int, default=10000,
+                        help='Полный просмотр таблицы больше стольких строк - предупреждение')
+    parser.add_argument('--no-admin', action='store_true', help='Без запросов админ-панели')
+    parser.add_argument('--output', help='Записать результаты в JSON')
+    parser.add_argument('--fail-on-scan', action='store_true', help='Код выхода 1, если есть предупреждения')
+    args = parser.parse_args()
+
+    try:
+        results = run(args.db, args.repeat, args.seed, args.scan_rows, include_admin=not args.no_admin)
+    except ValueError as e:
+        print(f"❌ {e}")
+        sys.exit(2)
+    print_report(results)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+    if args.fail_on_scan and any(stats['warnings'] for stats in results.values()):
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,208 @@
+"""
+Планировщик SLA-таймеров консультаций
+
+Таймеры хранятся в таблице sla_timers (вид, id объекта, срок в unix-времени)
+и переживают перезапуск ботов. Процесс-планировщик держит в памяти кучу
+только ближайших таймеров (на SLA_LOOKAHEAD секунд вперед), загружая их
+диапазонным запросом по индексу due_at; при изменении базы другим процессом
+(PRAGMA data_version) куча перечитывается.
+
+Обработчик таймера вызывается с id объекта и числом предыдущих
+срабатываний и возвращает задержку до следующего срабатывания в секундах
+или None, если таймер больше не нужен.
+"""
+
+import os
+import time
+import heapq
+import asyncio
+import sqlite3
+import logging
+import inspect
+from vetbot_improved.utils.metrics import DB_QUERY_SECONDS, QUEUE_DEPTH
+
+logger = logging.getLogger(__name__)
+
+# Конфигурация
+SLA_LOOKAHEAD = float(os.getenv('SLA_LOOKAHEAD', '300'))
+SLA_POLL_INTERVAL = float(os.getenv('SLA_POLL_INTERVAL', '1'))
+SLA_RETRY_DELAY = float(os.getenv('SLA_RETRY_DELAY', '60'))
+
+class SLAScheduler:
+    """Постоянные таймеры с обработчиками по виду таймера
+
+    schedule() и cancel() доступны любому процессу и могут выполняться в
+    транзакции изменения состояния; обработчики (on) и цикл run() работают
+    в одном процессе - основном боте.
+    """
+
+    def __init__(self, db_path='vetbot.db', lookahead=SLA_LOOKAHEAD, poll_interval=SLA_POLL_INTERVAL):
+        self.db_path = db_path
+        self.lookahead = lookahead
+        self.poll_interval = poll_interval
+        self._handlers = {}
+        self._heap = []
+        self._loaded_until = 0.0
+        self._initialized = False
+        self._running = False
+        QUEUE_DEPTH.set_function(lambda: len(self._heap), queue='sla_timers')
+
+    def init_database(self, conn=None):
+        """Таблица таймеров и индекс по сроку"""
+        own_conn = conn is None
+        if own_conn:
+            conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS sla_timers (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                kind TEXT NOT NULL,
+                ref_id INTEGER NOT NULL,
+                due_at REAL NOT NULL,
+                fired INTEGER DEFAULT 0,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                UNIQUE (kind, ref_id)
+            )
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_sla_timers_due
+            ON sla_timers (due_at)
+        ''')
+
+        if own_conn:
+            conn.commit()
+            conn.close()
+        self._initialized = True
+
+    def _ensure_database(self, conn=None):
+        if not self._initialized:
+            self.init_database(conn)
+
+    def schedule(self, kind, ref_id, delay, conn=None, keep_existing=False):
+        """Завести или перенести таймер kind для объекта ref_id через delay секунд
+
+        keep_existing=True не трогает уже заведенный таймер (для
+        периодических задач, которые заводятся при каждом запуске).
+        """
+        own_conn = conn is None
+        if own_conn:
+            conn = sqlite3.connect(self.db_path)
+
+        try:
+            self._ensure_database(conn)
+            conflict = 'NOTHING' if keep_existing else 'UPDATE SET due_at = excluded.due_at, fired = 0'
+            conn.execute(f'''
+                INSERT INTO sla_timers (kind, ref_id, due_at) VALUES (?, ?, ?)
+                ON CONFLICT(kind, ref_id) DO {conflict}
+            ''', (kind, ref_id, time.time() + delay))
+            if own_conn:
+                conn.commit()
+        finally:
+            if own_conn:
+                conn.close()
+
+    def cancel(self, kind, ref_id, conn=None):
+        """Отменить таймер"""
+        own_conn = conn is None
+        if own_conn:
+            conn = sqlite3.connect(self.db_path)
+
+        try:
+            self._ensure_database(conn)
+            conn.execute('DELETE FROM sla_timers WHERE kind = ? AND ref_id = ?', (kind, ref_id))
+            if own_conn:
+                conn.commit()
+        finally:
+            if own_conn:
+                conn.close()
+
+    def on(self, kind, handler):
+        """Обработчик таймеров вида kind: handler(ref_id, fired) -> задержка или None"""
+        self._handlers[kind] = handler
+
+    def load(self, now=None):
+        """Загрузить в кучу таймеры, срок которых наступит в пределах lookahead"""
+        self._ensure_database()
+        now = now if now is not None else time.time()
+        self._loaded_until = now + self.lookahead
+
+        conn = sqlite3.connect(self.db_path)
+        with DB_QUERY_SECONDS.time(query='sla_load'):
+            rows = conn.execute('''
+                SELECT due_at, id, kind, ref_id, fired FROM sla_timers
+                WHERE due_at <= ?
+                ORDER BY due_at
+            ''', (self._loaded_until,)).fetchall()
+        conn.close()
+
+        self._heap = rows
+        heapq.heapify(self._heap)
+        return len(rows)
+
+    def next_due(self):
+        """Срок ближайшего загруженного таймера или None"""
+        return self._heap[0][0] if self._heap else None
+
+    async def fire_due(self, now=None):
+        """Выполнить наступившие таймеры; возвращает число сработавших"""
+        now = now if now is not None else time.time()
+        fired = 0
+
+        while self._heap and self._heap[0][0] <= now:
+            due_at, timer_id, kind, ref_id, fired_before = heapq.heappop(self._heap)
+            handler = self._handlers.get(kind)
+            if handler is None:
+                continue
+
+            try:
+                delay = handler(ref_id, fired_before)
+                if inspect.isawaitable(delay):
+                    delay = await delay
+            except Exception as e:
+                logger.error(f"SLA timer {kind} #{ref_id} failed: {e}")
+                delay = SLA_RETRY_DELAY
+            fired += 1
+
+            # Условие по due_at: если таймер успели перенести (например, пришло
+            # новое сообщение), срабатывание его не затирает
+            conn = sqlite3.connect(self.db_path)
+            if delay is None:
+                conn.execute('DELETE FROM sla_timers WHERE id = ? AND due_at = ?', (timer_id, due_at))
+            else:
+                conn.execute('''
+                    UPDATE sla_timers SET due_at = ?, fired = fired + 1
+                    WHERE id = ? AND due_at = ?
+                ''', (time.time() + delay, timer_id, due_at))
+            conn.commit()
+            conn.close()
+
+        return fired
+
+    async def run(self):
+        """Цикл планировщика до вызова stop()"""
+        self._ensure_database()
+        self._running = True
+        watch = sqlite3.connect(self.db_path)
+        last_version = None
+
+        try:
+            while self._running:
+                try:
+                    version = watch.execute('PRAGMA data_version').fetchone()[0]
+                    if version != last_version or time.time() >= self._loaded_until:
+                        last_version = version
+                        self.load()
+                    await self.fire_due()
+                except sqlite3.Error as e:
+                    logger.error(f"SLA scheduler database error: {e}")
+
+                next_due = self.next_due()
+                sleep = self.poll_interval if next_due is None else min(self.poll_interval, max(0.0, next_due - time.time()))
+                await asyncio.sleep(sleep)
+        finally:
+            watch.close()
+
+    def stop(self):
+        """Остановить цикл run()"""
+        self._running = False
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Профиль холодного запуска процессов сервиса
+
+Каждая точка входа запускается в отдельном процессе - с пустым
+sys.modules, как при перезапуске супервизором - и замеряется:
+
+    - импорт модуля и разбивка python -X importtime: собственное время
+      самых медленных модулей и суммарное по пакетам верхнего уровня;
+    - создание объекта бота (EnhancedVetBot, VetDoctorBot) на новой базе
+      (первый запуск, схема создается) и на уже созданной (перезапуск -
+      DDL пропускается по версии схемы).
+
+Сетевые вызовы (getMe при инициализации Application) не входят в замер.
+
+Пример:
+    python startup_profile.py --process main_bot doctor_bot --top 10
+    python startup_profile.py --budget 1.0   # код 1, если перезапуск дольше секунды
+"""
+
+import os
+import sys
+import json
+import shutil
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# Процесс -> (модуль, класс, создаваемый при запуске, или None)
+ENTRY_POINTS = {
+    'main_bot': ('enhanced_bot', 'EnhancedVetBot'),
+    'doctor_bot': ('vet_doctor_bot', 'VetDoctorBot'),
+    'dispatcher': ('update_dispatcher', None),
+    'webapp': ('webapp_server', None),
+    'supervisor': ('supervisor', None),
+}
+
+# Выполняется в дочернем процессе: модуль, класс
+CHILD = '''
+import sys, json, time, importlib
+started = time.perf_counter()
+module = importlib.import_module(sys.argv[1])
+imported = time.perf_counter()
+if sys.argv[2]:
+    getattr(module, sys.argv[2])()
+print(json.dumps({"import_s": imported - started, "construct_s": time.perf_counter() - imported}))
+'''
+
+def parse_importtime(text):
+    """Строки -X importtime -> [(модуль, собственное время с, суммарное с)]"""
+    modules = []
+    for line in text.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue
+        modules.append((fields[2].strip(), int(fields[0]) / 1e6, int(fields[1]) / 1e6))
+    return modules
+
+def by_package(modules):
+    """Собственное время модулей, сложенное по пакету верхнего уровня"""
+    packages = {}
+    for name, own, _ in modules:
+        package = name.split('.')[0]
+        packages[package] = packages.get(package, 0.0) + own
+    return packages
+
+def run_child(process, workdir):
+    """Один запуск точки входа; возвращает замеры и модули из importtime"""
+    module, cls = ENTRY_POINTS[process]
+    env = dict(
+        os.environ,
+        PYTHONPATH=os.pathsep.join(filter(None, [ROOT, os.environ.get('PYTHONPATH')])),
+        # Клиенты Bot API создаются, но в сеть не ходят
+        TELEGRAM_BOT_TOKEN=os.environ.get('TELEGRAM_BOT_TOKEN', '1:PROFILE'),
+        VET_BOT_TOKEN=os.environ.get('VET_BOT_TOKEN', '2:PROFILE'),
+        METRICS_PORTS='', TRACE_EXPORT_PATH='',
+    )
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', CHILD, module, cls or ''],
+                            cwd=workdir, env=env, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"{process}: {result.stderr.strip().splitlines()[-1]}")
+    timings = json.loads(result.stdout.strip().splitlines()[-1])
+    return timings, parse_importtime(result.stderr)
+
+def profile(process, repeat=3, top=15, workdir=None):
+    """
+    Замеры запуска процесса
+
+    Первый запуск - на пустом каталоге (новая база), следующие repeat - в
+    том же каталоге, как перезапуск; по ним медианы и разбивка импорта.
+    """
+    own_workdir = workdir is None
+    if own_workdir:
+        workdir = tempfile.mkdtemp(prefix='vetbot-startup-')
+    try:
+        cold, _ = run_child(process, workdir)
+        warm = [run_child(process, workdir) for _ in range(max(repeat, 1))]
+    finally:
+        if own_workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    modules = warm[0][1]
+    packages = by_package(modules)
+    import_s = statistics.median(timings['import_s'] for timings, _ in warm)
+    construct_s = statistics.median(timings['construct_s'] for timings, _ in warm)
+    return {
+        'import_s': import_s,
+        'construct_cold_s': cold['construct_s'],
+        'construct_s': construct_s,
+        'total_s': import_s + construct_s,
+        'packages': dict(sorted(packages.items(), key=lambda item: -item[1])[:top]),
+        'modules': [{'module': name, 'own_s': own, 'cumulative_s': cumulative}
+                    for name, own, cumulative in sorted(modules, key=lambda module: -module[1])[:top]],
+    }
+
+def print_report(results):
+    """Сводка по процессам"""
+    for process, stats in results.items():
+        print(f"\n{process}: импорт {stats['import_s'] * 1000:.0f} мс, создание "
+              f"{stats['construct_cold_s'] * 1000:.0f} мс (новая база) / "
+              f"{stats['construct_s'] * 1000:.0f} мс (перезапуск)")
+        print("  пакеты: " + ', '.join(f"{name} {own * 1000:.0f}" for name, own in stats['packages'].items()))
+        for module in stats['modules']:
+            print(f"  {module['module']:<56} {module['own_s'] * 1000:>7.1f} {module['cumulative_s'] * 1000:>8.1f}")
+
+def main():
+    """Точка входа"""
+    parser = argparse.ArgumentParser(description='Профиль холодного запуска процессов сервиса')
+    parser.add_argument('--process', nargs='+', choices=sorted(ENTRY_POINTS), default=sorted(ENTRY_POINTS))
+    parser.add_argument('--repeat', type=int, default=3, help='Замеров перезапуска (медиана)')
+    parser.add_argument('--top', type=int, default=15, help='Модулей и пакетов в разбивке')
+    parser.add_argument('--output', help='Записать результаты в JSON')
+    parser.add_argument('--budget', type=float, help='Код выхода 1, если импорт и создание дольше стольких секунд')
+    args = parser.parse_args()
+
+    try:
+        results = {process: profile(process, args.repeat, args.top) for process in args.process}
+    except RuntimeError as e:
+        print(f"❌ {e}")
+        sys.exit(2)
+    print_report(results)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+    if args.budget is not None and any(stats['total_s'] > args.budget for stats in results.values()):
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
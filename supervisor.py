@@ -0,0 +1,323 @@
+"""
+Супервизор процессов сервиса
+
+Запускает дочерние процессы (боты, веб-приложение, админ-панель) в
+asyncio и следит за ними без опроса:
+
+    - выход процесса замечается сразу: pidfd процесса (Linux 5.3+)
+      читается циклом событий, на других системах - обработчик SIGCHLD;
+    - живость проверяется health-эндпоинтом каждые
+      SUPERVISOR_HEALTH_INTERVAL секунд: у ботов это /healthz на
+      эндпоинте метрик (пульс сторожа цикла событий), у веб-приложения
+      /health; после SUPERVISOR_HEALTH_FAILURES неудач подряд зависший
+      процесс перезапускается;
+    - перезапуск - с экспоненциальной задержкой от SUPERVISOR_BACKOFF_MIN
+      до SUPERVISOR_BACKOFF_MAX; после SUPERVISOR_STABLE_AFTER секунд
+      нормальной работы задержка снова минимальная;
+    - при остановке (SIGINT, SIGTERM) процессы в обратном порядке запуска
+      получают SIGTERM и SUPERVISOR_DRAIN_TIMEOUT секунд на то, чтобы
+      дописать журналы и закрыть соединения; не успевшие - SIGKILL;
+    - CPU и RSS процессов (из /proc) раз в SUPERVISOR_REPORT_INTERVAL
+      пишутся в лог и в метрики vetbot_process_* (эндпоинт supervisor
+      из METRICS_PORTS).
+
+Дети запускаются в своей сессии: Ctrl+C в терминале получает только
+супервизор, и он сам останавливает процессы по порядку.
+"""
+
+import os
+import json
+import time
+import signal
+import asyncio
+import logging
+import subprocess
+from urllib.parse import urlsplit
+from vetbot_improved.utils.metrics import (
+    PROCESS_UP, PROCESS_RESTARTS, PROCESS_CPU_PERCENT, PROCESS_RSS_BYTES, metrics_endpoints
+)
+
+logger = logging.getLogger(__name__)
+
+# Конфигурация
+SUPERVISOR_HEALTH_INTERVAL = float(os.getenv('SUPERVISOR_HEALTH_INTERVAL', '1'))
+SUPERVISOR_HEALTH_TIMEOUT = float(os.getenv('SUPERVISOR_HEALTH_TIMEOUT', '2'))
+SUPERVISOR_HEALTH_FAILURES = int(os.getenv('SUPERVISOR_HEALTH_FAILURES', '3'))
+SUPERVISOR_START_TIMEOUT = float(os.getenv('SUPERVISOR_START_TIMEOUT', '30'))
+SUPERVISOR_BACKOFF_MIN = float(os.getenv('SUPERVISOR_BACKOFF_MIN', '0.5'))
+SUPERVISOR_BACKOFF_MAX = float(os.getenv('SUPERVISOR_BACKOFF_MAX', '30'))
+SUPERVISOR_STABLE_AFTER = float(os.getenv('SUPERVISOR_STABLE_AFTER', '60'))
+SUPERVISOR_DRAIN_TIMEOUT = float(os.getenv('SUPERVISOR_DRAIN_TIMEOUT', '10'))
+SUPERVISOR_REPORT_INTERVAL = float(os.getenv('SUPERVISOR_REPORT_INTERVAL', '60'))
+
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+def pidfd_supported():
+    """pidfd_open есть в os и поддерживается ядром"""
+    if not hasattr(os, 'pidfd_open'):
+        return False
+    try:
+        os.close(os.pidfd_open(os.getpid()))
+    except OSError:
+        return False
+    return True
+
+def health_url(process, workers=None):
+    """/healthz процесса на его эндпоинте метрик (см. metrics_endpoints) или None"""
+    url = metrics_endpoints(workers).get(process)
+    return url.rsplit('/', 1)[0] + '/healthz' if url else None
+
+def read_usage(pid):
+    """(секунды CPU, RSS в байтах) процесса из /proc; None - если недоступно"""
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            # Имя процесса в скобках может содержать пробелы
+            fields = f.read().rsplit(')', 1)[1].split()
+        with open(f'/proc/{pid}/statm') as f:
+            rss_pages = int(f.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return None
+    # utime и stime - 14 и 15 поля stat, отсчет после имени процесса
+    return (int(fields[11]) + int(fields[12])) / CLOCK_TICKS, rss_pages * PAGE_SIZE
+
+async def probe(url, timeout=SUPERVISOR_HEALTH_TIMEOUT):
+    """GET url: здоров, если ответ 200 и в JSON-ответе нет ok=false"""
+    parts = urlsplit(url)
+    path = parts.path or '/'
+    if parts.query:
+        path += '?' + parts.query
+
+    async def request():
+        reader, writer = await asyncio.open_connection(parts.hostname, parts.port or 80)
+        try:
+            writer.write(f'GET {path} HTTP/1.0\r\nHost: {parts.netloc}\r\n\r\n'.encode())
+            await writer.drain()
+            return await reader.read()
+        finally:
+            writer.close()
+
+    try:
+        response = await asyncio.wait_for(request(), timeout)
+    except (OSError, asyncio.TimeoutError):
+        return False
+
+    head, _, body = response.partition(b'\r\n\r\n')
+    status = head.split(b' ', 2)[1:2]
+    if status != [b'200']:
+        return False
+    try:
+        result = json.loads(body)
+    except ValueError:
+        return True
+    return not (isinstance(result, dict) and result.get('ok') is False)
+
+class Service:
+    """Описание дочернего процесса и его текущее состояние"""
+
+    def __init__(self, name, argv, health=None, cwd=None, env=None,
+                 start_timeout=SUPERVISOR_START_TIMEOUT, drain_timeout=SUPERVISOR_DRAIN_TIMEOUT):
+        self.name = name
+        self.argv = argv
+        self.health = health  # URL проверки здоровья; None - только выход процесса
+        self.cwd = cwd
+        self.env = env
+        self.start_timeout = start_timeout
+        self.drain_timeout = drain_timeout
+        self.process = None
+        self.started_at = None
+        self.restarts = 0
+        self.backoff_step = 0
+        self.last_exit = None  # (код выхода, time.time() обнаружения)
+        self._exited = None
+        self._usage = None
+
+    @property
+    def pid(self):
+        return self.process.pid if self.process else None
+
+    def running(self):
+        return self._exited is not None and not self._exited.done()
+
+class ProcessSupervisor:
+    """Запуск, наблюдение, перезапуск и остановка дочерних процессов"""
+
+    def __init__(self, services, health_interval=SUPERVISOR_HEALTH_INTERVAL,
+                 health_failures=SUPERVISOR_HEALTH_FAILURES, backoff_min=SUPERVISOR_BACKOFF_MIN,
+                 backoff_max=SUPERVISOR_BACKOFF_MAX, stable_after=SUPERVISOR_STABLE_AFTER,
+                 report_interval=SUPERVISOR_REPORT_INTERVAL):
+        self.services = list(services)
+        self.health_interval = health_interval
+        self.health_failures = health_failures
+        self.backoff_min = backoff_min
+        self.backoff_max = backoff_max
+        self.stable_after = stable_after
+        self.report_interval = report_interval
+        self.use_pidfd = pidfd_supported()
+        self._loop = None
+        self._stopping = None
+
+    async def run(self):
+        """Запустить все процессы и следить за ними до stop() или сигнала"""
+        self._loop = asyncio.get_running_loop()
+        self._stopping = asyncio.Event()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            self._loop.add_signal_handler(signum, self.stop)
+        if not self.use_pidfd:
+            self._loop.add_signal_handler(signal.SIGCHLD, self._reap)
+
+        watchers = [asyncio.create_task(self._supervise(service), name=f'supervise-{service.name}')
+                    for service in self.services]
+        reporter = asyncio.create_task(self._report(), name='supervisor-report')
+        try:
+            await self._stopping.wait()
+        finally:
+            for task in watchers + [reporter]:
+                task.cancel()
+            await asyncio.gather(*watchers, reporter, return_exceptions=True)
+            await self.drain()
+            for signum in (signal.SIGINT, signal.SIGTERM):
+                self._loop.remove_signal_handler(signum)
+            if not self.use_pidfd:
+                self._loop.remove_signal_handler(signal.SIGCHLD)
+
+    def stop(self):
+        """Начать остановку: run() остановит процессы и вернется"""
+        if self._stopping is not None and not self._stopping.is_set():
+            logger.info("Supervisor stopping, draining processes")
+            self._stopping.set()
+
+    async def drain(self):
+        """Остановить процессы в обратном порядке запуска"""
+        for service in reversed(self.services):
+            await self.terminate(service)
+
+    async def terminate(self, service):
+        """SIGTERM и drain_timeout на корректное завершение, затем SIGKILL"""
+        if not service.running():
+            return
+        started = time.monotonic()
+        service.process.terminate()
+        try:
+            await asyncio.wait_for(asyncio.shield(service._exited), service.drain_timeout)
+            logger.info(f"{service.name} drained in {time.monotonic() - started:.2f} s")
+        except asyncio.TimeoutError:
+            logger.warning(f"{service.name} did not stop in {service.drain_timeout} s, killing")
+            service.process.kill()
+            await service._exited
+
+    def spawn(self, service):
+        """Запустить процесс и подписаться на его выход"""
+        service.process = subprocess.Popen(service.argv, cwd=service.cwd, env=service.env, start_new_session=True)
+        service.started_at = time.monotonic()
+        service._exited = self._loop.create_future()
+        service._usage = None
+        if self.use_pidfd:
+            # pidfd становится читаемым в момент выхода процесса
+            fd = os.pidfd_open(service.process.pid)
+            self._loop.add_reader(fd, self._on_pidfd, service, fd)
+        else:
+            self._reap()
+        logger.info(f"{service.name} started, pid {service.process.pid}")
+
+    def _on_pidfd(self, service, fd):
+        self._loop.remove_reader(fd)
+        os.close(fd)
+        self._exit(service, service.process.wait())
+
+    def _reap(self):
+        for service in self.services:
+            if service.running():
+                code = service.process.poll()
+                if code is not None:
+                    self._exit(service, code)
+
+    def _exit(self, service, code):
+        service.last_exit = (code, time.time())
+        PROCESS_UP.set(0, process=service.name)
+        if not service._exited.done():
+            service._exited.set_result(code)
+
+    async def _supervise(self, service):
+        while True:
+            try:
+                self.spawn(service)
+            except OSError as e:
+                logger.error(f"{service.name} failed to start: {e}")
+                service.started_at = time.monotonic()
+                service._exited = self._loop.create_future()
+                service._exited.set_result(None)
+            health = asyncio.create_task(self._watch_health(service))
+            try:
+                await asyncio.wait([service._exited, health], return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                health.cancel()
+
+            if service._exited.done():
+                reason = 'exit'
+                logger.warning(f"{service.name} exited with code {service._exited.result()}")
+            else:
+                reason = 'unhealthy'
+                logger.warning(f"{service.name} failed {self.health_failures} health checks, restarting")
+                await self.terminate(service)
+
+            # Процесс, проработавший stable_after, перезапускается без задержки
+            if time.monotonic() - service.started_at >= self.stable_after:
+                service.backoff_step = 0
+            delay = min(self.backoff_max, self.backoff_min * 2 ** service.backoff_step)
+            service.backoff_step += 1
+            service.restarts += 1
+            PROCESS_RESTARTS.inc(process=service.name, reason=reason)
+            logger.info(f"Restarting {service.name} in {delay:.1f} s")
+            await asyncio.sleep(delay)
+
+    async def _watch_health(self, service):
+        """Вернуться, когда процесс health_failures раз подряд не ответил"""
+        if service.health is None:
+            PROCESS_UP.set(1, process=service.name)
+            await asyncio.Event().wait()
+
+        healthy_once = False
+        failures = 0
+        while True:
+            await asyncio.sleep(self.health_interval)
+            if await probe(service.health):
+                healthy_once = True
+                failures = 0
+                PROCESS_UP.set(1, process=service.name)
+                continue
+            # Пока процесс стартует, эндпоинта еще может не быть
+            if not healthy_once and time.monotonic() - service.started_at < service.start_timeout:
+                continue
+            failures += 1
+            PROCESS_UP.set(0, process=service.name)
+            if failures >= self.health_failures:
+                return
+
+    def sample_usage(self):
+        """CPU (% одного ядра с прошлого замера) и RSS работающих процессов"""
+        report = {}
+        now = time.monotonic()
+        for service in self.services:
+            if not service.running():
+                continue
+            usage = read_usage(service.pid)
+            if usage is None:
+                continue
+            cpu_seconds, rss = usage
+            previous = service._usage or (service.started_at, 0.0)
+            elapsed = now - previous[0]
+            cpu_percent = 100 * (cpu_seconds - previous[1]) / elapsed if elapsed > 0 else 0.0
+            service._usage = (now, cpu_seconds)
+            PROCESS_CPU_PERCENT.set(round(cpu_percent, 1), process=service.name)
+            PROCESS_RSS_BYTES.set(rss, process=service.name)
+            report[service.name] = {'pid': service.pid, 'cpu_percent': cpu_percent, 'rss': rss,
+                                    'restarts': service.restarts}
+        return report
+
+    async def _report(self):
+        while True:
+            await asyncio.sleep(self.report_interval)
+            for name, usage in self.sample_usage().items():
+                logger.info(f"{name} pid {usage['pid']}: CPU {usage['cpu_percent']:.1f}%, "
+                            f"RSS {usage['rss'] / 2 ** 20:.1f} MB, restarts {usage['restarts']}")
@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Генератор синтетических данных для проверки базы и админ-панели на объеме
+
+Создает схему ботов (VetBotDatabase, VetDoctorDatabase, ConversationContext,
+DoctorRouter) и заполняет ее правдоподобными данными:
+
+    - регистрации растут к концу периода (рост сервиса);
+    - число вопросов AI и обращений к врачу на клиента - с тяжелым хвостом
+      (Парето): большинство спрашивает раз-два, немногие - сотни раз;
+    - длина диалога с врачом - логнормальная, в среднем ~16 реплик;
+    - последняя консультация клиента: 85% завершены, 8% ждут врача,
+      5% идут, 2% назначены; прежние завершены;
+    - загрузка врачей неравномерна, 90% врачей одобрены;
+    - уведомления врачам, волны эскалации, вызовы на дом, сообщения и
+      сессии админов, учет токенов AI.
+
+Строки вставляются пачками executemany (--batch строк на транзакцию), на
+время загрузки synchronous=OFF. По умолчанию - 200 тыс. клиентов и ~2.3
+млн consultation_messages. Схему vetbot_improved можно заполнить из
+полученной базы скриптом vetbot_improved/scripts/migrate_data.py.
+
+Пример:
+    python synthetic_data.py --db /tmp/big.db --users 200000
+    python query_benchmark.py --db /tmp/big.db
+"""
+
+import sys
+import json
+import time
+import random
+import sqlite3
+import argparse
+
+from load_test import QUESTIONS
+from doctor_routing import DoctorRouter, ROUTING_INITIAL_DOCTORS, ROUTING_ESCALATION_STEP, ROUTING_ESCALATION_TIMEOUT
+from vetbot_improved.services.llm_stub import STUB_ANSWERS
+
+CLIENT_ID_BASE = 100000
+DOCTOR_ID_BASE = 900000
+
+FIRST_NAMES = ['Анна', 'Мария', 'Елена', 'Ольга', 'Наталья', 'Ирина', 'Светлана', 'Татьяна',
+               'Алексей', 'Дмитрий', 'Сергей', 'Андрей', 'Иван', 'Михаил', 'Николай', 'Павел']
+LAST_NAMES = ['Иванова', 'Смирнова', 'Кузнецова', 'Попова', 'Соколова', 'Лебедева',
+              'Иванов', 'Смирнов', 'Кузнецов', 'Попов', 'Соколов', 'Лебедев']
+PETS = [('Кошка', 'Мурка'), ('Кот', 'Барсик'), ('Кот', 'Васька'), ('Кошка', 'Соня'),
+        ('Котенок', 'Пушок'), ('Кошка', 'Белла')]
+URGENCIES = ['low', 'medium', 'high', 'emergency']
+CLIENT_REPLIES = QUESTIONS + [
+    "Спасибо, понял", "А какую дозу дать?", "Температура 39.5", "Хорошо, понаблюдаю",
+    "Рвоты больше не было", "Прислать фото?", "Ест, но мало",
+]
+DOCTOR_REPLIES = [
+    "Здравствуйте! Расскажите, как давно это началось?",
+    "Измерьте, пожалуйста, температуру",
+    "Давайте понаблюдаем сутки, если не станет лучше - нужен осмотр",
+    "Дайте воду, корм пока не предлагайте",
+    "Это похоже на стресс, но исключим отравление",
+] + STUB_ANSWERS
+
+# Статус последней консультации клиента с врачом
+LAST_STATUS_WEIGHTS = {'completed': 85, 'waiting': 8, 'active': 5, 'assigned': 2}
+
+COLUMNS = {
+    'users': ('user_id', 'username', 'first_name', 'last_name', 'phone', 'created_at'),
+    'consultations': ('id', 'user_id', 'question', 'response', 'created_at', 'consultation_status'),
+    'ai_usage': ('user_id', 'consultation_id', 'backend', 'prompt_tokens', 'completion_tokens',
+                 'cache_hit_tokens', 'cost', 'latency', 'created_at'),
+    'doctors': ('id', 'telegram_id', 'username', 'full_name', 'is_approved', 'is_active',
+                'registered_at', 'last_activity'),
+    'doctor_stats': ('doctor_id', 'response_ewma', 'responses'),
+    'active_consultations': ('id', 'client_id', 'doctor_id', 'consultation_id', 'started_at', 'status',
+                             'client_username', 'client_name', 'initial_message'),
+    'consultation_messages': ('consultation_id', 'sender_type', 'sender_id', 'sender_name', 'message_text',
+                              'sent_at', 'telegram_message_id', 'trace_id'),
+    'doctor_notifications': ('consultation_id', 'doctor_id', 'message_id', 'is_responded', 'sent_at'),
+    'consultation_routing': ('consultation_id', 'notified', 'started_at'),
+    'vet_calls': ('user_id', 'name', 'phone', 'address', 'pet_type', 'pet_name', 'pet_age', 'problem',
+                  'urgency', 'preferred_time', 'comments', 'status', 'created_at'),
+    'admin_messages': ('user_id', 'admin_username', 'message', 'sent_at'),
+    'admin_message_queue': ('user_id', 'message', 'created_at', 'sent'),
+    'admin_sessions': ('user_id', 'admin_username', 'started_at', 'ended_at', 'is_active'),
+}
+
+def timestamp(seconds):
+    """Время в формате CURRENT_TIMESTAMP SQLite (UTC)"""
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(seconds))
+
+def create_schema(db_path):
+    """Схема и индексы - теми же классами, что и у работающих ботов"""
+    from enhanced_bot import VetBotDatabase
+    from vet_doctor_bot import VetDoctorDatabase
+    from conversation_context import ConversationContext
+
+    # Основной бот создает active_consultations с consultation_id - раньше бота врачей
+    VetBotDatabase(db_path)
+    VetDoctorDatabase(db_path)
+    ConversationContext(db_path)
+    DoctorRouter(db_path).init_database()
+
+class BatchWriter:
+    """Буфер строк по таблицам: сброс пачками executemany в одной транзакции"""
+
+    def __init__(self, conn, batch_size):
+        self.conn = conn
+        self.batch_size = batch_size
+        self.buffered = 0
+        self.rows = {table: [] for table in COLUMNS}
+        self.counts = dict.fromkeys(COLUMNS, 0)
+
+    def add(self, table, row):
+        self.rows[table].append(row)
+        self.buffered += 1
+        if self.buffered >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        with self.conn:
+            for table, rows in self.rows.items():
+                if not rows:
+                    continue
+                columns = COLUMNS[table]
+                self.conn.executemany(
+                    f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+                    rows
+                )
+                self.counts[table] += len(rows)
+                rows.clear()
+        self.buffered = 0
+
+def heavy_tail(rng, alpha, cap):
+    """Целое >= 1 с распределением Парето (большинство - 1-2, редкие - до cap)"""
+    return min(int(rng.paretovariate(alpha)), cap)
+
+def generate(db_path, users=200000, doctors=300, days=365, seed=0, batch_size=20000, now=None, progress=None):
+    """Заполнить пустую базу синтетическими данными
+
+    Возвращает словарь {таблица: вставлено строк}. progress(done, total)
+    вызывается после каждой тысячи клиентов.
+    """
+    rng = random.Random(seed)
+    now = now if now is not None else time.time()
+    start = now - days * 86400
+
+    create_schema(db_path)
+    conn = sqlite3.connect(db_path)
+    if conn.execute('SELECT COUNT(*) FROM users').fetchone()[0]:
+        conn.close()
+        raise ValueError(f"{db_path}: база уже содержит пользователей")
+
+    # Загрузке не нужна устойчивость к сбою питания; кэш - на всю пачку
+    conn.execute('PRAGMA synchronous=OFF')
+    conn.execute('PRAGMA cache_size=-65536')
+    writer = BatchWriter(conn, batch_size)
+
+    # Врачи: у немногих - основная часть консультаций (вес по Ципфу)
+    doctor_ids = []
+    for index in range(doctors):
+        doctor_id = index + 1
+        approved = rng.random() < 0.9
+        registered = start + (now - start) * rng.random()
+        writer.add('doctors', (
+            doctor_id, DOCTOR_ID_BASE + index, f"vet{index}",
+            f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}", int(approved), int(rng.random() < 0.95),
+            timestamp(registered), timestamp(now - rng.expovariate(1 / 86400)),
+        ))
+        if approved:
+            doctor_ids.append(doctor_id)
+            writer.add('doctor_stats', (doctor_id, rng.lognormvariate(4, 0.6), rng.randint(1, 500)))
+    doctor_weights = [1 / (rank + 1) for rank in range(len(doctor_ids))]
+
+    # Регистрации с плотностью, растущей линейно к концу периода
+    created = sorted(start + (now - start) * rng.random() ** 0.5 for _ in range(users))
+    consultation_id = 0
+    dialog_id = 0
+
+    for index, registered in enumerate(created):
+        user_id = CLIENT_ID_BASE + index
+        first_name = rng.choice(FIRST_NAMES)
+        last_name = rng.choice(LAST_NAMES) if rng.random() < 0.6 else None
+        username = f"user{user_id}" if rng.random() < 0.7 else None
+        client_name = f"{first_name} {last_name}" if last_name else first_name
+        writer.add('users', (user_id, username, first_name, last_name, None, timestamp(registered)))
+
+        # Вопросы AI: каждый пятый только нажал /start
+        asked = heavy_tail(rng, 1.3, 300) if rng.random() < 0.8 else 0
+        last_question = None
+        for at in sorted(registered + (now - registered) * rng.random() for _ in range(asked)):
+            consultation_id += 1
+            question = rng.choice(QUESTIONS)
+            writer.add('consultations', (
+                consultation_id, user_id, question, rng.choice(STUB_ANSWERS), timestamp(at), 'ai',
+            ))
+            prompt_tokens = rng.randint(300, 2500)
+            writer.add('ai_usage', (
+                user_id, consultation_id, 'deepseek', prompt_tokens, rng.randint(150, 600),
+                int(prompt_tokens * rng.random() * 0.8), prompt_tokens * 2.7e-7, rng.lognormvariate(0, 0.5),
+                timestamp(at),
+            ))
+            last_question = consultation_id
+
+        # Обращения к врачу
+        dialogs = heavy_tail(rng, 1.6, 50) if rng.random() < 0.35 else 0
+        dialog_starts = sorted(registered + (now - registered) * rng.random() for _ in range(dialogs))
+        for number, started in enumerate(dialog_starts):
+            dialog_id += 1
+            if number == len(dialog_starts) - 1:
+                status = rng.choices(list(LAST_STATUS_WEIGHTS), weights=list(LAST_STATUS_WEIGHTS.values()))[0]
+            else:
+                status = 'completed'
+
+            waves = 0
+            if status == 'waiting':
+                # Клиент ждет минуты: за это время прошло несколько волн эскалации
+                started = max(registered, now - rng.expovariate(1 / 600))
+                waves = int((now - started) // ROUTING_ESCALATION_TIMEOUT)
+            wave_size = ROUTING_INITIAL_DOCTORS + waves * ROUTING_ESCALATION_STEP
+            notified = rng.sample(doctor_ids, min(wave_size, len(doctor_ids)))
+            doctor_id = None
+            if status != 'waiting' and doctor_ids:
+                doctor_id = rng.choices(doctor_ids, weights=doctor_weights)[0]
+                if doctor_id not in notified:
+                    notified.append(doctor_id)
+
+            initial_message = rng.choice(QUESTIONS)
+            writer.add('active_consultations', (
+                dialog_id, user_id, doctor_id, last_question, timestamp(started), status,
+                username, client_name, initial_message,
+            ))
+            for notified_id in notified:
+                writer.add('doctor_notifications', (
+                    dialog_id, notified_id, rng.randint(1, 10 ** 6), int(notified_id == doctor_id),
+                    timestamp(started),
+                ))
+            if status == 'waiting':
+                writer.add('consultation_routing', (
+                    dialog_id, json.dumps([DOCTOR_ID_BASE + doctor - 1 for doctor in notified]), started,
+                ))
+                continue
+
+            # Диалог: реплики чередуются с вероятностью 0.7, паузы - минуты
+            at = started
+            sender = 'client'
+            for _ in range(min(max(1, int(rng.lognormvariate(2.5, 0.8))), 400)):
+                at += rng.expovariate(1 / 120)
+                if sender == 'client':
+                    trace_id = f"{rng.getrandbits(128):032x}" if rng.random() < 0.5 else None
+                    writer.add('consultation_messages', (
+                        dialog_id, 'client', user_id, client_name, rng.choice(CLIENT_REPLIES), timestamp(at),
+                        rng.randint(1, 10 ** 6), trace_id,
+                    ))
+                else:
+                    writer.add('consultation_messages', (
+                        dialog_id, 'doctor', DOCTOR_ID_BASE + doctor_id - 1, None, rng.choice(DOCTOR_REPLIES),
+                        timestamp(at), rng.randint(1, 10 ** 6), None,
+                    ))
+                if rng.random() < 0.7:
+                    sender = 'doctor' if sender == 'client' else 'client'
+
+        # Вызовы на дом
+        if rng.random() < 0.08:
+            for _ in range(rng.randint(1, 3)):
+                pet_type, pet_name = rng.choice(PETS)
+                at = registered + (now - registered) * rng.random()
+                writer.add('vet_calls', (
+                    user_id, client_name, f"+7-9{rng.randint(10, 99)}-{rng.randint(100, 999)}-{rng.randint(10, 99)}",
+                    f"ул. Ленина, д. {rng.randint(1, 200)}", pet_type, pet_name, f"{rng.randint(1, 15)} лет",
+                    rng.choice(QUESTIONS), rng.choice(URGENCIES), 'Сегодня', '',
+                    'pending' if rng.random() < 0.2 else 'completed', timestamp(at),
+                ))
+
+        # Админ вмешивается в редкие диалоги
+        if rng.random() < 0.02:
+            for _ in range(rng.randint(1, 5)):
+                at = registered + (now - registered) * rng.random()
+                writer.add('admin_messages', (user_id, 'admin', rng.choice(DOCTOR_REPLIES), timestamp(at)))
+        if rng.random() < 0.002:
+            writer.add('admin_message_queue', (user_id, rng.choice(DOCTOR_REPLIES), timestamp(now), 0))
+        if rng.random() < 0.01:
+            at = registered + (now - registered) * rng.random()
+            active = rng.random() < 0.05
+            writer.add('admin_sessions', (
+                user_id, 'admin', timestamp(at), None if active else timestamp(at + 600), int(active),
+            ))
+
+        if progress and (index + 1) % 1000 == 0:
+            progress(index + 1, users)
+
+    writer.flush()
+    conn.close()
+    return writer.counts
+
+def main():
+    """Точка входа"""
+    parser = argparse.ArgumentParser(description='Генератор синтетических данных vetbot.db')
+    parser.add_argument('--db', default='vetbot_synthetic.db', help='Путь к новой базе')
+    parser.add_argument('--users', type=int, default=200000)
+    parser.add_argument('--doctors', type=int, default=300)
+    parser.add_argument('--days', type=int, default=365, help='Период истории, дней')
+    parser.add_argument('--batch', type=int, default=20000, help='Строк в транзакции')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    def progress(done, total):
+        if done % 20000 == 0:
+            print(f"  {done}/{total} клиентов, {time.monotonic() - started:.0f} с", flush=True)
+
+    started = time.monotonic()
+    try:
+        counts = generate(args.db, args.users, args.doctors, args.days, args.seed, args.batch, progress=progress)
+    except ValueError as e:
+        print(f"❌ {e}")
+        sys.exit(2)
+    elapsed = time.monotonic() - started
+
+    for table, count in sorted(counts.items(), key=lambda item: -item[1]):
+        print(f"{table:<24} {count:>10}")
+    total = sum(counts.values())
+    print(f"✅ {total} строк за {elapsed:.1f} с ({total / elapsed:.0f} строк/с): {args.db}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,325 @@
+"""
+Транзакционный outbox для сообщений Telegram
+
+Изменение состояния в базе и сообщения Telegram, которые из него следуют,
+записываются в одной транзакции: сообщения попадают в таблицу
+telegram_outbox. Отдельный relay-цикл забирает их пачками, отправляет,
+повторяет при временных ошибках и в одной транзакции с отметкой об отправке
+выполняет связанный учет (например, сохраняет message_id уведомления врача).
+Вместе с сообщением сохраняется traceparent: отправка продолжает трассу
+обработчика, поставившего сообщение в очередь.
+"""
+
+import os
+import json
+import time
+import asyncio
+import sqlite3
+import logging
+from telegram import InlineKeyboardMarkup
+from telegram.error import BadRequest, Forbidden, RetryAfter
+from vetbot_improved.utils.metrics import DB_QUERY_SECONDS, QUEUE_DEPTH
+from vetbot_improved.utils.tracing import current_traceparent, span
+
+logger = logging.getLogger(__name__)
+
+# Конфигурация
+OUTBOX_BATCH_SIZE = int(os.getenv('OUTBOX_BATCH_SIZE', '20'))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv('OUTBOX_MAX_ATTEMPTS', '5'))
+OUTBOX_RETRY_DELAY = float(os.getenv('OUTBOX_RETRY_DELAY', '2'))
+OUTBOX_LEASE = float(os.getenv('OUTBOX_LEASE', '30'))
+OUTBOX_POLL_INTERVAL = float(os.getenv('OUTBOX_POLL_INTERVAL', '0.2'))
+
+class TelegramOutbox:
+    """Таблица исходящих сообщений Telegram
+
+    Строка проходит статусы pending -> sending -> sent; при исчерпании
+    попыток или постоянной ошибке - failed, при отмене - cancelled. Строка в
+    статусе sending, чей срок аренды (next_attempt_at) истек, снова доступна
+    для отправки: так сообщения не теряются при падении процесса-отправителя.
+    Сообщение чата не выдается, пока более раннее сообщение того же чата ждет
+    повтора или отправляется другим relay: порядок в чате сохраняется.
+    """
+
+    def __init__(self, db_path='vetbot.db'):
+        self.db_path = db_path
+        self._initialized = False
+
+    def init_database(self, conn=None):
+        """Таблица outbox и индекс по сроку отправки"""
+        own_conn = conn is None
+        if own_conn:
+            conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS telegram_outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                bot TEXT NOT NULL, -- main, vet
+                method TEXT NOT NULL, -- send_message, edit_message_text
+                params TEXT NOT NULL,
+                dedup_key TEXT UNIQUE,
+                kind TEXT, -- учет после отправки, см. OutboxRelay.on_sent
+                ref TEXT,
+                status TEXT DEFAULT 'pending', -- pending, sending, sent, failed, cancelled
+                attempts INTEGER DEFAULT 0,
+                next_attempt_at REAL DEFAULT 0,
+                last_error TEXT,
+                telegram_message_id INTEGER,
+                traceparent TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                sent_at TIMESTAMP
+            )
+        ''')
+        # Таблицы, созданные до трассировки, получают колонку traceparent
+        columns = {row[1] for row in cursor.execute('PRAGMA table_info(telegram_outbox)')}
+        if 'traceparent' not in columns:
+            cursor.execute('ALTER TABLE telegram_outbox ADD COLUMN traceparent TEXT')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_telegram_outbox_due
+            ON telegram_outbox (status, next_attempt_at)
+        ''')
+
+        if own_conn:
+            conn.commit()
+            conn.close()
+        self._initialized = True
+
+    def _ensure_database(self, conn=None):
+        if not self._initialized:
+            self.init_database(conn)
+
+    def enqueue(self, conn, bot, method, params, dedup_key=None, kind=None, ref=None):
+        """Записать сообщение в outbox в текущей транзакции conn
+
+        Повторная запись с тем же dedup_key игнорируется. Возвращает id
+        строки или None для дубликата.
+        """
+        self._ensure_database(conn)
+        cursor = conn.execute('''
+            INSERT OR IGNORE INTO telegram_outbox (bot, method, params, dedup_key, kind, ref, next_attempt_at, traceparent)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (bot, method, json.dumps(params, ensure_ascii=False), dedup_key, kind,
+              json.dumps(ref, ensure_ascii=False) if ref is not None else None, time.time(), current_traceparent()))
+        return cursor.lastrowid if cursor.rowcount else None
+
+    def cancel(self, conn, dedup_prefix):
+        """Отменить еще не отправленные сообщения с ключом, начинающимся с dedup_prefix"""
+        self._ensure_database(conn)
+        cursor = conn.execute('''
+            UPDATE telegram_outbox SET status = 'cancelled'
+            WHERE dedup_key LIKE ? AND status = 'pending'
+        ''', (dedup_prefix + '%',))
+        return cursor.rowcount
+
+    def claim(self, limit=OUTBOX_BATCH_SIZE, lease=OUTBOX_LEASE):
+        """Забрать пачку сообщений к отправке
+
+        Одна инструкция UPDATE ... RETURNING атомарна, поэтому несколько
+        relay-процессов не получат одно и то же сообщение. Сообщения чата,
+        у которого есть более раннее неотправленное сообщение не к сроку
+        (ждет повтора или в аренде), пропускаются.
+        """
+        self._ensure_database()
+        now = time.time()
+        conn = sqlite3.connect(self.db_path)
+        try:
+            with DB_QUERY_SECONDS.time(query='outbox_claim'):
+                rows = conn.execute('''
+                    UPDATE telegram_outbox
+                    SET status = 'sending', attempts = attempts + 1, next_attempt_at = ?
+                    WHERE id IN (
+                        SELECT id FROM telegram_outbox AS message
+                        WHERE status IN ('pending', 'sending') AND next_attempt_at <= ?
+                        AND NOT EXISTS (
+                            SELECT 1 FROM telegram_outbox AS earlier
+                            WHERE earlier.status IN ('pending', 'sending') AND earlier.next_attempt_at > ?
+                            AND earlier.id < message.id AND earlier.bot = message.bot
+                            AND json_extract(earlier.params, '$.chat_id') = json_extract(message.params, '$.chat_id')
+                        )
+                        ORDER BY id LIMIT ?
+                    )
+                    RETURNING id, bot, method, params, kind, ref, attempts, traceparent
+                ''', (now + lease, now, now, limit)).fetchall()
+                conn.commit()
+        finally:
+            conn.close()
+
+        columns = ['id', 'bot', 'method', 'params', 'kind', 'ref', 'attempts', 'traceparent']
+        messages = [dict(zip(columns, row)) for row in sorted(rows)]
+        for message in messages:
+            message['params'] = json.loads(message['params'])
+            message['ref'] = json.loads(message['ref']) if message['ref'] else None
+        return messages
+
+    def mark_sent(self, message, telegram_message_id=None, hook=None):
+        """Отметить отправку и выполнить учет hook(conn, ref, message_id) в той же транзакции"""
+        conn = sqlite3.connect(self.db_path)
+        try:
+            with DB_QUERY_SECONDS.time(query='outbox_mark_sent'):
+                cursor = conn.execute('''
+                    UPDATE telegram_outbox
+                    SET status = 'sent', telegram_message_id = ?, sent_at = CURRENT_TIMESTAMP, last_error = NULL
+                    WHERE id = ? AND status = 'sending'
+                ''', (telegram_message_id, message['id']))
+                # Учет выполняется ровно один раз - только если отметка прошла
+                if cursor.rowcount and hook is not None:
+                    hook(conn, message['ref'], telegram_message_id)
+                conn.commit()
+        finally:
+            conn.close()
+
+    def mark_failed(self, message, error, retry_in=None):
+        """Вернуть сообщение в очередь через retry_in секунд или отметить как failed"""
+        conn = sqlite3.connect(self.db_path)
+        if retry_in is None:
+            conn.execute('''
+                UPDATE telegram_outbox SET status = 'failed', last_error = ?
+                WHERE id = ?
+            ''', (str(error)[:500], message['id']))
+        else:
+            conn.execute('''
+                UPDATE telegram_outbox SET status = 'pending', last_error = ?, next_attempt_at = ?
+                WHERE id = ?
+            ''', (str(error)[:500], time.time() + retry_in, message['id']))
+        conn.commit()
+        conn.close()
+
+    def release(self, messages):
+        """Вернуть взятые, но не отправленные сообщения в очередь без траты попытки"""
+        if not messages:
+            return
+        conn = sqlite3.connect(self.db_path)
+        conn.executemany('''
+            UPDATE telegram_outbox SET status = 'pending', attempts = attempts - 1, next_attempt_at = ?
+            WHERE id = ? AND status = 'sending'
+        ''', [(time.time(), message['id']) for message in messages])
+        conn.commit()
+        conn.close()
+
+    def pending(self):
+        """Число сообщений, ждущих отправки (по индексу статуса)"""
+        self._ensure_database()
+        conn = sqlite3.connect(self.db_path)
+        count = conn.execute("SELECT COUNT(*) FROM telegram_outbox WHERE status = 'pending'").fetchone()[0]
+        conn.close()
+        return count
+
+    def stats(self):
+        """Число сообщений по статусам"""
+        self._ensure_database()
+        conn = sqlite3.connect(self.db_path)
+        rows = conn.execute('SELECT status, COUNT(*) FROM telegram_outbox GROUP BY status').fetchall()
+        conn.close()
+        return dict(rows)
+
+class OutboxRelay:
+    """Доставка сообщений из outbox через ботов Telegram
+
+    bots - словарь {'main': Bot, 'vet': Bot}. Временные ошибки повторяются с
+    экспоненциальной задержкой (RetryAfter - через указанное Telegram время),
+    BadRequest и Forbidden считаются постоянными.
+    """
+
+    def __init__(self, outbox, bots, batch_size=OUTBOX_BATCH_SIZE, max_attempts=OUTBOX_MAX_ATTEMPTS,
+                 retry_delay=OUTBOX_RETRY_DELAY, poll_interval=OUTBOX_POLL_INTERVAL):
+        self.outbox = outbox
+        self.bots = bots
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.poll_interval = poll_interval
+        self._hooks = {}
+        self._running = False
+        QUEUE_DEPTH.set_function(outbox.pending, queue='telegram_outbox')
+
+    def on_sent(self, kind, hook):
+        """Учет для сообщений вида kind: hook(conn, ref, telegram_message_id)"""
+        self._hooks[kind] = hook
+
+    async def deliver_batch(self):
+        """Отправить одну пачку; возвращает число обработанных сообщений"""
+        messages = self.outbox.claim(self.batch_size)
+        # Разные чаты отправляются параллельно, сообщения одного чата - по
+        # очереди, в порядке постановки в outbox
+        chats = {}
+        for message in messages:
+            chats.setdefault((message['bot'], message['params'].get('chat_id')), []).append(message)
+        if chats:
+            await asyncio.gather(*(self._deliver_chat(chat) for chat in chats.values()))
+        return len(messages)
+
+    async def _deliver_chat(self, messages):
+        # После неудачи остальные сообщения чата возвращаются в очередь:
+        # claim не выдаст их раньше, чем уйдет сообщение, ждущее повтора
+        for index, message in enumerate(messages):
+            if not await self._deliver(message):
+                self.outbox.release(messages[index + 1:])
+                break
+
+    async def _deliver(self, message):
+        # Сообщения, поставленные вне трассы (таймеры, события), не трассируются
+        with span('outbox.deliver', root=False, parent=message['traceparent'],
+                  bot=message['bot'], method=message['method'], attempt=message['attempts']):
+            return await self._send(message)
+
+    async def _send(self, message):
+        bot = self.bots.get(message['bot'])
+        if bot is None:
+            self.outbox.mark_failed(message, f"Bot '{message['bot']}' is not configured")
+            return False
+
+        params = dict(message['params'])
+        if 'reply_markup' in params:
+            params['reply_markup'] = InlineKeyboardMarkup.de_json(params['reply_markup'], bot)
+
+        try:
+            # Задержку и ошибки Bot API пишет транспорт бота (TracedRequest)
+            result = await getattr(bot, message['method'])(**params)
+        except RetryAfter as e:
+            delay = e.retry_after
+            delay = delay.total_seconds() if hasattr(delay, 'total_seconds') else float(delay)
+            self.outbox.mark_failed(message, e, retry_in=delay)
+            return False
+        except (BadRequest, Forbidden) as e:
+            logger.error(f"Outbox message #{message['id']} rejected by Telegram: {e}")
+            self.outbox.mark_failed(message, e)
+            return False
+        except Exception as e:
+            if message['attempts'] >= self.max_attempts:
+                logger.error(f"Outbox message #{message['id']} failed after {message['attempts']} attempts: {e}")
+                self.outbox.mark_failed(message, e)
+            else:
+                self.outbox.mark_failed(message, e, retry_in=self.retry_delay * 2 ** (message['attempts'] - 1))
+            return False
+
+        self.outbox.mark_sent(message, getattr(result, 'message_id', None), self._hooks.get(message['kind']))
+        return True
+
+    async def run(self):
+        """Цикл доставки до вызова stop()"""
+        self.outbox._ensure_database()
+        self._running = True
+        watch = sqlite3.connect(self.outbox.db_path)
+        last_version = None
+        next_check = 0.0
+
+        try:
+            while self._running:
+                # Новые записи видны по data_version, отложенные повторы - по времени
+                version = watch.execute('PRAGMA data_version').fetchone()[0]
+                if version != last_version or time.monotonic() >= next_check:
+                    last_version = version
+                    next_check = time.monotonic() + 1.0
+                    try:
+                        while self._running and await self.deliver_batch() == self.batch_size:
+                            pass
+                    except sqlite3.Error as e:
+                        logger.error(f"Outbox relay database error: {e}")
+                await asyncio.sleep(self.poll_interval)
+        finally:
+            watch.close()
+
+    def stop(self):
+        """Остановить цикл run()"""
+        self._running = False
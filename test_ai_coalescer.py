@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+Тесты склейки AI-запросов
+"""
+
+import asyncio
+from ai_coalescer import RequestCoalescer
+
+def test_burst_is_merged_into_one_request():
+    """Три сообщения подряд дают один AI-запрос"""
+    calls = []
+
+    async def request(text):
+        calls.append(text)
+        return f"ответ на: {text}"
+
+    async def scenario():
+        coalescer = RequestCoalescer(window=0.05)
+        tasks = []
+        for message in ['У кошки рвота', 'Второй день', 'Не ест']:
+            tasks.append(asyncio.create_task(coalescer.run(1, message, request)))
+            await asyncio.sleep(0.01)
+        return await asyncio.gather(*tasks)
+
+    results = asyncio.run(scenario())
+
+    assert calls == ['У кошки рвота\nВторой день\nНе ест']
+    assert results[:2] == [None, None]
+    assert results[2] == 'ответ на: У кошки рвота\nВторой день\nНе ест'
+
+def test_new_message_cancels_in_flight_request():
+    """Новое сообщение отменяет выполняющийся запрос и забирает его текст"""
+    calls = []
+
+    async def request(text):
+        calls.append(text)
+        await asyncio.sleep(0.2 if len(calls) == 1 else 0)
+        return text
+
+    async def scenario():
+        coalescer = RequestCoalescer(window=0.01)
+        first = asyncio.create_task(coalescer.run(1, 'первое', request))
+        await asyncio.sleep(0.05)
+        second = asyncio.create_task(coalescer.run(1, 'второе', request))
+        return await asyncio.gather(first, second), coalescer
+
+    (first, second), coalescer = asyncio.run(scenario())
+
+    assert first is None
+    assert second == 'первое\nвторое'
+    assert coalescer.cancelled_count == 1
+
+def test_global_limit_caps_concurrent_requests():
+    """Глобальный лимит ограничивает параллельные запросы разных пользователей"""
+    active = 0
+    peak = 0
+
+    async def request(text):
+        nonlocal active, peak
+        active += 1
+        peak = max(peak, active)
+        await asyncio.sleep(0.02)
+        active -= 1
+        return text
+
+    async def scenario():
+        coalescer = RequestCoalescer(window=0, global_limit=2)
+        return await asyncio.gather(*(coalescer.run(user_id, 'вопрос', request) for user_id in range(6)))
+
+    results = asyncio.run(scenario())
+
+    assert results == ['вопрос'] * 6
+    assert peak == 2
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Тесты приоритетного планировщика AI-запросов
+"""
+
+import asyncio
+from ai_scheduler import AIScheduler, classify_urgency, EMERGENCY, URGENT, ROUTINE
+
+def test_classify_urgency():
+    """Срочность определяется по ключевым словам и заявке на вызов врача"""
+    assert classify_urgency('Похоже на отравление, кошка шатается') == EMERGENCY
+    assert classify_urgency('Кот НЕ ДЫШИТ нормально') == EMERGENCY
+    assert classify_urgency('В моче кровь') == EMERGENCY
+    assert classify_urgency('Третий день рвота') == URGENT
+    assert classify_urgency('Каким кормом лучше кормить?') == ROUTINE
+    assert classify_urgency('Каким кормом лучше кормить?', call_urgency='high') == URGENT
+    assert classify_urgency('Каким кормом лучше кормить?', call_urgency='emergency') == EMERGENCY
+
+def test_emergency_overtakes_routine_queue():
+    """Экстренный вопрос обслуживается раньше накопившихся обычных"""
+    order = []
+
+    def request(name):
+        async def run():
+            order.append(name)
+            await asyncio.sleep(0.01)
+            return name
+        return run
+
+    async def scenario():
+        scheduler = AIScheduler(max_concurrency=1)
+        tasks = [asyncio.create_task(scheduler.submit(request(f'диета {i}'), ROUTINE)) for i in range(4)]
+        await asyncio.sleep(0)
+        tasks.append(asyncio.create_task(scheduler.submit(request('отравление'), EMERGENCY)))
+        await asyncio.gather(*tasks)
+        return scheduler.stats()
+
+    stats = asyncio.run(scenario())
+
+    assert order.index('отравление') == 1
+    assert stats[ROUTINE]['served'] == 4
+    assert stats[EMERGENCY]['served'] == 1
+
+def test_weighted_fair_share_does_not_starve_routine():
+    """Обычные вопросы получают свою долю слотов даже под потоком срочных"""
+    order = []
+
+    def request(lane):
+        async def run():
+            order.append(lane)
+            return lane
+        return run
+
+    async def scenario():
+        scheduler = AIScheduler(max_concurrency=1)
+        blocker = asyncio.create_task(scheduler.submit(lambda: asyncio.sleep(0.01), ROUTINE))
+        await asyncio.sleep(0)
+        tasks = [asyncio.create_task(scheduler.submit(request(URGENT), URGENT)) for _ in range(8)]
+        tasks += [asyncio.create_task(scheduler.submit(request(ROUTINE), ROUTINE)) for _ in range(2)]
+        await asyncio.gather(blocker, *tasks)
+
+    asyncio.run(scenario())
+
+    assert ROUTINE in order[:6]
+
+def test_missed_deadline_returns_fallback():
+    """Запрос, не успевший выполниться до срока, получает резервный ответ"""
+    async def slow():
+        await asyncio.sleep(1)
+        return 'AI'
+
+    async def scenario():
+        scheduler = AIScheduler(max_concurrency=1)
+        result = await scheduler.submit(slow, ROUTINE, fallback=lambda: 'позвоните врачу', deadline=0.05)
+        await asyncio.sleep(0.01)  # даем отмененному запросу освободить слот
+        return result, scheduler.stats()
+
+    result, stats = asyncio.run(scenario())
+
+    assert result == 'позвоните врачу'
+    assert stats[ROUTINE]['expired'] == 1
+    assert stats['running'] == 0
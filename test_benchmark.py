@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+"""
+Тесты сравнения прогона бенчмарка с базовым
+"""
+
+import copy
+
+from benchmark import compare
+
+def make_results():
+    return {
+        'updates_per_second': 10.0,
+        'steps': {'ai_answer': {'count': 40, 'timeouts': 0, 'p50': 1.6, 'p99': 2.0},
+                  'start': {'count': 20, 'timeouts': 0, 'p50': 0.015, 'p99': 0.025}},
+        'handlers': {'main_bot.handle_message': {'count': 46, 'p50': 1.6, 'p99': 2.4}},
+        'db': {'lock_wait': {'doctor_bot.consultation_claim': {'count': 6, 'p50': 0.001, 'p99': 0.004}},
+               'lock_timeouts': 0, 'locked_errors': 0, 'queries': {}},
+        'loop_blocks': {},
+    }
+
+def test_slower_and_failing_run_is_a_regression():
+    baseline = make_results()
+    results = copy.deepcopy(baseline)
+    results['steps']['ai_answer']['p99'] = 3.0
+    results['steps']['start']['timeouts'] = 1
+    results['db']['lock_wait']['doctor_bot.consultation_claim']['p99'] = 0.5
+    results['updates_per_second'] = 6.0
+
+    regressions = [line.split(':')[0] for line in compare(results, baseline, tolerance=0.3)]
+    assert regressions == [
+        'db.lock_wait.doctor_bot.consultation_claim.p99',
+        'steps.ai_answer.p99',
+        'steps.start.timeouts',
+        'updates_per_second',
+    ]
+
+def test_noise_and_new_metrics_are_not_regressions():
+    baseline = make_results()
+    results = copy.deepcopy(baseline)
+    # +100% на задержке в миллисекунды - ниже порога LATENCY_FLOOR
+    results['steps']['start']['p50'] = 0.02
+    results['steps']['ai_answer']['p99'] = 2.5
+    results['steps']['vet_call'] = {'count': 20, 'timeouts': 3, 'p50': 0.2, 'p99': 0.3}
+
+    assert compare(results, baseline, tolerance=0.3) == []
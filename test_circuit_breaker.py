@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Тесты предохранителя для DeepSeek
+"""
+
+import asyncio
+from circuit_breaker import CircuitBreaker, CLOSED, OPEN, HALF_OPEN
+
+def fallback():
+    return 'резервный ответ'
+
+def test_opens_after_failures_and_short_circuits():
+    """После серии ошибок запросы не отправляются, а сразу получают fallback"""
+    calls = 0
+
+    async def failing():
+        nonlocal calls
+        calls += 1
+        raise ConnectionError('DeepSeek недоступен')
+
+    async def scenario():
+        breaker = CircuitBreaker('test', failure_threshold=3, reset_timeout=60)
+        results = [await breaker.call(failing, fallback) for _ in range(5)]
+        return breaker, results
+
+    breaker, results = asyncio.run(scenario())
+
+    assert results == ['резервный ответ'] * 5
+    assert calls == 3
+    assert breaker.state == OPEN
+    assert breaker.short_circuited == 2
+
+def test_half_open_probe_closes_circuit():
+    """После паузы один пробный запрос замыкает цепь"""
+    async def ok():
+        return 'AI'
+
+    async def scenario():
+        breaker = CircuitBreaker('test', failure_threshold=1, reset_timeout=0)
+        breaker.record_failure()
+        assert breaker.state == OPEN
+        assert breaker.allow_request()
+        assert breaker.state == HALF_OPEN
+        assert not breaker.allow_request()  # пробный запрос только один
+        breaker._probe_in_flight = False
+        return await breaker.call(ok, fallback), breaker.state
+
+    assert asyncio.run(scenario()) == ('AI', CLOSED)
+
+def test_latency_slo_breaches_open_circuit():
+    """Серия медленных ответов размыкает цепь так же, как ошибки"""
+    breaker = CircuitBreaker('test', slow_threshold=2, latency_slo=1.0)
+
+    breaker.record_success(5.0)
+    assert breaker.state == CLOSED
+    breaker.record_success(5.0)
+    assert breaker.state == OPEN
+
+def test_hedged_request_returns_faster_duplicate():
+    """Если первый запрос завис, ответ дает дубликат"""
+    calls = 0
+
+    async def flaky():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(1 if calls == 1 else 0.01)
+        return f'ответ {calls}'
+
+    async def scenario():
+        breaker = CircuitBreaker('test', hedge=True, hedge_min_delay=0.02, latency_slo=0.04)
+        return await breaker.call(flaky, fallback), breaker
+
+    result, breaker = asyncio.run(scenario())
+
+    assert result == 'ответ 2'
+    assert breaker.hedged == 1
+
+def test_hung_calls_open_circuit():
+    """Зависший вызов - ошибка по таймауту предохранителя"""
+    async def hung():
+        await asyncio.sleep(10)
+
+    async def scenario():
+        breaker = CircuitBreaker('test', failure_threshold=2, timeout=0.05)
+        results = [await breaker.call(hung, fallback) for _ in range(2)]
+        return results, breaker.state
+
+    assert asyncio.run(scenario()) == (['резервный ответ'] * 2, OPEN)
+
+def test_cancelled_calls_are_not_failures():
+    """Отмена снаружи (склейка сообщений клиента) не размыкает цепь и освобождает пробный запрос"""
+    async def slow():
+        await asyncio.sleep(10)
+
+    async def scenario():
+        breaker = CircuitBreaker('test', failure_threshold=1, reset_timeout=0)
+        for _ in range(3):
+            task = asyncio.create_task(breaker.call(slow, fallback))
+            await asyncio.sleep(0.01)
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        assert breaker.state == CLOSED
+
+        breaker._open('test')
+        probe = asyncio.create_task(breaker.call(slow, fallback))
+        await asyncio.sleep(0.01)
+        probe.cancel()
+        await asyncio.gather(probe, return_exceptions=True)
+        return breaker.allow_request()
+
+    assert asyncio.run(scenario()) is True
+
+def test_regular_call_keeps_probe_slot():
+    """Обычный вызов, завершившийся во время пробного, не открывает второй пробный"""
+    async def scenario():
+        release = asyncio.Event()
+
+        async def slow():
+            await release.wait()
+            raise ConnectionError('DeepSeek недоступен')
+
+        breaker = CircuitBreaker('test', failure_threshold=1, reset_timeout=0)
+        regular = asyncio.create_task(breaker.call(slow, fallback))
+        await asyncio.sleep(0)
+        breaker._open('test')
+        assert breaker.allow_request()  # пробный запрос занят
+        release.set()
+        await regular
+        breaker.state = HALF_OPEN
+        return breaker.allow_request()
+
+    assert asyncio.run(scenario()) is False
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Тесты постраничной истории консультации
+"""
+
+import asyncio
+import sqlite3
+from types import SimpleNamespace
+from telegram.error import RetryAfter
+from consultation_history import ConsultationHistory
+from vetbot_improved.utils.telegram_format import utf16_length
+
+def make_db(path, messages):
+    conn = sqlite3.connect(path)
+    conn.execute('''
+        CREATE TABLE consultation_messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            consultation_id INTEGER NOT NULL,
+            sender_type TEXT NOT NULL,
+            sender_id INTEGER,
+            sender_name TEXT,
+            message_text TEXT NOT NULL,
+            sent_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            telegram_message_id INTEGER
+        )
+    ''')
+    for consultation_id, sender_type, text in messages:
+        conn.execute('''
+            INSERT INTO consultation_messages (consultation_id, sender_type, sender_name, message_text)
+            VALUES (?, ?, ?, ?)
+        ''', (consultation_id, sender_type, sender_type.title(), text))
+    conn.commit()
+    conn.close()
+    return str(path)
+
+class FakeBot:
+    """Бот, один раз отвечающий RetryAfter"""
+
+    def __init__(self):
+        self.sent = []
+        self.throttled = False
+
+    async def send_message(self, **params):
+        if not self.throttled:
+            self.throttled = True
+            raise RetryAfter(0)
+        self.sent.append(params)
+        return SimpleNamespace(message_id=len(self.sent))
+
+def test_pages_follow_cursor(tmp_path):
+    """Страницы идут по порядку, чужие консультации не попадают"""
+    messages = [(1, 'client', f'вопрос {i}') for i in range(7)] + [(2, 'client', 'чужое')]
+    history = ConsultationHistory(make_db(tmp_path / 'test.db', messages), page_size=3)
+
+    texts, cursor = [], 0
+    while True:
+        rows, cursor = history.page(1, cursor or 0)
+        texts.extend(row[3] for row in rows)
+        if cursor is None:
+            break
+
+    assert texts == [f'вопрос {i}' for i in range(7)]
+
+def test_long_history_fits_telegram_limit(tmp_path):
+    """Длинная история и длинные сообщения делятся на части в пределах лимита"""
+    messages = [(1, 'client', 'У кота <температура> & кашель. ' * 40) for _ in range(10)]
+    messages.append((1, 'doctor', 'Очень длинное назначение. ' * 400))
+    history = ConsultationHistory(make_db(tmp_path / 'test.db', messages), page_size=20)
+
+    rows, _ = history.page(1)
+    chunks = history.render(rows, "📖 <b>История:</b>\n\n")
+
+    assert len(chunks) > 3
+    assert all(utf16_length(chunk) <= 4096 for chunk in chunks)
+    assert '&lt;температура&gt; &amp;' in chunks[0]
+
+def test_send_page_offers_more_and_survives_throttling(tmp_path):
+    """Последняя часть страницы несет кнопку "показать ещё", RetryAfter переживается"""
+    messages = [(1, 'client', f'вопрос {i}') for i in range(5)]
+    history = ConsultationHistory(make_db(tmp_path / 'test.db', messages), page_size=3)
+    bot = FakeBot()
+
+    cursor = asyncio.run(history.send_page(bot, 77, 1))
+    assert cursor == 3
+    button = bot.sent[-1]['reply_markup'].inline_keyboard[0][0]
+    assert button.callback_data == 'history_1_3'
+
+    assert asyncio.run(history.send_page(bot, 77, 1, cursor)) is None
+    assert bot.sent[-1]['reply_markup'] is None
+    assert 'вопрос 4' in bot.sent[-1]['text']
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Тесты сборки контекста диалога для AI
+"""
+
+import sqlite3
+from conversation_context import ConversationContext, estimate_tokens, summarize_turns
+
+def make_db(path):
+    """Минимальная схема таблиц бота, из которых берется история"""
+    conn = sqlite3.connect(path)
+    conn.executescript('''
+        CREATE TABLE consultations (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, question TEXT,
+            response TEXT, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        CREATE TABLE active_consultations (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, client_id INTEGER NOT NULL
+        );
+        CREATE TABLE consultation_messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, consultation_id INTEGER NOT NULL,
+            sender_type TEXT NOT NULL, message_text TEXT NOT NULL,
+            sent_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+    ''')
+    conn.commit()
+    conn.close()
+    return str(path)
+
+def add_consultation(db_path, user_id, question, response, minute):
+    conn = sqlite3.connect(db_path)
+    conn.execute(
+        'INSERT INTO consultations (user_id, question, response, created_at) VALUES (?, ?, ?, ?)',
+        (user_id, question, response, f'2024-01-01 10:{minute:02d}:00')
+    )
+    conn.commit()
+    conn.close()
+
+def test_follow_up_gets_previous_turns(tmp_path):
+    """Уточняющий вопрос отправляется вместе с предыдущим обменом"""
+    db_path = make_db(tmp_path / 'test.db')
+    add_consultation(db_path, 1, 'Кошке назначили энтерофурил',
+                     'Давайте по инструкции.\n\n⚠️ Для точного диагноза рекомендуется очный осмотр', 0)
+    add_consultation(db_path, 2, 'Чужой вопрос', 'Чужой ответ', 1)
+
+    history, summary = ConversationContext(db_path).build(1, 'а сколько давать?')
+
+    assert history == [
+        {'role': 'user', 'content': 'Кошке назначили энтерофурил'},
+        {'role': 'assistant', 'content': 'Давайте по инструкции.'},
+    ]
+    assert summary == ''
+
+def test_doctor_messages_are_included(tmp_path):
+    """Переписка с врачом тоже попадает в историю"""
+    db_path = make_db(tmp_path / 'test.db')
+    add_consultation(db_path, 1, 'Кот хромает', 'Осмотрите лапу.', 0)
+    conn = sqlite3.connect(db_path)
+    conn.execute('INSERT INTO active_consultations (client_id) VALUES (1)')
+    conn.execute("INSERT INTO consultation_messages (consultation_id, sender_type, message_text, sent_at) "
+                 "VALUES (1, 'doctor', 'Пришлите фото лапы', '2024-01-01 10:05:00')")
+    conn.commit()
+    conn.close()
+
+    history, _ = ConversationContext(db_path).build(1, 'Фото отправил')
+
+    assert history[-1] == {'role': 'assistant', 'content': 'Врач: Пришлите фото лапы'}
+
+def test_old_turns_are_summarized_once(tmp_path):
+    """Реплики вне бюджета сворачиваются в краткое содержание один раз"""
+    db_path = make_db(tmp_path / 'test.db')
+    for minute in range(6):
+        add_consultation(db_path, 1, f'Вопрос номер {minute} про корм. Подробности.',
+                         f'Ответ номер {minute}. ' + 'текст ' * 20, minute)
+
+    calls = []
+
+    def summarizer(summary, turns, max_tokens):
+        calls.append(len(turns))
+        return summarize_turns(summary, turns, max_tokens)
+
+    context = ConversationContext(db_path, token_budget=160, summary_tokens=40, summarizer=summarizer)
+    history, summary = context.build(1, 'Еще вопрос')
+
+    assert summary.startswith('Клиент: Вопрос номер ') and estimate_tokens(summary) <= 40
+    assert history[0]['content'].split('.')[0] not in summary
+    assert history[0]['role'] == 'user'
+    assert estimate_tokens(summary) + sum(estimate_tokens(m['content']) for m in history) <= 160
+    assert len(calls) == 1
+
+    # Повторная сборка не пересчитывает содержание, в том числе после перезапуска
+    assert context.build(1, 'Еще вопрос') == (history, summary)
+    restarted = ConversationContext(db_path, token_budget=160, summary_tokens=40, summarizer=summarizer)
+    assert restarted.build(1, 'Еще вопрос') == (history, summary)
+    assert len(calls) == 1
+
+def test_same_second_turns_keep_order(tmp_path):
+    """Сообщения, отправленные в одну секунду, идут в порядке отправки"""
+    db_path = make_db(tmp_path / 'test.db')
+    conn = sqlite3.connect(db_path)
+    conn.execute('INSERT INTO active_consultations (client_id) VALUES (1)')
+    for text in ('first', 'second', 'third'):
+        conn.execute("INSERT INTO consultation_messages (consultation_id, sender_type, message_text, sent_at) "
+                     "VALUES (1, 'client', ?, '2024-01-01 10:05:00')", (text,))
+    conn.commit()
+    conn.close()
+
+    turns = ConversationContext(db_path).recent_turns(1)
+
+    assert [turn['content'] for turn in turns] == ['first', 'second', 'third']
+
+def test_turns_over_the_cap_are_summarized(tmp_path):
+    """Реплики сверх AI_CONTEXT_TURNS сворачиваются, даже если бюджет токенов велик"""
+    db_path = make_db(tmp_path / 'test.db')
+    for minute in range(4):
+        add_consultation(db_path, 1, f'Вопрос {minute}.', f'Ответ {minute}.', minute)
+
+    history, summary = ConversationContext(db_path, token_budget=10000, max_turns=4).build(1)
+
+    assert [m['content'] for m in history] == ['Вопрос 2.', 'Ответ 2.', 'Вопрос 3.', 'Ответ 3.']
+    assert summary.split('\n') == [f'{label}: {kind} {n}.' for n in range(2)
+                                   for label, kind in (('Клиент', 'Вопрос'), ('Ответ', 'Ответ'))]
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Тесты выбора врачей для уведомления о новом клиенте
+"""
+
+import json
+import asyncio
+import sqlite3
+from doctor_routing import DoctorRouter
+from notification_system import NotificationSystem
+
+def make_db(path, doctors=7):
+    conn = sqlite3.connect(path)
+    conn.executescript('''
+        CREATE TABLE doctors (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            telegram_id INTEGER UNIQUE NOT NULL,
+            full_name TEXT NOT NULL,
+            is_approved BOOLEAN DEFAULT 1,
+            is_active BOOLEAN DEFAULT 1,
+            last_activity TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        CREATE TABLE active_consultations (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            client_id INTEGER NOT NULL,
+            doctor_id INTEGER,
+            status TEXT DEFAULT 'waiting',
+            client_name TEXT,
+            initial_message TEXT
+        );
+        CREATE TABLE doctor_notifications (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            consultation_id INTEGER NOT NULL,
+            doctor_id INTEGER NOT NULL,
+            message_id INTEGER,
+            is_responded BOOLEAN DEFAULT 0
+        );
+    ''')
+    for i in range(1, doctors + 1):
+        conn.execute('INSERT INTO doctors (telegram_id, full_name) VALUES (?, ?)', (100 + i, f'Врач {i}'))
+    conn.commit()
+    conn.close()
+    return str(path)
+
+def notified_doctors(db_path):
+    conn = sqlite3.connect(db_path)
+    rows = conn.execute("SELECT params FROM telegram_outbox WHERE dedup_key LIKE 'notify:%' ORDER BY id").fetchall()
+    conn.close()
+    return [json.loads(params)['chat_id'] for params, in rows]
+
+def test_rank_prefers_free_and_fast_doctors(tmp_path):
+    """Сначала врачи без консультаций в работе, среди них - быстрее отвечающие"""
+    db_path = make_db(tmp_path / 'test.db', doctors=3)
+    conn = sqlite3.connect(db_path)
+    conn.execute("INSERT INTO active_consultations (client_id, doctor_id, status) VALUES (1, 1, 'active')")
+    conn.execute("INSERT INTO active_consultations (client_id, doctor_id, status) VALUES (2, 3, 'completed')")
+    router = DoctorRouter(db_path)
+    router.init_database(conn)
+    conn.execute('INSERT INTO doctor_stats (doctor_id, response_ewma) VALUES (2, 300), (3, 10)')
+    conn.commit()
+    conn.close()
+
+    ranked = DoctorRouter(db_path).rank()
+    assert [(doctor['id'], doctor['load']) for doctor in ranked] == [(3, 0), (2, 0), (1, 1)]
+
+def escalation_timers(db_path):
+    conn = sqlite3.connect(db_path)
+    rows = conn.execute("SELECT ref_id FROM sla_timers WHERE kind = 'consultation.escalate'").fetchall()
+    conn.close()
+    return [row[0] for row in rows]
+
+def test_waves_escalate_until_client_is_taken(tmp_path):
+    """Уведомление получают несколько врачей, после таймаута - следующие"""
+    db_path = make_db(tmp_path / 'test.db')
+    system = NotificationSystem(db_path)
+    system.vet_bot = object()
+    system.router = DoctorRouter(db_path, initial=3, step=2, timeout=60)
+
+    conn = sqlite3.connect(db_path)
+    conn.execute("INSERT INTO active_consultations (client_id, client_name, initial_message) VALUES (42, 'Клиент', 'Кот чихает')")
+    conn.commit()
+    conn.close()
+
+    assert asyncio.run(system.notify_doctors_about_client(1, 'Клиент', 'Кот чихает'))
+    assert notified_doctors(db_path) == [101, 102, 103]
+
+    # Следующую волну запускает SLA-таймер consultation.escalate
+    assert escalation_timers(db_path) == [1]
+    assert system.escalate_consultation(1) == 2
+    assert notified_doctors(db_path) == [101, 102, 103, 104, 105]
+
+    success, _ = system.claim_consultation(1, 104)
+    assert success
+
+    conn = sqlite3.connect(db_path)
+    routes = conn.execute('SELECT COUNT(*) FROM consultation_routing').fetchone()[0]
+    responses = conn.execute('SELECT doctor_id, responses FROM doctor_stats').fetchall()
+    conn.close()
+
+    assert escalation_timers(db_path) == []
+    assert system.escalate_consultation(1) == 0
+    assert notified_doctors(db_path) == [101, 102, 103, 104, 105]
+    assert routes == 0
+    assert responses == [(4, 1)]
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+Тесты шины событий между процессами
+"""
+
+import asyncio
+import sqlite3
+from event_bus import EventBus
+
+def test_event_in_transaction_is_visible_after_commit(tmp_path):
+    """Событие, записанное в транзакции, появляется только вместе с ней"""
+    db_path = str(tmp_path / 'test.db')
+    bus = EventBus(db_path)
+    bus.init_database()
+
+    conn = sqlite3.connect(db_path)
+    bus.publish('consultation.created', {'consultation_id': 1}, conn=conn)
+    assert bus.fetch() == []
+
+    conn.commit()
+    conn.close()
+    assert [event['payload'] for event in bus.fetch()] == [{'consultation_id': 1}]
+
+def test_subscriber_resumes_from_cursor(tmp_path):
+    """После перезапуска подписчик получает пропущенные события, но не старые"""
+    db_path = str(tmp_path / 'test.db')
+    publisher = EventBus(db_path)
+    publisher.publish('consultation.created', {'consultation_id': 1})
+
+    received = []
+    consumer = EventBus(db_path, consumer='main_bot')
+    consumer.subscribe('consultation.*', lambda event: received.append(event['payload']['consultation_id']))
+    consumer.subscribe('admin.*', lambda event: received.append('admin'))
+
+    # Новый подписчик начинает с конца журнала
+    assert asyncio.run(consumer.dispatch_pending()) == 0
+
+    publisher.publish('consultation.assigned', {'consultation_id': 2})
+    publisher.publish('message.relayed', {'consultation_id': 2})
+    restarted = EventBus(db_path, consumer='main_bot')
+    restarted._handlers = consumer._handlers
+
+    assert asyncio.run(restarted.dispatch_pending()) == 2
+    assert received == [2]
+
+def test_run_delivers_events_from_other_connections(tmp_path):
+    """Цикл подписчика реагирует на событие другого процесса без опроса таблиц"""
+    db_path = str(tmp_path / 'test.db')
+    consumer = EventBus(db_path, consumer='doctor_bot', poll_interval=0.01)
+    delivered = asyncio.Queue()
+
+    async def on_assigned(event):
+        await delivered.put(event['payload'])
+
+    consumer.subscribe('consultation.assigned', on_assigned)
+
+    async def scenario():
+        task = asyncio.create_task(consumer.run())
+        await asyncio.sleep(0.05)
+        EventBus(db_path).publish('consultation.assigned', {'consultation_id': 7, 'reassigned': True})
+        payload = await asyncio.wait_for(delivered.get(), timeout=2)
+        consumer.stop()
+        await task
+        return payload
+
+    assert asyncio.run(scenario()) == {'consultation_id': 7, 'reassigned': True}
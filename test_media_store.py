@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+"""
+Тесты хранилища фотографий врачей
+"""
+
+import os
+from media_store import MediaStore
+
+def test_same_photo_is_stored_once(tmp_path):
+    """Одинаковые фото дедуплицируются по содержимому"""
+    store = MediaStore(base_dir=str(tmp_path / 'media'), db_path=str(tmp_path / 'test.db'))
+
+    first = store.save_photo(b'photo-bytes', thumbnail=b'thumb-bytes')
+    second = store.save_photo(bytearray(b'photo-bytes'))
+
+    assert first == second
+    assert os.path.basename(first).startswith(MediaStore.content_hash(b'photo-bytes'))
+    with open(store.thumbnail_path(first), 'rb') as f:
+        assert f.read() == b'thumb-bytes'
+
+def test_file_id_is_cached_after_upload(tmp_path):
+    """После первой отправки фото берется по file_id"""
+    db_path = str(tmp_path / 'test.db')
+    store = MediaStore(base_dir=str(tmp_path / 'media'), db_path=db_path)
+
+    path = store.save_photo(b'photo-bytes')
+    assert store.get_file_id(path) is None
+
+    store.remember_file_id(path, 'AgACAgIAAxkBAAIB')
+    assert store.get_file_id(path) == 'AgACAgIAAxkBAAIB'
+
+    # Новый экземпляр (перезапуск бота) читает file_id из БД
+    restarted = MediaStore(base_dir=str(tmp_path / 'media'), db_path=db_path)
+    assert restarted.get_file_id(path) == 'AgACAgIAAxkBAAIB'
+
+def test_legacy_photo_path_gets_file_id(tmp_path):
+    """Фото, сохраненные до появления хранилища, тоже кэшируют file_id"""
+    store = MediaStore(base_dir=str(tmp_path / 'media'), db_path=str(tmp_path / 'test.db'))
+
+    store.remember_file_id('doctor_photos/1_old.jpg', 'legacy-file-id')
+
+    assert store.get_file_id('doctor_photos/1_old.jpg') == 'legacy-file-id'
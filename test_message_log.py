@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Тесты отложенной пакетной записи сообщений консультаций
+"""
+
+import sqlite3
+import threading
+from message_log import MessageLog
+
+def make_db(path):
+    conn = sqlite3.connect(path)
+    conn.execute('''
+        CREATE TABLE consultation_messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            consultation_id INTEGER NOT NULL,
+            sender_type TEXT NOT NULL,
+            sender_id INTEGER,
+            sender_name TEXT,
+            message_text TEXT NOT NULL,
+            sent_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            telegram_message_id INTEGER
+        )
+    ''')
+    conn.commit()
+    conn.close()
+    return str(path)
+
+def count_messages(db_path):
+    conn = sqlite3.connect(db_path)
+    count = conn.execute('SELECT COUNT(*) FROM consultation_messages').fetchone()[0]
+    conn.close()
+    return count
+
+def test_messages_are_written_in_group_commits(tmp_path):
+    """Сообщения из нескольких потоков записываются небольшим числом транзакций"""
+    db_path = make_db(tmp_path / 'test.db')
+    log = MessageLog(db_path, batch_size=50, flush_ms=20)
+    batches = []
+    log.on_flush(lambda conn, rows: batches.append(len(rows)))
+
+    def relay(sender_id):
+        for i in range(100):
+            log.append(1, 'client', sender_id, 'Клиент', f'сообщение {i}')
+
+    threads = [threading.Thread(target=relay, args=(sender_id,)) for sender_id in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    log.close()
+
+    assert count_messages(db_path) == 400
+    assert sum(batches) == 400
+    assert len(batches) < 400 // 10
+
+    conn = sqlite3.connect(db_path)
+    assert conn.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+    conn.close()
+
+def test_failed_flush_keeps_messages(tmp_path):
+    """Если учет в транзакции сброса упал, сообщения не теряются и не дублируются"""
+    db_path = make_db(tmp_path / 'test.db')
+    log = MessageLog(db_path)
+    failures = [RuntimeError('events table is locked')]
+
+    def hook(conn, rows):
+        if failures:
+            raise failures.pop()
+
+    log.on_flush(hook)
+    log._buffer.append({
+        'consultation_id': 1, 'sender_type': 'doctor', 'sender_id': 7, 'sender_name': 'Врач',
+        'message_text': 'Дайте воды', 'sent_at': '2024-01-01 10:00:00', 'telegram_message_id': None, 'trace_id': None,
+    })
+
+    try:
+        log.flush()
+    except RuntimeError:
+        pass
+    assert count_messages(db_path) == 0
+    assert log.pending() == 1
+
+    assert log.flush() == 1
+    assert count_messages(db_path) == 1
+
+def test_history_includes_buffered_messages(tmp_path):
+    """История консультации сразу видит только что переданное сообщение"""
+    from notification_system import NotificationSystem
+
+    db_path = make_db(tmp_path / 'test.db')
+    system = NotificationSystem(db_path)
+    system.messages = MessageLog(db_path, flush_ms=10000)
+
+    system.add_consultation_message(3, 'client', 42, 'Клиент', 'Кот чихает')
+    system.add_consultation_message(3, 'ai', 0, 'AI', 'Понаблюдайте за котом')
+
+    history = system.get_consultation_history(3)
+    assert [message_text for _, _, message_text, _ in history] == ['Кот чихает', 'Понаблюдайте за котом']
+    system.messages.close()
+
+def test_messages_keep_handler_trace_id(tmp_path):
+    """Сообщение хранит trace_id обработчика; старая схема получает колонку"""
+    from vetbot_improved.utils import tracing
+    previous = tracing.configure().path
+    tracing.configure(path=str(tmp_path / 'traces.jsonl'))
+
+    db_path = make_db(tmp_path / 'test.db')
+    log = MessageLog(db_path)
+    with tracing.span('handler.test') as handler:
+        log.append(1, 'client', 42, 'Клиент', 'Кот чихает')
+    log.append(1, 'ai', 0, 'AI', 'Понаблюдайте')
+    log.close()
+    tracing.configure(path=previous)
+
+    conn = sqlite3.connect(db_path)
+    rows = conn.execute('SELECT trace_id FROM consultation_messages ORDER BY id').fetchall()
+    conn.close()
+    assert rows == [(handler.trace_id,), (None,)]
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Тесты SLA-таймеров консультаций
+"""
+
+import time
+import asyncio
+import sqlite3
+from sla_scheduler import SLAScheduler
+from notification_system import NotificationSystem
+
+def make_db(path):
+    conn = sqlite3.connect(path)
+    conn.executescript('''
+        CREATE TABLE doctors (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            telegram_id INTEGER UNIQUE NOT NULL,
+            full_name TEXT NOT NULL,
+            is_approved BOOLEAN DEFAULT 1,
+            is_active BOOLEAN DEFAULT 1,
+            last_activity TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        CREATE TABLE active_consultations (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            client_id INTEGER NOT NULL,
+            doctor_id INTEGER,
+            status TEXT DEFAULT 'waiting',
+            client_username TEXT,
+            client_name TEXT,
+            initial_message TEXT
+        );
+        CREATE TABLE doctor_notifications (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            consultation_id INTEGER NOT NULL,
+            doctor_id INTEGER NOT NULL,
+            message_id INTEGER,
+            is_responded BOOLEAN DEFAULT 0
+        );
+        CREATE TABLE consultation_messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            consultation_id INTEGER NOT NULL,
+            sender_type TEXT NOT NULL,
+            sender_id INTEGER,
+            sender_name TEXT,
+            message_text TEXT NOT NULL,
+            sent_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            telegram_message_id INTEGER
+        );
+        INSERT INTO doctors (telegram_id, full_name) VALUES (101, 'Врач 1'), (102, 'Врач 2');
+    ''')
+    conn.commit()
+    conn.close()
+    return str(path)
+
+def timers(db_path):
+    conn = sqlite3.connect(db_path)
+    rows = conn.execute('SELECT kind, ref_id FROM sla_timers ORDER BY kind, ref_id').fetchall()
+    conn.close()
+    return rows
+
+def test_only_near_timers_are_loaded_and_fired(tmp_path):
+    """В память попадают таймеры в пределах lookahead; обработчик решает, повторять ли"""
+    db_path = str(tmp_path / 'test.db')
+    scheduler = SLAScheduler(db_path, lookahead=60)
+    scheduler.schedule('ping', 1, 0)
+    scheduler.schedule('once', 2, 0)
+    scheduler.schedule('ping', 3, 3600)
+
+    calls = []
+    scheduler.on('ping', lambda ref_id, fired: calls.append((ref_id, fired)) or 10)
+    scheduler.on('once', lambda ref_id, fired: calls.append((ref_id, fired)))
+
+    assert scheduler.load() == 2
+    assert asyncio.run(scheduler.fire_due()) == 2
+    assert sorted(calls) == [(1, 0), (2, 0)]
+    assert timers(db_path) == [('ping', 1), ('ping', 3)]
+
+    # Повторное срабатывание получает счетчик предыдущих
+    scheduler.load(now=time.time() + 20)
+    asyncio.run(scheduler.fire_due(now=time.time() + 20))
+    assert calls[-1] == (1, 1)
+
+def test_rescheduled_timer_is_not_overwritten_by_firing(tmp_path):
+    """Если таймер перенесли, пока он срабатывал, перенос сохраняется"""
+    db_path = str(tmp_path / 'test.db')
+    scheduler = SLAScheduler(db_path)
+    scheduler.schedule('consultation.idle', 5, 0)
+
+    def handler(ref_id, fired):
+        scheduler.schedule('consultation.idle', ref_id, 3600)
+
+    scheduler.on('consultation.idle', handler)
+    scheduler.load()
+    asyncio.run(scheduler.fire_due())
+
+    conn = sqlite3.connect(db_path)
+    due_at = conn.execute('SELECT due_at FROM sla_timers').fetchone()[0]
+    conn.close()
+    assert due_at > time.time() + 3000
+
+def test_consultation_lifecycle_timers(tmp_path):
+    """Ожидание врача повторно оповещает врачей, тишина завершает консультацию"""
+    db_path = make_db(tmp_path / 'test.db')
+    system = NotificationSystem(db_path)
+    scheduler = system.create_sla_scheduler()
+
+    consultation_id = system.create_consultation_request(42, 'client', 'Клиент', 'Кот чихает')
+    assert timers(db_path) == [('consultation.unclaimed', consultation_id)]
+
+    assert system.renotify_unclaimed(consultation_id) is not None
+    conn = sqlite3.connect(db_path)
+    queued = conn.execute('SELECT dedup_key FROM telegram_outbox ORDER BY id').fetchall()
+    conn.close()
+    assert [key for key, in queued] == ['notify:1:101:1', 'notify:1:102:1', 'unclaimed:1']
+
+    success, _ = system.claim_consultation(consultation_id, 101)
+    assert success
+    assert timers(db_path) == [('consultation.idle', consultation_id)]
+
+    # Тишина дольше SLA - срабатывает таймер автозавершения
+    conn = sqlite3.connect(db_path)
+    conn.execute('UPDATE sla_timers SET due_at = 0')
+    conn.commit()
+    conn.close()
+    scheduler.load()
+    assert asyncio.run(scheduler.fire_due()) == 1
+
+    conn = sqlite3.connect(db_path)
+    status = conn.execute('SELECT status FROM active_consultations').fetchone()[0]
+    notices = conn.execute("SELECT dedup_key FROM telegram_outbox WHERE dedup_key LIKE 'idle_completed:%'").fetchall()
+    conn.close()
+    assert status == 'completed'
+    assert len(notices) == 2
+    assert timers(db_path) == []
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Тесты быстрого запуска: профиль импорта, версия схемы, отложенные клиенты Bot API
+"""
+
+import sqlite3
+
+from telegram import Bot
+
+import enhanced_bot
+import notification_system
+from enhanced_bot import VetBotDatabase
+from vet_doctor_bot import VetDoctorDatabase
+from notification_system import NotificationSystem
+from query_benchmark import traced_statements
+from startup_profile import parse_importtime, by_package, profile
+
+IMPORTTIME = """\
+import time: self [us] | cumulative | imported package
+import time:       120 |        120 |   _io
+import time:      2000 |       2500 |     telegram._bot
+import time:      1000 |       4000 |   telegram
+import time:       300 |       4300 | enhanced_bot
+"""
+
+def test_importtime_is_parsed_and_grouped():
+    modules = parse_importtime(IMPORTTIME)
+
+    assert modules[1] == ('telegram._bot', 0.002, 0.0025)
+    assert by_package(modules) == {'_io': 0.00012, 'telegram': 0.003, 'enhanced_bot': 0.0003}
+
+def test_restart_skips_current_schema(tmp_path, monkeypatch):
+    path = str(tmp_path / 'schema.db')
+    VetBotDatabase(path)
+    VetDoctorDatabase(path)
+
+    with traced_statements() as statements:
+        VetBotDatabase(path)
+        VetDoctorDatabase(path)
+    assert not [sql for sql in statements if 'CREATE' in sql]
+
+    # Новая версия схемы компонента - DDL выполняется снова, один раз
+    monkeypatch.setattr(enhanced_bot, 'SCHEMA_VERSION', enhanced_bot.SCHEMA_VERSION + 1)
+    with traced_statements() as statements:
+        VetBotDatabase(path)
+        VetDoctorDatabase(path)
+    assert any('CREATE TABLE IF NOT EXISTS users' in sql for sql in statements)
+    assert not any('idx_doctor_notifications_consultation' in sql for sql in statements)
+    with traced_statements() as statements:
+        VetBotDatabase(path)
+    assert not [sql for sql in statements if 'CREATE' in sql]
+
+def test_admin_queue_keeps_parse_mode(tmp_path):
+    path = str(tmp_path / 'queue.db')
+    conn = sqlite3.connect(path)
+    conn.execute('''
+        CREATE TABLE admin_message_queue (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            message TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            sent BOOLEAN DEFAULT 0
+        )
+    ''')
+    conn.execute("INSERT INTO admin_message_queue (user_id, message) VALUES (1, 'старое')")
+    conn.commit()
+    conn.close()
+
+    # Очередь без parse_mode получает колонку, старые строки - без разметки
+    db = VetBotDatabase(path)
+    db.add_admin_message_to_queue(1, '<b>новое</b>', parse_mode='HTML')
+    assert [row[1:] for row in db.get_pending_admin_messages(1)] == [
+        ('старое', None), ('<b>новое</b>', 'HTML'),
+    ]
+
+def test_bot_clients_are_created_on_first_use(tmp_path, monkeypatch):
+    monkeypatch.setattr(notification_system, 'MAIN_BOT_TOKEN', '1:MAIN')
+    monkeypatch.setattr(notification_system, 'VET_BOT_TOKEN', None)
+    system = NotificationSystem(str(tmp_path / 'bots.db'))
+    relay = system.create_outbox_relay()
+
+    assert system.bots._bots == {}
+    assert isinstance(relay.bots.get('main'), Bot)
+    assert system.main_bot is relay.bots['main']
+    assert relay.bots.get('vet') is None
+
+def test_profile_reports_import_and_construction():
+    stats = profile('main_bot', repeat=1, top=5)
+
+    assert stats['import_s'] > 0 and stats['construct_s'] > 0
+    assert 'telegram' in stats['packages']
+    assert len(stats['modules']) == 5
+    assert stats['total_s'] == stats['import_s'] + stats['construct_s']
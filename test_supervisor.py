@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Тесты супервизора процессов: выход, зависание, остановка, ресурсы
+"""
+
+import os
+import sys
+import time
+import socket
+import asyncio
+
+import pytest
+
+from supervisor import ProcessSupervisor, Service, read_usage
+from vetbot_improved.utils.metrics import PROCESS_RESTARTS
+
+# Пишет момент выхода в файл и завершается с кодом 3
+CRASHING = '''
+import sys, time
+time.sleep(0.1)
+with open(sys.argv[1], 'a') as f:
+    f.write(f"{time.time()}\\n")
+sys.exit(3)
+'''
+
+# Отвечает на /healthz как сторож зависшего цикла событий
+HUNG = '''
+import sys, json
+from http.server import BaseHTTPRequestHandler, HTTPServer
+class Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = json.dumps({"ok": False, "heartbeat_age": 12.0}).encode()
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    def log_message(self, *args):
+        pass
+HTTPServer(("127.0.0.1", int(sys.argv[1])), Handler).serve_forever()
+'''
+
+# Дописывает журнал по SIGTERM; второй вариант SIGTERM игнорирует
+DRAINING = '''
+import sys, time, signal
+def drain(signum, frame):
+    with open(sys.argv[1], "w") as f:
+        f.write("drained")
+    sys.exit(0)
+signal.signal(signal.SIGTERM, drain if sys.argv[2] == "drain" else signal.SIG_IGN)
+while True:
+    time.sleep(0.01)
+'''
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+async def run_for(supervisor, seconds):
+    asyncio.get_running_loop().call_later(seconds, supervisor.stop)
+    await supervisor.run()
+
+def test_exit_is_detected_at_once_and_restarted_with_backoff(tmp_path):
+    exits = tmp_path / 'exits'
+    service = Service('test_crashing', [sys.executable, '-c', CRASHING, str(exits)])
+    supervisor = ProcessSupervisor([service], backoff_min=0.2, backoff_max=1.0, report_interval=60)
+
+    async def scenario():
+        task = asyncio.create_task(supervisor.run())
+        while service.restarts < 3:
+            await asyncio.sleep(0.01)
+        supervisor.stop()
+        await asyncio.wait_for(task, 5)
+
+    asyncio.run(scenario())
+
+    exited = [float(line) for line in exits.read_text().split()]
+    code, detected = service.last_exit
+    assert code == 3
+    assert detected - exited[-1] < 0.1
+    # Пауза перед перезапуском растет: 0.2, 0.4 с
+    gaps = [later - earlier for earlier, later in zip(exited, exited[1:])]
+    assert gaps[0] > 0.2 and gaps[1] - gaps[0] > 0.15
+    assert PROCESS_RESTARTS.value(process='test_crashing', reason='exit') == service.restarts == len(exited)
+
+def test_unhealthy_process_is_restarted():
+    port = free_port()
+    service = Service('test_hung', [sys.executable, '-c', HUNG, str(port)],
+                      health=f'http://127.0.0.1:{port}/healthz', start_timeout=0.5)
+    supervisor = ProcessSupervisor([service], health_interval=0.1, health_failures=2, backoff_min=0.1)
+
+    asyncio.run(run_for(supervisor, 1.5))
+
+    assert PROCESS_RESTARTS.value(process='test_hung', reason='unhealthy') >= 1
+    assert not service.running()
+
+def test_shutdown_drains_then_kills(tmp_path):
+    drained = tmp_path / 'drained'
+    polite = Service('test_polite', [sys.executable, '-c', DRAINING, str(drained), 'drain'], drain_timeout=2)
+    stubborn = Service('test_stubborn', [sys.executable, '-c', DRAINING, str(tmp_path / 'never'), 'ignore'],
+                       drain_timeout=0.3)
+    supervisor = ProcessSupervisor([polite, stubborn])
+
+    started = time.monotonic()
+    asyncio.run(run_for(supervisor, 0.5))
+
+    assert drained.read_text() == 'drained'
+    assert polite.last_exit[0] == 0
+    assert stubborn.last_exit[0] == -9
+    assert time.monotonic() - started < 2
+    assert polite.restarts == stubborn.restarts == 0
+
+@pytest.mark.skipif(not os.path.exists('/proc/self/stat'), reason='нужен /proc')
+def test_usage_is_read_from_proc():
+    sum(range(3 * 10 ** 6))
+    cpu_seconds, rss = read_usage(os.getpid())
+    assert cpu_seconds > 0
+    assert rss > 10 * 2 ** 20
+    assert read_usage(2 ** 22 + 1) is None
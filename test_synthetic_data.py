@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+Тесты генератора синтетических данных и микробенчмарка запросов
+"""
+
+import sqlite3
+
+import pytest
+
+from synthetic_data import generate
+from query_benchmark import run, plan_warnings
+
+def test_generated_rows_are_consistent(tmp_path):
+    path = str(tmp_path / 'synthetic.db')
+    counts = generate(path, users=500, doctors=12, seed=1, batch_size=100)
+
+    conn = sqlite3.connect(path)
+    assert conn.execute('SELECT COUNT(*) FROM users').fetchone()[0] == counts['users'] == 500
+    assert counts['consultation_messages'] > counts['active_consultations'] > 0
+    # Сообщения и уведомления ссылаются на существующие консультации
+    assert conn.execute('''
+        SELECT COUNT(*) FROM consultation_messages cm
+        LEFT JOIN active_consultations ac ON ac.id = cm.consultation_id WHERE ac.id IS NULL
+    ''').fetchone()[0] == 0
+    assert conn.execute('''
+        SELECT COUNT(*) FROM doctor_notifications dn
+        LEFT JOIN doctors d ON d.id = dn.doctor_id WHERE d.id IS NULL
+    ''').fetchone()[0] == 0
+    # Врача ждут только консультации без врача и без сообщений
+    assert conn.execute('''
+        SELECT COUNT(*) FROM active_consultations ac
+        WHERE ac.status = 'waiting' AND (ac.doctor_id IS NOT NULL
+            OR EXISTS (SELECT 1 FROM consultation_messages cm WHERE cm.consultation_id = ac.id))
+    ''').fetchone()[0] == 0
+    statuses = dict(conn.execute('SELECT status, COUNT(*) FROM active_consultations GROUP BY status'))
+    assert statuses['completed'] > statuses['waiting'] > 0
+    conn.close()
+
+    with pytest.raises(ValueError):
+        generate(path, users=10, doctors=1)
+
+def test_benchmark_runs_every_bot_query(tmp_path):
+    path = str(tmp_path / 'synthetic.db')
+    generate(path, users=300, doctors=8, seed=2)
+
+    results = run(path, repeat=3, include_admin=False)
+
+    assert 'main_bot.get_user_calls' in results
+    assert 'router.rank' in results
+    assert results['doctor_bot.get_approved_doctors']['rows'] > 0
+    assert all(stats['p99_ms'] >= stats['p50_ms'] for stats in results.values())
+
+def test_full_scan_of_large_table_is_flagged(tmp_path):
+    path = str(tmp_path / 'plans.db')
+    conn = sqlite3.connect(path)
+    conn.execute('CREATE TABLE calls (id INTEGER PRIMARY KEY, user_id INTEGER, created_at TEXT)')
+    conn.execute('CREATE INDEX idx_calls_created ON calls (created_at)')
+    conn.close()
+    sizes = {'calls': 50000}
+
+    warnings = plan_warnings(path, [
+        'SELECT * FROM calls c WHERE c.user_id = 5',
+        'SELECT * FROM calls ORDER BY created_at DESC LIMIT 10',
+        'SELECT * FROM calls WHERE id = 3',
+    ], sizes, scan_rows=10000)
+
+    assert warnings == ['SCAN c (50000 строк)']
@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""
+Тесты транзакционного outbox сообщений Telegram
+"""
+
+import asyncio
+import sqlite3
+from types import SimpleNamespace
+from telegram.error import BadRequest, NetworkError
+from telegram_outbox import TelegramOutbox, OutboxRelay
+
+class FakeBot:
+    """Бот, записывающий вызовы; errors - исключения для первых вызовов"""
+
+    def __init__(self, errors=()):
+        self.sent = []
+        self.errors = list(errors)
+
+    async def send_message(self, **params):
+        if self.errors:
+            raise self.errors.pop(0)
+        self.sent.append(params)
+        return SimpleNamespace(message_id=100 + len(self.sent))
+
+def create_outbox(tmp_path):
+    db_path = str(tmp_path / 'test.db')
+    outbox = TelegramOutbox(db_path)
+    outbox.init_database()
+    conn = sqlite3.connect(db_path)
+    conn.execute('CREATE TABLE notifications (ref TEXT, message_id INTEGER)')
+    conn.commit()
+    conn.close()
+    return outbox
+
+def test_rolled_back_transaction_sends_nothing(tmp_path):
+    """Сообщение уходит только если транзакция изменения состояния зафиксирована"""
+    outbox = create_outbox(tmp_path)
+    bot = FakeBot()
+    relay = OutboxRelay(outbox, {'vet': bot})
+
+    conn = sqlite3.connect(outbox.db_path)
+    outbox.enqueue(conn, 'vet', 'send_message', {'chat_id': 1, 'text': 'lost'})
+    conn.rollback()
+    outbox.enqueue(conn, 'vet', 'send_message', {'chat_id': 2, 'text': 'kept'}, dedup_key='notify:1:2')
+    outbox.enqueue(conn, 'vet', 'send_message', {'chat_id': 2, 'text': 'kept'}, dedup_key='notify:1:2')
+    conn.commit()
+    conn.close()
+
+    assert asyncio.run(relay.deliver_batch()) == 1
+    assert bot.sent == [{'chat_id': 2, 'text': 'kept'}]
+
+def test_bookkeeping_runs_once_with_delivery(tmp_path):
+    """Учет после отправки выполняется в транзакции отметки и только один раз"""
+    outbox = create_outbox(tmp_path)
+    bot = FakeBot()
+    relay = OutboxRelay(outbox, {'vet': bot}, batch_size=2)
+    relay.on_sent('notification', lambda conn, ref, message_id: conn.execute(
+        'INSERT INTO notifications VALUES (?, ?)', (ref['doctor'], message_id)))
+
+    conn = sqlite3.connect(outbox.db_path)
+    for doctor in range(3):
+        outbox.enqueue(conn, 'vet', 'send_message', {'chat_id': doctor, 'text': 'new client'},
+                       kind='notification', ref={'doctor': doctor})
+    conn.commit()
+    conn.close()
+
+    assert asyncio.run(relay.deliver_batch()) == 2
+    assert asyncio.run(relay.deliver_batch()) == 1
+    assert asyncio.run(relay.deliver_batch()) == 0
+
+    # Повторная отметка уже отправленного сообщения учет не дублирует
+    outbox.mark_sent({'id': 1, 'ref': {'doctor': 0}}, 999, relay._hooks['notification'])
+
+    conn = sqlite3.connect(outbox.db_path)
+    rows = conn.execute('SELECT ref, message_id FROM notifications ORDER BY ref').fetchall()
+    conn.close()
+    assert rows == [('0', 101), ('1', 102), ('2', 103)]
+    assert outbox.stats() == {'sent': 3}
+
+def test_transient_errors_are_retried_and_bad_requests_fail(tmp_path):
+    """Сетевые ошибки повторяются с задержкой, BadRequest - постоянная ошибка"""
+    outbox = create_outbox(tmp_path)
+    flaky = FakeBot(errors=[NetworkError('timeout')])
+    broken = FakeBot(errors=[BadRequest('chat not found')])
+    relay = OutboxRelay(outbox, {'main': flaky, 'vet': broken}, retry_delay=0)
+
+    conn = sqlite3.connect(outbox.db_path)
+    outbox.enqueue(conn, 'main', 'send_message', {'chat_id': 1, 'text': 'doctor joined'})
+    outbox.enqueue(conn, 'vet', 'send_message', {'chat_id': 2, 'text': 'new client'})
+    conn.commit()
+    conn.close()
+
+    assert asyncio.run(relay.deliver_batch()) == 2
+    assert outbox.stats() == {'pending': 1, 'failed': 1}
+
+    assert asyncio.run(relay.deliver_batch()) == 1
+    assert flaky.sent == [{'chat_id': 1, 'text': 'doctor joined'}]
+    assert outbox.stats() == {'sent': 1, 'failed': 1}
+
+def test_messages_to_one_chat_keep_order(tmp_path):
+    """Сообщения одному чату уходят по очереди, разным чатам - параллельно"""
+    outbox = create_outbox(tmp_path)
+
+    class SlowFirstBot(FakeBot):
+        async def send_message(self, **params):
+            # Первое сообщение чата 1 отправляется дольше остальных
+            await asyncio.sleep(0.05 if params['text'] == '1-0' else 0)
+            return await super().send_message(**params)
+
+    bot = SlowFirstBot()
+    relay = OutboxRelay(outbox, {'main': bot})
+    conn = sqlite3.connect(outbox.db_path)
+    for n in range(3):
+        for chat_id in (1, 2):
+            outbox.enqueue(conn, 'main', 'send_message', {'chat_id': chat_id, 'text': f'{chat_id}-{n}'})
+    conn.commit()
+    conn.close()
+
+    assert asyncio.run(relay.deliver_batch()) == 6
+    texts = [params['text'] for params in bot.sent]
+    assert [text for text in texts if text.startswith('1-')] == ['1-0', '1-1', '1-2']
+    assert texts[:3] == ['2-0', '2-1', '2-2']
+
+def test_expired_lease_is_claimed_again(tmp_path):
+    """Сообщение, взятое упавшим relay, снова доступно после истечения аренды"""
+    outbox = create_outbox(tmp_path)
+    conn = sqlite3.connect(outbox.db_path)
+    outbox.enqueue(conn, 'vet', 'send_message', {'chat_id': 1, 'text': 'new client'})
+    conn.commit()
+    conn.close()
+
+    assert len(outbox.claim(lease=60)) == 1
+    assert outbox.claim(lease=60) == []
+
+    # Аренда истекла - relay считается упавшим
+    conn = sqlite3.connect(outbox.db_path)
+    conn.execute('UPDATE telegram_outbox SET next_attempt_at = 0')
+    conn.commit()
+    conn.close()
+
+    reclaimed = outbox.claim()
+    assert [message['attempts'] for message in reclaimed] == [2]
+
+def test_delivery_continues_producer_trace(tmp_path):
+    """Отправка из outbox продолжает трассу обработчика, поставившего сообщение"""
+    from vetbot_improved.utils import tracing
+    previous = tracing.configure().path
+    tracing.configure(path=str(tmp_path / 'traces.jsonl'))
+
+    outbox = create_outbox(tmp_path)
+    traces = []
+
+    class TracingBot(FakeBot):
+        async def send_message(self, **params):
+            traces.append(tracing.current_trace_id())
+            return await super().send_message(**params)
+
+    relay = OutboxRelay(outbox, {'vet': TracingBot()})
+    conn = sqlite3.connect(outbox.db_path)
+    with tracing.span('handler.test') as handler:
+        outbox.enqueue(conn, 'vet', 'send_message', {'chat_id': 1, 'text': 'traced'})
+    outbox.enqueue(conn, 'vet', 'send_message', {'chat_id': 2, 'text': 'untraced'})
+    conn.commit()
+    conn.close()
+
+    asyncio.run(relay.deliver_batch())
+    tracing.configure(path=previous)
+    assert traces == [handler.trace_id, None]
+
+def test_failed_message_holds_back_rest_of_chat(tmp_path):
+    """После ошибки сообщения чата ждут его повтора, другие чаты не ждут"""
+    outbox = create_outbox(tmp_path)
+    bot = FakeBot(errors=[NetworkError('timeout')])
+    relay = OutboxRelay(outbox, {'main': bot}, retry_delay=60)
+
+    conn = sqlite3.connect(outbox.db_path)
+    for n in range(3):
+        outbox.enqueue(conn, 'main', 'send_message', {'chat_id': 1, 'text': f'1-{n}'})
+    conn.commit()
+    conn.close()
+
+    assert asyncio.run(relay.deliver_batch()) == 3
+    assert bot.sent == []
+    conn = sqlite3.connect(outbox.db_path)
+    rows = conn.execute('SELECT status, attempts FROM telegram_outbox ORDER BY id').fetchall()
+    conn.close()
+    assert rows == [('pending', 1), ('pending', 0), ('pending', 0)]
+
+    # Чат 1 ждет повтора первого сообщения, чат 2 отправляется сразу
+    conn = sqlite3.connect(outbox.db_path)
+    outbox.enqueue(conn, 'main', 'send_message', {'chat_id': 2, 'text': '2-0'})
+    conn.commit()
+    conn.close()
+    assert asyncio.run(relay.deliver_batch()) == 1
+    assert [params['text'] for params in bot.sent] == ['2-0']
+
+    conn = sqlite3.connect(outbox.db_path)
+    conn.execute('UPDATE telegram_outbox SET next_attempt_at = 0 WHERE id = 1')
+    conn.commit()
+    conn.close()
+    assert asyncio.run(relay.deliver_batch()) == 3
+    assert [params['text'] for params in bot.sent] == ['2-0', '1-0', '1-1', '1-2']
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Тесты диспетчера обновлений: разбиение по чатам, порядок, перезапуск воркера
+"""
+
+import asyncio
+from types import SimpleNamespace
+
+from telegram import Bot, Update
+
+from update_dispatcher import UpdateDispatcher, WorkerServer, bot_services, partition
+from vetbot_improved.services import telegram_stub
+from vetbot_improved.services.telegram_stub import text_message, callback_query
+
+TOKEN = '123:DISPATCH'
+
+def worker_app():
+    """Достаточно update_queue и bot: WorkerServer больше ничего не трогает"""
+    return SimpleNamespace(bot=None, update_queue=asyncio.Queue())
+
+async def received(app, count, timeout=10):
+    updates = []
+    async def collect():
+        while len(updates) < count:
+            updates.append(await app.update_queue.get())
+    await asyncio.wait_for(collect(), timeout)
+    return updates
+
+def test_updates_are_partitioned_by_chat_in_order(tmp_path):
+    stub, _ = telegram_stub.start_stub_server()
+    chats = list(range(1001, 1009))
+    for n in range(5):
+        for chat_id in chats:
+            stub.push(TOKEN, text_message(chat_id, f'{chat_id}-{n}'))
+    stub.push(TOKEN, callback_query(chats[0], 'call_vet', message_id=1))
+
+    async def scenario():
+        apps = [worker_app(), worker_app()]
+        servers = [WorkerServer(app, index, str(tmp_path)) for index, app in enumerate(apps)]
+        for server in servers:
+            await server.start()
+        dispatcher = UpdateDispatcher(workers=2, socket_dir=str(tmp_path))
+        task = asyncio.create_task(dispatcher.run(Bot(TOKEN, base_url=stub.url)))
+
+        expected = [sum(1 for chat_id in chats if partition(chat_id, 2) == index) * 5 for index in (0, 1)]
+        expected[partition(chats[0], 2)] += 1
+        results = [await received(app, count) for app, count in zip(apps, expected)]
+
+        dispatcher.stop()
+        await asyncio.wait_for(task, 10)
+        for server in servers:
+            await server.close()
+        return results
+
+    try:
+        results = asyncio.run(scenario())
+    finally:
+        stub.shutdown()
+
+    assert all(results)
+    for index, updates in enumerate(results):
+        assert all(isinstance(update, Update) for update in updates)
+        assert {partition(update.effective_chat.id, 2) for update in updates} == {index}
+        # Сообщения каждого чата - в порядке отправки
+        for chat_id in chats:
+            texts = [update.message.text for update in updates
+                     if update.message and update.effective_chat.id == chat_id]
+            assert texts == [f'{chat_id}-{n}' for n in range(5)] or not texts
+    callbacks = [update for updates in results for update in updates if update.callback_query]
+    assert callbacks[0].callback_query.data == 'call_vet'
+
+def test_updates_wait_for_restarted_worker(tmp_path):
+    updates = [Update.de_json(text_message(7, f'msg-{n}') | {'update_id': n}, None) for n in range(20)]
+
+    async def scenario():
+        dispatcher = UpdateDispatcher(workers=1, socket_dir=str(tmp_path))
+        link = dispatcher.links[0]
+        sender = asyncio.create_task(link.run())
+
+        # Воркер еще не запущен: обновления ждут в очереди
+        for update in updates[:10]:
+            await dispatcher.dispatch(update)
+        await asyncio.sleep(0.3)
+        assert link.queue.qsize() == 10
+
+        app = worker_app()
+        server = WorkerServer(app, 0, str(tmp_path))
+        await server.start()
+        first = await received(app, 10)
+
+        # Воркер перезапущен: соединение восстанавливается само
+        await server.close()
+        for update in updates[10:]:
+            await dispatcher.dispatch(update)
+        app = worker_app()
+        server = WorkerServer(app, 0, str(tmp_path))
+        await server.start()
+        second = await received(app, 10)
+
+        await dispatcher.drain(timeout=1)
+        sender.cancel()
+        await server.close()
+        return first + second
+
+    delivered = asyncio.run(scenario())
+
+    assert [update.message.text for update in delivered] == [f'msg-{n}' for n in range(20)]
+
+def test_worker_services_get_health_checks(monkeypatch):
+    """Воркеры и диспетчер получают порты метрик и без записи в METRICS_PORTS"""
+    from vetbot_improved.utils import metrics
+    monkeypatch.setattr(metrics, 'METRICS_PORTS', 'main_bot:9101,doctor_bot:9102,main_bot.1:9200')
+    monkeypatch.setattr(metrics, 'METRICS_WORKER_BASE_PORT', 9110)
+
+    services = {service.name: service for service in bot_services('.', workers=3)}
+
+    assert services['dispatcher'].health == 'http://127.0.0.1:9110/healthz'
+    assert services['main_bot.0'].health == 'http://127.0.0.1:9111/healthz'
+    assert services['main_bot.1'].health == 'http://127.0.0.1:9200/healthz'
+    assert set(metrics.metrics_endpoints(3)) == {'dispatcher', 'main_bot.0', 'main_bot.1', 'main_bot.2', 'doctor_bot'}
+    assert set(metrics.metrics_endpoints(1)) == {'main_bot', 'doctor_bot', 'main_bot.1'}
@@ -0,0 +1,289 @@
+"""
+Диспетчер обновлений для нескольких процессов главного бота
+
+Забирать обновления у Telegram может только один процесс на токен, а
+состояние бота в памяти (склейка AI-запросов, очереди планировщика,
+доставка сообщений админов) относится к конкретным чатам. Поэтому при
+BOT_WORKERS > 1:
+
+    - диспетчер (python update_dispatcher.py) получает обновления через
+      Updater python-telegram-bot - long polling, а при заданном
+      DISPATCH_WEBHOOK_URL - webhook (нужен python-telegram-bot[webhooks]);
+    - каждое обновление по хешу id чата уходит одному из BOT_WORKERS
+      воркеров - процессов enhanced_bot.py с BOT_WORKER_INDEX, у которых
+      нет своего Updater: воркер слушает unix-сокет
+      DISPATCH_SOCKET_DIR/worker-<номер>.sock и кладет обновления в
+      update_queue своего Application.
+
+Чат всегда обслуживает один воркер, и в его соединение обновления пишутся
+в порядке получения: порядок сообщений чата сохраняется, а AI-обработчики
+разных чатов работают на разных ядрах. Кадр - 4 байта длины (big-endian)
+и JSON обновления.
+
+У каждого воркера своя ограниченная очередь (DISPATCH_QUEUE_SIZE): пока
+воркер перезапускается, кадры ждут в ней; если она переполнена, диспетчер
+перестает забирать обновления и они ждут на стороне Telegram.
+
+Запуск - start_all.py / start_with_admin.py с BOT_WORKERS (см.
+bot_services). Порты метрик и /healthz диспетчера и воркеров по умолчанию
+отсчитываются от METRICS_WORKER_BASE_PORT (dispatcher:9110,
+main_bot.0:9111, main_bot.1:9112, ...), METRICS_PORTS их переопределяет.
+"""
+
+import os
+import json
+import zlib
+import sys
+import signal
+import asyncio
+import logging
+import tempfile
+from dotenv import load_dotenv
+from telegram import Bot, Update
+from telegram.ext import Updater
+from supervisor import Service, health_url
+from vetbot_improved.utils.metrics import DISPATCHED_UPDATES, QUEUE_DEPTH, start_metrics_server
+from vetbot_improved.utils.loop_watchdog import LoopWatchdog
+from vetbot_improved.utils.logging_setup import setup_logging
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Конфигурация
+BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN', 'YOUR_BOT_TOKEN_HERE')
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL', 'https://api.telegram.org/bot')
+BOT_WORKERS = int(os.getenv('BOT_WORKERS', '1'))
+DISPATCH_SOCKET_DIR = os.getenv('DISPATCH_SOCKET_DIR', os.path.join(tempfile.gettempdir(), 'vetbot-dispatch'))
+DISPATCH_QUEUE_SIZE = int(os.getenv('DISPATCH_QUEUE_SIZE', '1000'))
+DISPATCH_RECONNECT_INTERVAL = float(os.getenv('DISPATCH_RECONNECT_INTERVAL', '0.2'))
+DISPATCH_DRAIN_TIMEOUT = float(os.getenv('DISPATCH_DRAIN_TIMEOUT', '5'))
+# Webhook за обратным прокси (Caddy): Telegram шлет на DISPATCH_WEBHOOK_URL
+DISPATCH_WEBHOOK_URL = os.getenv('DISPATCH_WEBHOOK_URL', '')
+DISPATCH_WEBHOOK_LISTEN = os.getenv('DISPATCH_WEBHOOK_LISTEN', '127.0.0.1')
+DISPATCH_WEBHOOK_PORT = int(os.getenv('DISPATCH_WEBHOOK_PORT', '8081'))
+DISPATCH_WEBHOOK_SECRET = os.getenv('DISPATCH_WEBHOOK_SECRET') or None
+
+def partition(chat_id, workers):
+    """Номер воркера чата; один и тот же во всех процессах и запусках"""
+    return zlib.crc32(str(chat_id).encode()) % workers
+
+def chat_id_of(update):
+    """Чат обновления, а без чата (inline-запросы и т.п.) - пользователь"""
+    if update.effective_chat is not None:
+        return update.effective_chat.id
+    if update.effective_user is not None:
+        return update.effective_user.id
+    return 0
+
+def worker_name(index):
+    """Имя воркера в METRICS_PORTS, логах и курсоре шины событий"""
+    return f'main_bot.{index}'
+
+def worker_socket(index, socket_dir=DISPATCH_SOCKET_DIR):
+    return os.path.join(socket_dir, f'worker-{index}.sock')
+
+def bot_services(cwd, workers=BOT_WORKERS):
+    """Процессы главного бота для супервизора
+
+    Один процесс при workers == 1; иначе воркеры и диспетчер после них:
+    супервизор останавливает процессы в обратном порядке, и диспетчер
+    успевает отдать полученные обновления работающим воркерам.
+    """
+    if workers == 1:
+        return [Service('main_bot', [sys.executable, 'enhanced_bot.py'], cwd=cwd,
+                        health=health_url('main_bot'))]
+    services = [
+        Service(worker_name(index), [sys.executable, 'enhanced_bot.py'], cwd=cwd,
+                env=dict(os.environ, BOT_WORKERS=str(workers), BOT_WORKER_INDEX=str(index)),
+                health=health_url(worker_name(index), workers))
+        for index in range(workers)
+    ]
+    services.append(Service('dispatcher', [sys.executable, 'update_dispatcher.py'], cwd=cwd,
+                            env=dict(os.environ, BOT_WORKERS=str(workers)),
+                            health=health_url('dispatcher', workers)))
+    return services
+
+def encode_frame(update):
+    data = update.to_json().encode('utf-8')
+    return len(data).to_bytes(4, 'big') + data
+
+async def read_frame(reader):
+    """Следующий кадр (словарь обновления); None - соединение закрыто"""
+    try:
+        header = await reader.readexactly(4)
+    except asyncio.IncompleteReadError as e:
+        if e.partial:
+            raise
+        return None
+    return json.loads(await reader.readexactly(int.from_bytes(header, 'big')))
+
+class WorkerLink:
+    """Очередь кадров одного воркера и соединение с ним
+
+    При разрыве соединения неотправленный кадр не теряется: после
+    переподключения он уходит первым, за ним - остальная очередь.
+    """
+
+    def __init__(self, index, path, queue_size=DISPATCH_QUEUE_SIZE):
+        self.index = index
+        self.path = path
+        self.queue = asyncio.Queue(queue_size)
+        self.connected = False
+        QUEUE_DEPTH.set_function(self.queue.qsize, queue=f'dispatch_{index}')
+
+    async def run(self):
+        """Отправлять кадры воркеру, переподключаясь, до отмены задачи"""
+        frame = None
+        while True:
+            try:
+                reader, writer = await asyncio.open_unix_connection(self.path)
+            except OSError:
+                await asyncio.sleep(DISPATCH_RECONNECT_INTERVAL)
+                continue
+
+            self.connected = True
+            logger.info(f"Connected to worker {self.index}")
+            try:
+                while True:
+                    if frame is None:
+                        frame = await self.queue.get()
+                    writer.write(frame)
+                    await writer.drain()
+                    frame = None
+                    self.queue.task_done()
+                    DISPATCHED_UPDATES.inc(worker=str(self.index))
+            except (ConnectionError, OSError) as e:
+                logger.warning(f"Worker {self.index} connection lost: {e}")
+            finally:
+                self.connected = False
+                writer.close()
+
+class UpdateDispatcher:
+    """Раздача обновлений Telegram воркерам по id чата"""
+
+    def __init__(self, workers=BOT_WORKERS, socket_dir=DISPATCH_SOCKET_DIR, queue_size=DISPATCH_QUEUE_SIZE):
+        if workers < 1:
+            raise ValueError("workers must be at least 1")
+        self.links = [WorkerLink(index, worker_socket(index, socket_dir), queue_size)
+                      for index in range(workers)]
+        self._stopping = asyncio.Event()
+
+    def link_for(self, update):
+        return self.links[partition(chat_id_of(update), len(self.links))]
+
+    async def dispatch(self, update):
+        """Поставить обновление в очередь его воркера (ждет, если она полна)"""
+        await self.link_for(update).queue.put(encode_frame(update))
+
+    async def run(self, bot, webhook_url=DISPATCH_WEBHOOK_URL):
+        """Получать обновления бота и раздавать их до вызова stop()"""
+        # Ограниченная очередь Updater: при заполненных очередях воркеров
+        # он перестает запрашивать обновления
+        updates = asyncio.Queue(DISPATCH_QUEUE_SIZE)
+        senders = [asyncio.create_task(link.run()) for link in self.links]
+        forwarder = asyncio.create_task(self._forward(updates))
+
+        try:
+            async with Updater(bot, updates) as updater:
+                if webhook_url:
+                    await updater.start_webhook(
+                        listen=DISPATCH_WEBHOOK_LISTEN, port=DISPATCH_WEBHOOK_PORT,
+                        url_path=bot.token.split(':')[0], webhook_url=webhook_url,
+                        secret_token=DISPATCH_WEBHOOK_SECRET, drop_pending_updates=True
+                    )
+                else:
+                    await updater.start_polling(drop_pending_updates=True)
+                logger.info(f"Dispatching updates to {len(self.links)} workers")
+                await self._stopping.wait()
+                await updater.stop()
+
+            # Полученные обновления отдаются воркерам до выхода
+            await updates.put(None)
+            await forwarder
+            await self.drain()
+        finally:
+            forwarder.cancel()
+            for task in senders:
+                task.cancel()
+            await asyncio.gather(forwarder, *senders, return_exceptions=True)
+
+    async def _forward(self, updates):
+        while True:
+            update = await updates.get()
+            if update is None:
+                return
+            await self.dispatch(update)
+
+    async def drain(self, timeout=DISPATCH_DRAIN_TIMEOUT):
+        """Дождаться отправки очередей воркерам (не дольше timeout)"""
+        try:
+            await asyncio.wait_for(asyncio.gather(*(link.queue.join() for link in self.links)), timeout)
+        except asyncio.TimeoutError:
+            lost = sum(link.queue.qsize() for link in self.links)
+            logger.error(f"Dispatcher stopped with {lost} undelivered updates")
+
+    def stop(self):
+        self._stopping.set()
+
+class WorkerServer:
+    """Сторона воркера: прием кадров диспетчера в update_queue приложения"""
+
+    def __init__(self, application, index, socket_dir=DISPATCH_SOCKET_DIR):
+        self.application = application
+        self.path = worker_socket(index, socket_dir)
+        self._server = None
+        self._writers = set()
+
+    async def start(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        # Сокет от упавшего предыдущего процесса
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self._server = await asyncio.start_unix_server(self._handle, self.path)
+
+    async def _handle(self, reader, writer):
+        self._writers.add(writer)
+        try:
+            while True:
+                data = await read_frame(reader)
+                if data is None:
+                    break
+                await self.application.update_queue.put(Update.de_json(data, self.application.bot))
+        except (ConnectionError, asyncio.IncompleteReadError) as e:
+            logger.warning(f"Dispatcher connection lost: {e}")
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+
+    async def close(self):
+        """Перестать принимать обновления; уже принятые остаются в update_queue"""
+        if self._server is None:
+            return
+        self._server.close()
+        for writer in list(self._writers):
+            writer.close()
+        await self._server.wait_closed()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+async def main():
+    dispatcher = UpdateDispatcher()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, dispatcher.stop)
+
+    # /healthz диспетчера для супервизора - пульс его цикла событий
+    metrics_server = start_metrics_server('dispatcher')
+    watchdog = LoopWatchdog('dispatcher')
+    watchdog.start()
+    try:
+        await dispatcher.run(Bot(BOT_TOKEN, base_url=TELEGRAM_API_URL))
+    finally:
+        watchdog.stop()
+        if metrics_server is not None:
+            metrics_server.shutdown()
+
+if __name__ == '__main__':
+    setup_logging('dispatcher', './dispatcher.log')
+    asyncio.run(main())
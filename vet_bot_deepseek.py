@@ -4,6 +4,7 @@
 
 import os
 import sys
+import asyncio
 from dotenv import load_dotenv
 
 # Загружаем переменные окружения
@@ -11,7 +12,7 @@ load_dotenv('.env.deepseek')
 
 # Импортируем компоненты бота
 try:
-    from vet_bot_deepseek import DeepSeekAPI, VeterinarySystem
+    from vetbot_improved.services.llm_gateway import DeepSeekBackend, LLMGateway, LLMError
 except ImportError as e:
     print(f"❌ Ошибка импорта: {e}")
     sys.exit(1)
@@ -21,14 +22,14 @@ def test_deepseek_connection():
     print("🔍 Тестирование подключения к DeepSeek API...")
     
     try:
-        deepseek = DeepSeekAPI()
+        deepseek = LLMGateway([DeepSeekBackend()])
         
         # Простой тестовый запрос
         test_messages = [
             {"role": "user", "content": "Привет! Ответь кратко: ты работаешь?"}
         ]
         
-        response = deepseek.chat_completion(test_messages)
+        response = asyncio.run(deepseek.complete(test_messages)).text
         
         if response and "баланс" not in response.lower() and "ошибка" not in response.lower():
             print("✅ DeepSeek API работает!")
@@ -47,8 +48,7 @@ def test_veterinary_consultation():
     print("\n🐱 Тестирование ветеринарной консультации...")
     
     try:
-        deepseek = DeepSeekAPI()
-        vet_system = VeterinarySystem()
+        deepseek = LLMGateway([DeepSeekBackend()])
         
         # Тестовые случаи
         test_cases = [
@@ -60,8 +60,7 @@ def test_veterinary_consultation():
         for i, case in enumerate(test_cases, 1):
             print(f"\n📋 Тест {i}: {case}")
             
-            messages = vet_system.create_messages(case)
-            response = deepseek.chat_completion(messages)
+            response = asyncio.run(deepseek.consult(case)).text
             
             if response:
                 print(f"✅ Ответ получен:")
@@ -82,18 +81,16 @@ def test_error_handling():
     
     try:
         # Тест с неверным API ключом
-        os.environ['DEEPSEEK_API_KEY'] = 'invalid_key'
-        deepseek = DeepSeekAPI()
+        deepseek = LLMGateway([DeepSeekBackend(api_key='invalid_key')])
         
-        response = deepseek.chat_completion([{"role": "user", "content": "test"}])
+        response = asyncio.run(deepseek.complete([{"role": "user", "content": "test"}]))
         
-        if "авторизации" in response or "ключ" in response:
-            print("✅ Обработка неверного API ключа работает")
-            return True
-        else:
-            print(f"⚠️ Неожиданный ответ: {response}")
-            return False
+        print(f"⚠️ Неожиданный ответ: {response.text}")
+        return False
             
+    except LLMError as e:
+        print(f"✅ Обработка неверного API ключа работает: {e}")
+        return True
     except Exception as e:
         print(f"✅ Исключение обработано корректно: {e}")
         return True
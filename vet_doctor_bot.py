@@ -6,34 +6,37 @@ import os
 import json
 import logging
 import sqlite3
-import requests
 import asyncio
 from datetime import datetime
+from pathlib import Path
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup, KeyboardButton
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes, CallbackQueryHandler
 from dotenv import load_dotenv
 from notification_system import notification_system
+from consultation_history import ConsultationHistory
+from media_store import MediaStore
+from event_bus import EventBus
+from db_schema import schema_current, mark_schema
+from vetbot_improved.utils.metrics import timed, start_metrics_server
+from vetbot_improved.utils import tracing, profiler
+from vetbot_improved.utils.loop_watchdog import LoopWatchdog
+from vetbot_improved.utils.logging_setup import setup_logging
 
 # Загрузка переменных окружения
 load_dotenv()
 
 # Версия бота
 VERSION = "1.0.0"
+# Версия схемы init_database: увеличить при изменении таблиц или индексов
+SCHEMA_VERSION = 1
 
-# Настройка логирования
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO,
-    handlers=[
-        logging.FileHandler('./vet_doctor_bot.log'),
-        logging.StreamHandler()
-    ]
-)
 logger = logging.getLogger(__name__)
 
 # Конфигурация
 VET_BOT_TOKEN = os.getenv('VET_BOT_TOKEN', 'YOUR_VET_BOT_TOKEN_HERE')
 MAIN_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN', 'YOUR_MAIN_BOT_TOKEN_HERE')
+# Адрес Bot API (в бенчмарке - локальная заглушка)
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL', 'https://api.telegram.org/bot')
 
 class VetDoctorDatabase:
     """Класс для работы с базой данных врачей"""
@@ -45,6 +48,10 @@ class VetDoctorDatabase:
     def init_database(self):
         """Инициализация базы данных"""
         conn = sqlite3.connect(self.db_path)
+        # Схема уже актуальна: при перезапуске DDL не выполняется
+        if schema_current(conn, 'doctor_bot', SCHEMA_VERSION):
+            conn.close()
+            return
         cursor = conn.cursor()
         
         # Таблица врачей
@@ -87,6 +94,7 @@ class VetDoctorDatabase:
                 message_text TEXT NOT NULL,
                 sent_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                 telegram_message_id INTEGER,
+                trace_id TEXT, -- трасса обработчика, передавшего сообщение
                 FOREIGN KEY (consultation_id) REFERENCES active_consultations (id)
             )
         ''')
@@ -105,6 +113,25 @@ class VetDoctorDatabase:
             )
         ''')
         
+        # История консультации читается страницами по id
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_consultation_messages_consultation
+            ON consultation_messages (consultation_id, id)
+        ''')
+        
+        # Уведомления консультации перебираются в транзакции захвата клиента
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_doctor_notifications_consultation
+            ON doctor_notifications (consultation_id, doctor_id)
+        ''')
+        
+        # Загрузка врачей считается при каждом выборе, кого оповещать
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_active_consultations_doctor
+            ON active_consultations (doctor_id, status)
+        ''')
+        
+        mark_schema(conn, 'doctor_bot', SCHEMA_VERSION)
         conn.commit()
         conn.close()
     
@@ -194,31 +221,23 @@ class VetDoctorDatabase:
             return False
         finally:
             conn.close()
-    
-    def add_consultation_message(self, consultation_id, sender_type, sender_id, sender_name, message_text, telegram_message_id=None):
-        """Добавить сообщение в консультацию"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        try:
-            cursor.execute('''
-                INSERT INTO consultation_messages 
-                (consultation_id, sender_type, sender_id, sender_name, message_text, telegram_message_id)
-                VALUES (?, ?, ?, ?, ?, ?)
-            ''', (consultation_id, sender_type, sender_id, sender_name, message_text, telegram_message_id))
-            
-            conn.commit()
-            return cursor.lastrowid
-        except Exception as e:
-            logger.error(f"Error adding consultation message: {e}")
-            return None
-        finally:
-            conn.close()
 
 class VetDoctorBot:
     def __init__(self):
-        self.application = Application.builder().token(VET_BOT_TOKEN).build()
+        self.application = (
+            Application.builder().token(VET_BOT_TOKEN).base_url(TELEGRAM_API_URL)
+            .request(tracing.TracedRequest(connection_pool_size=256, bot_name='vet'))
+            .get_updates_request(tracing.TracedRequest(bot_name='vet'))
+            .post_init(self.start_event_bus).post_shutdown(self.stop_event_bus).build()
+        )
         self.db = VetDoctorDatabase()
+        self.media = MediaStore()
+        self.events = EventBus(self.db.db_path, consumer='doctor_bot')
+        self.events.subscribe('consultation.assigned', self.on_consultation_assigned)
+        self.outbox_relay = notification_system.create_outbox_relay()
+        self.metrics_server = None
+        self.watchdog = LoopWatchdog('doctor_bot')
+        self.history = ConsultationHistory(self.db.db_path, message_log=notification_system.messages)
         self.setup_handlers()
         
         # Состояния регистрации
@@ -287,6 +306,9 @@ class VetDoctorBot:
         elif query.data.startswith("take_client_"):
             consultation_id = int(query.data.split("_")[2])
             await self.take_client(query, context, consultation_id)
+        elif query.data.startswith("history_"):
+            _, consultation_id, after_id = query.data.split("_")
+            await self.show_more_history(query, context, int(consultation_id), int(after_id))
     
     async def start_registration(self, query, context):
         """Начать регистрацию врача"""
@@ -299,6 +321,7 @@ class VetDoctorBot:
             "Например: Иванов Иван Иванович"
         )
     
+    @timed('doctor_message')
     async def handle_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработчик текстовых сообщений"""
         user = update.effective_user
@@ -319,6 +342,12 @@ class VetDoctorBot:
                 message_text = update.message.text
                 client_id = active_consultation['client_id']
                 
+                # Трасса ответа ссылается на трассу вопроса клиента
+                tracing.annotate(**{
+                    'vetbot.consultation_id': active_consultation['id'],
+                    'vetbot.reply_to_trace': notification_system.last_client_trace(active_consultation['id']),
+                })
+                
                 # Отправляем сообщение клиенту
                 success = await notification_system.send_message_to_client(
                     client_id, 
@@ -350,7 +379,7 @@ class VetDoctorBot:
     
     def get_doctor_active_consultation(self, doctor_id):
         """Получить активную консультацию врача"""
-        conn = sqlite3.connect(self.db_path)
+        conn = sqlite3.connect(self.db.db_path)
         cursor = conn.cursor()
         
         cursor.execute('''
@@ -363,8 +392,9 @@ class VetDoctorBot:
         conn.close()
         
         if result:
-            columns = ['id', 'client_id', 'doctor_id', 'consultation_id', 'started_at', 
-                      'status', 'client_username', 'client_name', 'initial_message']
+            # Схема таблицы зависит от того, какой бот создал ее первым
+            # (у основного бота есть consultation_id), поэтому имена - из курсора
+            columns = [column[0] for column in cursor.description]
             return dict(zip(columns, result))
         return None
     
@@ -401,15 +431,21 @@ class VetDoctorBot:
         if state.get("step") == "waiting_photo":
             # Сохраняем фотографию
             photo = update.message.photo[-1]  # Берем фото наибольшего размера
+            thumb = update.message.photo[0]  # Наименьший размер служит миниатюрой
             
             try:
-                # Создаем директорию для фотографий врачей
-                os.makedirs("doctor_photos", exist_ok=True)
-                
-                # Скачиваем фото
+                # Скачиваем фото и миниатюру в память
                 file = await context.bot.get_file(photo.file_id)
-                photo_path = f"doctor_photos/{user.id}_{photo.file_id}.jpg"
-                await file.download_to_drive(photo_path)
+                photo_data = await file.download_as_bytearray()
+                
+                thumb_data = None
+                if thumb.file_unique_id != photo.file_unique_id:
+                    thumb_file = await context.bot.get_file(thumb.file_id)
+                    thumb_data = await thumb_file.download_as_bytearray()
+                
+                # Сохраняем в хранилище по хэшу содержимого; file_id уже годится
+                # для повторной отправки этим ботом без загрузки файла
+                photo_path = self.media.save_photo(photo_data, thumbnail=thumb_data, file_id=photo.file_id)
                 
                 # Регистрируем врача в базе данных
                 full_name = state["full_name"]
@@ -479,12 +515,23 @@ class VetDoctorBot:
         
         if doctor[4]:  # photo_path
             try:
-                with open(doctor[4], 'rb') as photo:
+                file_id = self.media.get_file_id(doctor[4])
+                if file_id:
+                    # Фото уже есть на серверах Telegram - отправляем по file_id
                     await update.message.reply_photo(
+                        photo=file_id,
+                        caption=profile_text,
+                        parse_mode='Markdown'
+                    )
+                else:
+                    # Чтение файла не должно блокировать цикл событий
+                    photo = await asyncio.to_thread(Path(doctor[4]).read_bytes)
+                    message = await update.message.reply_photo(
                         photo=photo,
                         caption=profile_text,
                         parse_mode='Markdown'
                     )
+                    self.media.remember_file_id(doctor[4], message.photo[-1].file_id)
             except:
                 await update.message.reply_text(profile_text, parse_mode='Markdown')
         else:
@@ -507,6 +554,7 @@ class VetDoctorBot:
             "🔄 Функция в разработке..."
         )
     
+    @timed('take_client')
     async def take_client(self, query, context, consultation_id):
         """Взять клиента на консультацию"""
         user = query.from_user
@@ -532,29 +580,11 @@ class VetDoctorBot:
             # Получаем информацию о консультации
             consultation_info = notification_system.get_consultation_info(consultation_id)
             if consultation_info:
-                # Отправляем историю диалога врачу
-                history = notification_system.get_consultation_history(consultation_id)
-                if history:
-                    history_text = "📖 **История диалога с клиентом:**\n\n"
-                    for sender_type, sender_name, message_text, sent_at in history:
-                        icon = {'client': '👤', 'ai': '🤖', 'admin': '👨‍💼'}.get(sender_type, '❓')
-                        history_text += f"{icon} **{sender_name}:** {message_text}\n\n"
-                    
-                    await context.bot.send_message(
-                        chat_id=user.id,
-                        text=history_text,
-                        parse_mode='Markdown'
-                    )
+                # Отправляем историю диалога врачу постранично
+                await self.history.send_page(context.bot, user.id, consultation_id)
                 
-                # Уведомляем клиента о подключении врача
-                client_id = consultation_info[1]  # client_id
-                await notification_system.send_message_to_client(
-                    client_id,
-                    f"👨‍⚕️ К диалогу подключился врач **{doctor[3]}**!\n\n"
-                    "Теперь вы можете задавать вопросы напрямую врачу. "
-                    "Все ваши сообщения будут переданы врачу, а ответы врача - вам.",
-                    from_doctor=doctor[3]
-                )
+                # Сообщение клиенту о подключении врача уже поставлено в outbox
+                # в транзакции назначения
                 
                 # Обновляем статус консультации на 'active'
                 self.update_consultation_status(consultation_id, 'active')
@@ -562,9 +592,22 @@ class VetDoctorBot:
         else:
             await query.edit_message_text(f"❌ {message}")
     
+    async def show_more_history(self, query, context, consultation_id, after_id):
+        """Следующая страница истории консультации"""
+        doctor = self.db.get_doctor(query.from_user.id)
+        consultation_info = notification_system.get_consultation_info(consultation_id)
+        
+        # Историю видит только врач, который ведет консультацию
+        if not doctor or not consultation_info or consultation_info['doctor_id'] != doctor[0]:
+            await context.bot.send_message(chat_id=query.from_user.id, text="❌ Нет доступа к этой консультации")
+            return
+        
+        await query.edit_message_reply_markup(reply_markup=None)
+        await self.history.send_page(context.bot, query.from_user.id, consultation_id, after_id)
+    
     def update_consultation_status(self, consultation_id, status):
         """Обновить статус консультации"""
-        conn = sqlite3.connect(self.db_path)
+        conn = sqlite3.connect(self.db.db_path)
         cursor = conn.cursor()
         
         try:
@@ -580,6 +623,37 @@ class VetDoctorBot:
         finally:
             conn.close()
     
+    async def on_consultation_assigned(self, event):
+        """Событие шины: админ переназначил консультацию на врача"""
+        payload = event['payload']
+        if not payload.get('reassigned'):
+            return
+        
+        await self.application.bot.send_message(
+            chat_id=payload['doctor_telegram_id'],
+            text=f"📋 Администратор назначил вам консультацию #{payload['consultation_id']}.\n\n"
+                 "💬 Ваши сообщения будут переданы клиенту."
+        )
+    
+    async def start_event_bus(self, application):
+        """Запустить доставку событий, outbox и /metrics вместе с ботом"""
+        self.metrics_server = start_metrics_server('doctor_bot')
+        tracing.configure('doctor_bot')
+        profiler.install('doctor_bot', asyncio.get_running_loop())
+        self.watchdog.start()
+        application.create_task(self.events.run())
+        application.create_task(self.outbox_relay.run())
+    
+    async def stop_event_bus(self, application):
+        """Остановить доставку событий и outbox, дописать журнал сообщений"""
+        self.events.stop()
+        self.outbox_relay.stop()
+        notification_system.messages.close()
+        profiler.stop()
+        self.watchdog.stop()
+        if self.metrics_server is not None:
+            self.metrics_server.shutdown()
+    
     def run(self):
         """Запуск бота"""
         print(f"""
@@ -591,6 +665,8 @@ class VetDoctorBot:
         self.application.run_polling(drop_pending_updates=True)
 
 if __name__ == '__main__':
+    # JSON-лог с ротацией, запись в файл - в отдельном потоке
+    setup_logging('doctor_bot', './vet_doctor_bot.log')
     bot = VetDoctorBot()
     bot.run()
 
@@ -16,10 +16,11 @@ from vetbot_improved.config import TELEGRAM_BOT_TOKEN, WEBAPP_URL, VERSION
 from vetbot_improved.database.base import get_db
 from vetbot_improved.models import (
     User, Consultation, ActiveConsultation, 
-    ConsultationMessage, VetCall
+    ConsultationMessage, VetCall, AIUsage
 )
 from vetbot_improved.services.ai_service import AIService
 from vetbot_improved.services.notification_service import NotificationService
+from vetbot_improved.utils.telegram_format import format_message
 
 logger = logging.getLogger(__name__)
 
@@ -273,11 +274,14 @@ class MainBot:
             # Получаем ответ от AI
             ai_response = await AIService.get_consultation(
                 message_text, 
-                user.username or user.first_name
+                user.username or user.first_name,
+                db=db,
+                user_id=user.id
             )
             
             # Отправляем ответ пользователю
-            await update.message.reply_text(ai_response)
+            for part in format_message(ai_response):
+                await update.message.reply_text(part)
             
             # Сохраняем консультацию в базу данных
             consultation = Consultation(
@@ -289,6 +293,13 @@ class MainBot:
             db.add(consultation)
             db.commit()
             
+            # Привязываем расход токенов к консультации
+            db.query(AIUsage).filter(
+                AIUsage.user_id == user.id,
+                AIUsage.consultation_id.is_(None)
+            ).update({AIUsage.consultation_id: consultation.id})
+            db.commit()
+            
             # Создаем активную консультацию
             active_consultation = ActiveConsultation(
                 client_id=user.id,
@@ -28,7 +28,18 @@ ADMIN_CHAT_ID = os.getenv("ADMIN_CHAT_ID", "")
 
 # Конфигурация DeepSeek API
 DEEPSEEK_API_KEY = os.getenv("DEEPSEEK_API_KEY", "")
-DEEPSEEK_API_URL = "https://api.deepseek.com/v1/chat/completions"
+DEEPSEEK_API_URL = os.getenv("DEEPSEEK_API_URL", "https://api.deepseek.com/v1/chat/completions")
+DEEPSEEK_MODEL = os.getenv("DEEPSEEK_MODEL", "deepseek-chat")
+DEEPSEEK_COST_PER_1K = float(os.getenv("DEEPSEEK_COST_PER_1K", "0.00027"))
+
+# Конфигурация шлюза LLM
+LLM_BACKENDS = [name.strip() for name in os.getenv("LLM_BACKENDS", "deepseek").split(",") if name.strip()]
+LLM_ROUTING = os.getenv("LLM_ROUTING", "priority")  # priority, cost, latency
+OPENAI_COMPAT_API_URL = os.getenv("OPENAI_COMPAT_API_URL", "")
+OPENAI_COMPAT_API_KEY = os.getenv("OPENAI_COMPAT_API_KEY", "")
+OPENAI_COMPAT_MODEL = os.getenv("OPENAI_COMPAT_MODEL", "gpt-4o-mini")
+OPENAI_COMPAT_COST_PER_1K = float(os.getenv("OPENAI_COMPAT_COST_PER_1K", "0.00015"))
+LLM_STUB_URL = os.getenv("LLM_STUB_URL", "http://127.0.0.1:8089/v1/chat/completions")
 
 # Конфигурация базы данных
 DATABASE_URL = os.getenv("DATABASE_URL", f"sqlite:///{DATA_DIR}/vetbot.db")
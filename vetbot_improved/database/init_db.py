@@ -8,7 +8,7 @@ from sqlalchemy.exc import SQLAlchemyError
 from vetbot_improved.database.base import Base, engine
 from vetbot_improved.models import (
     User, Doctor, Consultation, ActiveConsultation,
-    ConsultationMessage, DoctorNotification, VetCall,
+    ConsultationMessage, DoctorNotification, AIUsage, VetCall,
     AdminSession, AdminMessage, AdminMessageQueue
 )
 
@@ -8,7 +8,8 @@ from vetbot_improved.models.consultation import (
     Consultation,
     ActiveConsultation,
     ConsultationMessage,
-    DoctorNotification
+    DoctorNotification,
+    AIUsage
 )
 from vetbot_improved.models.vet_call import VetCall
 from vetbot_improved.models.admin import AdminSession, AdminMessage, AdminMessageQueue
@@ -20,6 +21,7 @@ __all__ = [
     "ActiveConsultation",
     "ConsultationMessage",
     "DoctorNotification",
+    "AIUsage",
     "VetCall",
     "AdminSession",
     "AdminMessage",
@@ -3,7 +3,7 @@
 """
 
 from datetime import datetime
-from sqlalchemy import Column, Integer, String, DateTime, Boolean, ForeignKey, Text
+from sqlalchemy import Column, Integer, String, DateTime, Boolean, ForeignKey, Text, Float
 from sqlalchemy.orm import relationship
 
 from vetbot_improved.database.base import Base
@@ -91,4 +91,23 @@ class DoctorNotification(Base):
     doctor = relationship("Doctor", back_populates="notifications")
 
     def __repr__(self):
-        return f"<DoctorNotification {self.id}: responded={self.is_responded}>"
\ No newline at end of file
+        return f"<DoctorNotification {self.id}: responded={self.is_responded}>"
+
+
+class AIUsage(Base):
+    """Модель учета токенов AI-запроса"""
+    __tablename__ = "ai_usage"
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, nullable=True)
+    consultation_id = Column(Integer, ForeignKey("consultations.id"), nullable=True)
+    backend = Column(String, nullable=True)
+    prompt_tokens = Column(Integer, default=0)
+    completion_tokens = Column(Integer, default=0)
+    cache_hit_tokens = Column(Integer, default=0)  # токены промпта из кэша контекста провайдера
+    cost = Column(Float, default=0.0)
+    latency = Column(Float, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f"<AIUsage {self.id}: {self.prompt_tokens}+{self.completion_tokens} tokens>"
@@ -3,11 +3,12 @@
 """
 
 import logging
-import asyncio
-import requests
-from typing import Dict, Any, Optional
+from typing import Optional
+from sqlalchemy.orm import Session
 
-from vetbot_improved.config import DEEPSEEK_API_KEY, DEEPSEEK_API_URL, VERSION
+from vetbot_improved.models import AIUsage
+from vetbot_improved.services.llm_gateway import get_gateway
+from vetbot_improved.utils.telegram_format import sanitize_markdown
 
 logger = logging.getLogger(__name__)
 
@@ -15,75 +16,47 @@ class AIService:
     """Сервис для работы с DeepSeek API"""
     
     @staticmethod
-    async def get_consultation(user_message: str, user_name: str) -> str:
+    async def get_consultation(
+        user_message: str,
+        user_name: str,
+        db: Optional[Session] = None,
+        user_id: Optional[int] = None
+    ) -> str:
         """
         Получение AI-консультации от DeepSeek
         
         Args:
             user_message: Сообщение пользователя
             user_name: Имя пользователя
+            db: Сессия базы данных для учета токенов
+            user_id: ID пользователя для учета токенов
             
         Returns:
             str: Ответ AI
         """
         try:
-            system_prompt = """Ты опытный ветеринар-фелинолог с 15+ летним стажем, специализирующийся исключительно на лечении кошек.
-
-Важные правила ответа:
-- НЕ используй символы ### в ответах
-- НЕ используй форматирование **текст**
-- Используй простой текст с эмодзи
-- Структурируй ответ с помощью номеров и эмодзи
-
-Дай профессиональную консультацию по здоровью кошки, включая:
-1. Анализ симптомов
-2. Возможные причины
-3. Рекомендации по первой помощи
-4. Когда обязательно нужен осмотр врача
-
-Помни: ты консультируешь только по кошкам!"""
+            response = await get_gateway().consult(user_message, user_name)
+            ai_response = response.text
             
-            headers = {
-                'Authorization': f'Bearer {DEEPSEEK_API_KEY}',
-                'Content-Type': 'application/json'
-            }
+            if db is not None:
+                db.add(AIUsage(
+                    user_id=user_id,
+                    backend=response.backend,
+                    prompt_tokens=response.prompt_tokens,
+                    completion_tokens=response.completion_tokens,
+                    cache_hit_tokens=response.cache_hit_tokens,
+                    cost=response.cost,
+                    latency=response.latency
+                ))
+                db.commit()
             
-            data = {
-                "model": "deepseek-chat",
-                "messages": [
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": f"Пользователь {user_name} спрашивает: {user_message}"}
-                ],
-                "max_tokens": 1500,
-                "temperature": 0.7
-            }
+            # Очистка форматирования
+            ai_response = sanitize_markdown(ai_response)
             
-            # Асинхронный запрос с таймаутом
-            response = await asyncio.wait_for(
-                asyncio.to_thread(
-                    requests.post, 
-                    DEEPSEEK_API_URL, 
-                    headers=headers, 
-                    json=data, 
-                    timeout=30
-                ),
-                timeout=35.0
-            )
+            # Добавляем предупреждение
+            ai_response += "\n\n⚠️ Для точного диагноза рекомендуется очный осмотр"
             
-            if response.status_code == 200:
-                result = response.json()
-                ai_response = result['choices'][0]['message']['content']
-                
-                # Очистка форматирования
-                ai_response = ai_response.replace('###', '').replace('**', '')
-                
-                # Добавляем предупреждение
-                ai_response += "\n\n⚠️ Для точного диагноза рекомендуется очный осмотр"
-                
-                return ai_response
-            else:
-                logger.error(f"DeepSeek API error: {response.status_code}")
-                return AIService.get_fallback_response()
+            return ai_response
                 
         except Exception as e:
             logger.error(f"Error getting AI consultation: {e}")
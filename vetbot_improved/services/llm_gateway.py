@@ -0,0 +1,427 @@
+"""
+Шлюз к языковым моделям: единая точка обращения к DeepSeek и совместимым API
+"""
+
+import time
+import asyncio
+import logging
+import requests
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+from vetbot_improved.config import (
+    DEEPSEEK_API_KEY, DEEPSEEK_API_URL, DEEPSEEK_MODEL, DEEPSEEK_COST_PER_1K,
+    LLM_BACKENDS, LLM_ROUTING, LLM_STUB_URL,
+    OPENAI_COMPAT_API_URL, OPENAI_COMPAT_API_KEY, OPENAI_COMPAT_MODEL, OPENAI_COMPAT_COST_PER_1K
+)
+from vetbot_improved.utils.metrics import LLM_REQUEST_SECONDS, LLM_TOKENS
+from vetbot_improved.utils.tracing import span
+
+logger = logging.getLogger(__name__)
+
+VET_SYSTEM_PROMPT = """Ты опытный ветеринар-фелинолог с 15+ летним стажем, специализирующийся исключительно на лечении кошек.
+
+Важные правила ответа:
+- НЕ используй символы ### в ответах
+- НЕ используй форматирование **текст**
+- Используй простой текст с эмодзи
+- Структурируй ответ с помощью номеров и эмодзи
+
+Дай профессиональную консультацию по здоровью кошки, включая:
+1. Анализ симптомов
+2. Возможные причины
+3. Рекомендации по первой помощи
+4. Когда обязательно нужен осмотр врача
+
+Помни: ты консультируешь только по кошкам!"""
+
+
+class LLMError(Exception):
+    """Ошибка обращения к языковой модели"""
+
+
+@dataclass
+class LLMResponse:
+    """Ответ языковой модели"""
+    text: str
+    backend: str
+    latency: float
+    usage: Dict[str, int] = field(default_factory=dict)
+    cost: float = 0.0
+
+    @property
+    def prompt_tokens(self) -> int:
+        return self.usage.get('prompt_tokens', 0)
+
+    @property
+    def completion_tokens(self) -> int:
+        return self.usage.get('completion_tokens', 0)
+
+    @property
+    def cache_hit_tokens(self) -> int:
+        """Токены промпта, взятые из кэша контекста провайдера"""
+        # DeepSeek отдает prompt_cache_hit_tokens, OpenAI - prompt_tokens_details.cached_tokens
+        if 'prompt_cache_hit_tokens' in self.usage:
+            return self.usage['prompt_cache_hit_tokens']
+        details = self.usage.get('prompt_tokens_details') or {}
+        return details.get('cached_tokens', 0)
+
+
+@lru_cache(maxsize=8)
+def prompt_prefix(system_prompt: str) -> Tuple[Dict[str, str], ...]:
+    """
+    Неизменный префикс запроса для системного промпта
+
+    Провайдеры кэшируют контекст только для побайтно одинакового начала
+    запроса, поэтому префикс строится один раз и переиспользуется.
+
+    Args:
+        system_prompt: Системный промпт
+
+    Returns:
+        Tuple[Dict[str, str], ...]: Сообщения префикса
+    """
+    return ({"role": "system", "content": system_prompt.strip()},)
+
+
+class LLMBackend:
+    """Базовый класс бэкенда языковой модели"""
+
+    name = "base"
+    cost_per_1k_tokens = 0.0
+
+    async def complete(
+        self,
+        messages: List[Dict[str, str]],
+        max_tokens: int = 1500,
+        temperature: float = 0.7
+    ) -> LLMResponse:
+        """
+        Получить ответ модели
+
+        Args:
+            messages: Сообщения в формате chat completions
+            max_tokens: Максимальная длина ответа
+            temperature: Температура генерации
+
+        Returns:
+            LLMResponse: Ответ модели
+
+        Raises:
+            LLMError: Модель недоступна или вернула ошибку
+        """
+        raise NotImplementedError
+
+
+class OpenAICompatibleBackend(LLMBackend):
+    """Бэкенд для любого API, совместимого с OpenAI chat completions"""
+
+    def __init__(
+        self,
+        name: str,
+        url: str,
+        api_key: str,
+        model: str,
+        cost_per_1k_tokens: float = 0.0,
+        timeout: tuple = (5, 30)
+    ):
+        self.name = name
+        self.url = url
+        self.api_key = api_key
+        self.model = model
+        self.cost_per_1k_tokens = cost_per_1k_tokens
+        self.timeout = timeout
+
+    async def complete(
+        self,
+        messages: List[Dict[str, str]],
+        max_tokens: int = 1500,
+        temperature: float = 0.7
+    ) -> LLMResponse:
+        headers = {
+            'Authorization': f'Bearer {self.api_key}',
+            'Content-Type': 'application/json'
+        }
+
+        data = {
+            "model": self.model,
+            "messages": messages,
+            "max_tokens": max_tokens,
+            "temperature": temperature
+        }
+
+        start = time.monotonic()
+        with span('llm.request', root=False, backend=self.name, model=self.model) as opened:
+            if opened is not None:
+                headers['traceparent'] = opened.traceparent()
+            try:
+                # requests блокирующий - выполняем в отдельном потоке
+                response = await asyncio.to_thread(
+                    requests.post,
+                    self.url,
+                    headers=headers,
+                    json=data,
+                    timeout=self.timeout
+                )
+            except requests.RequestException as e:
+                raise LLMError(f"{self.name} request failed: {e}") from e
+
+            if opened is not None:
+                opened.set_attribute('http.status_code', response.status_code)
+            if response.status_code != 200:
+                raise LLMError(f"{self.name} API error: {response.status_code}")
+
+        result = response.json()
+        usage = result.get('usage', {})
+        return LLMResponse(
+            text=result['choices'][0]['message']['content'],
+            backend=self.name,
+            latency=time.monotonic() - start,
+            usage=usage,
+            cost=usage.get('total_tokens', 0) / 1000 * self.cost_per_1k_tokens
+        )
+
+
+class DeepSeekBackend(OpenAICompatibleBackend):
+    """Бэкенд DeepSeek API"""
+
+    def __init__(
+        self,
+        api_key: str = DEEPSEEK_API_KEY,
+        url: str = DEEPSEEK_API_URL,
+        model: str = DEEPSEEK_MODEL
+    ):
+        super().__init__("deepseek", url, api_key, model, cost_per_1k_tokens=DEEPSEEK_COST_PER_1K)
+
+
+class _BackendHealth:
+    """Состояние бэкенда для маршрутизации"""
+
+    def __init__(self):
+        self.ewma_latency = 0.0
+        self.failures = 0
+        self.down_until = 0.0
+
+
+class LLMGateway:
+    """
+    Маршрутизатор запросов между бэкендами
+
+    Бэкенды перебираются в порядке стратегии маршрутизации: priority - в
+    порядке конфигурации, cost - от дешевого к дорогому, latency - по
+    сглаженной задержке. Бэкенд, ошибившийся failure_threshold раз подряд,
+    пропускается на cooldown секунд.
+    """
+
+    def __init__(
+        self,
+        backends: List[LLMBackend],
+        routing: str = "priority",
+        failure_threshold: int = 3,
+        cooldown: float = 30.0,
+        alpha: float = 0.2
+    ):
+        self.backends = backends
+        self.routing = routing
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.alpha = alpha
+        self._health = {backend.name: _BackendHealth() for backend in backends}
+        self.usage = {'requests': 0, 'prompt_tokens': 0, 'completion_tokens': 0,
+                      'cache_hit_tokens': 0, 'cost': 0.0}
+
+    def ordered_backends(self) -> List[LLMBackend]:
+        """
+        Доступные бэкенды в порядке маршрутизации
+
+        Returns:
+            List[LLMBackend]: Бэкенды, которые сейчас не на паузе
+        """
+        now = time.monotonic()
+        available = [b for b in self.backends if self._health[b.name].down_until <= now]
+
+        if self.routing == "cost":
+            return sorted(available, key=lambda b: b.cost_per_1k_tokens)
+        if self.routing == "latency":
+            return sorted(available, key=lambda b: self._health[b.name].ewma_latency)
+        return available
+
+    def _record_success(self, backend: LLMBackend, latency: float) -> None:
+        health = self._health[backend.name]
+        health.failures = 0
+        if health.ewma_latency:
+            health.ewma_latency = self.alpha * latency + (1 - self.alpha) * health.ewma_latency
+        else:
+            health.ewma_latency = latency
+
+    def _record_usage(self, response: LLMResponse) -> None:
+        self.usage['requests'] += 1
+        self.usage['prompt_tokens'] += response.prompt_tokens
+        self.usage['completion_tokens'] += response.completion_tokens
+        self.usage['cache_hit_tokens'] += response.cache_hit_tokens
+        self.usage['cost'] += response.cost
+        LLM_TOKENS.inc(response.prompt_tokens, backend=response.backend, kind='prompt')
+        LLM_TOKENS.inc(response.completion_tokens, backend=response.backend, kind='completion')
+        LLM_TOKENS.inc(response.cache_hit_tokens, backend=response.backend, kind='cache_hit')
+
+    def cache_hit_ratio(self) -> float:
+        """
+        Доля токенов промпта, попавших в кэш провайдера
+
+        Returns:
+            float: От 0 до 1
+        """
+        if not self.usage['prompt_tokens']:
+            return 0.0
+        return self.usage['cache_hit_tokens'] / self.usage['prompt_tokens']
+
+    def _record_failure(self, backend: LLMBackend) -> None:
+        health = self._health[backend.name]
+        health.failures += 1
+        if health.failures >= self.failure_threshold:
+            health.down_until = time.monotonic() + self.cooldown
+            logger.warning(f"LLM backend {backend.name} paused for {self.cooldown:.0f}s")
+
+    async def complete(
+        self,
+        messages: List[Dict[str, str]],
+        max_tokens: int = 1500,
+        temperature: float = 0.7
+    ) -> LLMResponse:
+        """
+        Получить ответ от первого работающего бэкенда
+
+        Args:
+            messages: Сообщения в формате chat completions
+            max_tokens: Максимальная длина ответа
+            temperature: Температура генерации
+
+        Returns:
+            LLMResponse: Ответ модели
+
+        Raises:
+            LLMError: Ни один бэкенд не ответил
+        """
+        backends = self.ordered_backends()
+        if not backends:
+            raise LLMError("All LLM backends are paused")
+
+        last_error: Optional[Exception] = None
+        for backend in backends:
+            started = time.perf_counter()
+            try:
+                response = await backend.complete(messages, max_tokens=max_tokens, temperature=temperature)
+            except Exception as e:
+                LLM_REQUEST_SECONDS.observe(time.perf_counter() - started, backend=backend.name, outcome='error')
+                logger.error(f"LLM backend {backend.name} failed: {e}")
+                self._record_failure(backend)
+                last_error = e
+                continue
+
+            LLM_REQUEST_SECONDS.observe(response.latency, backend=backend.name, outcome='ok')
+            self._record_success(backend, response.latency)
+            self._record_usage(response)
+            return response
+
+        raise LLMError(f"All LLM backends failed: {last_error}")
+
+    @staticmethod
+    def build_messages(
+        user_message: str,
+        user_name: Optional[str] = None,
+        system_prompt: str = VET_SYSTEM_PROMPT,
+        history: Optional[List[Dict[str, str]]] = None,
+        summary: str = ""
+    ) -> List[Dict[str, str]]:
+        """
+        Сообщения для ветеринарной консультации
+
+        Args:
+            user_message: Вопрос пользователя
+            user_name: Имя пользователя
+            system_prompt: Системный промпт
+            history: Предыдущие реплики диалога
+            summary: Краткое содержание более ранних обращений
+
+        Returns:
+            List[Dict[str, str]]: Сообщения для chat completions
+        """
+        content = f"Пользователь {user_name} спрашивает: {user_message}" if user_name else user_message
+        # Системный промпт, краткое содержание и история идут перед вопросом,
+        # чтобы общее начало запросов попадало в кэш контекста провайдера
+        messages = list(prompt_prefix(system_prompt))
+        if summary:
+            messages.append({
+                "role": "system",
+                "content": f"Краткое содержание предыдущих обращений клиента:\n{summary}"
+            })
+        messages.extend(history or [])
+        messages.append({"role": "user", "content": content})
+        return messages
+
+    async def consult(
+        self,
+        user_message: str,
+        user_name: Optional[str] = None,
+        system_prompt: str = VET_SYSTEM_PROMPT,
+        max_tokens: int = 1500,
+        temperature: float = 0.7,
+        history: Optional[List[Dict[str, str]]] = None,
+        summary: str = ""
+    ) -> LLMResponse:
+        """
+        Ветеринарная консультация по вопросу пользователя
+
+        Args:
+            user_message: Вопрос пользователя
+            user_name: Имя пользователя
+            system_prompt: Системный промпт
+            max_tokens: Максимальная длина ответа
+            temperature: Температура генерации
+            history: Предыдущие реплики диалога
+            summary: Краткое содержание более ранних обращений
+
+        Returns:
+            LLMResponse: Ответ модели
+        """
+        messages = self.build_messages(user_message, user_name, system_prompt, history, summary)
+        return await self.complete(messages, max_tokens=max_tokens, temperature=temperature)
+
+
+def create_backend(name: str) -> LLMBackend:
+    """
+    Создать бэкенд по имени из конфигурации
+
+    Args:
+        name: deepseek, openai или stub
+
+    Returns:
+        LLMBackend: Бэкенд
+    """
+    if name == "deepseek":
+        return DeepSeekBackend()
+    if name == "openai":
+        return OpenAICompatibleBackend(
+            "openai", OPENAI_COMPAT_API_URL, OPENAI_COMPAT_API_KEY,
+            OPENAI_COMPAT_MODEL, cost_per_1k_tokens=OPENAI_COMPAT_COST_PER_1K
+        )
+    if name == "stub":
+        return OpenAICompatibleBackend("stub", LLM_STUB_URL, "stub", "stub-vet")
+    raise ValueError(f"Unknown LLM backend: {name}")
+
+
+_gateway: Optional[LLMGateway] = None
+
+
+def get_gateway() -> LLMGateway:
+    """
+    Общий шлюз, настроенный по LLM_BACKENDS и LLM_ROUTING
+
+    Returns:
+        LLMGateway: Шлюз
+    """
+    global _gateway
+    if _gateway is None:
+        _gateway = LLMGateway([create_backend(name) for name in LLM_BACKENDS], routing=LLM_ROUTING)
+    return _gateway
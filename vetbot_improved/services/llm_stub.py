@@ -0,0 +1,205 @@
+"""
+Офлайн-заглушка LLM API для нагрузочного тестирования
+
+Отвечает в формате OpenAI chat completions детерминированным текстом,
+зависящим только от вопроса, с настраиваемым распределением задержки.
+"""
+
+import json
+import math
+import time
+import random
+import hashlib
+import logging
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Tuple
+
+logger = logging.getLogger(__name__)
+
+STUB_ANSWERS = [
+    "🐱 1. Анализ симптомов: описанное состояние требует наблюдения.\n"
+    "2. Возможные причины: погрешность в кормлении, стресс, начало инфекции.\n"
+    "3. Первая помощь: обеспечьте покой и доступ к воде.\n"
+    "4. Осмотр врача нужен, если состояние не улучшится в течение суток.",
+    "🩺 1. Анализ симптомов: похоже на расстройство пищеварения.\n"
+    "2. Возможные причины: смена корма, шерсть в желудке, паразиты.\n"
+    "3. Первая помощь: голодная диета 8-12 часов, вода без ограничений.\n"
+    "4. Осмотр врача обязателен при крови, вялости или отказе от воды.",
+    "😺 1. Анализ симптомов: поведение в пределах нормы для кошки.\n"
+    "2. Возможные причины: возрастные особенности, скука, изменения в доме.\n"
+    "3. Рекомендации: игры, когтеточка, стабильный режим дня.\n"
+    "4. Осмотр врача - при появлении новых симптомов.",
+]
+
+
+def parse_latency(spec: str, seed: int = 0) -> Callable[[], float]:
+    """
+    Разобрать описание распределения задержки
+
+    Args:
+        spec: fixed:S, uniform:MIN,MAX или lognormal:MEDIAN,SIGMA (секунды)
+        seed: Зерно генератора, чтобы прогоны были воспроизводимы
+
+    Returns:
+        Callable[[], float]: Функция, возвращающая очередную задержку
+    """
+    rng = random.Random(seed)
+    kind, _, args = spec.partition(":")
+    values = [float(v) for v in args.split(",") if v] if args else []
+
+    if kind == "fixed":
+        delay = values[0] if values else 0.0
+        return lambda: delay
+    if kind == "uniform":
+        low, high = values
+        return lambda: rng.uniform(low, high)
+    if kind == "lognormal":
+        median, sigma = values
+        mu = math.log(median)
+        return lambda: rng.lognormvariate(mu, sigma)
+    raise ValueError(f"Unknown latency distribution: {spec}")
+
+
+def stub_answer(messages) -> str:
+    """
+    Детерминированный ответ на вопрос
+
+    Args:
+        messages: Сообщения запроса
+
+    Returns:
+        str: Ответ, одинаковый для одинаковых вопросов
+    """
+    question = messages[-1]["content"] if messages else ""
+    digest = hashlib.sha256(question.encode("utf-8")).digest()
+    return STUB_ANSWERS[digest[0] % len(STUB_ANSWERS)]
+
+
+class StubLLMServer(ThreadingHTTPServer):
+    """HTTP-сервер заглушки"""
+
+    daemon_threads = True
+
+    def __init__(self, address, latency: Callable[[], float], error_rate: float = 0.0, seed: int = 0):
+        super().__init__(address, _StubHandler)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests_served = 0
+        # Как у DeepSeek: префикс запроса, уже встречавшийся раньше, берется из кэша
+        self.seen_prefixes = set()
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1/chat/completions"
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    """Обработчик запросов chat completions"""
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        payload = json.loads(self.rfile.read(length) or b"{}")
+
+        with self.server.lock:
+            delay = self.server.latency()
+            failed = self.server.rng.random() < self.server.error_rate
+            self.server.requests_served += 1
+
+        time.sleep(max(0.0, delay))
+
+        if failed:
+            self._reply(503, {"error": {"message": "stub overloaded"}})
+            return
+
+        messages = payload.get("messages", [])
+        text = stub_answer(messages)
+        prompt_tokens = sum(len(m.get("content", "")) for m in messages) // 4
+        cache_hit_tokens = self._cached_prefix_tokens(messages)
+        self._reply(200, {
+            "id": "stub",
+            "object": "chat.completion",
+            "model": payload.get("model", "stub-vet"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": len(text) // 4,
+                "total_tokens": prompt_tokens + len(text) // 4,
+                "prompt_cache_hit_tokens": cache_hit_tokens,
+                "prompt_cache_miss_tokens": prompt_tokens - cache_hit_tokens
+            }
+        })
+
+    def _cached_prefix_tokens(self, messages) -> int:
+        """Токены самого длинного ранее встречавшегося префикса сообщений"""
+        digest = hashlib.sha256()
+        hit = tokens = 0
+        with self.server.lock:
+            for message in messages:
+                digest.update(json.dumps(message, ensure_ascii=False, sort_keys=True).encode("utf-8"))
+                tokens += len(message.get("content", "")) // 4
+                key = digest.hexdigest()
+                if key in self.server.seen_prefixes:
+                    hit = tokens
+                self.server.seen_prefixes.add(key)
+        return hit
+
+    def _reply(self, status: int, body: dict) -> None:
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+
+def start_stub_server(
+    host: str = "127.0.0.1",
+    port: int = 0,
+    latency: str = "fixed:0",
+    error_rate: float = 0.0,
+    seed: int = 0
+) -> Tuple[StubLLMServer, threading.Thread]:
+    """
+    Запустить заглушку в фоновом потоке
+
+    Args:
+        host: Адрес
+        port: Порт (0 - любой свободный)
+        latency: Распределение задержки, см. parse_latency
+        error_rate: Доля ответов 503
+        seed: Зерно генератора
+
+    Returns:
+        Tuple[StubLLMServer, threading.Thread]: Сервер (адрес в server.url) и его поток
+    """
+    server = StubLLMServer((host, port), parse_latency(latency, seed), error_rate, seed)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, thread
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+    )
+
+    parser = argparse.ArgumentParser(description='Заглушка LLM API')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8089)
+    parser.add_argument('--latency', default='lognormal:0.8,0.5')
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    server = StubLLMServer((args.host, args.port), parse_latency(args.latency, args.seed), args.error_rate, args.seed)
+    logger.info(f"LLM stub listening on {server.url}")
+    server.serve_forever()
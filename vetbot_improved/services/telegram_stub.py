@@ -0,0 +1,250 @@
+"""
+Офлайн-заглушка Telegram Bot API для сквозного бенчмарка
+
+Принимает запросы python-telegram-bot по адресу <url><токен>/<метод>
+(url передается ботам как TELEGRAM_API_URL). Обновления для ботов
+кладутся в очередь методом push() и раздаются через getUpdates с long
+polling; все вызовы ботов (sendMessage, editMessageText, ...) пишутся в
+журнал sent с моментом получения, по которому считается задержка ответа.
+"""
+
+import re
+import sys
+import json
+import time
+import logging
+import itertools
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl
+
+logger = logging.getLogger(__name__)
+
+# Дольше не держим getUpdates, чтобы боты быстро останавливались
+MAX_POLL_TIMEOUT = 2.0
+
+# Методы, которые возвращают True, а не Message
+_BOOLEAN_METHODS = {
+    "answerCallbackQuery", "deleteMessage", "deleteWebhook", "setWebhook", "setMyCommands",
+    "sendChatAction", "logOut", "close",
+}
+
+
+def _user(user_id: int, first_name: Optional[str] = None) -> dict:
+    return {"id": user_id, "is_bot": False, "first_name": first_name or f"Клиент {user_id}",
+            "username": f"user{user_id}"}
+
+
+def _chat(chat_id: int) -> dict:
+    return {"id": chat_id, "type": "private"}
+
+
+def text_message(user_id: int, text: str, first_name: Optional[str] = None) -> dict:
+    """Обновление с текстовым сообщением (команды размечаются как bot_command)"""
+    message = {"message_id": 0, "date": int(time.time()), "chat": _chat(user_id),
+               "from": _user(user_id, first_name), "text": text}
+    if text.startswith("/"):
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+    return {"message": message}
+
+
+def callback_query(user_id: int, data: str, message_id: int) -> dict:
+    """Обновление с нажатием inline-кнопки под сообщением бота message_id"""
+    return {"callback_query": {
+        "id": f"{user_id}:{message_id}:{data}",
+        "from": _user(user_id),
+        "chat_instance": str(user_id),
+        "data": data,
+        "message": {"message_id": message_id, "date": int(time.time()), "chat": _chat(user_id), "text": ""},
+    }}
+
+
+def web_app_message(user_id: int, data: dict) -> dict:
+    """Обновление с данными формы веб-приложения"""
+    return {"message": {
+        "message_id": 0, "date": int(time.time()), "chat": _chat(user_id), "from": _user(user_id),
+        "web_app_data": {"data": json.dumps(data, ensure_ascii=False), "button_text": "Вызвать врача"},
+    }}
+
+
+def callback_data(record: dict) -> List[str]:
+    """callback_data всех inline-кнопок сообщения из журнала sent"""
+    markup = record.get("reply_markup") or {}
+    return [button["callback_data"] for row in markup.get("inline_keyboard", [])
+            for button in row if "callback_data" in button]
+
+
+class StubTelegramServer(ThreadingHTTPServer):
+    """HTTP-сервер заглушки Bot API"""
+
+    daemon_threads = True
+    # Всплеск запросов ботов не должен упираться в очередь accept()
+    request_queue_size = 256
+
+    def __init__(self, address):
+        super().__init__(address, _StubHandler)
+        self.cond = threading.Condition()
+        self.updates: Dict[str, List[dict]] = {}
+        self.polling: Dict[str, float] = {}
+        self.sent: List[dict] = []
+        self.on_sent: Optional[Callable[[dict], None]] = None
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        # Чат, из которого пришел callback_query, - для answerCallbackQuery
+        self._callback_chats: Dict[str, int] = {}
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/bot"
+
+    def handle_error(self, request, client_address):
+        # Боты рвут соединение long polling при остановке - это не ошибка
+        if isinstance(sys.exc_info()[1], ConnectionError):
+            return
+        super().handle_error(request, client_address)
+
+    def push(self, token: str, update: dict) -> float:
+        """
+        Поставить обновление в очередь бота
+
+        Args:
+            token: Токен бота-получателя
+            update: Обновление без update_id (см. text_message и др.)
+
+        Returns:
+            float: Момент постановки (time.monotonic) - начало отсчета задержки
+        """
+        with self.cond:
+            update = dict(update, update_id=next(self._update_ids))
+            for key in ("message", "callback_query"):
+                if key in update:
+                    update[key] = dict(update[key])
+            if "message" in update and not update["message"].get("message_id"):
+                update["message"]["message_id"] = next(self._message_ids)
+            if "callback_query" in update:
+                query = update["callback_query"]
+                self._callback_chats[query["id"]] = query["from"]["id"]
+            self.updates.setdefault(token, []).append(update)
+            self.cond.notify_all()
+            return time.monotonic()
+
+    def pending(self, token: str) -> int:
+        """Обновления, которые бот еще не подтвердил"""
+        with self.cond:
+            return len(self.updates.get(token, []))
+
+    def _get_updates(self, token: str, offset: int, timeout: float) -> List[dict]:
+        with self.cond:
+            self.polling[token] = time.monotonic()
+            queue = self.updates.setdefault(token, [])
+            # offset подтверждает все обновления до него
+            queue[:] = [update for update in queue if update["update_id"] >= offset]
+            self.cond.wait_for(lambda: self.updates[token], timeout=min(timeout, MAX_POLL_TIMEOUT))
+            return list(self.updates[token])
+
+    def _record(self, token: str, method: str, params: dict) -> dict:
+        chat_id = params.get("chat_id")
+        if chat_id is None and "callback_query_id" in params:
+            chat_id = self._callback_chats.get(params["callback_query_id"])
+        message_id = params.get("message_id")
+        if message_id is None and method.startswith("send"):
+            message_id = next(self._message_ids)
+
+        record = {
+            "at": time.monotonic(),
+            "token": token,
+            "method": method,
+            "chat_id": int(chat_id) if chat_id is not None else None,
+            "message_id": int(message_id) if message_id is not None else None,
+            "text": params.get("text") or params.get("caption") or "",
+            "reply_markup": params.get("reply_markup"),
+        }
+        with self.cond:
+            self.sent.append(record)
+        if self.on_sent is not None:
+            self.on_sent(record)
+        return record
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    """Обработчик методов Bot API"""
+
+    def do_POST(self):
+        match = re.fullmatch(r"/bot([^/]+)/(\w+)", self.path)
+        if not match:
+            self._reply(404, {"ok": False, "error_code": 404, "description": "Not Found"})
+            return
+        token, method = match.groups()
+        params = self._params()
+
+        if method == "getMe":
+            bot_id = int(token.split(":")[0]) if token.split(":")[0].isdigit() else 1
+            result = {"id": bot_id, "is_bot": True, "first_name": "Stub", "username": f"stub{bot_id}_bot",
+                      "can_join_groups": False, "can_read_all_group_messages": False,
+                      "supports_inline_queries": False}
+        elif method == "getUpdates":
+            result = self.server._get_updates(token, int(params.get("offset") or 0), float(params.get("timeout") or 0))
+        elif method == "getWebhookInfo":
+            result = {"url": "", "has_custom_certificate": False, "pending_update_count": 0}
+        elif method in _BOOLEAN_METHODS:
+            if method != "deleteWebhook":
+                self.server._record(token, method, params)
+            result = True
+        else:
+            record = self.server._record(token, method, params)
+            result = {"message_id": record["message_id"] or 0, "date": int(time.time()),
+                      "chat": _chat(record["chat_id"] or 0), "text": record["text"]}
+        self._reply(200, {"ok": True, "result": result})
+
+    def _params(self) -> dict:
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length) if length else b""
+        content_type = self.headers.get("Content-Type", "")
+
+        if content_type.startswith("application/json"):
+            return json.loads(body or b"{}")
+        if content_type.startswith("multipart/form-data"):
+            # sendPhoto и т.п.: нужны только простые поля, файл не разбираем
+            raw = dict(re.findall(rb'name="(\w+)"\r\n\r\n([^\r]*)\r\n', body))
+            pairs = [(key.decode(), value.decode("utf-8", "replace")) for key, value in raw.items()]
+        else:
+            pairs = parse_qsl(body.decode("utf-8"), keep_blank_values=True)
+
+        # python-telegram-bot кодирует нестроковые параметры в JSON
+        params = {}
+        for key, value in pairs:
+            try:
+                params[key] = json.loads(value) if key != "text" else value
+            except ValueError:
+                params[key] = value
+        return params
+
+    def _reply(self, status: int, body: dict) -> None:
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+
+def start_stub_server(host: str = "127.0.0.1", port: int = 0) -> Tuple[StubTelegramServer, threading.Thread]:
+    """
+    Запустить заглушку в фоновом потоке
+
+    Args:
+        host: Адрес
+        port: Порт (0 - любой свободный)
+
+    Returns:
+        Tuple[StubTelegramServer, threading.Thread]: Сервер (base_url ботов в server.url) и его поток
+    """
+    server = StubTelegramServer((host, port))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, thread
@@ -12,12 +12,18 @@ from sqlalchemy.orm import sessionmaker
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 from vetbot_improved.database.base import Base
+from vetbot_improved.utils import tracing
 from vetbot_improved.models import (
     User, Doctor, Consultation, ActiveConsultation,
-    ConsultationMessage, DoctorNotification, VetCall,
+    ConsultationMessage, DoctorNotification, AIUsage, VetCall,
     AdminSession, AdminMessage, AdminMessageQueue
 )
 
+@pytest.fixture(scope="session", autouse=True)
+def no_trace_export():
+    """Тесты не пишут трассы в рабочий каталог"""
+    tracing.configure(path='')
+
 # Создаем тестовую базу данных в памяти
 TEST_DATABASE_URL = "sqlite:///:memory:"
 
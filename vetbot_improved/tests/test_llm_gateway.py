@@ -0,0 +1,135 @@
+"""
+Тесты шлюза LLM и офлайн-заглушки
+"""
+
+import asyncio
+import pytest
+
+from vetbot_improved.services.llm_gateway import (
+    LLMBackend, LLMGateway, LLMError, LLMResponse, OpenAICompatibleBackend
+)
+from vetbot_improved.services.llm_stub import start_stub_server, stub_answer, parse_latency
+
+
+class FakeBackend(LLMBackend):
+    """Бэкенд с заданной ценой, задержкой и ошибками"""
+
+    def __init__(self, name, cost=0.0, latency=0.0, fail=False):
+        self.name = name
+        self.cost_per_1k_tokens = cost
+        self.latency = latency
+        self.fail = fail
+        self.calls = 0
+
+    async def complete(self, messages, max_tokens=1500, temperature=0.7):
+        self.calls += 1
+        if self.fail:
+            raise LLMError(f"{self.name} down")
+        return LLMResponse(text=f"ответ {self.name}", backend=self.name, latency=self.latency)
+
+
+def test_cost_routing_prefers_cheapest_backend():
+    """Маршрутизация по цене выбирает самый дешевый бэкенд"""
+    expensive = FakeBackend("expensive", cost=1.0)
+    cheap = FakeBackend("cheap", cost=0.1)
+    gateway = LLMGateway([expensive, cheap], routing="cost")
+
+    response = asyncio.run(gateway.consult("Кошка чихает", "Анна"))
+
+    assert response.backend == "cheap"
+    assert expensive.calls == 0
+
+
+def test_latency_routing_learns_from_responses():
+    """Маршрутизация по задержке переключается на более быстрый бэкенд"""
+    slow = FakeBackend("slow", latency=5.0)
+    fast = FakeBackend("fast", latency=0.5)
+    gateway = LLMGateway([slow, fast], routing="latency")
+
+    # Первые ответы дают оценку задержки обоих бэкендов
+    asyncio.run(gateway.complete([]))
+    slow.fail = True
+    asyncio.run(gateway.complete([]))
+    slow.fail = False
+
+    assert [b.name for b in gateway.ordered_backends()][0] == "fast"
+
+
+def test_failover_and_pause_of_broken_backend():
+    """Сломанный бэкенд пропускается, а после серии ошибок ставится на паузу"""
+    broken = FakeBackend("broken", fail=True)
+    spare = FakeBackend("spare")
+    gateway = LLMGateway([broken, spare], failure_threshold=2, cooldown=60)
+
+    for _ in range(3):
+        assert asyncio.run(gateway.complete([])).backend == "spare"
+
+    assert broken.calls == 2
+    assert [b.name for b in gateway.ordered_backends()] == ["spare"]
+
+
+def test_all_backends_failed_raises():
+    """Если ни один бэкенд не ответил, вызывающий получает LLMError"""
+    gateway = LLMGateway([FakeBackend("a", fail=True), FakeBackend("b", fail=True)])
+
+    with pytest.raises(LLMError):
+        asyncio.run(gateway.complete([]))
+
+
+def test_stub_server_is_deterministic():
+    """Заглушка отвечает одинаково на одинаковый вопрос через настоящий HTTP"""
+    server, _ = start_stub_server(latency="fixed:0")
+    try:
+        gateway = LLMGateway([OpenAICompatibleBackend("stub", server.url, "stub", "stub-vet")])
+        messages = gateway.build_messages("Кот хромает", "Иван")
+
+        first = asyncio.run(gateway.complete(messages))
+        second = asyncio.run(gateway.complete(messages))
+    finally:
+        server.shutdown()
+
+    assert first.text == second.text == stub_answer(messages)
+    assert first.usage["total_tokens"] > 0
+    assert server.requests_served == 2
+
+
+def test_parse_latency_distributions():
+    """Распределения задержки воспроизводимы при одинаковом зерне"""
+    assert parse_latency("fixed:0.25")() == 0.25
+    uniform = parse_latency("uniform:0.1,0.2", seed=1)
+    assert 0.1 <= uniform() <= 0.2
+    assert parse_latency("lognormal:0.8,0.5", seed=7)() == parse_latency("lognormal:0.8,0.5", seed=7)()
+
+
+def test_build_messages_with_history_and_summary():
+    """История и краткое содержание идут между системным промптом и вопросом"""
+    history = [{"role": "user", "content": "Кошке назначили энтерофурил"},
+               {"role": "assistant", "content": "Давайте по инструкции."}]
+
+    messages = LLMGateway.build_messages("а сколько давать?", history=history, summary="Клиент: Кошка чихает.")
+
+    assert [m["role"] for m in messages] == ["system", "system", "user", "assistant", "user"]
+    assert messages[1]["content"].endswith("Клиент: Кошка чихает.")
+    assert messages[-1]["content"] == "а сколько давать?"
+
+
+def test_system_prompt_prefix_is_reused_and_cached_by_provider():
+    """Префикс запроса одинаков побайтно, и заглушка засчитывает его как попадание в кэш"""
+    first = LLMGateway.build_messages("Кот хромает", "Иван")
+    second = LLMGateway.build_messages("Кошка чихает", "Анна")
+    assert first[0] is second[0]
+
+    server, _ = start_stub_server(latency="fixed:0")
+    try:
+        gateway = LLMGateway([OpenAICompatibleBackend("stub", server.url, "stub", "stub-vet", cost_per_1k_tokens=1.0)])
+        cold = asyncio.run(gateway.complete(first))
+        warm = asyncio.run(gateway.complete(second))
+    finally:
+        server.shutdown()
+
+    assert cold.cache_hit_tokens == 0
+    assert warm.cache_hit_tokens > 0
+    assert warm.cost == warm.usage["total_tokens"] / 1000
+    assert gateway.usage["requests"] == 2
+    assert gateway.usage["cache_hit_tokens"] == warm.cache_hit_tokens
+    assert 0 < gateway.cache_hit_ratio() < 1
@@ -0,0 +1,85 @@
+"""
+Тесты логирования: JSON-контекст, сэмплирование, ротация
+"""
+
+import os
+import json
+import time
+import logging
+
+import pytest
+
+from vetbot_improved.utils import tracing
+from vetbot_improved.utils.logging_setup import (
+    SamplingFilter, SizeAndTimeRotatingFileHandler, parse_sample_rates, setup_logging, shutdown_logging
+)
+
+
+@pytest.fixture
+def root_logging():
+    root = logging.getLogger()
+    handlers, level = root.handlers[:], root.level
+    yield
+    shutdown_logging()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    for handler in handlers:
+        root.addHandler(handler)
+    root.setLevel(level)
+
+
+def read_records(path):
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f]
+
+
+def test_json_records_carry_trace_and_consultation(tmp_path, root_logging):
+    path = str(tmp_path / 'bot.log')
+    setup_logging('main_bot', path, sample_rates={})
+    log = logging.getLogger('enhanced_bot')
+
+    with tracing.span('handler.handle_message', **{'vetbot.user_id': 42}) as span:
+        tracing.annotate(**{'vetbot.consultation_id': 7})
+        log.info('Relayed to doctor')
+    log.warning('No context', extra={'consultation_id': 9})
+    shutdown_logging()
+
+    records = read_records(path)
+    assert records[0]['msg'] == 'Relayed to doctor'
+    assert records[0]['process'] == 'main_bot'
+    assert records[0]['trace_id'] == span.trace_id
+    assert records[0]['user_id'] == 42
+    assert records[0]['consultation_id'] == 7
+    assert records[1]['consultation_id'] == 9
+    assert 'trace_id' not in records[1]
+
+
+def test_sampling_limits_hot_logger_and_counts_dropped():
+    sampler = SamplingFilter(parse_sample_rates('httpx:5'))
+    records = [logging.makeLogRecord({'name': 'httpx._client', 'levelno': logging.INFO}) for _ in range(100)]
+
+    passed = [record for record in records if sampler.filter(record)]
+    assert len(passed) == 5
+    assert sampler.filter(logging.makeLogRecord({'name': 'httpx', 'levelno': logging.ERROR}))
+    assert sampler.filter(logging.makeLogRecord({'name': 'enhanced_bot', 'levelno': logging.INFO}))
+
+    time.sleep(0.25)
+    record = logging.makeLogRecord({'name': 'httpx', 'levelno': logging.INFO})
+    assert sampler.filter(record)
+    assert record.sampled_out == 95
+
+
+def test_rotation_by_size_and_by_time(tmp_path):
+    path = str(tmp_path / 'bot.log')
+    handler = SizeAndTimeRotatingFileHandler(path, max_bytes=200, interval=3600, backup_count=2)
+    record = logging.makeLogRecord({'msg': 'x' * 150})
+    for _ in range(5):
+        handler.emit(record)
+    assert sorted(os.listdir(tmp_path)) == ['bot.log', 'bot.log.1', 'bot.log.2']
+
+    handler.maxBytes = 0
+    handler.rollover_at = time.time() - 1
+    handler.emit(logging.makeLogRecord({'msg': 'after interval'}))
+    handler.close()
+    with open(path, encoding='utf-8') as f:
+        assert f.read() == 'after interval\n'
@@ -0,0 +1,68 @@
+"""
+Тесты сторожа цикла событий
+"""
+
+import time
+import asyncio
+
+from vetbot_improved.utils.loop_watchdog import LoopWatchdog
+from vetbot_improved.utils.metrics import LOOP_BLOCKS, LOOP_LAG_SECONDS
+
+
+def blocking_lookup():
+    # Синхронный вызов внутри корутины, как sqlite3 или requests.post
+    time.sleep(0.3)
+
+
+def test_blocking_call_is_caught_with_stack():
+    async def scenario():
+        watchdog = LoopWatchdog('test_blocking', interval=0.02, threshold=0.1)
+        watchdog.start()
+        await asyncio.sleep(0.1)
+        blocking_lookup()
+        await asyncio.sleep(0.1)
+        watchdog.stop()
+        return watchdog
+
+    watchdog = asyncio.run(scenario())
+
+    assert LOOP_BLOCKS.value(process='test_blocking') == 1
+    assert len(watchdog.blocks) == 1
+    assert 'blocking_lookup' in watchdog.blocks[0]['stack']
+    assert watchdog.blocks[0]['duration'] >= 0.1
+    assert watchdog.max_lag >= 0.2
+
+
+def test_awaiting_loop_is_not_reported():
+    async def scenario():
+        watchdog = LoopWatchdog('test_idle', interval=0.02, threshold=0.1)
+        watchdog.start()
+        await asyncio.gather(*(asyncio.sleep(0.01 * i) for i in range(20)))
+        await asyncio.to_thread(time.sleep, 0.3)
+        watchdog.stop()
+        return watchdog
+
+    watchdog = asyncio.run(scenario())
+
+    assert LOOP_BLOCKS.value(process='test_idle') == 0
+    assert watchdog.blocks == []
+    assert LOOP_LAG_SECONDS.count(process='test_idle') > 5
+
+
+def test_health_reports_stalled_loop():
+    async def scenario():
+        watchdog = LoopWatchdog('test_health', interval=0.02, threshold=0.1)
+        watchdog.start()
+        await asyncio.sleep(0.1)
+        healthy = watchdog.health(stall=0.2)
+        # Пока цикл занят синхронным вызовом, пульса нет
+        time.sleep(0.3)
+        stalled = watchdog.health(stall=0.2)
+        watchdog.stop()
+        return healthy, stalled, watchdog.health(stall=0.2)
+
+    healthy, stalled, stopped = asyncio.run(scenario())
+
+    assert healthy['ok'] and healthy['heartbeat_age'] < 0.2
+    assert not stalled['ok'] and stalled['heartbeat_age'] >= 0.3
+    assert not stopped['ok']
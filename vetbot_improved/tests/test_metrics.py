@@ -0,0 +1,86 @@
+"""
+Тесты метрик и эндпоинта /metrics
+"""
+
+import asyncio
+import urllib.request
+import pytest
+
+from vetbot_improved.utils.metrics import (
+    Registry, histogram_quantile, parse_metrics, start_metrics_server, summarize_histograms, timed,
+    HANDLER_SECONDS, HANDLER_ERRORS
+)
+
+
+def test_render_uses_prometheus_text_format():
+    registry = Registry()
+    requests_total = registry.counter('test_requests', 'Запросы', ['status'])
+    depth = registry.gauge('test_depth', 'Глубина', ['queue'])
+    latency = registry.histogram('test_seconds', 'Задержка', ['query'], buckets=(0.1, 1.0))
+
+    requests_total.inc(status='ok')
+    requests_total.inc(2, status='ok')
+    depth.set_function(lambda: 7, queue='outbox')
+    latency.observe(0.05, query='claim')
+    latency.observe(0.5, query='claim')
+
+    text = registry.render()
+    assert '# TYPE test_requests counter' in text
+    assert 'test_requests_total{status="ok"} 3' in text
+    assert 'test_depth{queue="outbox"} 7' in text
+    assert 'test_seconds_bucket{query="claim",le="0.1"} 1' in text
+    assert 'test_seconds_bucket{query="claim",le="+Inf"} 2' in text
+    assert 'test_seconds_count{query="claim"} 2' in text
+
+
+def test_histogram_summary_roundtrip():
+    registry = Registry()
+    latency = registry.histogram('test_seconds', 'Задержка', ['query'], buckets=(0.01, 0.1, 1.0))
+    for _ in range(98):
+        latency.observe(0.005, query='page')
+    latency.observe(0.5, query='page')
+    latency.observe(0.5, query='page')
+
+    summary = summarize_histograms(parse_metrics(registry.render()))
+    assert len(summary) == 1
+    row = summary[0]
+    assert row['labels'] == {'query': 'page'}
+    assert row['count'] == 100
+    assert row['p50'] <= 0.01
+    assert 0.1 < row['p99'] <= 1.0
+    assert row['avg'] == pytest.approx((98 * 0.005 + 2 * 0.5) / 100)
+
+
+def test_histogram_quantile_interpolates():
+    buckets = [(0.1, 50), (0.2, 100), (float('inf'), 100)]
+    assert histogram_quantile(0.5, buckets) == pytest.approx(0.1)
+    assert histogram_quantile(0.75, buckets) == pytest.approx(0.15)
+    assert histogram_quantile(0.5, []) == 0.0
+
+
+def test_timed_counts_async_handler_errors():
+    @timed('test_handler')
+    async def handler(fail):
+        if fail:
+            raise ValueError('boom')
+        return 'ok'
+
+    before = HANDLER_SECONDS.count(handler='test_handler')
+    assert asyncio.run(handler(False)) == 'ok'
+    with pytest.raises(ValueError):
+        asyncio.run(handler(True))
+
+    assert HANDLER_SECONDS.count(handler='test_handler') == before + 2
+    assert HANDLER_ERRORS.value(handler='test_handler') >= 1
+
+
+def test_metrics_endpoint_serves_registry():
+    server = start_metrics_server('test', port=0)
+    try:
+        url = f'http://127.0.0.1:{server.server_address[1]}/metrics'
+        with urllib.request.urlopen(url, timeout=5) as response:
+            body = response.read().decode('utf-8')
+        assert response.headers['Content-Type'].startswith('text/plain')
+        assert '# TYPE vetbot_handler_seconds histogram' in body
+    finally:
+        server.shutdown()
@@ -0,0 +1,91 @@
+"""
+Тесты сэмплирующего профилировщика и дампа задач
+"""
+
+import os
+import json
+import time
+import signal
+import asyncio
+import urllib.request
+
+from vetbot_improved.utils import profiler
+from vetbot_improved.utils.metrics import start_metrics_server
+
+
+def busy_wait(seconds):
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        pass
+
+
+def test_profile_captures_hot_function_and_loop_lag(tmp_path):
+    async def scenario():
+        sampler = profiler.SamplingProfiler('test', directory=str(tmp_path), interval=0.005,
+                                            loop=asyncio.get_running_loop())
+        assert sampler.start(seconds=5)
+        assert not sampler.start()
+        await asyncio.sleep(0.15)
+        # Синхронная работа в корутине блокирует цикл
+        busy_wait(0.3)
+        await asyncio.sleep(0.15)
+        return await asyncio.to_thread(sampler.stop)
+
+    files = asyncio.run(scenario())
+
+    with open(files['profile'], encoding='utf-8') as f:
+        stacks = [line.rsplit(' ', 1) for line in f.read().splitlines()]
+    hot = sum(int(count) for stack, count in stacks if 'busy_wait (test_profiler.py' in stack)
+    assert hot >= 10
+    assert any(stack.startswith('MainThread;') for stack, _ in stacks)
+
+    with open(files['loop_lag'], encoding='utf-8') as f:
+        lags = [float(line.split(',')[1]) for line in f.read().splitlines()[1:]]
+    assert max(lags) >= 150
+
+
+def test_task_dump_over_debug_endpoint(tmp_path, monkeypatch):
+    async def scenario():
+        loop = asyncio.get_running_loop()
+        profiler.install('test', loop, signals=False)
+        monkeypatch.setattr(profiler.get_profiler(), 'directory', str(tmp_path))
+        waiter = asyncio.create_task(asyncio.sleep(10), name='relay-waiter')
+        server = start_metrics_server('test', port=0)
+        url = f'http://127.0.0.1:{server.server_address[1]}/debug/tasks'
+        try:
+            body = await asyncio.to_thread(lambda: urllib.request.urlopen(url, timeout=5).read())
+        finally:
+            server.shutdown()
+            waiter.cancel()
+        return json.loads(body)
+
+    result = asyncio.run(scenario())
+    with open(result['file'], encoding='utf-8') as f:
+        dump = f.read()
+    assert 'relay-waiter' in dump
+    assert '=== Потоки' in dump
+
+
+def test_signals_run_outside_handler(tmp_path, monkeypatch):
+    previous = {signum: signal.getsignal(signum) for signum in (signal.SIGUSR1, signal.SIGUSR2)}
+    sampler = profiler.install('test', signals=True)
+    monkeypatch.setattr(sampler, 'directory', str(tmp_path))
+    try:
+        os.kill(os.getpid(), signal.SIGUSR2)
+        os.kill(os.getpid(), signal.SIGUSR1)
+        # Обработчик только ставит действие в очередь: дамп и запуск - в потоке profiler-signals
+        deadline = time.monotonic() + 5
+        while not (sampler.running and list(tmp_path.glob('tasks-test-*.txt'))) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert sampler.running
+        assert list(tmp_path.glob('tasks-test-*.txt'))
+
+        os.kill(os.getpid(), signal.SIGUSR1)
+        deadline = time.monotonic() + 5
+        while not list(tmp_path.glob('profile-test-*.folded')) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert not sampler.running
+    finally:
+        sampler.stop()
+        for signum, handler in previous.items():
+            signal.signal(signum, handler)
@@ -0,0 +1,61 @@
+"""
+Тесты подготовки ответов AI к отправке в Telegram
+"""
+
+from vetbot_improved.utils.telegram_format import (
+    TelegramFormatter, format_message, sanitize_markdown, utf16_length
+)
+
+
+def test_sanitize_removes_model_markdown():
+    """Заголовки и жирный шрифт убираются, одиночные символы остаются"""
+    text = "### Анализ симптомов\n**Важно:** дайте воды.\nЦена 5*3 руб, #1"
+
+    assert sanitize_markdown(text) == "Анализ симптомов\nВажно: дайте воды.\nЦена 5*3 руб, #1"
+
+
+def test_chunked_input_matches_whole_text():
+    """Разметка, разорванная между фрагментами, обрабатывается так же"""
+    text = "#" * 3 + " Итог\nОчень **важно** не давать парацетамол. " * 40
+    formatter = TelegramFormatter(limit=300)
+
+    messages = []
+    for i in range(0, len(text), 7):
+        messages.extend(formatter.feed(text[i:i + 7]))
+    messages.extend(formatter.finish())
+
+    assert messages == format_message(text, limit=300)
+
+
+def test_split_on_paragraphs_and_sentences():
+    """Длинный ответ режется по абзацам, а внутри абзаца - по предложениям"""
+    paragraph = "Кошке нужен покой. Дайте воды. " * 10
+    text = "\n\n".join([paragraph.strip()] * 5)
+
+    messages = format_message(text, limit=500)
+
+    assert len(messages) > 1
+    for message in messages:
+        assert utf16_length(message) <= 500
+        assert message.endswith(".")
+    assert " ".join(messages).replace("\n\n", " ") == text.replace("\n\n", " ")
+
+
+def test_emoji_are_not_split_and_length_counts_utf16():
+    """Эмодзи из нескольких символов не разрываются, длина считается в UTF-16"""
+    family = "\U0001F468\u200d\U0001F469\u200d\U0001F467"
+    text = family * 100
+
+    messages = format_message(text, limit=64)
+
+    assert "".join(messages) == text
+    for message in messages:
+        assert utf16_length(message) <= 64
+        assert not message.startswith("\u200d") and not message.endswith("\u200d")
+
+
+def test_escaping_for_parse_mode():
+    """Спецсимволы экранируются под выбранный parse_mode"""
+    assert format_message("1 < 2 & 3", parse_mode="HTML") == ["1 &lt; 2 &amp; 3"]
+    assert format_message("Доза 0.5 мл (утром)!", parse_mode="MarkdownV2") == ["Доза 0\\.5 мл \\(утром\\)\\!"]
+    assert format_message("корм_для_кошек", parse_mode="Markdown") == ["корм\\_для\\_кошек"]
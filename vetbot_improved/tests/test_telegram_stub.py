@@ -0,0 +1,52 @@
+"""
+Тесты заглушки Telegram Bot API
+"""
+
+import asyncio
+
+import pytest
+from telegram import Bot, InlineKeyboardButton, InlineKeyboardMarkup
+
+from vetbot_improved.services.telegram_stub import start_stub_server, text_message, callback_data
+
+
+@pytest.fixture
+def stub():
+    server, _ = start_stub_server()
+    yield server
+    server.shutdown()
+
+
+def test_bot_calls_are_recorded_with_markup(stub):
+    async def scenario():
+        async with Bot('1002:test', base_url=stub.url) as bot:
+            assert (await bot.get_me()).id == 1002
+            markup = InlineKeyboardMarkup([[InlineKeyboardButton("Взять", callback_data="take_client_7")]])
+            message = await bot.send_message(chat_id=42, text="Новый клиент", reply_markup=markup)
+            await bot.edit_message_text(chat_id=42, message_id=message.message_id, text="Клиент взят")
+            return message
+
+    message = asyncio.run(scenario())
+
+    sent, edited = stub.sent
+    assert (sent["method"], sent["chat_id"], sent["text"]) == ("sendMessage", 42, "Новый клиент")
+    assert callback_data(sent) == ["take_client_7"]
+    assert (edited["method"], edited["message_id"]) == ("editMessageText", message.message_id)
+
+
+def test_pushed_updates_are_delivered_until_confirmed(stub):
+    stub.push('1001:test', text_message(5, '/start'))
+    stub.push('1001:test', text_message(5, 'Кошка не ест'))
+
+    async def scenario():
+        async with Bot('1001:test', base_url=stub.url) as bot:
+            first = await bot.get_updates(timeout=1)
+            again = await bot.get_updates(offset=first[-1].update_id + 1, timeout=0.1)
+            return first, again
+
+    first, again = asyncio.run(scenario())
+
+    assert [update.message.text for update in first] == ['/start', 'Кошка не ест']
+    assert first[0].message.entities[0].type == 'bot_command'
+    assert again == ()
+    assert stub.pending('1001:test') == 0
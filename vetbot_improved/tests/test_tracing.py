@@ -0,0 +1,180 @@
+"""
+Тесты трассировки и экспорта OTLP/JSON
+"""
+
+import sys
+import json
+import asyncio
+import subprocess
+import pytest
+
+from vetbot_improved.utils import tracing
+from vetbot_improved.utils.metrics import DB_QUERY_SECONDS, TELEGRAM_SEND_SECONDS, TELEGRAM_ERRORS, timed
+
+
+@pytest.fixture
+def exporter(tmp_path):
+    """Экспорт спанов во временный файл"""
+    settings = ('path', 'service_name', 'sample_rate', 'max_bytes', 'backup_count')
+    previous = {name: getattr(tracing._exporter, name) for name in settings}
+    yield tracing.configure(path=str(tmp_path / 'traces.jsonl'), sample_rate=1.0)
+    tracing.configure()
+    for name, value in previous.items():
+        setattr(tracing._exporter, name, value)
+
+
+def test_spans_follow_handler_into_db_and_tasks(exporter):
+    @timed('test_trace_handler')
+    async def handler():
+        with DB_QUERY_SECONDS.time(query='test_lookup'):
+            pass
+        # Задачи asyncio наследуют контекст обработчика
+        await asyncio.gather(child('llm'), child('telegram'))
+        return tracing.current_trace_id()
+
+    async def child(name):
+        with tracing.span(name, root=False):
+            await asyncio.sleep(0)
+
+    trace_id = asyncio.run(handler())
+    assert tracing.current_trace_id() is None
+    assert exporter.flush() == 4
+
+    spans = tracing.load_traces(exporter.path)[trace_id]
+    root = next(item for item in spans if item['name'] == 'handler.test_trace_handler')
+    assert root['parent_id'] is None
+    assert {item['name'] for item in spans if item['parent_id'] == root['span_id']} == {'db.query', 'llm', 'telegram'}
+    assert next(item for item in spans if item['name'] == 'db.query')['attributes'] == {'query': 'test_lookup'}
+
+
+def test_no_spans_outside_trace(exporter):
+    with DB_QUERY_SECONDS.time(query='test_background'):
+        pass
+    with tracing.span('background', root=False) as opened:
+        assert opened is None
+    assert exporter.flush() == 0
+
+
+def test_traceparent_continues_trace_and_marks_errors(exporter):
+    with tracing.span('enqueue') as producer:
+        header = tracing.current_traceparent()
+
+    with pytest.raises(RuntimeError):
+        with tracing.span('deliver', root=False, parent=header, bot='vet'):
+            raise RuntimeError('Forbidden')
+    exporter.flush()
+
+    with open(exporter.path, encoding='utf-8') as f:
+        request = json.loads(f.read())
+    otlp = request['resourceSpans'][0]['scopeSpans'][0]['spans'][1]
+    assert otlp['name'] == 'deliver'
+    assert otlp['traceId'] == producer.trace_id
+    assert otlp['parentSpanId'] == producer.span_id
+    assert otlp['status'] == {'code': tracing.STATUS_ERROR, 'message': 'RuntimeError: Forbidden'}
+    assert {'key': 'bot', 'value': {'stringValue': 'vet'}} in otlp['attributes']
+
+
+def test_render_trace_shows_tree():
+    spans = [
+        {'service': 'main_bot', 'name': 'handler.handle_message', 'span_id': 'a', 'parent_id': None,
+         'start': 10.0, 'end': 10.5, 'attributes': {}, 'error': False},
+        {'service': 'main_bot', 'name': 'telegram.sendMessage', 'span_id': 'b', 'parent_id': 'a',
+         'start': 10.1, 'end': 10.4, 'attributes': {'http.status_code': 200}, 'error': False},
+    ]
+    lines = tracing.render_trace(spans).splitlines()
+    assert lines[0].split() == ['0.0', 'ms', '500.0', 'ms', 'handler.handle_message', '[main_bot]']
+    assert '  telegram.sendMessage [main_bot] http.status_code=200' in lines[1]
+    assert tracing.trace_duration(spans) == pytest.approx(0.5)
+
+
+def test_telegram_is_imported_only_for_traced_request():
+    code = (
+        "import sys\n"
+        "import vetbot_improved.utils.metrics\n"
+        "assert 'telegram' not in sys.modules\n"
+        "from vetbot_improved.utils.tracing import TracedRequest\n"
+        "first, second = TracedRequest(), TracedRequest()\n"
+        "assert first._client_kwargs['verify'] is second._client_kwargs['verify']\n"
+    )
+    subprocess.run([sys.executable, '-c', code], check=True)
+
+
+
+def test_traced_request_measures_every_bot_api_call(monkeypatch):
+    from telegram import Bot
+    from telegram.error import RetryAfter
+    from telegram.request import HTTPXRequest
+
+    message = {'message_id': 5, 'date': 0, 'chat': {'id': 1, 'type': 'private'}, 'text': 'hi'}
+    responses = [
+        (429, {'ok': False, 'error_code': 429, 'description': 'Too Many Requests', 'parameters': {'retry_after': 3}}),
+        (200, {'ok': True, 'result': message}),
+        (200, {'ok': True, 'result': []}),
+    ]
+
+    async def respond(self, url, method, *args, **kwargs):
+        code, payload = responses.pop(0)
+        return code, json.dumps(payload).encode()
+
+    monkeypatch.setattr(HTTPXRequest, 'do_request', respond)
+
+    async def run():
+        # Прямой вызов бота (как reply_text в обработчике), без outbox
+        bot = Bot('1:TOKEN', request=tracing.TracedRequest(bot_name='traced'))
+        with pytest.raises(RetryAfter):
+            await bot.send_message(chat_id=1, text='hi')
+        await bot.send_message(chat_id=1, text='hi')
+        await bot.get_updates()
+
+    asyncio.run(run())
+    assert TELEGRAM_ERRORS.value(bot='traced', reason='retry_after') == 1
+    assert TELEGRAM_SEND_SECONDS.count(bot='traced', method='sendMessage') == 2
+    # Долгий опрос - не задержка отправки
+    assert TELEGRAM_SEND_SECONDS.count(bot='traced', method='getUpdates') == 0
+
+def test_unsampled_traces_propagate_but_are_not_written(exporter):
+    tracing.configure(sample_rate=0.0)
+    with tracing.span('handler.unsampled') as handler:
+        header = tracing.current_traceparent()
+        with tracing.span('db.query', root=False):
+            pass
+    # Другой процесс продолжает трассу и тоже ее не пишет
+    with tracing.span('deliver', root=False, parent=header) as remote:
+        pass
+
+    assert header.endswith('-00')
+    assert remote.trace_id == handler.trace_id
+    assert exporter.flush() == 0
+
+
+def test_export_file_is_rotated_by_size(exporter):
+    exporter.max_bytes, exporter.backup_count = 1, 2
+    for number in range(4):
+        with tracing.span(f'handler.{number}'):
+            pass
+        exporter.flush()
+
+    path = exporter.path
+    assert [span['name'] for spans in tracing.load_traces(path).values() for span in spans] == ['handler.3']
+    assert [span['name'] for spans in tracing.load_traces(f'{path}.1').values() for span in spans] == ['handler.2']
+    assert [span['name'] for spans in tracing.load_traces(f'{path}.2').values() for span in spans] == ['handler.1']
+
+
+def test_each_process_writes_its_own_file(exporter, tmp_path):
+    template = str(tmp_path / 'traces-{service}.jsonl')
+    tracing.configure('main_bot', path=template)
+    with tracing.span('handler.handle_message'):
+        header = tracing.current_traceparent()
+    exporter.flush()
+
+    # Процесс врачей продолжает трассу в своем файле: ротации не пересекаются
+    tracing.configure('doctor_bot')
+    with tracing.span('outbox.deliver', root=False, parent=header):
+        pass
+    exporter.flush()
+
+    assert sorted(path.name for path in tmp_path.iterdir()) == ['traces-doctor_bot.jsonl', 'traces-main_bot.jsonl']
+    [spans] = tracing.load_traces(template).values()
+    assert [(span['service'], span['name']) for span in spans] == [
+        ('main_bot', 'handler.handle_message'), ('doctor_bot', 'outbox.deliver'),
+    ]
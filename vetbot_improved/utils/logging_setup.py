@@ -0,0 +1,219 @@
+"""
+Логирование процессов ботов: очередь, JSON, ротация и сэмплирование
+
+setup_logging() оставляет на корневом логгере один QueueHandler: вызов
+logger.info() в обработчике только кладет запись в очередь, а запись в
+файл и консоль выполняет поток QueueListener. В файл пишутся JSON-записи
+с полями trace_id, user_id и consultation_id - они берутся из текущего
+спана трассировки (см. tracing) или из extra вызова. Файл ротируется и
+по размеру (LOG_MAX_BYTES), и по времени (LOG_ROTATE_HOURS), хранится
+LOG_BACKUP_COUNT архивов. Для шумных логгеров LOG_SAMPLE_RATES задает
+предел INFO/DEBUG-записей в секунду; предупреждения и ошибки проходят
+всегда, а число отброшенных записей попадает в поле sampled_out.
+"""
+
+import os
+import sys
+import json
+import time
+import queue
+import atexit
+import logging
+import threading
+import logging.handlers
+from typing import Dict, Optional
+
+from vetbot_improved.utils.tracing import current_span
+
+# Конфигурация
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+LOG_MAX_BYTES = int(os.getenv('LOG_MAX_BYTES', str(50 * 1024 * 1024)))
+LOG_ROTATE_HOURS = float(os.getenv('LOG_ROTATE_HOURS', '24'))
+LOG_BACKUP_COUNT = int(os.getenv('LOG_BACKUP_COUNT', '7'))
+LOG_SAMPLE_RATES = os.getenv('LOG_SAMPLE_RATES', 'httpx:1,notification_system:20,telegram_outbox:20')
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# Поля контекста: имя в JSON -> атрибут спана
+CONTEXT_ATTRIBUTES = {'user_id': 'vetbot.user_id', 'consultation_id': 'vetbot.consultation_id'}
+
+# Стандартные атрибуты LogRecord, которые не считаются extra
+_RECORD_FIELDS = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime'}
+
+
+class ContextFilter(logging.Filter):
+    """Добавить к записи trace_id, user_id и consultation_id текущего спана
+
+    Фильтр стоит на QueueHandler, поэтому контекст берется в потоке и
+    задаче, где запись создана, а не в потоке записи.
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        span = current_span()
+        if span is not None:
+            if not hasattr(record, 'trace_id'):
+                record.trace_id = span.trace_id
+            for field, attribute in CONTEXT_ATTRIBUTES.items():
+                if not hasattr(record, field) and attribute in span.attributes:
+                    setattr(record, field, span.attributes[attribute])
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Ограничить число INFO/DEBUG-записей логгера в секунду
+
+    rates - {имя логгера: записей в секунду}; правило логгера действует и
+    на его потомков (httpx -> httpx._client).
+    """
+
+    def __init__(self, rates: Dict[str, float]):
+        super().__init__()
+        self.rates = rates
+        self._lock = threading.Lock()
+        self._buckets: Dict[str, list] = {}
+
+    def _rule(self, name: str) -> Optional[str]:
+        while name:
+            if name in self.rates:
+                return name
+            name = name.rpartition('.')[0]
+        return None
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        rule = self._rule(record.name)
+        if rule is None:
+            return True
+
+        rate = self.rates[rule]
+        now = time.monotonic()
+        with self._lock:
+            # Ведро токенов: [токены, время обновления, отброшено]
+            bucket = self._buckets.setdefault(rule, [rate, now, 0])
+            bucket[0] = min(rate, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+            if bucket[0] < 1:
+                bucket[2] += 1
+                return False
+            bucket[0] -= 1
+            if bucket[2]:
+                record.sampled_out = bucket[2]
+                bucket[2] = 0
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """Запись лога одной строкой JSON"""
+
+    def __init__(self, process: str):
+        super().__init__()
+        self.process = process
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            'ts': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(record.created)) + f'.{int(record.msecs):03d}',
+            'level': record.levelname,
+            'logger': record.name,
+            'process': self.process,
+            'msg': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_FIELDS and not key.startswith('_'):
+                data[key] = value if isinstance(value, (str, int, float, bool, type(None))) else str(value)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data['exc'] = record.exc_text
+        return json.dumps(data, ensure_ascii=False)
+
+
+class SizeAndTimeRotatingFileHandler(logging.handlers.RotatingFileHandler):
+    """Ротация по размеру файла или по истечении interval секунд, что раньше"""
+
+    def __init__(self, filename: str, max_bytes: int = LOG_MAX_BYTES, interval: float = LOG_ROTATE_HOURS * 3600,
+                 backup_count: int = LOG_BACKUP_COUNT):
+        super().__init__(filename, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8')
+        self.interval = interval
+        self.rollover_at = time.time() + interval
+
+    def shouldRollover(self, record: logging.LogRecord) -> bool:
+        if self.interval and time.time() >= self.rollover_at and os.path.isfile(self.baseFilename):
+            return True
+        return bool(super().shouldRollover(record))
+
+    def doRollover(self) -> None:
+        super().doRollover()
+        self.rollover_at = time.time() + self.interval
+
+
+def parse_sample_rates(value: str) -> Dict[str, float]:
+    """Разобрать "логгер:в_секунду,..." в словарь"""
+    rates = {}
+    for item in value.split(','):
+        if ':' in item:
+            name, rate = item.strip().rsplit(':', 1)
+            rates[name] = float(rate)
+    return rates
+
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def setup_logging(process: str, filename: Optional[str] = None, level: str = LOG_LEVEL,
+                  sample_rates: Optional[Dict[str, float]] = None) -> logging.handlers.QueueListener:
+    """
+    Настроить логирование процесса
+
+    Args:
+        process: Имя процесса в JSON-записях (main_bot, doctor_bot)
+        filename: Файл JSON-лога с ротацией; None - только консоль
+        level: Уровень корневого логгера
+        sample_rates: Пределы записей в секунду по логгерам
+            (по умолчанию из LOG_SAMPLE_RATES)
+
+    Returns:
+        logging.handlers.QueueListener: Поток записи (останавливается при выходе)
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+
+    console = logging.StreamHandler(sys.stdout)
+    console.setFormatter(logging.Formatter(TEXT_FORMAT))
+    handlers = [console]
+    if filename:
+        directory = os.path.dirname(filename)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        file_handler = SizeAndTimeRotatingFileHandler(filename)
+        file_handler.setFormatter(JsonFormatter(process))
+        handlers.append(file_handler)
+
+    records = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(records)
+    queue_handler.addFilter(SamplingFilter(parse_sample_rates(LOG_SAMPLE_RATES) if sample_rates is None else sample_rates))
+    queue_handler.addFilter(ContextFilter())
+
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+        handler.close()
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+
+    _listener = logging.handlers.QueueListener(records, *handlers, respect_handler_level=True)
+    _listener.start()
+    return _listener
+
+
+def shutdown_logging() -> None:
+    """Дописать очередь и остановить поток записи"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+atexit.register(shutdown_logging)
@@ -0,0 +1,127 @@
+"""
+Сторож цикла событий: лаг и блокирующие вызовы
+
+Внутри цикла крутится корутина-пульс: спит LOOP_WATCHDOG_INTERVAL и
+отмечает время пробуждения; опоздание пробуждения - лаг цикла, он
+пишется в гистограмму vetbot_loop_lag_seconds. Отдельный поток следит
+за пульсом: если цикл не отвечает дольше LOOP_BLOCK_THRESHOLD, значит
+какой-то колбэк держит его синхронным вызовом (sqlite3, requests, файл).
+Поток снимает стек потока цикла в этот момент - на нем видно виновника -
+пишет его в лог и увеличивает vetbot_loop_blocks_total. Последние
+блокировки со стеками отдает /debug/loop на эндпоинте метрик, а
+/healthz - возраст последнего пульса для супервизора процессов: цикл,
+молчащий дольше LOOP_HEALTH_STALL, считается зависшим.
+"""
+
+import os
+import sys
+import time
+import asyncio
+import logging
+import threading
+import traceback
+from typing import List, Optional
+
+from vetbot_improved.utils.metrics import LOOP_LAG_SECONDS, LOOP_BLOCKS, LOOP_BLOCKED_SECONDS, register_debug_route
+
+logger = logging.getLogger(__name__)
+
+# Конфигурация
+LOOP_WATCHDOG_INTERVAL = float(os.getenv('LOOP_WATCHDOG_INTERVAL', '0.05'))
+LOOP_BLOCK_THRESHOLD = float(os.getenv('LOOP_BLOCK_THRESHOLD', '0.1'))
+LOOP_HEALTH_STALL = float(os.getenv('LOOP_HEALTH_STALL', '5'))
+
+
+class LoopWatchdog:
+    """
+    Сторож одного цикла asyncio
+
+    Запускается start() изнутри работающего цикла; stop() останавливает
+    пульс и поток. blocks хранит последние пойманные блокировки:
+    словари с ключами started (time.time), duration (секунды) и stack.
+    """
+
+    def __init__(self, process: str, interval: float = LOOP_WATCHDOG_INTERVAL,
+                 threshold: float = LOOP_BLOCK_THRESHOLD, history: int = 20):
+        self.process = process
+        self.interval = interval
+        self.threshold = threshold
+        self.history = history
+        self.blocks: List[dict] = []
+        self.max_lag = 0.0
+        self._beat = 0.0
+        self._loop_thread_id: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        """Запустить пульс в текущем цикле и поток-наблюдатель"""
+        self._loop_thread_id = threading.get_ident()
+        self._beat = time.monotonic()
+        self._stop.clear()
+        self._task = asyncio.get_running_loop().create_task(self._pulse(), name='loop-watchdog')
+        self._thread = threading.Thread(target=self._watch, name='loop-watchdog', daemon=True)
+        self._thread.start()
+        register_debug_route('/debug/loop', lambda query: {
+            'process': self.process, 'max_lag': self.max_lag, 'blocks': self.blocks,
+        })
+        register_debug_route('/healthz', lambda query: self.health())
+
+    def heartbeat_age(self) -> float:
+        """Секунды с последнего пульса цикла"""
+        return max(0.0, time.monotonic() - self._beat)
+
+    def health(self, stall: float = LOOP_HEALTH_STALL) -> dict:
+        """
+        Состояние для проверки здоровья
+
+        Args:
+            stall: Дольше стольких секунд без пульса цикл считается зависшим
+
+        Returns:
+            dict: process, ok и heartbeat_age (секунды)
+        """
+        age = self.heartbeat_age()
+        running = self._thread is not None and not self._stop.is_set()
+        return {'process': self.process, 'ok': running and age < stall, 'heartbeat_age': age}
+
+    def stop(self) -> None:
+        """Остановить пульс и поток"""
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout=1)
+
+    async def _pulse(self) -> None:
+        while not self._stop.is_set():
+            started = time.monotonic()
+            await asyncio.sleep(self.interval)
+            self._beat = time.monotonic()
+            lag = max(0.0, self._beat - started - self.interval)
+            self.max_lag = max(self.max_lag, lag)
+            LOOP_LAG_SECONDS.observe(lag, process=self.process)
+
+    def _watch(self) -> None:
+        blocked: Optional[dict] = None
+        while not self._stop.wait(self.interval):
+            stalled = time.monotonic() - self._beat - self.interval
+            if stalled > self.threshold:
+                if blocked is None:
+                    # Стек снимается, пока цикл еще стоит
+                    blocked = {'started': time.time() - stalled, 'duration': stalled, 'stack': self._loop_stack()}
+                    LOOP_BLOCKS.inc(process=self.process)
+                    logger.warning(
+                        f"Event loop of {self.process} blocked for {stalled * 1000:.0f} ms, stack:\n{blocked['stack']}"
+                    )
+                blocked['duration'] = stalled
+            elif blocked is not None:
+                LOOP_BLOCKED_SECONDS.inc(blocked['duration'], process=self.process)
+                logger.warning(f"Event loop of {self.process} resumed after {blocked['duration'] * 1000:.0f} ms")
+                self.blocks = (self.blocks + [blocked])[-self.history:]
+                blocked = None
+
+    def _loop_stack(self) -> str:
+        frame = sys._current_frames().get(self._loop_thread_id)
+        return ''.join(traceback.format_stack(frame)) if frame is not None else ''
@@ -0,0 +1,537 @@
+"""
+Метрики процесса в формате Prometheus
+
+Счетчики, гистограммы и датчики живут в реестре процесса и отдаются
+текстовым форматом Prometheus на локальном HTTP-эндпоинте /metrics
+(start_metrics_server). Для каждого процесса свой порт: METRICS_PORTS
+задает их списком "процесс:порт", по нему же админ-панель находит
+эндпоинты. При BOT_WORKERS > 1 порты диспетчера и воркеров главного бота,
+не заданные явно, отсчитываются от METRICS_WORKER_BASE_PORT. Внешних
+зависимостей нет.
+"""
+
+import os
+import json
+import time
+import inspect
+import bisect
+import logging
+import threading
+import functools
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from vetbot_improved.utils.tracing import span as trace_span
+
+logger = logging.getLogger(__name__)
+
+# Конфигурация
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORTS = os.getenv('METRICS_PORTS', 'main_bot:9101,doctor_bot:9102')
+BOT_WORKERS = int(os.getenv('BOT_WORKERS', '1'))
+# dispatcher - базовый порт, main_bot.<n> - базовый + 1 + n
+METRICS_WORKER_BASE_PORT = int(os.getenv('METRICS_WORKER_BASE_PORT', '9110'))
+
+# Границы корзин по умолчанию (секунды): от миллисекунды до минуты
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+LabelKey = Tuple[str, ...]
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    type_name = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> LabelKey:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name}: expected labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self) -> List[str]:
+        return [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type_name}']
+
+
+class Counter(_Metric):
+    """Монотонный счетчик"""
+
+    type_name = 'counter'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelKey, float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        """
+        Увеличить счетчик
+
+        Args:
+            amount: Прирост
+            **labels: Значения меток
+        """
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels: str) -> float:
+        """Текущее значение для набора меток"""
+        return self._values.get(self._key(labels), 0)
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f'{self.name}_total{_format_labels(self.labelnames, key)} {_format_value(value)}')
+        return lines
+
+
+class Gauge(_Metric):
+    """Мгновенное значение; может вычисляться функцией при каждом чтении"""
+
+    type_name = 'gauge'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelKey, float] = {}
+        self._functions: Dict[LabelKey, Callable[[], float]] = {}
+
+    def set(self, value: float, **labels: str) -> None:
+        """Установить значение"""
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def set_function(self, function: Callable[[], float], **labels: str) -> None:
+        """
+        Вычислять значение при чтении метрик
+
+        Args:
+            function: Функция без аргументов, например глубина очереди
+            **labels: Значения меток
+        """
+        with self._lock:
+            self._functions[self._key(labels)] = function
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        with self._lock:
+            values = dict(self._values)
+            functions = dict(self._functions)
+        for key, function in functions.items():
+            try:
+                values[key] = function()
+            except Exception as e:
+                logger.debug(f"Gauge {self.name} callback failed: {e}")
+        for key, value in sorted(values.items()):
+            lines.append(f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}')
+        return lines
+
+
+class Histogram(_Metric):
+    """Гистограмма с накопительными корзинами
+
+    Если задан span, time() внутри трассы еще и открывает спан с этим
+    именем и метками в атрибутах.
+    """
+
+    type_name = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS, span: Optional[str] = None):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self.span = span
+        self._series: Dict[LabelKey, List[float]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        """
+        Записать наблюдение
+
+        Args:
+            value: Значение (для задержек - секунды)
+            **labels: Значения меток
+        """
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            # Корзины без накопления, затем сумма и число наблюдений
+            series = self._series.setdefault(key, [0] * (len(self.buckets) + 1) + [0.0, 0])
+            series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        """Замерить длительность блока with"""
+        started = time.perf_counter()
+        try:
+            if self.span:
+                with trace_span(self.span, root=False, **labels):
+                    yield
+            else:
+                yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def count(self, **labels: str) -> int:
+        """Число наблюдений для набора меток"""
+        series = self._series.get(self._key(labels))
+        return series[-1] if series else 0
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        with self._lock:
+            snapshot = {key: list(series) for key, series in self._series.items()}
+        for key, series in sorted(snapshot.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), series):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f'{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}')
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f'{self.name}_sum{labels} {_format_value(series[-2])}')
+            lines.append(f'{self.name}_count{labels} {series[-1]}')
+        return lines
+
+
+class Registry:
+    """Реестр метрик процесса; повторная регистрация возвращает ту же метрику"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, cls, name: str, *args, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, *args, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError(f"Metric {name} is already registered as {metric.type_name}")
+            return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._get_or_create(Counter, name, documentation, labelnames)
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._get_or_create(Gauge, name, documentation, labelnames)
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS, span: Optional[str] = None) -> Histogram:
+        return self._get_or_create(Histogram, name, documentation, labelnames, buckets, span)
+
+    def render(self) -> str:
+        """
+        Все метрики в текстовом формате Prometheus
+
+        Returns:
+            str: Тело ответа /metrics
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines: List[str] = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+# Метрики горячих путей
+HANDLER_SECONDS = REGISTRY.histogram(
+    'vetbot_handler_seconds', 'Длительность обработчиков Telegram', ['handler'])
+HANDLER_ERRORS = REGISTRY.counter(
+    'vetbot_handler_errors', 'Исключения в обработчиках Telegram', ['handler'])
+LLM_REQUEST_SECONDS = REGISTRY.histogram(
+    'vetbot_llm_request_seconds', 'Задержка запросов к LLM', ['backend', 'outcome'])
+LLM_TOKENS = REGISTRY.counter(
+    'vetbot_llm_tokens', 'Токены LLM', ['backend', 'kind'])
+DB_QUERY_SECONDS = REGISTRY.histogram(
+    'vetbot_db_query_seconds', 'Время запросов SQLite по имени запроса', ['query'], span='db.query')
+DB_LOCK_WAIT_SECONDS = REGISTRY.histogram(
+    'vetbot_db_lock_wait_seconds', 'Ожидание блокировки SQLite на запись (BEGIN IMMEDIATE)', ['query'])
+DB_LOCK_TIMEOUTS = REGISTRY.counter(
+    'vetbot_db_lock_timeouts', 'Запросы, не дождавшиеся блокировки SQLite (database is locked)', ['query'])
+TELEGRAM_SEND_SECONDS = REGISTRY.histogram(
+    'vetbot_telegram_send_seconds', 'Задержка вызовов Telegram Bot API', ['bot', 'method'])
+TELEGRAM_ERRORS = REGISTRY.counter(
+    'vetbot_telegram_errors', 'Ошибки Telegram Bot API (retry_after - ответы 429)', ['bot', 'reason'])
+QUEUE_DEPTH = REGISTRY.gauge(
+    'vetbot_queue_depth', 'Глубина внутренних очередей', ['queue'])
+LOOP_LAG_SECONDS = REGISTRY.histogram(
+    'vetbot_loop_lag_seconds', 'Опоздание пробуждения пульса цикла событий', ['process'])
+LOOP_BLOCKS = REGISTRY.counter(
+    'vetbot_loop_blocks', 'Блокировки цикла событий дольше порога', ['process'])
+LOOP_BLOCKED_SECONDS = REGISTRY.counter(
+    'vetbot_loop_blocked_seconds', 'Суммарное время блокировок цикла событий', ['process'])
+PROCESS_UP = REGISTRY.gauge(
+    'vetbot_process_up', 'Процесс под супервизором работает и отвечает на проверку здоровья', ['process'])
+PROCESS_RESTARTS = REGISTRY.counter(
+    'vetbot_process_restarts', 'Перезапуски процессов супервизором (reason: exit, unhealthy)', ['process', 'reason'])
+PROCESS_CPU_PERCENT = REGISTRY.gauge(
+    'vetbot_process_cpu_percent', 'Загрузка CPU процесса, % одного ядра', ['process'])
+PROCESS_RSS_BYTES = REGISTRY.gauge(
+    'vetbot_process_rss_bytes', 'Резидентная память процесса', ['process'])
+DISPATCHED_UPDATES = REGISTRY.counter(
+    'vetbot_dispatched_updates', 'Обновления Telegram, переданные воркерам главного бота', ['worker'])
+
+
+def timed(handler: str) -> Callable:
+    """
+    Декоратор: замер длительности и ошибок обработчика (sync или async)
+
+    Обработчик выполняется в спане handler.<имя>: обновление Telegram
+    начинает новую трассу, id пользователя попадает в атрибут
+    vetbot.user_id (его берут и записи лога).
+
+    Args:
+        handler: Имя обработчика в метке handler
+
+    Returns:
+        Callable: Декоратор
+    """
+    def decorator(function: Callable) -> Callable:
+        if inspect.iscoroutinefunction(function):
+            @functools.wraps(function)
+            async def async_wrapper(*args, **kwargs):
+                with trace_span(f'handler.{handler}', **_user_attributes(args)), HANDLER_SECONDS.time(handler=handler):
+                    try:
+                        return await function(*args, **kwargs)
+                    except Exception:
+                        HANDLER_ERRORS.inc(handler=handler)
+                        raise
+            return async_wrapper
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with trace_span(f'handler.{handler}', **_user_attributes(args)), HANDLER_SECONDS.time(handler=handler):
+                try:
+                    return function(*args, **kwargs)
+                except Exception:
+                    HANDLER_ERRORS.inc(handler=handler)
+                    raise
+        return wrapper
+    return decorator
+
+
+def _user_attributes(args: tuple) -> Dict[str, int]:
+    # Update (effective_user) или CallbackQuery (from_user) среди аргументов обработчика
+    for arg in args:
+        user = getattr(arg, 'effective_user', None) or getattr(arg, 'from_user', None)
+        if user is not None:
+            return {'vetbot.user_id': user.id}
+    return {}
+
+
+def metrics_endpoints(workers: Optional[int] = None) -> Dict[str, str]:
+    """
+    Адреса /metrics процессов из METRICS_PORTS
+
+    Args:
+        workers: Число воркеров главного бота (по умолчанию BOT_WORKERS);
+            при нескольких добавляются диспетчер и воркеры main_bot.<n>
+
+    Returns:
+        Dict[str, str]: Имя процесса -> URL
+    """
+    ports = {}
+    if workers is None:
+        workers = BOT_WORKERS
+    if workers > 1:
+        ports['dispatcher'] = str(METRICS_WORKER_BASE_PORT)
+        for index in range(workers):
+            ports[f'main_bot.{index}'] = str(METRICS_WORKER_BASE_PORT + 1 + index)
+    for item in METRICS_PORTS.split(','):
+        if ':' in item:
+            name, port = item.strip().split(':', 1)
+            ports[name] = port
+    if workers > 1:
+        # Процесса main_bot нет: вместо него диспетчер и воркеры
+        ports.pop('main_bot', None)
+    return {name: f'http://{METRICS_HOST}:{port}/metrics' for name, port in ports.items()}
+
+
+_DEBUG_ROUTES: Dict[str, Callable[[Dict[str, str]], Dict]] = {}
+
+
+def register_debug_route(path: str, handler: Callable[[Dict[str, str]], Dict]) -> None:
+    """
+    Добавить служебный маршрут на эндпоинт метрик
+
+    Args:
+        path: Путь, например /debug/tasks
+        handler: Функция от параметров запроса, возвращающая ответ для JSON
+    """
+    _DEBUG_ROUTES[path] = handler
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    registry = REGISTRY
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if url.path == '/metrics':
+            self._reply(self.registry.render(), 'text/plain; version=0.0.4; charset=utf-8')
+            return
+
+        handler = _DEBUG_ROUTES.get(url.path)
+        if handler is None:
+            self.send_error(404)
+            return
+        try:
+            result = handler(dict(parse_qsl(url.query)))
+        except Exception as e:
+            logger.error(f"Debug route {url.path} failed: {e}")
+            self.send_error(500, str(e))
+            return
+        self._reply(json.dumps(result, ensure_ascii=False), 'application/json; charset=utf-8')
+
+    def _reply(self, text: str, content_type: str) -> None:
+        body = text.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(process: Optional[str] = None, port: Optional[int] = None,
+                         host: str = METRICS_HOST) -> Optional[ThreadingHTTPServer]:
+    """
+    Запустить эндпоинт /metrics в фоновом потоке
+
+    Args:
+        process: Имя процесса в METRICS_PORTS (main_bot, doctor_bot)
+        port: Явный порт (0 - любой свободный)
+        host: Адрес; по умолчанию только локальный
+
+    Returns:
+        Optional[ThreadingHTTPServer]: Сервер или None, если порт не задан или занят
+    """
+    if port is None:
+        url = metrics_endpoints().get(process)
+        if url is None:
+            return None
+        port = int(url.rsplit(':', 1)[1].split('/')[0])
+
+    try:
+        server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    except OSError as e:
+        logger.warning(f"Metrics endpoint for {process} not started on port {port}: {e}")
+        return None
+
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    logger.info(f"Metrics endpoint: http://{host}:{server.server_address[1]}/metrics")
+    return server
+
+
+def parse_metrics(text: str) -> Dict[str, List[Tuple[Dict[str, str], float]]]:
+    """
+    Разобрать текстовый формат Prometheus (для админ-панели)
+
+    Args:
+        text: Тело ответа /metrics
+
+    Returns:
+        Dict[str, List[Tuple[Dict[str, str], float]]]: Имя ряда -> [(метки, значение)]
+    """
+    samples: Dict[str, List[Tuple[Dict[str, str], float]]] = {}
+    for line in text.splitlines():
+        if not line or line.startswith('#'):
+            continue
+        series, value = line.rsplit(' ', 1)
+        labels: Dict[str, str] = {}
+        if '{' in series:
+            series, raw = series[:-1].split('{', 1)
+            for pair in raw.split('",'):
+                if '=' in pair:
+                    key, label_value = pair.split('=', 1)
+                    labels[key] = label_value.strip('"')
+        samples.setdefault(series, []).append((labels, float(value)))
+    return samples
+
+
+def histogram_quantile(quantile: float, buckets: List[Tuple[float, float]]) -> float:
+    """
+    Оценка квантиля по накопительным корзинам (как histogram_quantile в PromQL)
+
+    Args:
+        quantile: Квантиль от 0 до 1
+        buckets: Пары (верхняя граница, накопленное число)
+
+    Returns:
+        float: Оценка значения квантиля
+    """
+    buckets = sorted(buckets)
+    if not buckets or buckets[-1][1] == 0:
+        return 0.0
+    rank = quantile * buckets[-1][1]
+    previous_bound, previous_count = 0.0, 0.0
+    for bound, count in buckets:
+        if count >= rank:
+            if bound == float('inf'):
+                return previous_bound
+            if count == previous_count:
+                return bound
+            return previous_bound + (bound - previous_bound) * (rank - previous_count) / (count - previous_count)
+        previous_bound, previous_count = bound, count
+    return previous_bound
+
+
+def summarize_histograms(samples: Dict[str, List[Tuple[Dict[str, str], float]]]) -> List[Dict]:
+    """
+    Сводка гистограмм из parse_metrics: число, среднее, p50 и p99 по каждому ряду
+
+    Args:
+        samples: Результат parse_metrics
+
+    Returns:
+        List[Dict]: Словари с ключами metric, labels, count, avg, p50, p99
+    """
+    summary = []
+    for series, values in samples.items():
+        if not series.endswith('_bucket'):
+            continue
+        name = series[:-len('_bucket')]
+        groups: Dict[Tuple[Tuple[str, str], ...], List[Tuple[float, float]]] = {}
+        for labels, value in values:
+            key = tuple(sorted((k, v) for k, v in labels.items() if k != 'le'))
+            groups.setdefault(key, []).append((float(labels['le']), value))
+        sums = {tuple(sorted(labels.items())): value for labels, value in samples.get(name + '_sum', [])}
+        for key, buckets in groups.items():
+            count = max(count for _, count in buckets)
+            summary.append({
+                'metric': name,
+                'labels': dict(key),
+                'count': int(count),
+                'avg': sums.get(key, 0.0) / count if count else 0.0,
+                'p50': histogram_quantile(0.5, buckets),
+                'p99': histogram_quantile(0.99, buckets),
+            })
+    return summary
@@ -0,0 +1,300 @@
+"""
+Сэмплирующий профилировщик и дамп задач asyncio для работающих процессов
+
+Профилировщик раз в PROFILE_INTERVAL снимает стеки всех потоков
+(sys._current_frames) и копит их в свернутом виде ("a;b;c N") - формат,
+который напрямую читают flamegraph.pl и speedscope. Пока он включен, на
+цикл asyncio раз в LOOP_LAG_INTERVAL ставится пробный колбэк: задержка
+до его выполнения - это лаг цикла. Результаты пишутся в PROFILE_DIR:
+
+    profile-<процесс>-<время>.folded   стеки для flamegraph
+    loop-lag-<процесс>-<время>.csv     лаг цикла, мс
+    tasks-<процесс>-<время>.txt        дамп задач asyncio и потоков
+
+Управление (install): SIGUSR1 включает и выключает профилировщик,
+SIGUSR2 снимает дамп задач. Обработчик сигнала только ставит действие в
+очередь потока profiler-signals: блокировка, логирование или запись файла
+в самом обработчике могут зависнуть на блокировке прерванного кода. Те же
+действия доступны на эндпоинте метрик процесса:
+/debug/profile/start?seconds=N, /debug/profile/stop, /debug/tasks.
+"""
+
+import os
+import sys
+import time
+import queue
+import signal
+import asyncio
+import logging
+import threading
+import traceback
+from collections import Counter
+from typing import Dict, List, Optional
+
+from vetbot_improved.utils.metrics import register_debug_route
+
+logger = logging.getLogger(__name__)
+
+# Конфигурация
+PROFILE_DIR = os.getenv('PROFILE_DIR', 'logs')
+PROFILE_INTERVAL = float(os.getenv('PROFILE_INTERVAL', '0.01'))
+PROFILE_MAX_SECONDS = float(os.getenv('PROFILE_MAX_SECONDS', '300'))
+LOOP_LAG_INTERVAL = float(os.getenv('LOOP_LAG_INTERVAL', '0.1'))
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'
+
+
+def _timestamp() -> str:
+    return time.strftime('%Y%m%d-%H%M%S')
+
+
+class SamplingProfiler:
+    """
+    Профилировщик процесса по стекам потоков
+
+    Поток профилировщика сам себя не сэмплирует; накладные расходы -
+    один обход стеков раз в interval секунд.
+    """
+
+    def __init__(self, process: str, directory: str = PROFILE_DIR, interval: float = PROFILE_INTERVAL,
+                 loop: Optional[asyncio.AbstractEventLoop] = None):
+        self.process = process
+        self.directory = directory
+        self.interval = interval
+        self.loop = loop
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._stacks: Counter = Counter()
+        self._lags: List[tuple] = []
+        self._started_at = ''
+        self.last_files: Dict[str, str] = {}
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, seconds: Optional[float] = None) -> bool:
+        """
+        Включить профилировщик
+
+        Args:
+            seconds: Через сколько секунд остановиться и записать результат
+                (не больше PROFILE_MAX_SECONDS)
+
+        Returns:
+            bool: False, если профилировщик уже работает
+        """
+        with self._lock:
+            if self.running:
+                return False
+            self._stacks = Counter()
+            self._lags = []
+            self._started_at = _timestamp()
+            self._stop.clear()
+            duration = min(seconds or PROFILE_MAX_SECONDS, PROFILE_MAX_SECONDS)
+            self._thread = threading.Thread(target=self._run, args=(duration,), name='profiler', daemon=True)
+            self._thread.start()
+        logger.info(f"Profiler started for {self.process} ({duration:.0f}s max)")
+        return True
+
+    def stop(self) -> Dict[str, str]:
+        """
+        Выключить профилировщик и дождаться записи файлов
+
+        Returns:
+            Dict[str, str]: Записанные файлы (profile, loop_lag)
+        """
+        thread = self._thread
+        if thread is None:
+            return {}
+        self._stop.set()
+        if thread is not threading.current_thread():
+            thread.join(timeout=10)
+        return self.last_files
+
+    def _run(self, duration: float) -> None:
+        own_id = threading.get_ident()
+        deadline = time.monotonic() + duration
+        next_probe = 0.0
+        names = {}
+
+        while not self._stop.wait(self.interval) and time.monotonic() < deadline:
+            if self.loop is not None and time.monotonic() >= next_probe and not self.loop.is_closed():
+                next_probe = time.monotonic() + LOOP_LAG_INTERVAL
+                sent = time.monotonic()
+                try:
+                    self.loop.call_soon_threadsafe(self._record_lag, sent)
+                except RuntimeError:
+                    pass
+
+            for thread in threading.enumerate():
+                names[thread.ident] = thread.name
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_label(frame))
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, f'thread-{thread_id}'))
+                self._stacks[';'.join(reversed(stack))] += 1
+
+        self.last_files = self._write()
+        logger.info(f"Profiler stopped for {self.process}: {self.last_files}")
+
+    def _record_lag(self, sent: float) -> None:
+        self._lags.append((time.time(), (time.monotonic() - sent) * 1000))
+
+    def _write(self) -> Dict[str, str]:
+        os.makedirs(self.directory, exist_ok=True)
+        files = {}
+
+        profile_path = os.path.join(self.directory, f'profile-{self.process}-{self._started_at}.folded')
+        with open(profile_path, 'w', encoding='utf-8') as f:
+            for stack, count in self._stacks.most_common():
+                f.write(f'{stack} {count}\n')
+        files['profile'] = profile_path
+
+        if self._lags:
+            lag_path = os.path.join(self.directory, f'loop-lag-{self.process}-{self._started_at}.csv')
+            with open(lag_path, 'w', encoding='utf-8') as f:
+                f.write('timestamp,lag_ms\n')
+                for moment, lag in self._lags:
+                    f.write(f'{moment:.3f},{lag:.2f}\n')
+            files['loop_lag'] = lag_path
+
+            lags = sorted(lag for _, lag in self._lags)
+            logger.info(
+                f"Event loop lag for {self.process}: p50 {lags[len(lags) // 2]:.1f} ms, "
+                f"p99 {lags[min(len(lags) - 1, int(len(lags) * 0.99))]:.1f} ms, max {lags[-1]:.1f} ms"
+            )
+        return files
+
+
+def dump_tasks(process: str, loop: Optional[asyncio.AbstractEventLoop] = None,
+               directory: str = PROFILE_DIR) -> str:
+    """
+    Записать стеки задач asyncio и всех потоков процесса
+
+    Args:
+        process: Имя процесса в имени файла
+        loop: Цикл, задачи которого снимаются (None - только потоки)
+        directory: Каталог для файла
+
+    Returns:
+        str: Путь к файлу дампа
+    """
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f'tasks-{process}-{_timestamp()}.txt')
+
+    with open(path, 'w', encoding='utf-8') as f:
+        if loop is not None:
+            tasks = asyncio.all_tasks(loop)
+            f.write(f'=== asyncio: {len(tasks)} задач ===\n\n')
+            for task in sorted(tasks, key=lambda item: item.get_name()):
+                f.write(f'--- {task.get_name()}: {task.get_coro()!r}\n')
+                for frame in task.get_stack():
+                    f.write(''.join(traceback.format_stack(frame, limit=1)))
+                f.write('\n')
+
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        frames = sys._current_frames()
+        f.write(f'=== Потоки: {len(frames)} ===\n\n')
+        for thread_id, frame in frames.items():
+            f.write(f'--- {names.get(thread_id, thread_id)}\n')
+            f.write(''.join(traceback.format_stack(frame)))
+            f.write('\n')
+
+    logger.info(f"Task dump for {process}: {path}")
+    return path
+
+
+_profiler: Optional[SamplingProfiler] = None
+# Действия по сигналам; SimpleQueue.put можно вызывать из обработчика сигнала
+_signal_actions: Optional[queue.SimpleQueue] = None
+
+
+def _run_signal_actions(actions: queue.SimpleQueue) -> None:
+    while True:
+        action = actions.get()
+        try:
+            action()
+        except Exception as e:
+            logger.error(f"Profiler signal action failed: {e}")
+
+
+def _install_signals() -> None:
+    global _signal_actions
+    if _signal_actions is None:
+        _signal_actions = queue.SimpleQueue()
+        threading.Thread(target=_run_signal_actions, args=(_signal_actions,),
+                         name='profiler-signals', daemon=True).start()
+    actions = _signal_actions
+    signal.signal(signal.SIGUSR1, lambda signum, frame: actions.put(toggle))
+    signal.signal(signal.SIGUSR2, lambda signum, frame: actions.put(_dump))
+
+
+def install(process: str, loop: Optional[asyncio.AbstractEventLoop] = None,
+            signals: bool = True) -> SamplingProfiler:
+    """
+    Подключить управление профилировщиком в процессе
+
+    Args:
+        process: Имя процесса (main_bot, doctor_bot, webapp, admin)
+        loop: Цикл asyncio процесса, если есть
+        signals: Повесить SIGUSR1/SIGUSR2 (только из главного потока)
+
+    Returns:
+        SamplingProfiler: Профилировщик процесса
+    """
+    global _profiler
+    if _profiler is None:
+        _profiler = SamplingProfiler(process, loop=loop)
+    _profiler.process = process
+    _profiler.loop = loop or _profiler.loop
+
+    if signals and hasattr(signal, 'SIGUSR1') and threading.current_thread() is threading.main_thread():
+        _install_signals()
+
+    register_debug_route('/debug/profile/start', _route_start)
+    register_debug_route('/debug/profile/stop', lambda query: {'running': False, 'files': stop()})
+    register_debug_route('/debug/tasks', lambda query: {'file': _dump()})
+    return _profiler
+
+
+def get_profiler(process: str = 'process') -> SamplingProfiler:
+    """Профилировщик процесса (создается при первом обращении)"""
+    global _profiler
+    if _profiler is None:
+        _profiler = SamplingProfiler(process)
+    return _profiler
+
+
+def toggle() -> bool:
+    """Включить профилировщик или выключить работающий; True - включен"""
+    profiler = get_profiler()
+    if profiler.running:
+        profiler.stop()
+        return False
+    return profiler.start()
+
+
+def stop() -> Dict[str, str]:
+    """Выключить профилировщик; возвращает записанные файлы"""
+    return get_profiler().stop()
+
+
+def _dump() -> str:
+    profiler = get_profiler()
+    return dump_tasks(profiler.process, profiler.loop, profiler.directory)
+
+
+def _route_start(query: Dict[str, str]) -> Dict:
+    profiler = get_profiler()
+    seconds = float(query['seconds']) if query.get('seconds') else None
+    started = profiler.start(seconds)
+    return {'running': profiler.running, 'started': started}
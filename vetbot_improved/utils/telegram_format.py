@@ -0,0 +1,213 @@
+"""
+Подготовка ответов AI к отправке в Telegram
+
+Один проход по тексту: убирает markdown-разметку модели, экранирует символы
+для выбранного parse_mode и режет текст на сообщения по границам абзацев и
+предложений так, чтобы длина каждого не превышала лимит Telegram в единицах
+UTF-16. Текст можно подавать по частям по мере генерации.
+"""
+
+import unicodedata
+from typing import List, Optional
+
+# Лимит длины сообщения Telegram (в единицах UTF-16)
+TELEGRAM_MESSAGE_LIMIT = 4096
+
+_MARKDOWN_V2_SPECIAL = set('_*[]()~`>#+-=|{}.!\\')
+_MARKDOWN_SPECIAL = set('_*`[')
+_HTML_ESCAPES = {'&': '&amp;', '<': '&lt;', '>': '&gt;'}
+_SENTENCE_END = set('.!?…')
+_ZWJ = '\u200d'
+
+
+def utf16_length(text: str) -> int:
+    """
+    Длина строки так, как ее считает Telegram
+
+    Args:
+        text: Текст
+
+    Returns:
+        int: Число единиц UTF-16
+    """
+    return len(text.encode('utf-16-le')) // 2
+
+
+def _escape(char: str, parse_mode: Optional[str]) -> str:
+    if parse_mode == 'MarkdownV2':
+        return '\\' + char if char in _MARKDOWN_V2_SPECIAL else char
+    if parse_mode == 'Markdown':
+        return '\\' + char if char in _MARKDOWN_SPECIAL else char
+    if parse_mode == 'HTML':
+        return _HTML_ESCAPES.get(char, char)
+    return char
+
+
+def _joins_previous(char: str, previous: str) -> bool:
+    """Символ нельзя отрывать от предыдущего (части одного эмодзи или буквы)"""
+    if previous == _ZWJ or char == _ZWJ:
+        return True
+    if unicodedata.category(char) in ('Mn', 'Me'):
+        return True
+    # Вариационные селекторы, модификаторы цвета кожи и теги флагов
+    code = ord(char)
+    return (0xFE00 <= code <= 0xFE0F or 0x1F3FB <= code <= 0x1F3FF
+            or 0xE0020 <= code <= 0xE007F)
+
+
+class TelegramFormatter:
+    """
+    Потоковый форматтер ответа AI
+
+    feed() принимает очередной фрагмент текста и возвращает сообщения,
+    которые уже можно отправить; finish() возвращает остаток. Разметка,
+    которая может продолжиться в следующем фрагменте (хвостовые * и #),
+    придерживается до его прихода.
+
+    Разрез выбирается в порядке предпочтения: граница абзаца, конец
+    предложения или строки, пробел - если она во второй половине сообщения;
+    иначе самая поздняя из найденных; в крайнем случае - граница символа,
+    не разрывающая эмодзи.
+    """
+
+    def __init__(self, parse_mode: Optional[str] = None, limit: Optional[int] = TELEGRAM_MESSAGE_LIMIT):
+        self.parse_mode = parse_mode
+        self.limit = limit
+        self._pending = ''
+        self._reset()
+
+    def _reset(self) -> None:
+        self._chars: List[str] = []
+        self._pieces: List[str] = []
+        self._size = 0
+        self._paragraph = self._sentence = self._space = 0
+        self._previous = '\n'
+
+    def feed(self, chunk: str) -> List[str]:
+        """
+        Добавить фрагмент текста
+
+        Args:
+            chunk: Очередной фрагмент ответа
+
+        Returns:
+            List[str]: Готовые к отправке сообщения
+        """
+        text = self._pending + chunk
+        held = len(text) - len(text.rstrip('*#'))
+        self._pending = text[len(text) - held:]
+        return self._consume(text[:len(text) - held])
+
+    def finish(self) -> List[str]:
+        """
+        Завершить текст
+
+        Returns:
+            List[str]: Оставшиеся сообщения
+        """
+        messages = self._consume(self._pending)
+        self._pending = ''
+        tail = ''.join(self._pieces).strip()
+        self._reset()
+        if tail:
+            messages.append(tail)
+        return messages
+
+    def _consume(self, text: str) -> List[str]:
+        messages: List[str] = []
+        i, length = 0, len(text)
+        while i < length:
+            char = text[i]
+            if char == '*' and text.startswith('**', i):
+                i += 2
+                continue
+            if char == '#':
+                end = i
+                while end < length and text[end] == '#':
+                    end += 1
+                # Заголовки (# в начале строки) и ### внутри текста
+                if end - i >= 2 or self._previous == '\n':
+                    if self._previous == '\n' and end < length and text[end] == ' ':
+                        end += 1
+                    i = end
+                    continue
+            self._append(char, messages)
+            i += 1
+        return messages
+
+    def _append(self, char: str, messages: List[str]) -> None:
+        piece = _escape(char, self.parse_mode)
+        width = utf16_length(piece)
+        while self.limit is not None and self._pieces and self._size + width > self.limit:
+            message = self._cut(char)
+            if message:
+                messages.append(message)
+
+        previous = self._previous
+        self._chars.append(char)
+        self._pieces.append(piece)
+        self._size += width
+        position = len(self._pieces)
+        if char == '\n':
+            if previous == '\n':
+                self._paragraph = position
+            else:
+                self._sentence = position
+        elif char == ' ':
+            if previous in _SENTENCE_END:
+                self._sentence = position
+            else:
+                self._space = position
+        self._previous = char
+
+    def _cut(self, incoming: str) -> str:
+        """Отрезать готовое сообщение, оставив хвост для следующего"""
+        count = len(self._pieces)
+        candidates = (self._paragraph, self._sentence, self._space)
+        cut = next((c for c in candidates if c > count // 2), max(candidates))
+        if not cut:
+            cut = count
+            following = incoming
+            while cut > 1 and _joins_previous(following, self._chars[cut - 1]):
+                cut -= 1
+                following = self._chars[cut]
+
+        message = ''.join(self._pieces[:cut]).strip()
+        rest = ''.join(self._chars[cut:]).lstrip()
+        self._reset()
+        for char in rest:
+            self._append(char, [])
+        return message
+
+
+def format_message(
+    text: str,
+    parse_mode: Optional[str] = None,
+    limit: Optional[int] = TELEGRAM_MESSAGE_LIMIT
+) -> List[str]:
+    """
+    Подготовить готовый текст к отправке
+
+    Args:
+        text: Текст ответа
+        parse_mode: None, HTML, Markdown или MarkdownV2
+        limit: Максимальная длина сообщения в единицах UTF-16 (None - без разбиения)
+
+    Returns:
+        List[str]: Сообщения для отправки
+    """
+    formatter = TelegramFormatter(parse_mode, limit)
+    return formatter.feed(text) + formatter.finish()
+
+
+def sanitize_markdown(text: str) -> str:
+    """
+    Убрать из ответа модели markdown-разметку
+
+    Args:
+        text: Текст ответа
+
+    Returns:
+        str: Текст без заголовков и жирного шрифта
+    """
+    return ''.join(format_message(text, limit=None))
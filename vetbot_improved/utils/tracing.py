@@ -0,0 +1,512 @@
+"""
+Трассировка обработки обновлений: спаны и экспорт в файл OTLP/JSON
+
+Спан открывается на каждый обработчик Telegram (metrics.timed), на
+запросы SQLite (гистограммы со span), HTTP-запросы к LLM и вызовы
+Telegram Bot API (TracedRequest, он же пишет метрики Bot API). Текущий
+спан хранится в contextvars, поэтому в корутинах и задачах asyncio
+дочерние спаны находят родителя сами. Между процессами контекст передается строкой traceparent (W3C):
+она пишется в telegram_outbox, а trace_id - в consultation_messages.
+
+Готовые спаны пачками пишутся фоновым потоком в TRACE_EXPORT_PATH: одна
+строка - один запрос ExportTraceServiceRequest в JSON-кодировке OTLP.
+{service} в пути заменяется именем процесса, так что каждый процесс пишет
+и ротирует свой файл. Записывается доля TRACE_SAMPLE_RATE трасс (решение
+принимается при открытии корневого спана и передается в traceparent),
+файл ротируется по размеру TRACE_MAX_BYTES. Файлы всех процессов читает
+просмотрщик этого модуля:
+
+    python -m vetbot_improved.utils.tracing [файл] [--trace ID]
+"""
+
+import os
+import sys
+import glob
+import json
+import time
+import atexit
+import random
+import logging
+import argparse
+import functools
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+
+logger = logging.getLogger(__name__)
+
+# Конфигурация
+# Путь без {service} процессы делят и ротируют независимо друг от друга
+TRACE_EXPORT_PATH = os.getenv('TRACE_EXPORT_PATH', 'traces-{service}.jsonl')
+TRACE_SERVICE_NAME = os.getenv('TRACE_SERVICE_NAME', 'vetbot')
+TRACE_FLUSH_INTERVAL = float(os.getenv('TRACE_FLUSH_INTERVAL', '1'))
+TRACE_BATCH_SIZE = int(os.getenv('TRACE_BATCH_SIZE', '200'))
+TRACE_SAMPLE_RATE = float(os.getenv('TRACE_SAMPLE_RATE', '0.1'))
+TRACE_MAX_BYTES = int(os.getenv('TRACE_MAX_BYTES', str(50 * 1024 * 1024)))
+TRACE_BACKUP_COUNT = int(os.getenv('TRACE_BACKUP_COUNT', '3'))
+
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+
+class Span:
+    """Интервал работы внутри трассы"""
+
+    __slots__ = ('trace_id', 'span_id', 'parent_id', 'name', 'attributes', 'start_ns', 'end_ns',
+                 'status', 'status_message', 'sampled')
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str] = None,
+                 attributes: Optional[Dict[str, Any]] = None, sampled: bool = True):
+        self.trace_id = trace_id
+        self.span_id = _random_id(8)
+        self.parent_id = parent_id
+        self.name = name
+        self.attributes = dict(attributes or {})
+        self.start_ns = time.time_ns()
+        self.end_ns = 0
+        self.status = STATUS_OK
+        self.status_message = ''
+        # Невыбранная трасса продолжается (trace_id в логах и БД), но не пишется
+        self.sampled = sampled
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        """Добавить атрибут спана"""
+        self.attributes[key] = value
+
+    def traceparent(self) -> str:
+        """Заголовок W3C traceparent для продолжения трассы в другом процессе"""
+        return f'00-{self.trace_id}-{self.span_id}-{"01" if self.sampled else "00"}'
+
+    def to_otlp(self) -> Dict[str, Any]:
+        """Спан в JSON-кодировке OTLP"""
+        data = {
+            'traceId': self.trace_id,
+            'spanId': self.span_id,
+            'name': self.name,
+            'kind': 1,
+            'startTimeUnixNano': str(self.start_ns),
+            'endTimeUnixNano': str(self.end_ns),
+            'attributes': [{'key': key, 'value': _otlp_value(value)} for key, value in self.attributes.items()],
+            'status': {'code': self.status},
+        }
+        if self.parent_id:
+            data['parentSpanId'] = self.parent_id
+        if self.status_message:
+            data['status']['message'] = self.status_message
+        return data
+
+
+def _random_id(size: int) -> str:
+    return f'{random.getrandbits(size * 8):0{size * 2}x}'
+
+
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+
+def parse_traceparent(header: Optional[str]) -> Optional[Tuple[str, str, bool]]:
+    """
+    Разобрать заголовок traceparent
+
+    Args:
+        header: Строка вида 00-<trace_id>-<span_id>-<flags>
+
+    Returns:
+        Optional[Tuple[str, str, bool]]: (trace_id, span_id, sampled) или None
+    """
+    if not header:
+        return None
+    parts = header.split('-')
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    try:
+        sampled = bool(int(parts[3], 16) & 1)
+    except ValueError:
+        return None
+    return parts[1], parts[2], sampled
+
+
+class FileSpanExporter:
+    """
+    Запись спанов в файл OTLP/JSON фоновым потоком
+
+    export() только кладет спан в буфер; поток пишет буфер пачкой раз в
+    flush_interval секунд или по набору batch_size спанов. {service} в path
+    заменяется именем процесса (см. file_path). Файл больше max_bytes
+    переименовывается в файл.1 (старые - в файл.2 ... файл.N).
+    """
+
+    def __init__(self, path: str = TRACE_EXPORT_PATH, service_name: str = TRACE_SERVICE_NAME,
+                 flush_interval: float = TRACE_FLUSH_INTERVAL, batch_size: int = TRACE_BATCH_SIZE,
+                 sample_rate: float = TRACE_SAMPLE_RATE, max_bytes: int = TRACE_MAX_BYTES,
+                 backup_count: int = TRACE_BACKUP_COUNT):
+        self.path = path
+        self.service_name = service_name
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.sample_rate = sample_rate
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self._buffer: List[Span] = []
+        self._condition = threading.Condition()
+        self._write_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def file_path(self) -> str:
+        """Файл экспорта этого процесса"""
+        return self.path.replace('{service}', self.service_name)
+
+    def export(self, span: Span) -> None:
+        """Поставить готовый спан в очередь записи"""
+        if not self.path or not span.sampled:
+            return
+        with self._condition:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='trace-export', daemon=True)
+                self._thread.start()
+                atexit.register(self.flush)
+            self._buffer.append(span)
+            if len(self._buffer) >= self.batch_size:
+                self._condition.notify()
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                self._condition.wait(self.flush_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Trace export failed: {e}")
+
+    def flush(self) -> int:
+        """
+        Записать накопленные спаны
+
+        Returns:
+            int: Число записанных спанов
+        """
+        with self._write_lock:
+            with self._condition:
+                spans, self._buffer = self._buffer, []
+            if not spans or not self.path:
+                return 0
+
+            request = {'resourceSpans': [{
+                'resource': {'attributes': [
+                    {'key': 'service.name', 'value': {'stringValue': self.service_name}},
+                ]},
+                'scopeSpans': [{
+                    'scope': {'name': 'vetbot'},
+                    'spans': [span.to_otlp() for span in spans],
+                }],
+            }]}
+            path = self.file_path
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._rotate(path)
+            with open(path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(request, ensure_ascii=False) + '\n')
+            return len(spans)
+
+    def _rotate(self, path: str) -> None:
+        """Сдвинуть файлы path.1 ... path.N, если текущий превысил max_bytes"""
+        try:
+            if not self.max_bytes or os.path.getsize(path) < self.max_bytes:
+                return
+        except OSError:
+            return
+        if self.backup_count <= 0:
+            os.remove(path)
+            return
+        for number in range(self.backup_count - 1, 0, -1):
+            source = f'{path}.{number}'
+            if os.path.exists(source):
+                os.replace(source, f'{path}.{number + 1}')
+        os.replace(path, f'{path}.1')
+
+
+_current: ContextVar[Optional[Span]] = ContextVar('vetbot_current_span', default=None)
+_exporter = FileSpanExporter()
+
+
+def configure(service_name: Optional[str] = None, path: Optional[str] = None,
+              sample_rate: Optional[float] = None) -> FileSpanExporter:
+    """
+    Настроить экспорт спанов процесса
+
+    Args:
+        service_name: Имя процесса в ресурсе OTLP (main_bot, doctor_bot)
+        path: Файл экспорта, {service} - имя процесса; пустая строка
+            отключает запись
+        sample_rate: Доля записываемых трасс (от 0 до 1)
+
+    Returns:
+        FileSpanExporter: Экспортер процесса
+    """
+    _exporter.flush()
+    if service_name is not None:
+        _exporter.service_name = service_name
+    if path is not None:
+        _exporter.path = path
+    if sample_rate is not None:
+        _exporter.sample_rate = sample_rate
+    return _exporter
+
+
+def current_span() -> Optional[Span]:
+    """Текущий спан или None вне трассы"""
+    return _current.get()
+
+
+def current_trace_id() -> Optional[str]:
+    """trace_id текущей трассы или None"""
+    active = _current.get()
+    return active.trace_id if active else None
+
+
+def annotate(**attributes: Any) -> None:
+    """Добавить атрибуты текущему спану; None пропускаются, вне трассы ничего не делает"""
+    active = _current.get()
+    if active is not None:
+        active.attributes.update((key, value) for key, value in attributes.items() if value is not None)
+
+
+def current_traceparent() -> Optional[str]:
+    """traceparent текущего спана или None"""
+    active = _current.get()
+    return active.traceparent() if active else None
+
+
+@contextmanager
+def span(name: str, *, root: bool = True, parent: Optional[str] = None, **attributes: Any) -> Iterator[Optional[Span]]:
+    """
+    Открыть спан на время блока with
+
+    Args:
+        name: Имя спана
+        root: Начинать новую трассу, если текущей нет; при False вне
+            трассы спан не создается и блок получает None
+        parent: traceparent из другого процесса (важнее текущего спана)
+        **attributes: Атрибуты спана
+
+    Yields:
+        Optional[Span]: Открытый спан
+    """
+    remote = parse_traceparent(parent)
+    active = _current.get()
+    if remote:
+        trace_id, parent_id, sampled = remote
+    elif active is not None:
+        trace_id, parent_id, sampled = active.trace_id, active.span_id, active.sampled
+    elif root:
+        trace_id, parent_id = _random_id(16), None
+        sampled = random.random() < _exporter.sample_rate
+    else:
+        yield None
+        return
+
+    opened = Span(name, trace_id, parent_id, attributes, sampled)
+    token = _current.set(opened)
+    try:
+        yield opened
+    except BaseException as e:
+        opened.status = STATUS_ERROR
+        opened.status_message = f'{type(e).__name__}: {e}'[:500]
+        raise
+    finally:
+        _current.reset(token)
+        opened.end_ns = time.time_ns()
+        _exporter.export(opened)
+
+
+@functools.lru_cache(maxsize=None)
+def _shared_ssl_context():
+    import httpx
+    # Тот же контекст, что httpx создает сам (certifi, SSL_CERT_FILE/SSL_CERT_DIR)
+    return httpx.create_ssl_context()
+
+
+def _define_traced_request() -> type:
+    from telegram.request import HTTPXRequest
+    from vetbot_improved.utils.metrics import TELEGRAM_SEND_SECONDS, TELEGRAM_ERRORS
+
+    # Коды ответов Bot API, которые PTB превращает в RetryAfter, BadRequest, Forbidden
+    error_reasons = {429: 'retry_after', 400: 'badrequest', 403: 'forbidden'}
+
+    class TracedRequest(HTTPXRequest):
+        """
+        Транспорт python-telegram-bot со спаном и метриками на каждый вызов Bot API
+
+        Спан telegram.<метод> создается только внутри трассы, поэтому
+        фоновый опрос getUpdates трассы не порождает. Задержка и ошибки
+        (включая 429) пишутся в TELEGRAM_SEND_SECONDS/TELEGRAM_ERRORS с меткой
+        bot_name для всех вызовов, кроме долгого опроса getUpdates: так
+        измеряются и ответы обработчиков, и отправка из outbox. Все
+        экземпляры в процессе делят один SSL-контекст: корневые сертификаты
+        загружаются один раз, а не для каждого клиента (это ~25 мс на клиент
+        при запуске бота).
+        """
+
+        def __init__(self, *args, bot_name='unknown', **kwargs):
+            self.bot_name = bot_name
+            httpx_kwargs = dict(kwargs.pop('httpx_kwargs', None) or {})
+            httpx_kwargs.setdefault('verify', _shared_ssl_context())
+            super().__init__(*args, httpx_kwargs=httpx_kwargs, **kwargs)
+
+        async def do_request(self, url, method, *args, **kwargs):
+            api_method = url.rsplit('/', 1)[-1]
+            if api_method == 'getUpdates':
+                return await self._traced_request(api_method, url, method, *args, **kwargs)
+
+            try:
+                with TELEGRAM_SEND_SECONDS.time(bot=self.bot_name, method=api_method):
+                    code, payload = await self._traced_request(api_method, url, method, *args, **kwargs)
+            except Exception:
+                TELEGRAM_ERRORS.inc(bot=self.bot_name, reason='other')
+                raise
+            if code >= 400:
+                TELEGRAM_ERRORS.inc(bot=self.bot_name, reason=error_reasons.get(code, 'other'))
+            return code, payload
+
+        async def _traced_request(self, api_method, url, method, *args, **kwargs):
+            with span(f'telegram.{api_method}', root=False) as opened:
+                code, payload = await super().do_request(url, method, *args, **kwargs)
+                if opened is not None:
+                    opened.set_attribute('http.status_code', code)
+                return code, payload
+
+    return TracedRequest
+
+
+def __getattr__(name: str) -> Any:
+    # TracedRequest наследует класс python-telegram-bot: модуль трассировки
+    # импортируют через metrics и процессы без Telegram (супервизор,
+    # webapp), и им незачем импортировать telegram и httpx
+    if name == 'TracedRequest':
+        cls = globals()['TracedRequest'] = _define_traced_request()
+        return cls
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def load_traces(path: str = TRACE_EXPORT_PATH) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    Прочитать файлы экспорта
+
+    Args:
+        path: Файл OTLP/JSON (по запросу в строке); путь с {service}
+            читает файлы всех процессов
+
+    Returns:
+        Dict[str, List[Dict[str, Any]]]: trace_id -> спаны (словари с
+        ключами service, name, span_id, parent_id, start, end, attributes,
+        error), отсортированные по началу
+    """
+    traces: Dict[str, List[Dict[str, Any]]] = {}
+    paths = sorted(glob.glob(glob.escape(path).replace('{service}', '*'))) if '{service}' in path else [path]
+    for file_path in paths:
+        with open(file_path, encoding='utf-8') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                for resource_spans in json.loads(line).get('resourceSpans', []):
+                    service = next((a['value'].get('stringValue') for a in resource_spans['resource']['attributes']
+                                    if a['key'] == 'service.name'), '')
+                    for scope_spans in resource_spans.get('scopeSpans', []):
+                        for item in scope_spans.get('spans', []):
+                            traces.setdefault(item['traceId'], []).append({
+                                'service': service,
+                                'name': item['name'],
+                                'span_id': item['spanId'],
+                                'parent_id': item.get('parentSpanId'),
+                                'start': int(item['startTimeUnixNano']) / 1e9,
+                                'end': int(item['endTimeUnixNano']) / 1e9,
+                                'attributes': {a['key']: next(iter(a['value'].values()))
+                                               for a in item.get('attributes', [])},
+                                'error': item.get('status', {}).get('code') == STATUS_ERROR,
+                            })
+    for spans in traces.values():
+        spans.sort(key=lambda item: item['start'])
+    return traces
+
+
+def render_trace(spans: List[Dict[str, Any]]) -> str:
+    """
+    Дерево спанов трассы со смещением от начала и длительностью
+
+    Args:
+        spans: Спаны одной трассы из load_traces
+
+    Returns:
+        str: Текст для терминала
+    """
+    if not spans:
+        return ''
+    origin = spans[0]['start']
+    known = {item['span_id'] for item in spans}
+    children: Dict[Optional[str], List[Dict[str, Any]]] = {}
+    for item in spans:
+        parent = item['parent_id'] if item['parent_id'] in known else None
+        children.setdefault(parent, []).append(item)
+
+    lines = []
+
+    def walk(parent: Optional[str], depth: int) -> None:
+        for item in children.get(parent, []):
+            attributes = ' '.join(f'{k}={v}' for k, v in item['attributes'].items())
+            lines.append(
+                f"{(item['start'] - origin) * 1000:9.1f} ms {(item['end'] - item['start']) * 1000:9.1f} ms  "
+                f"{'  ' * depth}{item['name']} [{item['service']}]{' ' + attributes if attributes else ''}"
+                f"{'  ERROR' if item['error'] else ''}"
+            )
+            walk(item['span_id'], depth + 1)
+
+    walk(None, 0)
+    return '\n'.join(lines)
+
+
+def trace_duration(spans: List[Dict[str, Any]]) -> float:
+    """Длительность трассы от первого до последнего спана, секунды"""
+    return max(item['end'] for item in spans) - min(item['start'] for item in spans) if spans else 0.0
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Просмотрщик файла трасс: самые долгие трассы или одна трасса целиком"""
+    parser = argparse.ArgumentParser(description='Просмотр трасс VetBot из файла OTLP/JSON')
+    parser.add_argument('path', nargs='?', default=TRACE_EXPORT_PATH)
+    parser.add_argument('--trace', help='trace_id (например, из consultation_messages.trace_id)')
+    parser.add_argument('--top', type=int, default=10, help='Сколько самых долгих трасс показать')
+    args = parser.parse_args(argv)
+
+    traces = load_traces(args.path)
+    if args.trace:
+        spans = traces.get(args.trace)
+        if not spans:
+            print(f'Трасса {args.trace} не найдена')
+            return 1
+        print(render_trace(spans))
+        # Ответ врача связан с трассой сообщения клиента, на которое он отвечает
+        replied = {item['attributes'].get('vetbot.reply_to_trace') for item in spans} - {None, ''}
+        for trace_id in replied:
+            if trace_id in traces:
+                print(f'\nВ ответ на трассу {trace_id}:')
+                print(render_trace(traces[trace_id]))
+        return 0
+
+    ranked = sorted(traces.items(), key=lambda pair: trace_duration(pair[1]), reverse=True)
+    for trace_id, spans in ranked[:args.top]:
+        print(f"{trace_id}  {trace_duration(spans) * 1000:9.1f} ms  {spans[0]['name']} ({len(spans)} спанов)")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
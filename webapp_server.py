@@ -10,13 +10,15 @@ import json
 from datetime import datetime
 from flask import Flask, render_template_string, send_from_directory, request, jsonify
 from flask_cors import CORS
+from vetbot_improved.utils import profiler
+from vetbot_improved.utils.metrics import start_metrics_server
 
 app = Flask(__name__)
 CORS(app)  # Разрешить CORS для всех доменов
 
 # Путь к файлам веб-приложения
 WEBAPP_DIR = os.path.join(os.path.dirname(__file__), 'webapp')
-DB_PATH = os.path.join(os.path.dirname(__file__), 'vetbot.db')
+DB_PATH = os.getenv('WEBAPP_DB_PATH', os.path.join(os.path.dirname(__file__), 'vetbot.db'))
 
 def init_db():
     """Инициализация базы данных"""
@@ -147,6 +149,10 @@ if __name__ == '__main__':
     # Инициализация базы данных при запуске
     init_db()
     
+    # Профилировщик: SIGUSR1/SIGUSR2, а при webapp в METRICS_PORTS - и /debug/*
+    profiler.install('webapp')
+    start_metrics_server('webapp')
+    
     port = int(os.environ.get('PORT', 5000))
     app.run(host='0.0.0.0', port=port, debug=False)
 